@@ -334,6 +334,12 @@ def init_app(app):
     def after_request(response):
         CONCURRENT_REQUESTS.dec()
 
+        # avoid circular imports by importing this file later
+        from app.notifications.validators import (
+            release_daily_limit_reservations,
+        )
+        release_daily_limit_reservations(response)
+
         response.headers.add('Access-Control-Allow-Origin', '*')
         response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
         response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE')
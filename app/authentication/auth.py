@@ -1,5 +1,10 @@
+import hashlib
+import time
 import uuid
+from threading import Lock
 
+import cachetools
+import jwt
 from flask import current_app, g, request
 from gds_metrics import Histogram
 from notifications_python_client.authentication import (
@@ -25,6 +30,17 @@ AUTH_DB_CONNECTION_DURATION_SECONDS = Histogram(
     'Time taken to get DB connection and fetch service from database',
 )
 
+# notifications_python_client rejects tokens whose iat is more than this many seconds in the past
+TOKEN_IAT_BOUND_SECONDS = 30
+
+# Tokens are commonly reused for several requests within their 30 second window. We remember which API key verified
+# each token so that it doesn't have to be checked against every secret again, and which key each service last used
+# so that it is tried first for the service's next token. The tokens are keyed by a digest of the whole token (not
+# just its signature) so a cached verification can't vouch for a different header or payload.
+verified_tokens = cachetools.LRUCache(maxsize=10000)
+last_verified_api_key_ids = cachetools.LRUCache(maxsize=10000)
+verified_tokens_lock = Lock()
+
 
 class AuthError(Exception):
     def __init__(self, message, code, service_id=None, api_key_id=None):
@@ -126,7 +142,15 @@ def requires_auth():
 
 
 def _decode_jwt_token(auth_token, api_keys, service_id=None):
-    for api_key in api_keys:
+    token_digest = hashlib.sha256(auth_token.encode()).digest()
+
+    api_key = _get_api_key_that_verified_token(token_digest, api_keys)
+    if api_key:
+        if api_key.expiry_date:
+            raise AuthError("Invalid token: API key revoked", 403, service_id=service_id, api_key_id=api_key.id)
+        return api_key
+
+    for api_key in _last_verified_api_key_first(api_keys, service_id):
         try:
             decode_jwt_token(auth_token, api_key.secret)
         except TokenExpiredError:
@@ -149,12 +173,44 @@ def _decode_jwt_token(auth_token, api_keys, service_id=None):
         if api_key.expiry_date:
             raise AuthError("Invalid token: API key revoked", 403, service_id=service_id, api_key_id=api_key.id)
 
+        _remember_verified_token(token_digest, auth_token, api_key, service_id)
         return api_key
     else:
         # service has API keys, but none matching the one the user provided
         raise AuthError("Invalid token: API key not found", 403, service_id=service_id)
 
 
+def _get_api_key_that_verified_token(token_digest, api_keys):
+    with verified_tokens_lock:
+        api_key_id, valid_until = verified_tokens.get(token_digest, (None, 0))
+
+    if time.time() > valid_until:
+        return None
+
+    # the key might have been deleted since, in which case we check the token against the remaining keys again
+    return next((api_key for api_key in api_keys if api_key.id == api_key_id), None)
+
+
+def _last_verified_api_key_first(api_keys, service_id):
+    if service_id is None:
+        return api_keys
+
+    with verified_tokens_lock:
+        api_key_id = last_verified_api_key_ids.get(str(service_id))
+
+    return sorted(api_keys, key=lambda api_key: api_key.id != api_key_id)
+
+
+def _remember_verified_token(token_digest, auth_token, api_key, service_id):
+    # decode_jwt_token has already checked the signature and that iat is present and recent
+    issued_at = int(jwt.decode(auth_token, options={"verify_signature": False})['iat'])
+
+    with verified_tokens_lock:
+        verified_tokens[token_digest] = (api_key.id, issued_at + TOKEN_IAT_BOUND_SECONDS)
+        if service_id is not None:
+            last_verified_api_key_ids[str(service_id)] = api_key.id
+
+
 def _get_auth_token(req):
     auth_header = req.headers.get('Authorization', None)
     if not auth_header:
@@ -1,24 +1,86 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
 import botocore
 from boto3 import client, resource
+from botocore.config import Config
 from flask import current_app
 
+from app.utils import chunked
+
 FILE_LOCATION_STRUCTURE = 'service-{}-notify/{}.csv'
 
+# the most keys S3 accepts in one DeleteObjects request
+MAX_KEYS_PER_DELETE = 1000
+
+_s3_clients = {}
+_s3_clients_lock = threading.Lock()
+_s3_resources = threading.local()
+
+
+def _s3_config():
+    return Config(max_pool_connections=current_app.config['S3_MAX_POOL_CONNECTIONS'])
+
+
+def get_s3_client():
+    """
+    Returns this process's S3 client. boto3 clients are thread safe, so one client (and its connection pool) is
+    shared by every thread in the process instead of resolving credentials and endpoints for each call. Clients can't
+    be shared across a fork, so they are keyed by pid.
+    """
+    key = (os.getpid(), current_app.config['AWS_REGION'])
+    s3_client = _s3_clients.get(key)
+    if s3_client is None:
+        with _s3_clients_lock:
+            s3_client = _s3_clients.get(key)
+            if s3_client is None:
+                s3_client = client('s3', region_name=key[1], config=_s3_config())
+                _s3_clients[key] = s3_client
+    return s3_client
+
+
+def get_s3_resource():
+    """
+    Returns an S3 resource for the current thread. Unlike clients, boto3 resources aren't thread safe, so each
+    thread keeps its own.
+    """
+    key = (os.getpid(), current_app.config['AWS_REGION'])
+    if getattr(_s3_resources, 'key', None) != key:
+        _s3_resources.resource = resource('s3', region_name=key[1], config=_s3_config())
+        _s3_resources.key = key
+    return _s3_resources.resource
+
+
+def reset_s3_clients():
+    """
+    Forget the cached clients and resources, so the next call creates new ones (for example after credentials change)
+    """
+    with _s3_clients_lock:
+        _s3_clients.clear()
+    _s3_resources.__dict__.clear()
+
 
 def get_s3_file(bucket_name, file_location):
-    s3_file = get_s3_object(bucket_name, file_location)
-    return s3_file.get()['Body'].read().decode('utf-8')
+    return get_s3_object_body_and_metadata(bucket_name, file_location)[0].decode('utf-8')
 
 
 def get_s3_object(bucket_name, file_location):
-    s3 = resource('s3')
-    return s3.Object(bucket_name, file_location)
+    return get_s3_resource().Object(bucket_name, file_location)
+
+
+def get_s3_object_body_and_metadata(bucket_name, file_location):
+    """
+    Returns the object's body (as bytes) and its metadata from a single GET request
+    """
+    response = get_s3_client().get_object(Bucket=bucket_name, Key=file_location)
+    return response['Body'].read(), response['Metadata']
 
 
 def head_s3_object(bucket_name, file_location):
     # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3.html#S3.Client.head_object
-    boto_client = client('s3', current_app.config['AWS_REGION'])
-    return boto_client.head_object(Bucket=bucket_name, Key=file_location)
+    return get_s3_client().head_object(Bucket=bucket_name, Key=file_location)
 
 
 def file_exists(bucket_name, file_location):
@@ -47,36 +109,95 @@ def get_contact_list_location(service_id, contact_list_id):
 
 
 def get_job_and_metadata_from_s3(service_id, job_id):
-    obj = get_s3_object(*get_job_location(service_id, job_id))
-    return obj.get()['Body'].read().decode('utf-8'), obj.get()['Metadata']
+    body, metadata = get_s3_object_body_and_metadata(*get_job_location(service_id, job_id))
+    return body.decode('utf-8'), metadata
+
+
+def get_job_stream_and_metadata_from_s3(service_id, job_id):
+    """
+    Returns the job's streaming (unread) body and its metadata from a single GET, so that large jobs can be read
+    incrementally instead of being loaded into memory in one go.
+    """
+    bucket_name, file_location = get_job_location(service_id, job_id)
+    response = get_s3_client().get_object(Bucket=bucket_name, Key=file_location)
+    return response['Body'], response['Metadata']
+
+
+def get_job_byte_range_from_s3(service_id, job_id, byte_start, byte_end):
+    """
+    Returns bytes byte_start (inclusive) to byte_end (exclusive) of the job's file
+    """
+    bucket_name, file_location = get_job_location(service_id, job_id)
+    response = get_s3_client().get_object(
+        Bucket=bucket_name, Key=file_location, Range=f'bytes={byte_start}-{byte_end - 1}'
+    )
+    return response['Body'].read().decode('utf-8')
 
 
 def get_job_from_s3(service_id, job_id):
-    obj = get_s3_object(*get_job_location(service_id, job_id))
-    return obj.get()['Body'].read().decode('utf-8')
+    return get_s3_file(*get_job_location(service_id, job_id))
 
 
 def get_job_metadata_from_s3(service_id, job_id):
-    obj = get_s3_object(*get_job_location(service_id, job_id))
-    return obj.get()['Metadata']
+    bucket_name, file_location = get_job_location(service_id, job_id)
+    return get_s3_client().head_object(Bucket=bucket_name, Key=file_location)['Metadata']
 
 
-def remove_job_from_s3(service_id, job_id):
-    return remove_s3_object(*get_job_location(service_id, job_id))
+def remove_jobs_from_s3(jobs):
+    """
+    Delete the CSV files of a list of jobs. Returns a dict of the ids of the jobs whose files couldn't be deleted to
+    the error for each.
+    """
+    bucket_name = current_app.config['CSV_UPLOAD_BUCKET_NAME']
+    job_ids_by_key = {FILE_LOCATION_STRUCTURE.format(job.service_id, job.id): job.id for job in jobs}
+    failures = remove_s3_objects(bucket_name, job_ids_by_key)
+    return {job_ids_by_key[key]: error for key, error in failures.items()}
 
 
 def remove_contact_list_from_s3(service_id, contact_list_id):
-    return remove_s3_object(*get_contact_list_location(service_id, contact_list_id))
+    bucket_name, file_location = get_contact_list_location(service_id, contact_list_id)
+    failures = remove_s3_objects(bucket_name, [file_location])
+    for key, error in failures.items():
+        current_app.logger.error(f'Error removing contact list {key} from s3: {error}')
+    return failures
+
+
+def remove_s3_objects(bucket_name, object_keys):
+    """
+    Delete objects from a bucket with DeleteObjects, MAX_KEYS_PER_DELETE keys a request, running up to
+    S3_DELETE_THREADS requests at once. Keys that don't exist count as deleted. Rather than raising on the first
+    failure, returns a dict of the keys that couldn't be deleted to the error S3 gave for each.
+    """
+    batches = list(chunked(list(dict.fromkeys(object_keys)), MAX_KEYS_PER_DELETE))
+    if not batches:
+        return {}
+
+    failures = {}
+    delete_batch = partial(_delete_s3_objects, get_s3_client(), bucket_name)
+    with ThreadPoolExecutor(max_workers=min(len(batches), current_app.config['S3_DELETE_THREADS'])) as executor:
+        for batch_failures in executor.map(delete_batch, batches):
+            failures.update(batch_failures)
+    return failures
+
+
+def _delete_s3_objects(s3_client, bucket_name, object_keys):
+    # called from a thread pool, outside of the app context
+    try:
+        response = s3_client.delete_objects(
+            Bucket=bucket_name,
+            Delete={'Objects': [{'Key': key} for key in object_keys], 'Quiet': True},
+        )
+    except botocore.exceptions.ClientError as e:
+        return {key: _describe_s3_error(e.response.get('Error', {})) for key in object_keys}
+    return {error['Key']: _describe_s3_error(error) for error in response.get('Errors', [])}
 
 
-def remove_s3_object(bucket_name, object_key):
-    obj = get_s3_object(bucket_name, object_key)
-    return obj.delete()
+def _describe_s3_error(error):
+    return f"{error.get('Code')}: {error.get('Message')}"
 
 
 def get_list_of_files_by_suffix(bucket_name, subfolder='', suffix='', last_modified=None):
-    s3_client = client('s3', current_app.config['AWS_REGION'])
-    paginator = s3_client.get_paginator('list_objects_v2')
+    paginator = get_s3_client().get_paginator('list_objects_v2')
 
     page_iterator = paginator.paginate(
         Bucket=bucket_name,
@@ -1,4 +1,5 @@
 from base64 import urlsafe_b64encode
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from hashlib import sha512
 
@@ -27,11 +28,13 @@ from app.exceptions import NotificationTechnicalFailureException
 from app.letters.utils import (
     LetterPDFNotFound,
     ScanErrorType,
-    find_letter_pdf_in_s3,
+    find_letter_pdf_key_and_size,
     generate_letter_pdf_filename,
     get_billable_units_for_letter_page_count,
+    get_bucket_name_and_prefix_for_notification,
     get_file_names_from_error_bucket,
     get_folder_name,
+    get_letter_pdfs_in_folder,
     get_reference_from_filename,
     move_error_pdf_to_scan_bucket,
     move_failed_pdf,
@@ -53,6 +56,10 @@ from app.models import (
     RESOLVE_POSTAGE_FOR_FILE_NAME,
     Service,
 )
+from app.utils import chunked
+
+# letters are matched against the S3 listing, and any stragglers looked up, this many at a time
+LETTER_PDF_LOOKUP_BATCH_SIZE = 1000
 
 
 @notify_celery.task(bind=True, name="get-pdf-for-templated-letter", max_retries=15, default_retry_delay=300)
@@ -234,6 +241,7 @@ def send_letters_volume_email_to_dvla(letters_volumes, date):
             notification_type=template.template_type,
             api_key_id=None,
             key_type=KEY_TYPE_NORMAL,
+            count_towards_daily_limit=True,
             reply_to_text=reply_to
         )
 
@@ -241,19 +249,57 @@ def send_letters_volume_email_to_dvla(letters_volumes, date):
 
 
 def get_key_and_size_of_letters_to_be_sent_to_print(print_run_deadline, postage):
+    """
+    Rather than looking up each letter's PDF in S3 one at a time, list each day's folder of the bucket once and match
+    the letters against that. Any letters that aren't in the listing (for example because their PDF was uploaded
+    after we listed the folder) are looked up individually, concurrently. Letters are yielded in the order
+    dao_get_letters_to_be_printed returns them, as group_letters relies on them being grouped by service.
+    """
     letters_awaiting_sending = dao_get_letters_to_be_printed(print_run_deadline, postage)
-    for letter in letters_awaiting_sending:
+    letter_pdfs_by_folder = {}
+    with ThreadPoolExecutor(max_workers=current_app.config['LETTER_PDF_LOOKUP_THREADS']) as executor:
+        for letters in chunked(letters_awaiting_sending, LETTER_PDF_LOOKUP_BATCH_SIZE):
+            yield from _get_key_and_size_of_letters(letters, letter_pdfs_by_folder, executor)
+
+
+def _get_key_and_size_of_letters(letters, letter_pdfs_by_folder, executor):
+    s3_client = s3.get_s3_client()
+    letter_pdfs = {}
+    stragglers = []
+    for letter in letters:
+        bucket_name, prefix = get_bucket_name_and_prefix_for_notification(letter)
+        folder = prefix[:prefix.index('NOTIFY.')]
+        if (bucket_name, folder) not in letter_pdfs_by_folder:
+            letter_pdfs_by_folder[(bucket_name, folder)] = get_letter_pdfs_in_folder(bucket_name, folder)
+
+        letter_pdf = letter_pdfs_by_folder[(bucket_name, folder)].get(letter.reference.upper())
+        if letter_pdf:
+            letter_pdfs[letter.id] = letter_pdf
+        else:
+            stragglers.append(
+                (letter.id, executor.submit(find_letter_pdf_key_and_size, s3_client, bucket_name, prefix))
+            )
+
+    for letter_id, future in stragglers:
         try:
-            letter_pdf = find_letter_pdf_in_s3(letter)
-            yield {
-                "Key": letter_pdf.key,
-                "Size": letter_pdf.size,
-                "ServiceId": str(letter.service_id),
-                "OrganisationId": str(letter.service.organisation_id)
-            }
+            letter_pdfs[letter_id] = future.result()
         except (BotoClientError, LetterPDFNotFound) as e:
-            current_app.logger.exception(
-                f"Error getting letter from bucket for notification: {letter.id} with reference: {letter.reference}", e)
+            letter_pdfs[letter_id] = e
+
+    for letter in letters:
+        letter_pdf = letter_pdfs[letter.id]
+        if isinstance(letter_pdf, Exception):
+            current_app.logger.error(
+                f"Error getting letter from bucket for notification: {letter.id} with reference: {letter.reference}: "
+                f"{letter_pdf}"
+            )
+            continue
+        yield {
+            "Key": letter_pdf['Key'],
+            "Size": letter_pdf['Size'],
+            "ServiceId": str(letter.service_id),
+            "OrganisationId": str(letter.service.organisation_id)
+        }
 
 
 def group_letters(letter_pdfs):
@@ -1,3 +1,5 @@
+import random
+import time
 from datetime import datetime, timedelta
 
 import pytz
@@ -6,23 +8,33 @@ from notifications_utils.clients.zendesk.zendesk_client import (
     NotifySupportTicket,
 )
 from notifications_utils.timezones import convert_utc_to_bst
+from psycopg2.errorcodes import LOCK_NOT_AVAILABLE
 from sqlalchemy import func
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
 
-from app import notify_celery, statsd_client, zendesk_client
+from app import notify_celery, redis_store, statsd_client, zendesk_client
 from app.aws import s3
 from app.config import QueueNames
 from app.cronitor import cronitor
 from app.dao.fact_processing_time_dao import insert_update_processing_time
 from app.dao.inbound_sms_dao import delete_inbound_sms_older_than_retention
 from app.dao.jobs_dao import (
-    dao_archive_job,
+    dao_archive_jobs,
     dao_get_jobs_older_than_data_retention,
 )
+from app.dao.notification_archival_dao import (
+    dao_claim_notification_archival,
+    dao_queue_notification_archivals,
+    dao_record_notification_archival_progress,
+)
 from app.dao.notifications_dao import (
+    dao_delete_notification_activity_before,
     dao_get_notifications_processing_time_stats,
     dao_timeout_notifications,
-    get_service_ids_with_notifications_before,
+    delete_letters_from_s3,
+    delete_test_key_notifications,
+    get_estimated_notification_counts_by_service_before,
+    insert_notification_history_delete_notifications,
     move_notifications_to_notification_history,
 )
 from app.dao.service_data_retention_dao import (
@@ -57,10 +69,14 @@ def remove_letter_csv_files():
 
 def _remove_csv_files(job_types):
     jobs = dao_get_jobs_older_than_data_retention(notification_types=job_types)
-    for job in jobs:
-        s3.remove_job_from_s3(job.service_id, job.id)
-        dao_archive_job(job)
-        current_app.logger.info("Job ID {} has been removed from s3.".format(job.id))
+    failures = s3.remove_jobs_from_s3(jobs)
+    for job_id, error in failures.items():
+        current_app.logger.error("Error removing job ID {} from s3: {}".format(job_id, error))
+
+    # jobs that couldn't be removed are left unarchived, so they're tried again tomorrow
+    removed_jobs = [job for job in jobs if job.id not in failures]
+    dao_archive_jobs(removed_jobs)
+    current_app.logger.info("{} jobs have been removed from s3.".format(len(removed_jobs)))
 
 
 @notify_celery.task(name="delete-notifications-older-than-retention")
@@ -90,41 +106,209 @@ def delete_letter_notifications_older_than_retention():
 
 def _delete_notifications_older_than_retention_by_type(notification_type):
     flexible_data_retention = fetch_service_data_retention_for_all_services_by_notification_type(notification_type)
+    today = convert_utc_to_bst(datetime.utcnow()).date()
+    seven_days_ago = get_london_midnight_in_utc(today - timedelta(days=7))
 
-    for f in flexible_data_retention:
-        day_to_delete_backwards_from = get_london_midnight_in_utc(
-            convert_utc_to_bst(datetime.utcnow()).date() - timedelta(days=f.days_of_retention)
-        )
+    # the services with notifications from before the default retention, and roughly how many so the biggest can be
+    # started first. Typically that might only be 5% of services.
+    notification_counts = get_estimated_notification_counts_by_service_before(
+        notification_type, today - timedelta(days=7)
+    )
 
-        delete_notifications_for_service_and_type.apply_async(queue=QueueNames.REPORTING, kwargs={
+    archivals = [
+        {
             'service_id': f.service_id,
             'notification_type': notification_type,
-            'datetime_to_delete_before': day_to_delete_backwards_from
-        })
-
-    seven_days_ago = get_london_midnight_in_utc(convert_utc_to_bst(datetime.utcnow()).date() - timedelta(days=7))
+            'delete_before': get_london_midnight_in_utc(today - timedelta(days=f.days_of_retention)),
+            'estimated_rows': notification_counts.get(f.service_id, 0),
+        }
+        for f in flexible_data_retention
+    ]
     service_ids_with_data_retention = {x.service_id for x in flexible_data_retention}
+    archivals += [
+        {
+            'service_id': service_id,
+            'notification_type': notification_type,
+            'delete_before': seven_days_ago,
+            'estimated_rows': count,
+        }
+        for service_id, count in notification_counts.items()
+        if service_id not in service_ids_with_data_retention
+    ]
 
-    # get a list of all service ids that we'll need to delete for. Typically that might only be 5% of services.
-    # This query takes a couple of mins to run.
-    service_ids_that_have_sent_notifications_recently = get_service_ids_with_notifications_before(
-        notification_type,
-        seven_days_ago
+    dao_queue_notification_archivals(archivals)
+    start_archival_workers()
+
+    current_app.logger.info(
+        f'delete-notifications-older-than-retention: queued archivals for notification_type {notification_type}: '
+        f'{len(service_ids_with_data_retention)} services with flexible data retention, '
+        f'{len(archivals) - len(service_ids_with_data_retention)} services without flexible data retention'
     )
 
-    service_ids_to_purge = service_ids_that_have_sent_notifications_recently - service_ids_with_data_retention
 
-    for service_id in service_ids_to_purge:
-        delete_notifications_for_service_and_type.apply_async(queue=QueueNames.REPORTING, kwargs={
-            'service_id': service_id,
-            'notification_type': notification_type,
-            'datetime_to_delete_before': seven_days_ago
-        })
+ARCHIVAL_WORKER_KEY = 'archive-notifications-worker-{}'
+# an archival (or worker slot) that hasn't been updated for this long belonged to a worker that has stopped
+ARCHIVAL_STALE_AFTER = timedelta(minutes=15)
+# the longest a worker waits before trying a batch again after it timed out waiting for a lock
+ARCHIVAL_MAX_LOCK_BACKOFF_SECONDS = 60
+
+
+class AdaptiveBatchSize:
+    """
+    How many notifications to archive in one transaction. Grows towards the number that would take `target_seconds`
+    at the rate recent batches went, and halves when a batch is much slower than that or had to wait for a lock, so
+    archiving backs off while the database is busy sending.
+    """
+    MAX_GROWTH = 1.5
+    SMOOTHING = 0.5
+
+    def __init__(self, minimum, maximum, target_seconds):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_seconds = target_seconds
+        self.size = minimum
+
+    def _clamp(self, size):
+        return int(max(self.minimum, min(self.maximum, size)))
+
+    def record(self, rows, seconds):
+        if seconds > self.target_seconds * 2:
+            self.size = self._clamp(self.size / 2)
+            return
+        if rows < self.size:
+            # a part batch (the last one for a service) doesn't tell us how long a full one would take
+            return
+
+        ideal = rows * self.target_seconds / max(seconds, 0.001)
+        smoothed = self.size + (ideal - self.size) * self.SMOOTHING
+        self.size = self._clamp(min(smoothed, self.size * self.MAX_GROWTH))
+
+    def record_lock_wait(self):
+        self.size = self._clamp(self.size / 2)
+
+
+def start_archival_workers():
+    for _ in range(current_app.config['ARCHIVAL_MAX_WORKERS']):
+        archive_notifications.apply_async(queue=QueueNames.REPORTING)
+
+
+def _take_archival_worker_slot():
+    """
+    Returns the Redis key this worker holds while it runs, or None if the maximum number of workers are already
+    running. Without Redis we can't tell, so rely on only ARCHIVAL_MAX_WORKERS being started.
+    """
+    if not redis_store.active:
+        return ''
+    for slot in range(current_app.config['ARCHIVAL_MAX_WORKERS']):
+        key = ARCHIVAL_WORKER_KEY.format(slot)
+        if redis_store.redis_store.set(key, 1, ex=ARCHIVAL_STALE_AFTER, nx=True):
+            return key
+    return None
+
+
+def _refresh_archival_worker_slot(key):
+    if key:
+        redis_store.redis_store.expire(key, ARCHIVAL_STALE_AFTER)
+
+
+def _release_archival_worker_slot(key):
+    if key:
+        redis_store.redis_store.delete(key)
+
+
+@notify_celery.task(name='archive-notifications')
+def archive_notifications():
+    """
+    Work through the queue of services whose notifications are past retention, moving them to notification_history
+    a batch at a time. Progress is saved after each batch, so a stopped worker's archival is picked up by another.
+    """
+    key = _take_archival_worker_slot()
+    if key is None:
+        current_app.logger.info('archive-notifications: maximum number of workers already running')
+        return
+
+    batch_size = AdaptiveBatchSize(
+        current_app.config['ARCHIVAL_MIN_BATCH_SIZE'],
+        current_app.config['ARCHIVAL_MAX_BATCH_SIZE'],
+        current_app.config['ARCHIVAL_TARGET_BATCH_SECONDS'],
+    )
+    try:
+        while True:
+            archival = dao_claim_notification_archival(stale_before=datetime.utcnow() - ARCHIVAL_STALE_AFTER)
+            if not archival:
+                break
+            _archive_notifications_for_service_and_type(archival, batch_size, key)
+    finally:
+        _release_archival_worker_slot(key)
+
+
+def _wait_after_lock_timeout(lock_timeouts):
+    # exponential backoff with full jitter, so workers that timed out on the same lock don't all try again together
+    backoff = min(
+        ARCHIVAL_MAX_LOCK_BACKOFF_SECONDS,
+        current_app.config['ARCHIVAL_LOCK_TIMEOUT_MS'] / 1000 * 2 ** lock_timeouts,
+    )
+    time.sleep(random.uniform(0, backoff))
+
+
+def _archive_notifications_for_service_and_type(archival, batch_size, key):
+    service_id = archival.service_id
+    notification_type = archival.notification_type
+    delete_before = archival.delete_before
+    start = datetime.utcnow()
+
+    if notification_type == LETTER_TYPE:
+        delete_letters_from_s3(notification_type, service_id, delete_before, batch_size.maximum)
+
+    lock_timeouts = 0
+    while True:
+        size = batch_size.size
+        batch_start = time.monotonic()
+        try:
+            archived = insert_notification_history_delete_notifications(
+                notification_type=notification_type,
+                service_id=service_id,
+                timestamp_to_delete_backwards_from=delete_before,
+                qry_limit=size,
+                lock_timeout_ms=current_app.config['ARCHIVAL_LOCK_TIMEOUT_MS'],
+            )
+        except OperationalError as e:
+            if getattr(e.orig, 'pgcode', None) != LOCK_NOT_AVAILABLE:
+                raise
+            batch_size.record_lock_wait()
+            statsd_client.incr('archive-notifications.lock-timeout')
+            lock_timeouts += 1
+            if lock_timeouts >= current_app.config['ARCHIVAL_MAX_LOCK_TIMEOUTS']:
+                # leave it in progress: once it's stale another worker (or tomorrow night's run) takes it over
+                current_app.logger.warning(
+                    f'archive-notifications: giving up on service: {service_id}, '
+                    f'notification_type: {notification_type} after {lock_timeouts} lock timeouts in a row'
+                )
+                return
+            _wait_after_lock_timeout(lock_timeouts)
+            # show that this worker is still alive, so the archival isn't taken over while it waits
+            dao_record_notification_archival_progress(archival, 0)
+            _refresh_archival_worker_slot(key)
+            continue
+
+        lock_timeouts = 0
+        batch_size.record(archived, time.monotonic() - batch_start)
+        dao_record_notification_archival_progress(archival, archived)
+        _refresh_archival_worker_slot(key)
+        if archived < size:
+            break
+
+    delete_test_key_notifications(notification_type, service_id, delete_before)
+    dao_delete_notification_activity_before(service_id, notification_type, convert_utc_to_bst(delete_before).date())
+    dao_record_notification_archival_progress(archival, 0, finished=True)
 
     current_app.logger.info(
-        f'delete-notifications-older-than-retention: triggered subtasks for notification_type {notification_type}: '
-        f'{len(service_ids_with_data_retention)} services with flexible data retention, '
-        f'{len(service_ids_to_purge)} services without flexible data retention'
+        f'archive-notifications: '
+        f'service: {service_id}, '
+        f'notification_type: {notification_type}, '
+        f'count deleted: {archival.archived_rows}, '
+        f'duration: {(datetime.utcnow() - start).seconds} seconds, '
+        f'batch size: {batch_size.size}'
     )
 
 
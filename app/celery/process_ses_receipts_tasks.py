@@ -1,3 +1,5 @@
+import time
+from collections import namedtuple
 from datetime import datetime, timedelta
 
 import iso8601
@@ -5,14 +7,19 @@ from celery.exceptions import Retry
 from flask import current_app, json
 from sqlalchemy.orm.exc import NoResultFound
 
-from app import notify_celery, statsd_client
+from app import db, notify_celery, statsd_client
+from app.celery.service_callback_tasks import send_delivery_status_to_service
 from app.clients.email.aws_ses import get_aws_responses
 from app.config import QueueNames
 from app.dao import notifications_dao
-from app.models import NOTIFICATION_PENDING, NOTIFICATION_SENDING
+from app.models import NOTIFICATION_PENDING, NOTIFICATION_SENDING, Notification
+from app.notifications.notification_status_buffer import (
+    notification_status_buffer,
+)
 from app.notifications.notifications_ses_callback import (
     _check_and_queue_complaint_callback_task,
     check_and_queue_callback_task,
+    create_delivery_status_callbacks,
     determine_notification_bounce_type,
     handle_complaint,
 )
@@ -55,26 +62,25 @@ def process_ses_results(self, response):
         if bounce_message:
             current_app.logger.info(f"SES bounce for notification ID {notification.id}: {bounce_message}")
 
+        buffered = notification_status_buffer.active and isinstance(notification, Notification)
+
         if notification.status not in [NOTIFICATION_SENDING, NOTIFICATION_PENDING]:
             notifications_dao._duplicate_update_warning(
                 notification=notification,
                 status=notification_status
             )
             return
+        elif buffered:
+            notifications_dao.dao_set_notification_values(
+                notification, buffered=True, status=notification_status, updated_at=datetime.utcnow()
+            )
         else:
             notifications_dao.dao_update_notifications_by_reference(
                 references=[reference],
                 update_dict={'status': notification_status}
             )
 
-        statsd_client.incr('callback.ses.{}'.format(notification_status))
-
-        if notification.sent_at:
-            statsd_client.timing_with_dates(
-                f'callback.ses.{notification_status}.elapsed-time',
-                datetime.utcnow(),
-                notification.sent_at
-            )
+        _record_ses_result(notification, notification_status)
 
         check_and_queue_callback_task(notification)
 
@@ -86,3 +92,192 @@ def process_ses_results(self, response):
     except Exception as e:
         current_app.logger.exception('Error processing SES results: {}'.format(type(e)))
         self.retry(queue=QueueNames.RETRY)
+
+
+SesReceipt = namedtuple(
+    'SesReceipt', ['response', 'reference', 'mail_timestamp', 'notification_status', 'bounce_message']
+)
+
+
+@notify_celery.task(name="process-ses-results-batch")
+def process_ses_results_batch(responses):
+    """
+    Processes many SES results at once, as process_ses_results does for one. The notifications are looked up with
+    one query (and one more for notification history), updated with one UPDATE for each status, and the services'
+    callbacks are looked up with one query.
+
+    Results for notifications that can't be found yet are handed to process_ses_results, which retries them. If the
+    batch fails, every result in it is handed to process_ses_results to be retried on its own.
+    """
+    try:
+        receipts = []
+        complaints = []
+        for response in responses:
+            ses_message = json.loads(response['Message'])
+            notification_type = ses_message['notificationType']
+            bounce_message = None
+
+            if notification_type == 'Bounce':
+                notification_type, bounce_message = determine_notification_bounce_type(notification_type, ses_message)
+            elif notification_type == 'Complaint':
+                complaints.append(ses_message)
+                continue
+
+            receipts.append(SesReceipt(
+                response=response,
+                reference=ses_message['mail']['messageId'],
+                mail_timestamp=ses_message['mail']['timestamp'],
+                notification_status=get_aws_responses(notification_type)['notification_status'],
+                bounce_message=bounce_message,
+            ))
+
+        notifications = notifications_dao.dao_get_notifications_or_history_by_references(
+            [receipt.reference for receipt in receipts]
+        )
+
+        notification_statuses = {}
+        responses_to_retry = []
+        for receipt in receipts:
+            notification = notifications.get(receipt.reference)
+            if not notification:
+                message_time = iso8601.parse_date(receipt.mail_timestamp).replace(tzinfo=None)
+                if datetime.utcnow() - message_time < timedelta(minutes=5):
+                    # the notification may not have been saved yet, so try again later, as process_ses_results would
+                    responses_to_retry.append(receipt.response)
+                else:
+                    current_app.logger.warning(
+                        f"notification not found for reference: {receipt.reference} "
+                        f"(update to {receipt.notification_status})"
+                    )
+                continue
+
+            if receipt.bounce_message:
+                current_app.logger.info(f"SES bounce for notification ID {notification.id}: {receipt.bounce_message}")
+
+            if notification.status not in [NOTIFICATION_SENDING, NOTIFICATION_PENDING]:
+                notifications_dao._duplicate_update_warning(
+                    notification=notification,
+                    status=receipt.notification_status
+                )
+                continue
+
+            # if there's more than one result for a notification the last one wins, as each would have replaced the
+            # status set by the one before
+            notification_statuses[notification] = receipt.notification_status
+
+        callbacks = []
+        if notification_statuses:
+            notifications_dao.dao_update_notification_statuses(list(notification_statuses.items()))
+            for notification, notification_status in notification_statuses.items():
+                _record_ses_result(notification, notification_status)
+            # the callbacks are created before committing, as the notifications would be reloaded one by one after.
+            # Notification history doesn't have the recipient that a callback needs
+            callbacks = create_delivery_status_callbacks([
+                notification for notification in notification_statuses if isinstance(notification, Notification)
+            ])
+            db.session.commit()
+
+        for response in responses_to_retry:
+            process_ses_results.apply_async(
+                [response], queue=QueueNames.RETRY, countdown=process_ses_results.default_retry_delay
+            )
+
+        for notification_id, notification_data in callbacks:
+            send_delivery_status_to_service.apply_async(
+                [notification_id, notification_data], queue=QueueNames.CALLBACKS
+            )
+
+        for ses_message in complaints:
+            _check_and_queue_complaint_callback_task(*handle_complaint(ses_message))
+
+        return True
+
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.exception(
+            f'Error processing batch of {len(responses)} SES results: {type(e)}. Processing them one by one instead'
+        )
+        for response in responses:
+            process_ses_results.apply_async([response], queue=QueueNames.RETRY)
+
+
+@notify_celery.task(name="process-ses-results-from-queue")
+def process_ses_results_from_queue():
+    """
+    Takes the SES results that the SES callback lambda puts on the ses-callbacks queue (as process-ses-result tasks)
+    off the queue SES_RESULTS_BATCH_SIZE at a time, and processes each lot with process_ses_results_batch. Runs until
+    the queue is empty or for SES_RESULTS_DRAIN_SECONDS, and is started every minute, so this can take over from the
+    receipts workers consuming ses-callbacks one message at a time.
+
+    Messages are only acknowledged once their batch has been processed, so if the worker stops part way through SQS
+    delivers them again once their visibility timeout runs out.
+    """
+    batch_size = current_app.config['SES_RESULTS_BATCH_SIZE']
+    if not batch_size:
+        return
+
+    deadline = time.monotonic() + current_app.config['SES_RESULTS_DRAIN_SECONDS']
+    processed = 0
+    with notify_celery.connection_for_read() as connection:
+        queue = connection.SimpleQueue(QueueNames.SES_CALLBACKS)
+        try:
+            while time.monotonic() < deadline:
+                messages = _get_messages(queue, batch_size)
+                if not messages:
+                    break
+
+                responses = []
+                for message in messages:
+                    response = _ses_response_from_message(message)
+                    if response is None:
+                        current_app.logger.error(
+                            f'Unexpected message on {QueueNames.SES_CALLBACKS}: {message.headers}, leaving it there'
+                        )
+                        message.requeue()
+                    else:
+                        responses.append((message, response))
+
+                if responses:
+                    # results it can't process are handed on to process-ses-result, so they're all done with now
+                    process_ses_results_batch([response for _, response in responses])
+                    for message, _ in responses:
+                        message.ack()
+                    processed += len(responses)
+        finally:
+            queue.close()
+
+    current_app.logger.info(f'process-ses-results-from-queue: processed {processed} SES results')
+
+
+def _get_messages(queue, limit):
+    messages = []
+    while len(messages) < limit:
+        try:
+            messages.append(queue.get(block=False))
+        except queue.Empty:
+            break
+    return messages
+
+
+def _ses_response_from_message(message):
+    body = message.decode()
+    if isinstance(body, dict):
+        # task message protocol 1, with the task in the body
+        task, args = body.get('task'), body.get('args')
+    else:
+        # task message protocol 2, with the task in the headers and the body as (args, kwargs, embed)
+        task, args = message.headers.get('task'), body[0]
+    if task != process_ses_results.name or not args:
+        return None
+    return args[0]
+
+
+def _record_ses_result(notification, notification_status):
+    statsd_client.incr('callback.ses.{}'.format(notification_status))
+
+    if notification.sent_at:
+        statsd_client.timing_with_dates(
+            f'callback.ses.{notification_status}.elapsed-time',
+            datetime.utcnow(),
+            notification.sent_at
+        )
@@ -61,7 +61,8 @@ def _process_for_status(notification_status, client_name, provider_reference, de
         notification_id=provider_reference,
         status=notification_status,
         sent_by=client_name.lower(),
-        detailed_status_code=detailed_status_code
+        detailed_status_code=detailed_status_code,
+        buffered=True,
     )
     if not notification:
         return
@@ -1,3 +1,5 @@
+import random
+
 from flask import current_app
 from sqlalchemy.orm.exc import NoResultFound
 
@@ -9,12 +11,45 @@ from app.config import QueueNames
 from app.dao import notifications_dao
 from app.dao.notifications_dao import update_notification_status_by_id
 from app.delivery import send_to_providers
+from app.delivery.send_rate_governor import (
+    SendRateExceeded,
+    is_throttling_exception,
+)
 from app.exceptions import NotificationTechnicalFailureException
 from app.models import NOTIFICATION_TECHNICAL_FAILURE
 
+# the send rate governor slows every worker down when a provider throttles us, so there's no need to wait as long as
+# after other errors before trying a throttled message again
+THROTTLED_RETRY_DELAY_SECONDS = 10
+# messages that weren't sent because it wasn't their turn are tried again up to this fraction of their wait later
+# than their turn, so that all the messages turned away at once don't come back at the same moment
+SEND_RATE_DEFERRAL_JITTER = 0.5
+
+
+def _send_rate_countdown(exception):
+    return exception.retry_after * random.uniform(1, 1 + SEND_RATE_DEFERRAL_JITTER)
+
+
+def _defer_until_its_turn(task, notification_id, exception, deferrals):
+    """
+    Try a notification that wasn't sent because of the send rate governor again once it's its turn. This is a new
+    task rather than a retry, so waiting for a busy provider doesn't use up the retries the notification has for
+    errors. Returns False if it has already been deferred SEND_RATE_MAX_DEFERRALS times, and should be retried.
+    """
+    if deferrals >= current_app.config['SEND_RATE_MAX_DEFERRALS']:
+        return False
+    task.apply_async(
+        [str(notification_id)],
+        {'deferrals': deferrals + 1},
+        queue=QueueNames.RETRY,
+        countdown=_send_rate_countdown(exception),
+        retries=task.request.retries,
+    )
+    return True
+
 
 @notify_celery.task(bind=True, name="deliver_sms", max_retries=48, default_retry_delay=300)
-def deliver_sms(self, notification_id):
+def deliver_sms(self, notification_id, deferrals=0):
     try:
         current_app.logger.info("Start sending SMS for notification id: {}".format(notification_id))
         notification = notifications_dao.get_notification_by_id(notification_id)
@@ -22,7 +57,7 @@ def deliver_sms(self, notification_id):
             raise NoResultFound()
         send_to_providers.send_sms_to_provider(notification)
     except Exception as e:
-        if isinstance(e, SmsClientResponseException):
+        if isinstance(e, (SmsClientResponseException, SendRateExceeded)):
             current_app.logger.warning(
                 "SMS notification delivery for id: {} failed".format(notification_id)
             )
@@ -31,9 +66,16 @@ def deliver_sms(self, notification_id):
                 "SMS notification delivery for id: {} failed".format(notification_id)
             )
 
+        if isinstance(e, SendRateExceeded) and _defer_until_its_turn(self, notification_id, e, deferrals):
+            return
+
         try:
-            if self.request.retries == 0:
+            if isinstance(e, SendRateExceeded):
+                self.retry(queue=QueueNames.RETRY, countdown=_send_rate_countdown(e))
+            elif self.request.retries == 0:
                 self.retry(queue=QueueNames.RETRY, countdown=0)
+            elif is_throttling_exception(e):
+                self.retry(queue=QueueNames.RETRY, countdown=THROTTLED_RETRY_DELAY_SECONDS)
             else:
                 self.retry(queue=QueueNames.RETRY)
         except self.MaxRetriesExceededError:
@@ -43,8 +85,34 @@ def deliver_sms(self, notification_id):
             raise NotificationTechnicalFailureException(message)
 
 
+@notify_celery.task(name="deliver-sms-batch")
+def deliver_sms_batch(notification_ids):
+    """
+    Sends a batch of SMS notifications to their providers at once (see send_smss_to_provider). Notifications that
+    couldn't be sent, or the whole batch if something else went wrong, are passed to deliver_sms to be retried one at
+    a time with its usual retry policy. deliver_sms skips any that have been sent in the meantime.
+    """
+    try:
+        failures = send_to_providers.send_smss_to_provider(notification_ids)
+    except Exception:
+        current_app.logger.exception(f"Delivery of a batch of {len(notification_ids)} SMS notifications failed")
+        failures = {notification_id: None for notification_id in notification_ids}
+
+    for notification_id, exception in failures.items():
+        if isinstance(exception, SmsClientResponseException):
+            current_app.logger.warning(f"SMS notification delivery for id: {notification_id} failed")
+        elif exception is not None and not isinstance(exception, SendRateExceeded):
+            current_app.logger.error(f"SMS notification delivery for id: {notification_id} failed: {exception!r}")
+
+        deliver_sms.apply_async(
+            [str(notification_id)],
+            queue=QueueNames.RETRY,
+            countdown=_send_rate_countdown(exception) if isinstance(exception, SendRateExceeded) else 0,
+        )
+
+
 @notify_celery.task(bind=True, name="deliver_email", max_retries=48, default_retry_delay=300)
-def deliver_email(self, notification_id):
+def deliver_email(self, notification_id, deferrals=0):
     try:
         current_app.logger.info("Start sending email for notification id: {}".format(notification_id))
         notification = notifications_dao.get_notification_by_id(notification_id)
@@ -57,17 +125,26 @@ def deliver_email(self, notification_id):
         )
         update_notification_status_by_id(notification_id, 'technical-failure')
     except Exception as e:
+        if isinstance(e, SendRateExceeded) and _defer_until_its_turn(self, notification_id, e, deferrals):
+            current_app.logger.info(f"Email notification {notification_id} is waiting for its turn to send: {e}")
+            return
+
         try:
-            if isinstance(e, AwsSesClientThrottlingSendRateException):
+            if isinstance(e, SendRateExceeded):
+                current_app.logger.warning(
+                    f"RETRY: Email notification {notification_id} has waited for its turn to send too many times"
+                )
+                self.retry(queue=QueueNames.RETRY, countdown=_send_rate_countdown(e))
+            elif isinstance(e, AwsSesClientThrottlingSendRateException):
                 current_app.logger.warning(
                     f"RETRY: Email notification {notification_id} was rate limited by SES"
                 )
+                self.retry(queue=QueueNames.RETRY, countdown=THROTTLED_RETRY_DELAY_SECONDS)
             else:
                 current_app.logger.exception(
                     f"RETRY: Email notification {notification_id} failed"
                 )
-
-            self.retry(queue=QueueNames.RETRY)
+                self.retry(queue=QueueNames.RETRY)
         except self.MaxRetriesExceededError:
             message = "RETRY FAILED: Max retries reached. " \
                       "The task send_email_to_provider failed for notification {}. " \
@@ -8,10 +8,14 @@ from app.config import QueueNames
 from app.cronitor import cronitor
 from app.dao.fact_billing_dao import (
     fetch_billing_data_for_day,
-    update_fact_billing,
+    update_fact_billing_for_day,
+)
+from app.dao.fact_notification_status_dao import (
+    delete_live_notification_status_before,
+    fetch_live_notification_status_differences,
+    update_fact_notification_status,
+    update_fact_notification_status_for_day,
 )
-from app.dao.fact_notification_status_dao import update_fact_notification_status
-from app.dao.notifications_dao import get_service_ids_with_notifications_on_date
 from app.models import EMAIL_TYPE, LETTER_TYPE, SMS_TYPE
 
 
@@ -52,12 +56,11 @@ def create_nightly_billing_for_day(process_day):
         f'create-nightly-billing-for-day task for {process_day}: data fetched in {(end - start).seconds} seconds'
     )
 
-    for data in transit_data:
-        update_fact_billing(data, process_day)
+    rows_updated = update_fact_billing_for_day(transit_data, process_day)
 
     current_app.logger.info(
         f"create-nightly-billing-for-day task for {process_day}: "
-        f"task complete. {len(transit_data)} rows updated"
+        f"task complete. {rows_updated} rows updated"
     )
 
 
@@ -89,25 +92,49 @@ def create_nightly_notification_status():
 
     yesterday = convert_utc_to_bst(datetime.utcnow()).date() - timedelta(days=1)
 
+    # the live counts are only read for today, and checked against the nightly counts for yesterday
+    deleted = delete_live_notification_status_before(yesterday)
+    current_app.logger.info(f'create-nightly-notification-status deleted {deleted} old live_notification_status rows')
+
     for notification_type in [SMS_TYPE, EMAIL_TYPE, LETTER_TYPE]:
         days = 10 if notification_type == LETTER_TYPE else 4
 
         for i in range(days):
             process_day = yesterday - timedelta(days=i)
 
-            relevant_service_ids = get_service_ids_with_notifications_on_date(
-                notification_type, process_day
+            create_nightly_notification_status_for_day.apply_async(
+                kwargs={
+                    'process_day': process_day.isoformat(),
+                    'notification_type': notification_type,
+                },
+                queue=QueueNames.REPORTING
             )
 
-            for service_id in relevant_service_ids:
-                create_nightly_notification_status_for_service_and_day.apply_async(
-                    kwargs={
-                        'process_day': process_day.isoformat(),
-                        'notification_type': notification_type,
-                        'service_id': service_id,
-                    },
-                    queue=QueueNames.REPORTING
-                )
+
+@notify_celery.task(name="create-nightly-notification-status-for-day")
+def create_nightly_notification_status_for_day(process_day, notification_type):
+    """
+    Aggregate every service's notifications for the day and notification type in one go
+    """
+    process_day = datetime.strptime(process_day, "%Y-%m-%d").date()
+
+    start = datetime.utcnow()
+    update_fact_notification_status_for_day(process_day=process_day, notification_type=notification_type)
+
+    end = datetime.utcnow()
+    current_app.logger.info(
+        f'create-nightly-notification-status-for-day task update '
+        f'for {notification_type} for {process_day}: '
+        f'updated in {(end - start).seconds} seconds'
+    )
+
+    if process_day == convert_utc_to_bst(datetime.utcnow()).date() - timedelta(days=1):
+        differences = fetch_live_notification_status_differences(process_day, notification_type)
+        if differences:
+            current_app.logger.warning(
+                f'live_notification_status has {len(differences)} rows that differ from ft_notification_status '
+                f'for {notification_type} for {process_day}: {differences[:10]}'
+            )
 
 
 @notify_celery.task(name="create-nightly-notification-status-for-service-and-day")
@@ -1,3 +1,5 @@
+import codecs
+import csv
 import json
 from collections import defaultdict, namedtuple
 from datetime import datetime
@@ -18,8 +20,14 @@ from app.dao.daily_sorted_letter_dao import (
     dao_create_or_update_daily_sorted_letter,
 )
 from app.dao.inbound_sms_dao import dao_get_inbound_sms_by_id
-from app.dao.jobs_dao import dao_get_job_by_id, dao_update_job
+from app.dao.jobs_dao import (
+    dao_get_job_by_id,
+    dao_record_job_chunk_completed,
+    dao_set_job_chunk_count,
+    dao_update_job,
+)
 from app.dao.notifications_dao import (
+    dao_get_job_row_numbers,
     dao_get_last_notification_added_for_job_id,
     dao_get_notification_or_history_by_reference,
     dao_update_notifications_by_reference,
@@ -53,13 +61,24 @@ from app.models import (
     SMS_TYPE,
     DailySortedLetter,
 )
-from app.notifications.process_notifications import persist_notification
-from app.notifications.validators import check_service_over_daily_message_limit
+from app.notifications.process_notifications import (
+    build_notification,
+    persist_notification,
+    persist_notifications,
+    queue_sms_deliveries,
+)
+from app.notifications.validators import check_and_reserve_limits
 from app.serialised_models import SerialisedService, SerialisedTemplate
 from app.service.utils import service_allowed_to_send_to
-from app.utils import DATETIME_FORMAT, get_reference_from_personalisation
+from app.utils import (
+    DATETIME_FORMAT,
+    chunked,
+    get_reference_from_personalisation,
+)
 from app.v2.errors import TooManyRequestsError
 
+JobChunk = namedtuple('JobChunk', ['index', 'header', 'start_row', 'byte_start', 'byte_end'])
+
 
 @notify_celery.task(name="process-job")
 def process_job(job_id, sender_id=None):
@@ -86,12 +105,17 @@ def process_job(job_id, sender_id=None):
     if __sending_limits_for_job_exceeded(service, job, job_id):
         return
 
+    if job.notification_count > current_app.config['JOB_CHUNK_SIZE']:
+        job.completed_chunks = []
+        dao_update_job(job)
+        process_job_in_chunks(job)
+        return
+
     recipient_csv, template, sender_id = get_recipient_csv_and_template_and_sender_id(job)
 
     current_app.logger.info("Starting job {} processing {} notifications".format(job_id, job.notification_count))
 
-    for row in recipient_csv.get_rows():
-        process_row(row, template, job, service, sender_id=sender_id)
+    process_rows(recipient_csv.get_rows(), template, job, service, sender_id=sender_id)
 
     job_complete(job, start=start)
 
@@ -123,14 +147,135 @@ def get_recipient_csv_and_template_and_sender_id(job):
     return recipient_csv, template, meta_data.get("sender_id")
 
 
-def process_row(row, template, job, service, sender_id=None):
+def _iter_lines(stream, block_size=64 * 1024):
+    """
+    Yield the lines (including their line endings) of a binary UTF-8 stream without reading it all into memory. Lines
+    are split wherever str.splitlines splits them, as RecipientCSV does, so a file with \r line endings (or any of the
+    other characters splitlines treats as a line break) is split into the same rows.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    remainder = ''
+    for block in iter(lambda: stream.read(block_size), b''):
+        # hold back the last line, as it might not be finished (or might be a \r followed by a \n in the next block)
+        lines = (remainder + decoder.decode(block)).splitlines(keepends=True)
+        remainder = lines.pop() if lines else ''
+        yield from lines
+    remainder += decoder.decode(b'', final=True)
+    if remainder:
+        yield remainder
+
+
+def get_job_chunks(csv_stream, chunk_size):
+    """
+    Read a job's CSV file from a stream and split it into chunks of (at most) chunk_size rows. Each chunk knows the byte
+    range of its rows in the file and the index of its first row, so it can be fetched and processed independently.
+
+    Chunks always start on a non-blank row, so that the row numbers within a chunk line up with the ones RecipientCSV
+    gives the same rows when it reads the whole file.
+    """
+    byte_offset = 0
+    header_lines = []
+
+    def decoded_lines():
+        nonlocal byte_offset
+        for line in _iter_lines(csv_stream):
+            byte_offset += len(line.encode('utf-8'))
+            if header_lines is not None:
+                header_lines.append(line)
+            # RecipientCSV reads the lines without their line endings
+            yield line.splitlines()[0]
+
+    reader = csv.reader(decoded_lines(), quoting=csv.QUOTE_MINIMAL, skipinitialspace=True)
+
+    if next(reader, None) is None:
+        return
+    header = ''.join(header_lines)
+    header_lines = None
+
+    chunk_index, chunk_start_row, rows_in_chunk = 0, 0, 0
+    chunk_start = row_start = byte_offset
+
+    for row_index, row in enumerate(reader):
+        if rows_in_chunk >= chunk_size and any(row):
+            yield JobChunk(chunk_index, header, chunk_start_row, chunk_start, row_start)
+            chunk_index, chunk_start_row, chunk_start, rows_in_chunk = chunk_index + 1, row_index, row_start, 0
+        rows_in_chunk += 1
+        row_start = byte_offset
+
+    if rows_in_chunk:
+        yield JobChunk(chunk_index, header, chunk_start_row, chunk_start, row_start)
+
+
+def process_job_in_chunks(job, completed_chunks=None):
+    """
+    Stream the job's file from S3 and start a process-job-chunk task for each chunk that hasn't been completed yet.
+    The job is finished by whichever chunk completes last (or here, if they had all been completed already).
+    """
+    resumed = completed_chunks is not None
+    completed_chunks = completed_chunks or set()
+    csv_stream, meta_data = s3.get_job_stream_and_metadata_from_s3(
+        service_id=str(job.service_id), job_id=str(job.id)
+    )
+    sender_id = meta_data.get("sender_id")
+
+    chunk_count = 0
+    for chunk in get_job_chunks(csv_stream, current_app.config['JOB_CHUNK_SIZE']):
+        chunk_count += 1
+        if chunk.index in completed_chunks:
+            continue
+        process_job_chunk.apply_async(
+            (str(job.id), chunk.index, chunk.header, chunk.start_row, chunk.byte_start, chunk.byte_end),
+            {'sender_id': sender_id, 'resumed': resumed},
+            queue=QueueNames.JOBS
+        )
+
+    current_app.logger.info("Job {} split into {} chunks".format(job.id, chunk_count))
+
+    completed_count = dao_set_job_chunk_count(job.id, chunk_count)
+    if completed_count >= chunk_count:
+        job_complete(job, resumed=resumed, start=job.processing_started)
+
+
+@notify_celery.task(name="process-job-chunk")
+def process_job_chunk(job_id, chunk_index, header, start_row, byte_start, byte_end, sender_id=None, resumed=False):
+    job = dao_get_job_by_id(job_id)
+    db_template = dao_get_template_by_id(job.template_id, job.template_version)
+    template = db_template._as_utils_template()
+
+    contents = s3.get_job_byte_range_from_s3(str(job.service_id), job_id, byte_start, byte_end)
+    recipient_csv = RecipientCSV(header + contents, template=template)
+
+    rows = list(recipient_csv.get_rows())
+    if resumed:
+        already_saved = dao_get_job_row_numbers(job_id, start_row, start_row + len(rows))
+    else:
+        already_saved = set()
+
+    process_rows(
+        [row for row in rows if start_row + row.index not in already_saved],
+        template,
+        job,
+        job.service,
+        sender_id=sender_id,
+        row_offset=start_row,
+    )
+
+    completed_count, chunk_count = dao_record_job_chunk_completed(job_id, chunk_index)
+    current_app.logger.info(
+        "Job {} chunk {} processed ({} of {} chunks complete)".format(job_id, chunk_index, completed_count, chunk_count)
+    )
+    if chunk_count is not None and completed_count >= chunk_count:
+        job_complete(job, resumed=resumed, start=job.processing_started)
+
+
+def process_row(row, template, job, service, sender_id=None, row_number=None):
     template_type = template.template_type
     encrypted = encryption.encrypt({
         'template': str(template.id),
         'template_version': job.template_version,
         'job': str(job.id),
         'to': row.recipient,
-        'row_number': row.index,
+        'row_number': row.index if row_number is None else row_number,
         'personalisation': dict(row.personalisation)
     })
 
@@ -159,9 +304,58 @@ def process_row(row, template, job, service, sender_id=None):
     return notification_id
 
 
+def process_rows(rows, template, job, service, sender_id=None, row_offset=0):
+    """
+    Batch version of process_row. SMS and email rows are published JOB_ROW_BATCH_SIZE at a time to save-smss or
+    save-emails, so a large job needs a fraction of the broker round trips and database commits. Letters still go to
+    save-letter one row at a time. row_offset is added to each row's index to get its row number in the job.
+    """
+    template_type = template.template_type
+    if template_type == LETTER_TYPE:
+        return [
+            process_row(row, template, job, service, sender_id=sender_id, row_number=row_offset + row.index)
+            for row in rows
+        ]
+
+    send_fn = save_smss if template_type == SMS_TYPE else save_emails
+
+    task_kwargs = {}
+    if sender_id:
+        task_kwargs['sender_id'] = sender_id
+
+    notification_ids = []
+    for batch in chunked(rows, current_app.config['JOB_ROW_BATCH_SIZE']):
+        encrypted_notifications = []
+        for row in batch:
+            notification_id = create_uuid()
+            encrypted_notifications.append(encryption.encrypt({
+                'id': notification_id,
+                'template': str(template.id),
+                'template_version': job.template_version,
+                'job': str(job.id),
+                'to': row.recipient,
+                'row_number': row_offset + row.index,
+                'personalisation': dict(row.personalisation)
+            }))
+            notification_ids.append(notification_id)
+
+        send_fn.apply_async(
+            (
+                str(service.id),
+                encrypted_notifications,
+            ),
+            task_kwargs,
+            queue=QueueNames.DATABASE if not service.research_mode else QueueNames.RESEARCH_MODE
+        )
+    return notification_ids
+
+
 def __sending_limits_for_job_exceeded(service, job, job_id):
     try:
-        total_sent = check_service_over_daily_message_limit(KEY_TYPE_NORMAL, service)
+        total_sent = check_and_reserve_limits(
+            service, KEY_TYPE_NORMAL, notification_count=job.notification_count, check_throughput=False
+        )
+        # check_and_reserve_limits has already done this if redis is enabled
         if total_sent + job.notification_count > service.message_limit:
             raise TooManyRequestsError(service.message_limit)
         else:
@@ -286,6 +480,103 @@ def save_email(self,
         handle_exception(self, notification, notification_id, e)
 
 
+@notify_celery.task(bind=True, name="save-smss", max_retries=5, default_retry_delay=300)
+def save_smss(self, service_id, encrypted_notifications, sender_id=None):
+    save_job_notifications(self, SMS_TYPE, service_id, encrypted_notifications, sender_id=sender_id)
+
+
+@notify_celery.task(bind=True, name="save-emails", max_retries=5, default_retry_delay=300)
+def save_emails(self, service_id, encrypted_notifications, sender_id=None):
+    save_job_notifications(self, EMAIL_TYPE, service_id, encrypted_notifications, sender_id=sender_id)
+
+
+def save_job_notifications(self, notification_type, service_id, encrypted_notifications, sender_id=None):
+    """
+    Batch version of save_sms and save_email for rows published by process_rows. All the rows are from the same job,
+    so share a template and reply-to, and are saved with a single insert. Rows that already exist (because SQS
+    delivered the task twice) are skipped and not queued for delivery again.
+    """
+    notifications = [encryption.decrypt(encrypted_notification) for encrypted_notification in encrypted_notifications]
+    service = SerialisedService.from_id(service_id)
+    template = SerialisedTemplate.from_id_and_service_id(
+        notifications[0]['template'],
+        service_id=service.id,
+        version=notifications[0]['template_version'],
+    )
+
+    if sender_id and notification_type == SMS_TYPE:
+        reply_to_text = dao_get_service_sms_senders_by_id(service_id, sender_id).sms_sender
+    elif sender_id:
+        reply_to_text = dao_get_reply_to_by_id(service_id, sender_id).email_address
+    else:
+        reply_to_text = template.reply_to_text
+
+    allowed_notifications = [
+        notification for notification in notifications
+        if service_allowed_to_send_to(notification['to'], service, KEY_TYPE_NORMAL)
+    ]
+    if len(allowed_notifications) != len(notifications):
+        current_app.logger.info(
+            "{} of {} {} notifications for job {} failed as restricted service".format(
+                len(notifications) - len(allowed_notifications),
+                len(notifications),
+                notification_type,
+                notifications[0].get('job')
+            )
+        )
+
+    if notification_type == SMS_TYPE:
+        queue = QueueNames.SEND_SMS if not service.research_mode else QueueNames.RESEARCH_MODE
+    else:
+        queue = QueueNames.SEND_EMAIL if not service.research_mode else QueueNames.RESEARCH_MODE
+
+    try:
+        created_at = datetime.utcnow()
+        saved_notifications = persist_notifications(
+            [
+                build_notification(
+                    notification_id=notification['id'],
+                    template_id=notification['template'],
+                    template_version=notification['template_version'],
+                    recipient=notification['to'],
+                    service=service,
+                    personalisation=notification.get('personalisation'),
+                    notification_type=notification_type,
+                    api_key_id=None,
+                    key_type=KEY_TYPE_NORMAL,
+                    created_at=created_at,
+                    job_id=notification.get('job', None),
+                    job_row_number=notification.get('row_number', None),
+                    reply_to_text=reply_to_text
+                )
+                for notification in allowed_notifications
+            ],
+            service=service,
+        )
+    except SQLAlchemyError:
+        try:
+            self.retry(queue=QueueNames.RETRY)
+        except self.MaxRetriesExceededError:
+            current_app.logger.error(
+                "Max retry failed Failed to persist {} {} notifications for job {}".format(
+                    len(notifications), notification_type, notifications[0].get('job')
+                )
+            )
+        return
+
+    if notification_type == SMS_TYPE:
+        queue_sms_deliveries([saved_notification.id for saved_notification in saved_notifications], queue)
+    else:
+        for saved_notification in saved_notifications:
+            provider_tasks.deliver_email.apply_async([str(saved_notification.id)], queue=queue)
+
+    current_app.logger.debug(
+        "{} {} notifications created at {} for job {}".format(
+            len(saved_notifications), notification_type, created_at, notifications[0].get('job')
+        )
+    )
+
+
 @notify_celery.task(bind=True, name="save-api-email", max_retries=5, default_retry_delay=300)
 def save_api_email(self, encrypted_notification):
 
@@ -341,6 +632,81 @@ def save_api_email_or_sms(self, encrypted_notification):
             current_app.logger.error(f"Max retry failed Failed to persist notification {notification['id']}")
 
 
+@notify_celery.task(bind=True, name="save-api-emails", max_retries=5, default_retry_delay=300)
+def save_api_emails(self, encrypted_notifications):
+    save_api_emails_or_smss(self, encrypted_notifications)
+
+
+@notify_celery.task(bind=True, name="save-api-smss", max_retries=5, default_retry_delay=300)
+def save_api_smss(self, encrypted_notifications):
+    save_api_emails_or_smss(self, encrypted_notifications)
+
+
+def save_api_emails_or_smss(self, encrypted_notifications):
+    """
+    Batch version of save_api_email_or_sms. Saves all of the notifications with one insert per service and then
+    queues delivery for the ones that were actually inserted, so notifications that already exist (because SQS
+    delivered the batch twice) are not sent again.
+    """
+    notifications_by_service = defaultdict(list)
+    for encrypted_notification in encrypted_notifications:
+        notification = encryption.decrypt(encrypted_notification)
+        notifications_by_service[notification['service_id']].append(notification)
+
+    try:
+        for service_id, notifications in notifications_by_service.items():
+            service = SerialisedService.from_id(service_id)
+            saved_notifications = persist_notifications(
+                [
+                    build_notification(
+                        notification_id=notification['id'],
+                        template_id=notification['template_id'],
+                        template_version=notification['template_version'],
+                        recipient=notification['to'],
+                        service=service,
+                        personalisation=notification.get('personalisation'),
+                        notification_type=notification['notification_type'],
+                        client_reference=notification['client_reference'],
+                        api_key_id=notification.get('api_key_id'),
+                        key_type=KEY_TYPE_NORMAL,
+                        created_at=notification['created_at'],
+                        reply_to_text=notification['reply_to_text'],
+                        status=notification['status'],
+                        document_download_count=notification['document_download_count']
+                    )
+                    for notification in notifications
+                ],
+                service=service,
+            )
+
+            sms_ids = []
+            for saved_notification in saved_notifications:
+                if saved_notification.notification_type == EMAIL_TYPE:
+                    provider_tasks.deliver_email.apply_async(
+                        [str(saved_notification.id)],
+                        queue=QueueNames.SEND_EMAIL if not service.research_mode else QueueNames.RESEARCH_MODE
+                    )
+                else:
+                    sms_ids.append(saved_notification.id)
+            queue_sms_deliveries(
+                sms_ids, QueueNames.SEND_SMS if not service.research_mode else QueueNames.RESEARCH_MODE
+            )
+
+            if len(saved_notifications) != len(notifications):
+                current_app.logger.info(
+                    f"{len(notifications) - len(saved_notifications)} of {len(notifications)} notifications for "
+                    f"service {service_id} already exist."
+                )
+    except SQLAlchemyError:
+        # services whose notifications were saved before the error will skip them on retry, as they already exist
+        try:
+            self.retry(queue=QueueNames.RETRY)
+        except self.MaxRetriesExceededError:
+            current_app.logger.error(
+                f"Max retry failed Failed to persist {len(encrypted_notifications)} notifications"
+            )
+
+
 @notify_celery.task(bind=True, name="save-letter", max_retries=5, default_retry_delay=300)
 def save_letter(
         self,
@@ -630,6 +996,13 @@ def process_incomplete_jobs(job_ids):
 def process_incomplete_job(job_id):
     job = dao_get_job_by_id(job_id)
 
+    if job.completed_chunks is not None:
+        current_app.logger.info(
+            "Resuming job {} with {} chunks already completed".format(job_id, len(job.completed_chunks))
+        )
+        process_job_in_chunks(job, completed_chunks=set(job.completed_chunks))
+        return
+
     last_notification_added = dao_get_last_notification_added_for_job_id(job_id)
 
     if last_notification_added:
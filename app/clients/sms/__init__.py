@@ -1,3 +1,6 @@
+from requests import Session
+from requests.adapters import HTTPAdapter
+
 from app.clients import Client, ClientException
 
 
@@ -13,11 +16,53 @@ class SmsClientResponseException(ClientException):
         return "Message {}".format(self.message)
 
 
+class ConnectionCountingHTTPAdapter(HTTPAdapter):
+    """
+    An HTTPAdapter that counts, in statsd, whether each request reused one of the pool's open connections or had to
+    open (and do a TLS handshake for) a new one.
+    """
+    def __init__(self, statsd_client, metric_prefix, **kwargs):
+        self.statsd_client = statsd_client
+        self.metric_prefix = metric_prefix
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        pool = self.get_connection(request.url, kwargs.get('proxies'))
+        connections_before = pool.num_connections
+        try:
+            return super().send(request, **kwargs)
+        finally:
+            if pool.num_connections > connections_before:
+                self.statsd_client.incr(f'{self.metric_prefix}.new-connection')
+            else:
+                self.statsd_client.incr(f'{self.metric_prefix}.reused-connection')
+
+
 class SmsClient(Client):
     '''
     Base Sms client for sending smss.
     '''
 
+    def init_session(self, current_app, statsd_client):
+        """
+        Each client sends through its own session, which keeps up to SMS_CLIENT_POOL_SIZE connections to the
+        provider open between messages, rather than opening a new connection for every message.
+        """
+        self.timeout = (
+            current_app.config['SMS_CLIENT_CONNECT_TIMEOUT_SECONDS'],
+            current_app.config['SMS_CLIENT_READ_TIMEOUT_SECONDS'],
+        )
+        self.session = Session()
+        self.session.mount('https://', ConnectionCountingHTTPAdapter(
+            statsd_client,
+            f'clients.{self.name}',
+            pool_connections=1,
+            pool_maxsize=current_app.config['SMS_CLIENT_POOL_SIZE'],
+            # the provider may have got a message whose response we didn't, so retrying could send it twice.
+            # deliver_sms retries instead, once it has checked the notification hasn't been sent
+            max_retries=0,
+        ))
+
     def send_sms(self, *args, **kwargs):
         raise NotImplementedError('TODO Need to implement.')
 
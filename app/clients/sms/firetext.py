@@ -2,7 +2,7 @@ import json
 import logging
 from time import monotonic
 
-from requests import RequestException, request
+from requests import RequestException
 
 from app.clients.sms import SmsClient, SmsClientResponseException
 
@@ -71,6 +71,7 @@ class FiretextClient(SmsClient):
         self.name = 'firetext'
         self.url = current_app.config.get('FIRETEXT_URL')
         self.statsd_client = statsd_client
+        self.init_session(current_app, statsd_client)
 
     def get_name(self):
         return self.name
@@ -103,11 +104,11 @@ class FiretextClient(SmsClient):
 
         start_time = monotonic()
         try:
-            response = request(
+            response = self.session.request(
                 "POST",
                 self.url,
                 data=data,
-                timeout=60
+                timeout=self.timeout
             )
             response.raise_for_status()
             try:
@@ -1,7 +1,7 @@
 import json
 from time import monotonic
 
-from requests import RequestException, request
+from requests import RequestException
 
 from app.clients.sms import SmsClient, SmsClientResponseException
 
@@ -77,6 +77,7 @@ class MMGClient(SmsClient):
         self.name = 'mmg'
         self.statsd_client = statsd_client
         self.mmg_url = current_app.config.get('MMG_URL')
+        self.init_session(current_app, statsd_client)
 
     def record_outcome(self, success, response):
         status_code = response.status_code if response else 503
@@ -109,7 +110,7 @@ class MMGClient(SmsClient):
 
         start_time = monotonic()
         try:
-            response = request(
+            response = self.session.request(
                 "POST",
                 self.mmg_url,
                 data=json.dumps(data),
@@ -117,7 +118,7 @@ class MMGClient(SmsClient):
                     'Content-Type': 'application/json',
                     'Authorization': 'Basic {}'.format(self.api_key)
                 },
-                timeout=60
+                timeout=self.timeout
             )
 
             response.raise_for_status()
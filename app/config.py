@@ -30,6 +30,8 @@ class QueueNames(object):
     CALLBACKS_RETRY = 'service-callbacks-retry'
     LETTERS = 'letter-tasks'
     SMS_CALLBACKS = 'sms-callbacks'
+    # filled by the SES callback lambda rather than by the api, so not in all_queues
+    SES_CALLBACKS = 'ses-callbacks'
     ANTIVIRUS = 'antivirus-tasks'
     SANITISE_LETTERS = 'sanitise-letter-tasks'
     SAVE_API_EMAIL = 'save-api-email-tasks'
@@ -233,6 +235,12 @@ class Config(object):
                 'schedule': crontab(),
                 'options': {'queue': QueueNames.PERIODIC}
             },
+            # app/celery/process_ses_receipts_tasks.py, does nothing unless SES_RESULTS_BATCH_SIZE is set
+            'process-ses-results-from-queue': {
+                'task': 'process-ses-results-from-queue',
+                'schedule': crontab(),
+                'options': {'queue': QueueNames.PERIODIC}
+            },
             'tend-providers-back-to-middle': {
                 'task': 'tend-providers-back-to-middle',
                 'schedule': crontab(minute='*/5'),
@@ -369,7 +377,57 @@ class Config(object):
     ROUTE_SECRET_KEY_1 = os.environ.get('ROUTE_SECRET_KEY_1', '')
     ROUTE_SECRET_KEY_2 = os.environ.get('ROUTE_SECRET_KEY_2', '')
 
+    # how long services, templates and API keys stay in each process's memory. Changes are normally pushed to every
+    # process over Redis pub/sub, so this is only a backstop
+    SERIALISED_MODEL_CACHE_TTL = int(os.environ.get('SERIALISED_MODEL_CACHE_TTL', 3600))
+
+    # how long a performance dashboard response is cached in Redis. Its figures only change overnight, apart from the
+    # list of live services
+    PERFORMANCE_DASHBOARD_CACHE_TTL = int(os.environ.get('PERFORMANCE_DASHBOARD_CACHE_TTL', 3600))
+
     HIGH_VOLUME_SERVICE = json.loads(os.environ.get('HIGH_VOLUME_SERVICE', '[]'))
+    # how many notifications from a bulk API request go in each save-api-emails/smss task. Keep this low enough that
+    # the encrypted batch stays under SQS's 256kb message limit
+    SAVE_API_BATCH_SIZE = int(os.environ.get('SAVE_API_BATCH_SIZE', 50))
+    # how long, in milliseconds, a single API request from a high volume service waits for others to put their
+    # notifications on the save queue in the same save-api-emails/smss task. 0 (the default) puts each on the queue
+    # by itself. Requests can only be grouped with others being handled by the same process at the same time, so only
+    # turn this on with threaded workers (eg gunicorn's gthread). With a sync worker no other request can join the
+    # batch, so every request would just wait this long for nothing
+    SAVE_API_BATCH_WAIT_MS = int(os.environ.get('SAVE_API_BATCH_WAIT_MS', 0))
+    # jobs with more rows than this are read from S3 as a stream and split into chunks of this many rows, each
+    # processed by its own process-job-chunk task
+    JOB_CHUNK_SIZE = int(os.environ.get('JOB_CHUNK_SIZE', 1000))
+    # how many rows of a chunked SMS or email job go in each save-smss/save-emails task
+    JOB_ROW_BATCH_SIZE = int(os.environ.get('JOB_ROW_BATCH_SIZE', 50))
+    # how many SMS notifications go in each deliver-sms-batch task. Each batch is sent with up to
+    # SMS_DELIVERY_MAX_IN_FLIGHT messages waiting on the providers at once, and at most
+    # SMS_DELIVERY_MAX_IN_FLIGHT_PER_PROVIDER of them on any one provider. If it's 1 each SMS gets its own deliver_sms
+    # task instead
+    SMS_DELIVERY_BATCH_SIZE = int(os.environ.get('SMS_DELIVERY_BATCH_SIZE', 1))
+    SMS_DELIVERY_MAX_IN_FLIGHT = int(os.environ.get('SMS_DELIVERY_MAX_IN_FLIGHT', 10))
+    SMS_DELIVERY_MAX_IN_FLIGHT_PER_PROVIDER = int(os.environ.get('SMS_DELIVERY_MAX_IN_FLIGHT_PER_PROVIDER', 5))
+    # how often, in seconds, the status changes from email and text message delivery receipts are written to the
+    # database in one go, or sooner once NOTIFICATION_STATUS_BUFFER_MAX_SIZE notifications are waiting. 0 writes each
+    # change straight away. Changes that haven't been written yet are lost if a worker is killed
+    NOTIFICATION_STATUS_BUFFER_SECONDS = float(os.environ.get('NOTIFICATION_STATUS_BUFFER_SECONDS', 0))
+    NOTIFICATION_STATUS_BUFFER_MAX_SIZE = int(os.environ.get('NOTIFICATION_STATUS_BUFFER_MAX_SIZE', 1000))
+    # when set, a task started every minute takes SES results off the ses-callbacks queue this many at a time and
+    # processes each lot with process-ses-results-batch, for up to SES_RESULTS_DRAIN_SECONDS. 0 leaves them to
+    # process-ses-result, one at a time
+    SES_RESULTS_BATCH_SIZE = int(os.environ.get('SES_RESULTS_BATCH_SIZE', 0))
+    SES_RESULTS_DRAIN_SECONDS = int(os.environ.get('SES_RESULTS_DRAIN_SECONDS', 50))
+
+    # the nightly move of notifications past retention to notification_history. At most ARCHIVAL_MAX_WORKERS tasks
+    # run at once, each sizing its batches so that one takes about ARCHIVAL_TARGET_BATCH_SECONDS
+    ARCHIVAL_MAX_WORKERS = int(os.environ.get('ARCHIVAL_MAX_WORKERS', 4))
+    ARCHIVAL_TARGET_BATCH_SECONDS = int(os.environ.get('ARCHIVAL_TARGET_BATCH_SECONDS', 10))
+    ARCHIVAL_MIN_BATCH_SIZE = int(os.environ.get('ARCHIVAL_MIN_BATCH_SIZE', 1000))
+    ARCHIVAL_MAX_BATCH_SIZE = int(os.environ.get('ARCHIVAL_MAX_BATCH_SIZE', 50000))
+    # how long a batch waits for a row lock held by other writes before backing off with a smaller batch
+    ARCHIVAL_LOCK_TIMEOUT_MS = int(os.environ.get('ARCHIVAL_LOCK_TIMEOUT_MS', 2000))
+    # how many lock timeouts in a row before a worker leaves a service's notifications for later
+    ARCHIVAL_MAX_LOCK_TIMEOUTS = int(os.environ.get('ARCHIVAL_MAX_LOCK_TIMEOUTS', 10))
 
     TEMPLATE_PREVIEW_API_HOST = os.environ.get('TEMPLATE_PREVIEW_API_HOST', 'http://localhost:6013')
     TEMPLATE_PREVIEW_API_KEY = os.environ.get('TEMPLATE_PREVIEW_API_KEY', 'my-secret-key')
@@ -381,8 +439,40 @@ class Config(object):
     MMG_URL = os.environ.get("MMG_URL", "https://api.mmg.co.uk/jsonv2a/api.php")
     FIRETEXT_URL = os.environ.get("FIRETEXT_URL", "https://www.firetext.co.uk/api/sendsms/json")
     SES_STUB_URL = os.environ.get("SES_STUB_URL")
+    # each SMS client keeps up to this many connections to its provider open between messages. Should be at least
+    # the number of threads that send SMS at once (for example celery's concurrency)
+    SMS_CLIENT_POOL_SIZE = int(os.environ.get('SMS_CLIENT_POOL_SIZE', 10))
+    # a provider that doesn't accept a connection within SMS_CLIENT_CONNECT_TIMEOUT_SECONDS is probably down, but
+    # one that's slow to respond may still send the message
+    SMS_CLIENT_CONNECT_TIMEOUT_SECONDS = int(os.environ.get('SMS_CLIENT_CONNECT_TIMEOUT_SECONDS', 5))
+    SMS_CLIENT_READ_TIMEOUT_SECONDS = int(os.environ.get('SMS_CLIENT_READ_TIMEOUT_SECONDS', 60))
+    # each process stops sending SMS to a provider for SMS_PROVIDER_CIRCUIT_OPEN_SECONDS once, of at least
+    # SMS_PROVIDER_CIRCUIT_MIN_REQUESTS it sent in the last SMS_PROVIDER_HEALTH_WINDOW_SECONDS, this percentage
+    # failed or took longer than SMS_PROVIDER_SLOW_RESPONSE_MS
+    SMS_PROVIDER_CIRCUIT_ERROR_PERCENTAGE = int(os.environ.get('SMS_PROVIDER_CIRCUIT_ERROR_PERCENTAGE', 50))
+    SMS_PROVIDER_CIRCUIT_MIN_REQUESTS = int(os.environ.get('SMS_PROVIDER_CIRCUIT_MIN_REQUESTS', 10))
+    SMS_PROVIDER_HEALTH_WINDOW_SECONDS = int(os.environ.get('SMS_PROVIDER_HEALTH_WINDOW_SECONDS', 30))
+    SMS_PROVIDER_SLOW_RESPONSE_MS = int(os.environ.get('SMS_PROVIDER_SLOW_RESPONSE_MS', 10000))
+    SMS_PROVIDER_CIRCUIT_OPEN_SECONDS = int(os.environ.get('SMS_PROVIDER_CIRCUIT_OPEN_SECONDS', 30))
+    # the most messages a second all workers together send to each provider, for example {"ses": 100}. Providers
+    # that aren't listed aren't paced. The rate drops when a provider throttles us and climbs back to the ceiling by
+    # SEND_RATE_INCREASE_PER_SECOND each second. A worker waits for its turn to send unless that's more than
+    # SEND_RATE_MAX_WAIT_SECONDS away, in which case the message is retried once it would have been its turn
+    SEND_RATE_CEILINGS = json.loads(os.environ.get('SEND_RATE_CEILINGS', '{}'))
+    SEND_RATE_MINIMUM = int(os.environ.get('SEND_RATE_MINIMUM', 1))
+    SEND_RATE_INCREASE_PER_SECOND = int(os.environ.get('SEND_RATE_INCREASE_PER_SECOND', 1))
+    SEND_RATE_MAX_WAIT_SECONDS = int(os.environ.get('SEND_RATE_MAX_WAIT_SECONDS', 5))
+    # waiting for its turn to send doesn't count as one of a message's retries, up to this many times
+    SEND_RATE_MAX_DEFERRALS = int(os.environ.get('SEND_RATE_MAX_DEFERRALS', 100))
 
     AWS_REGION = 'eu-west-1'
+    # size of the connection pool of each process's shared S3 client. Should be at least the number of threads that
+    # use S3 at once (for example celery's concurrency), or they will wait for a free connection
+    S3_MAX_POOL_CONNECTIONS = int(os.environ.get('S3_MAX_POOL_CONNECTIONS', 50))
+    # how many letter PDFs missing from the bucket listing to look up at once when collating letters for printing
+    LETTER_PDF_LOOKUP_THREADS = int(os.environ.get('LETTER_PDF_LOOKUP_THREADS', 10))
+    # how many DeleteObjects requests (of up to 1000 keys each) to make at once when deleting files from S3
+    S3_DELETE_THREADS = int(os.environ.get('S3_DELETE_THREADS', 4))
 
     CBC_PROXY_ENABLED = True
     CBC_PROXY_AWS_ACCESS_KEY_ID = os.environ.get('CBC_PROXY_AWS_ACCESS_KEY_ID', '')
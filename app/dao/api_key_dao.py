@@ -5,6 +5,7 @@ from sqlalchemy import func, or_
 
 from app import db
 from app.dao.dao_utils import autocommit, version_class
+from app.memory_cache import invalidate_service_cache
 from app.models import ApiKey
 
 
@@ -15,6 +16,7 @@ def save_model_api_key(api_key):
         api_key.id = uuid.uuid4()  # must be set now so version history model can use same id
     api_key.secret = uuid.uuid4()
     db.session.add(api_key)
+    invalidate_service_cache(api_key.service_id)
 
 
 @autocommit
@@ -23,6 +25,7 @@ def expire_api_key(service_id, api_key_id):
     api_key = ApiKey.query.filter_by(id=api_key_id, service_id=service_id).one()
     api_key.expiry_date = datetime.utcnow()
     db.session.add(api_key)
+    invalidate_service_cache(service_id)
 
 
 def get_model_api_keys(service_id, id=None):
@@ -1,5 +1,6 @@
 from app import db
 from app.dao.dao_utils import autocommit
+from app.memory_cache import invalidate_email_branding_cache
 from app.models import EmailBranding
 
 
@@ -25,3 +26,4 @@ def dao_update_email_branding(email_branding, **kwargs):
     for key, value in kwargs.items():
         setattr(email_branding, key, value or None)
     db.session.add(email_branding)
+    invalidate_email_branding_cache(email_branding.id)
@@ -24,12 +24,14 @@ from app.models import (
     AnnualBilling,
     FactBilling,
     LetterRate,
+    Notification,
     NotificationHistory,
     Organisation,
     Rate,
     Service,
+    ServicePermission,
 )
-from app.utils import get_london_midnight_in_utc, get_notification_table_to_use
+from app.utils import get_london_midnight_in_utc, notification_table_filter
 
 
 def fetch_sms_free_allowance_remainder_until_date(end_date):
@@ -254,8 +256,7 @@ def fetch_monthly_billing_for_year(service_id, year):
     # if year end date is less than today, we are calculating for data in the past and have no need for deltas.
     if year_end_date >= today:
         data = fetch_billing_data_for_day(process_day=today, service_id=service_id, check_permissions=True)
-        for d in data:
-            update_fact_billing(data=d, process_day=today)
+        update_fact_billing_for_day(data, process_day=today)
 
     email_and_letters = db.session.query(
         func.date_trunc('month', FactBilling.bst_date).cast(Date).label("month"),
@@ -317,38 +318,35 @@ def delete_billing_data_for_service_for_day(process_day, service_id):
 
 
 def fetch_billing_data_for_day(process_day, service_id=None, check_permissions=False):
+    """
+    Aggregate the day's billable notifications for every service (or just service_id) with one query per
+    notification type and table, rather than one per service.
+    """
     start_date = get_london_midnight_in_utc(process_day)
     end_date = get_london_midnight_in_utc(process_day + timedelta(days=1))
     current_app.logger.info("Populate ft_billing for {} to {}".format(start_date, end_date))
     transit_data = []
-    if not service_id:
-        services = Service.query.all()
-    else:
-        services = [Service.query.get(service_id)]
-
-    for service in services:
-        for notification_type in (SMS_TYPE, EMAIL_TYPE, LETTER_TYPE):
-            if (not check_permissions) or service.has_permission(notification_type):
-                table = get_notification_table_to_use(service, notification_type, process_day,
-                                                      has_delete_task_run=False)
-                results = _query_for_billing_data(
-                    table=table,
-                    notification_type=notification_type,
-                    start_date=start_date,
-                    end_date=end_date,
-                    service=service
-                )
-                transit_data += results
+    for notification_type in (SMS_TYPE, EMAIL_TYPE, LETTER_TYPE):
+        for table in (Notification, NotificationHistory):
+            transit_data += _query_for_billing_data(
+                table=table,
+                notification_type=notification_type,
+                start_date=start_date,
+                end_date=end_date,
+                process_day=process_day,
+                service_id=service_id,
+                check_permissions=check_permissions,
+            )
 
     return transit_data
 
 
-def _query_for_billing_data(table, notification_type, start_date, end_date, service):
+def _query_for_billing_data(table, notification_type, start_date, end_date, process_day, service_id, check_permissions):
     def _email_query():
         return db.session.query(
             table.template_id,
-            literal(service.crown).label('crown'),
-            literal(service.id).label('service_id'),
+            Service.crown,
+            table.service_id,
             literal(notification_type).label('notification_type'),
             literal('ses').label('sent_by'),
             literal(0).label('rate_multiplier'),
@@ -359,13 +357,10 @@ def _query_for_billing_data(table, notification_type, start_date, end_date, serv
             func.count().label('notifications_sent'),
         ).filter(
             table.status.in_(NOTIFICATION_STATUS_TYPES_SENT_EMAILS),
-            table.key_type != KEY_TYPE_TEST,
-            table.created_at >= start_date,
-            table.created_at < end_date,
-            table.notification_type == notification_type,
-            table.service_id == service.id
         ).group_by(
             table.template_id,
+            table.service_id,
+            Service.crown,
         )
 
     def _sms_query():
@@ -374,8 +369,8 @@ def _query_for_billing_data(table, notification_type, start_date, end_date, serv
         international = func.coalesce(table.international, False)
         return db.session.query(
             table.template_id,
-            literal(service.crown).label('crown'),
-            literal(service.id).label('service_id'),
+            Service.crown,
+            table.service_id,
             literal(notification_type).label('notification_type'),
             sent_by.label('sent_by'),
             rate_multiplier.label('rate_multiplier'),
@@ -386,13 +381,10 @@ def _query_for_billing_data(table, notification_type, start_date, end_date, serv
             func.count().label('notifications_sent'),
         ).filter(
             table.status.in_(NOTIFICATION_STATUS_TYPES_BILLABLE_SMS),
-            table.key_type != KEY_TYPE_TEST,
-            table.created_at >= start_date,
-            table.created_at < end_date,
-            table.notification_type == notification_type,
-            table.service_id == service.id
         ).group_by(
             table.template_id,
+            table.service_id,
+            Service.crown,
             sent_by,
             rate_multiplier,
             international,
@@ -403,8 +395,8 @@ def _query_for_billing_data(table, notification_type, start_date, end_date, serv
         postage = func.coalesce(table.postage, 'none')
         return db.session.query(
             table.template_id,
-            literal(service.crown).label('crown'),
-            literal(service.id).label('service_id'),
+            Service.crown,
+            table.service_id,
             literal(notification_type).label('notification_type'),
             literal('dvla').label('sent_by'),
             rate_multiplier.label('rate_multiplier'),
@@ -415,13 +407,10 @@ def _query_for_billing_data(table, notification_type, start_date, end_date, serv
             func.count().label('notifications_sent'),
         ).filter(
             table.status.in_(NOTIFICATION_STATUS_TYPES_BILLABLE_FOR_LETTERS),
-            table.key_type != KEY_TYPE_TEST,
-            table.created_at >= start_date,
-            table.created_at < end_date,
-            table.notification_type == notification_type,
-            table.service_id == service.id
         ).group_by(
             table.template_id,
+            table.service_id,
+            Service.crown,
             rate_multiplier,
             table.billable_units,
             postage,
@@ -434,7 +423,25 @@ def _query_for_billing_data(table, notification_type, start_date, end_date, serv
         LETTER_TYPE: _letter_query
     }
 
-    query = query_funcs[notification_type]()
+    query = query_funcs[notification_type]().join(
+        Service, Service.id == table.service_id
+    ).filter(
+        table.key_type != KEY_TYPE_TEST,
+        table.created_at >= start_date,
+        table.created_at < end_date,
+        table.notification_type == notification_type,
+        # only read each service's notifications from the table that holds them, depending on their retention
+        notification_table_filter(table, notification_type, process_day, has_delete_task_run=False),
+    )
+    if service_id:
+        query = query.filter(table.service_id == service_id)
+    if check_permissions:
+        query = query.filter(
+            db.session.query(ServicePermission).filter(
+                ServicePermission.service_id == table.service_id,
+                ServicePermission.permission == notification_type,
+            ).exists()
+        )
     return query.all()
 
 
@@ -487,46 +494,67 @@ def get_rate(
 
 
 def update_fact_billing(data, process_day):
+    update_fact_billing_for_day([data], process_day)
+
+
+def update_fact_billing_for_day(transit_data, process_day):
+    """
+    Upsert every row of fetch_billing_data_for_day into ft_billing with a single statement, working out the rates
+    from one read of the rates tables. Returns the number of ft_billing rows written.
+    """
     non_letter_rates, letter_rates = get_rates_for_billing()
-    rate = get_rate(non_letter_rates,
-                    letter_rates,
-                    data.notification_type,
-                    process_day,
-                    data.crown,
-                    data.letter_page_count,
-                    data.postage)
-    billing_record = create_billing_record(data, rate, process_day)
-
-    table = FactBilling.__table__
-    '''
-       This uses the Postgres upsert to avoid race conditions when two threads try to insert
-       at the same row. The excluded object refers to values that we tried to insert but were
-       rejected.
-       http://docs.sqlalchemy.org/en/latest/dialects/postgresql.html#insert-on-conflict-upsert
-    '''
-    stmt = insert(table).values(
-        bst_date=billing_record.bst_date,
-        template_id=billing_record.template_id,
-        service_id=billing_record.service_id,
-        provider=billing_record.provider,
-        rate_multiplier=billing_record.rate_multiplier,
-        notification_type=billing_record.notification_type,
-        international=billing_record.international,
-        billable_units=billing_record.billable_units,
-        notifications_sent=billing_record.notifications_sent,
-        rate=billing_record.rate,
-        postage=billing_record.postage,
-    )
 
-    stmt = stmt.on_conflict_do_update(
-        constraint="ft_billing_pkey",
-        set_={"notifications_sent": stmt.excluded.notifications_sent,
-              "billable_units": stmt.excluded.billable_units,
-              "updated_at": datetime.utcnow()
-              }
-    )
-    db.session.connection().execute(stmt)
+    billing_records = {}
+    for data in transit_data:
+        rate = get_rate(non_letter_rates,
+                        letter_rates,
+                        data.notification_type,
+                        process_day,
+                        data.crown,
+                        data.letter_page_count,
+                        data.postage)
+        billing_record = create_billing_record(data, rate, process_day)
+        key = tuple(getattr(billing_record, column.name) for column in FactBilling.__table__.primary_key)
+        if key in billing_records:
+            # for example letters with different page counts that cost the same: add them to one ft_billing row
+            billing_records[key]['billable_units'] = (
+                (billing_records[key]['billable_units'] or 0) + (billing_record.billable_units or 0)
+            )
+            billing_records[key]['notifications_sent'] += billing_record.notifications_sent
+        else:
+            billing_records[key] = {
+                'bst_date': billing_record.bst_date,
+                'template_id': billing_record.template_id,
+                'service_id': billing_record.service_id,
+                'provider': billing_record.provider,
+                'rate_multiplier': billing_record.rate_multiplier,
+                'notification_type': billing_record.notification_type,
+                'international': billing_record.international,
+                'billable_units': billing_record.billable_units,
+                'notifications_sent': billing_record.notifications_sent,
+                'rate': billing_record.rate,
+                'postage': billing_record.postage,
+            }
+
+    if billing_records:
+        table = FactBilling.__table__
+        '''
+           This uses the Postgres upsert to avoid race conditions when two threads try to insert
+           at the same row. The excluded object refers to values that we tried to insert but were
+           rejected.
+           http://docs.sqlalchemy.org/en/latest/dialects/postgresql.html#insert-on-conflict-upsert
+        '''
+        stmt = insert(table).values(list(billing_records.values()))
+        stmt = stmt.on_conflict_do_update(
+            constraint="ft_billing_pkey",
+            set_={"notifications_sent": stmt.excluded.notifications_sent,
+                  "billable_units": stmt.excluded.billable_units,
+                  "updated_at": datetime.utcnow()
+                  }
+        )
+        db.session.connection().execute(stmt)
     db.session.commit()
+    return len(billing_records)
 
 
 def create_billing_record(data, rate, process_day):
@@ -660,8 +688,7 @@ def fetch_usage_year_for_organisation(organisation_id, year):
     if year_end_date >= today:
         for service in services:
             data = fetch_billing_data_for_day(process_day=today, service_id=service.id)
-            for d in data:
-                update_fact_billing(data=d, process_day=today)
+            update_fact_billing_for_day(data, process_day=today)
     service_with_usage = {}
     # initialise results
     for service in services:
@@ -1,6 +1,7 @@
 from datetime import datetime, timedelta
 
-from sqlalchemy import Date, case, func
+from notifications_utils.timezones import convert_utc_to_bst
+from sqlalchemy import Date, and_, case, func
 from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.sql.expression import extract, literal
 from sqlalchemy.types import DateTime, Integer
@@ -22,7 +23,10 @@ from app.models import (
     NOTIFICATION_TECHNICAL_FAILURE,
     NOTIFICATION_TEMPORARY_FAILURE,
     FactNotificationStatus,
+    FactNotificationStatusTotal,
+    LiveNotificationStatus,
     Notification,
+    NotificationHistory,
     Service,
     Template,
 )
@@ -31,6 +35,7 @@ from app.utils import (
     get_london_month_from_utc_column,
     get_notification_table_to_use,
     midnight_n_days_ago,
+    notification_table_filter,
 )
 
 
@@ -94,6 +99,175 @@ def update_fact_notification_status(process_day, notification_type, service_id):
         )
     )
 
+    _update_fact_notification_status_totals(process_day)
+
+
+@autocommit
+def update_fact_notification_status_for_day(process_day, notification_type):
+    """
+    Rebuild the ft_notification_status rows for every service for one day and notification type with a single
+    INSERT ... SELECT over notifications and notification_history, reading each service's notifications from
+    whichever table holds them. The old rows are deleted in the same transaction, so readers see either the old rows
+    or the new ones.
+    """
+    start_date = get_london_midnight_in_utc(process_day)
+    end_date = get_london_midnight_in_utc(process_day + timedelta(days=1))
+
+    FactNotificationStatus.query.filter(
+        FactNotificationStatus.bst_date == process_day,
+        FactNotificationStatus.notification_type == notification_type,
+    ).delete(synchronize_session=False)
+
+    def _query_for_table(source_table):
+        job_id = func.coalesce(source_table.job_id, '00000000-0000-0000-0000-000000000000')
+        return db.session.query(
+            literal(process_day).label("process_day"),
+            source_table.template_id,
+            source_table.service_id,
+            job_id.label('job_id'),
+            literal(notification_type).label("notification_type"),
+            source_table.key_type,
+            source_table.status,
+            func.count().label('notification_count')
+        ).filter(
+            source_table.created_at >= start_date,
+            source_table.created_at < end_date,
+            source_table.notification_type == notification_type,
+            source_table.key_type.in_((KEY_TYPE_NORMAL, KEY_TYPE_TEAM)),
+            notification_table_filter(source_table, notification_type, process_day, has_delete_task_run=False),
+        ).group_by(
+            source_table.template_id,
+            source_table.service_id,
+            job_id,
+            source_table.key_type,
+            source_table.status
+        )
+
+    db.session.connection().execute(
+        insert(FactNotificationStatus.__table__).from_select(
+            [
+                FactNotificationStatus.bst_date,
+                FactNotificationStatus.template_id,
+                FactNotificationStatus.service_id,
+                FactNotificationStatus.job_id,
+                FactNotificationStatus.notification_type,
+                FactNotificationStatus.key_type,
+                FactNotificationStatus.notification_status,
+                FactNotificationStatus.notification_count
+            ],
+            _query_for_table(Notification).union_all(_query_for_table(NotificationHistory))
+        )
+    )
+
+    _update_fact_notification_status_totals(process_day)
+
+
+def _update_fact_notification_status_totals(start_date):
+    """
+    Rebuild the ft_notification_status_totals rows from start_date onwards, carrying the running totals on from the
+    last day before it. Only the last few days of ft_notification_status are rebuilt each night, so this only reads
+    those days rather than all of them.
+    """
+    # stops two transactions rebuilding the rows at once, as each can't see the other's ft_notification_status rows
+    db.session.execute('LOCK TABLE ft_notification_status_totals IN EXCLUSIVE MODE')
+
+    previous_day = FactNotificationStatusTotal.query.filter(
+        FactNotificationStatusTotal.bst_date < start_date
+    ).order_by(
+        FactNotificationStatusTotal.bst_date.desc()
+    ).first()
+
+    daily_totals = db.session.query(
+        FactNotificationStatus.bst_date,
+        *[
+            func.sum(case(
+                [(FactNotificationStatus.notification_type == type_, FactNotificationStatus.notification_count)],
+                else_=0
+            )).label(label)
+            for type_, label in [('email', 'emails'), ('sms', 'sms'), ('letter', 'letters')]
+        ]
+    ).filter(
+        FactNotificationStatus.bst_date >= start_date,
+        FactNotificationStatus.key_type != KEY_TYPE_TEST,
+    ).group_by(
+        FactNotificationStatus.bst_date
+    ).order_by(
+        FactNotificationStatus.bst_date
+    ).all()
+
+    FactNotificationStatusTotal.query.filter(
+        FactNotificationStatusTotal.bst_date >= start_date
+    ).delete(synchronize_session=False)
+
+    total_emails = previous_day.total_emails if previous_day else 0
+    total_sms = previous_day.total_sms if previous_day else 0
+    total_letters = previous_day.total_letters if previous_day else 0
+    for day in daily_totals:
+        total_emails += day.emails
+        total_sms += day.sms
+        total_letters += day.letters
+        db.session.add(FactNotificationStatusTotal(
+            bst_date=day.bst_date,
+            emails=day.emails,
+            sms=day.sms,
+            letters=day.letters,
+            total_emails=total_emails,
+            total_sms=total_sms,
+            total_letters=total_letters,
+        ))
+
+
+@autocommit
+def update_fact_notification_status_totals(start_date):
+    _update_fact_notification_status_totals(start_date)
+
+
+def fetch_live_notification_status_differences(process_day, notification_type):
+    """
+    Compare the live counts for a day with its ft_notification_status rows, which are built from the notifications
+    themselves. Returns the rows whose counts don't match, with the live and nightly counts.
+    """
+    key_columns = ['template_id', 'service_id', 'job_id', 'key_type', 'notification_status']
+
+    live = db.session.query(
+        *[getattr(LiveNotificationStatus, column) for column in key_columns],
+        func.sum(LiveNotificationStatus.notification_count).label('notification_count'),
+    ).filter(
+        LiveNotificationStatus.bst_date == process_day,
+        LiveNotificationStatus.notification_type == notification_type,
+        LiveNotificationStatus.key_type.in_((KEY_TYPE_NORMAL, KEY_TYPE_TEAM)),
+    ).group_by(
+        *[getattr(LiveNotificationStatus, column) for column in key_columns],
+    ).having(
+        func.sum(LiveNotificationStatus.notification_count) != 0
+    ).subquery()
+    nightly = db.session.query(
+        *[getattr(FactNotificationStatus, column) for column in key_columns],
+        FactNotificationStatus.notification_count,
+    ).filter(
+        FactNotificationStatus.bst_date == process_day,
+        FactNotificationStatus.notification_type == notification_type,
+    ).subquery()
+
+    return db.session.query(
+        *[func.coalesce(live.c[column], nightly.c[column]).label(column) for column in key_columns],
+        func.coalesce(live.c.notification_count, 0).label('live_count'),
+        func.coalesce(nightly.c.notification_count, 0).label('nightly_count'),
+    ).select_from(live).outerjoin(
+        nightly,
+        and_(*[live.c[column] == nightly.c[column] for column in key_columns]),
+        full=True,
+    ).filter(
+        func.coalesce(live.c.notification_count, 0) != func.coalesce(nightly.c.notification_count, 0)
+    ).all()
+
+
+@autocommit
+def delete_live_notification_status_before(bst_date):
+    return LiveNotificationStatus.query.filter(
+        LiveNotificationStatus.bst_date < bst_date
+    ).delete(synchronize_session=False)
+
 
 def fetch_notification_status_for_service_by_month(start_date, end_date, service_id):
     return db.session.query(
@@ -146,18 +320,16 @@ def fetch_notification_status_for_service_for_today_and_7_previous_days(service_
     )
 
     stats_for_today = db.session.query(
-        Notification.notification_type.cast(db.Text),
-        Notification.status,
-        *([Notification.template_id] if by_template else []),
-        func.count().label('count')
+        LiveNotificationStatus.notification_type,
+        LiveNotificationStatus.notification_status,
+        *([LiveNotificationStatus.template_id] if by_template else []),
+        LiveNotificationStatus.notification_count.label('count')
     ).filter(
-        Notification.created_at >= get_london_midnight_in_utc(now),
-        Notification.service_id == service_id,
-        Notification.key_type != KEY_TYPE_TEST
-    ).group_by(
-        Notification.notification_type,
-        *([Notification.template_id] if by_template else []),
-        Notification.status
+        LiveNotificationStatus.bst_date == convert_utc_to_bst(now).date(),
+        LiveNotificationStatus.service_id == service_id,
+        LiveNotificationStatus.key_type != KEY_TYPE_TEST,
+        # statuses that all of today's notifications have moved on from are left with a count of 0
+        LiveNotificationStatus.notification_count != 0,
     )
 
     all_stats_table = stats_for_7_days.union_all(stats_for_today).subquery()
@@ -420,6 +592,21 @@ def fetch_monthly_template_usage_for_service(start_date, end_date, service_id):
     return query.all()
 
 
+def get_total_notifications_for_all_time():
+    """
+    The running totals as of the latest day in ft_notification_status, as a list holding a single row (or no rows if
+    there aren't any notifications yet) with `emails`, `sms` and `letters` columns.
+    """
+    return db.session.query(
+        FactNotificationStatusTotal.bst_date,
+        FactNotificationStatusTotal.total_emails.label('emails'),
+        FactNotificationStatusTotal.total_sms.label('sms'),
+        FactNotificationStatusTotal.total_letters.label('letters'),
+    ).order_by(
+        FactNotificationStatusTotal.bst_date.desc()
+    ).limit(1).all()
+
+
 def get_total_notifications_for_date_range(start_date, end_date):
     query = db.session.query(
         FactNotificationStatus.bst_date.cast(db.Text).label("bst_date"),
@@ -97,9 +97,10 @@ def dao_get_job_by_id(job_id):
     return Job.query.filter_by(id=job_id).one()
 
 
-def dao_archive_job(job):
-    job.archived = True
-    db.session.add(job)
+def dao_archive_jobs(jobs):
+    for job in jobs:
+        job.archived = True
+    db.session.add_all(jobs)
     db.session.commit()
 
 
@@ -253,3 +254,48 @@ def find_missing_row_for_job(job_id, job_size):
         Notification.job_row_number == None  # noqa
     )
     return query.all()
+
+
+def dao_set_job_chunk_count(job_id, chunk_count):
+    """
+    Record how many chunks a job has been split into. Returns the number of chunks that have already been completed,
+    so the caller can finish the job if every chunk completed before the count was known.
+    """
+    completed_count = db.session.execute(
+        """
+        UPDATE jobs
+        SET chunk_count = :chunk_count
+        WHERE id = :job_id
+        RETURNING jsonb_array_length(coalesce(completed_chunks, '[]'::jsonb))
+        """,
+        {'job_id': job_id, 'chunk_count': chunk_count}
+    ).scalar()
+    db.session.commit()
+    return completed_count
+
+
+def dao_record_job_chunk_completed(job_id, chunk_index):
+    """
+    Atomically add chunk_index to the job's completed chunks (if it isn't there already) so that parallel chunk tasks
+    don't overwrite each other's checkpoints. Returns the number of completed chunks and the job's chunk_count, which
+    is None if the job's file hasn't been read to the end yet.
+    """
+    db.session.execute(
+        """
+        UPDATE jobs
+        SET completed_chunks = coalesce(completed_chunks, '[]'::jsonb) || jsonb_build_array(:chunk_index)
+        WHERE id = :job_id
+        AND NOT coalesce(completed_chunks, '[]'::jsonb) @> jsonb_build_array(:chunk_index)
+        """,
+        {'job_id': job_id, 'chunk_index': chunk_index}
+    )
+    completed_count, chunk_count = db.session.execute(
+        """
+        SELECT jsonb_array_length(coalesce(completed_chunks, '[]'::jsonb)), chunk_count
+        FROM jobs
+        WHERE id = :job_id
+        """,
+        {'job_id': job_id}
+    ).one()
+    db.session.commit()
+    return completed_count, chunk_count
@@ -0,0 +1,82 @@
+from datetime import datetime
+
+from sqlalchemy import and_, case, or_
+from sqlalchemy.dialects.postgresql import insert
+
+from app import db
+from app.dao.dao_utils import autocommit
+from app.models import (
+    ARCHIVAL_DONE,
+    ARCHIVAL_IN_PROGRESS,
+    ARCHIVAL_PENDING,
+    NotificationArchival,
+)
+
+
+@autocommit
+def dao_queue_notification_archivals(archivals):
+    """
+    Queue notifications to be archived, from a list of dicts with service_id, notification_type, delete_before and
+    estimated_rows. A service and notification type that's still queued from a previous night keeps its place and
+    progress, but is brought up to date with tonight's cut off.
+    """
+    if not archivals:
+        return
+
+    table = NotificationArchival.__table__
+    stmt = insert(table).values([
+        {
+            **archival,
+            'archived_rows': 0,
+            'status': ARCHIVAL_PENDING,
+            'updated_at': datetime.utcnow(),
+        }
+        for archival in archivals
+    ])
+    finished = table.c.status == ARCHIVAL_DONE
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.service_id, table.c.notification_type],
+        set_={
+            'delete_before': stmt.excluded.delete_before,
+            'estimated_rows': stmt.excluded.estimated_rows,
+            'archived_rows': case([(finished, 0)], else_=table.c.archived_rows),
+            'status': case([(finished, ARCHIVAL_PENDING)], else_=table.c.status),
+            'updated_at': stmt.excluded.updated_at,
+        }
+    )
+    db.session.execute(stmt)
+
+
+@autocommit
+def dao_claim_notification_archival(stale_before):
+    """
+    Take the queued archival with the most notifications to move, so the longest ones start first. Archivals that
+    are in progress but haven't been updated since `stale_before` belonged to a worker that stopped, so are taken
+    over. Returns None if there's nothing left to do.
+    """
+    archival = NotificationArchival.query.filter(
+        or_(
+            NotificationArchival.status == ARCHIVAL_PENDING,
+            and_(
+                NotificationArchival.status == ARCHIVAL_IN_PROGRESS,
+                NotificationArchival.updated_at < stale_before,
+            )
+        )
+    ).order_by(
+        NotificationArchival.estimated_rows.desc()
+    ).with_for_update(
+        skip_locked=True
+    ).first()
+
+    if archival:
+        archival.status = ARCHIVAL_IN_PROGRESS
+        archival.updated_at = datetime.utcnow()
+    return archival
+
+
+@autocommit
+def dao_record_notification_archival_progress(archival, archived_rows, finished=False):
+    archival.archived_rows += archived_rows
+    archival.updated_at = datetime.utcnow()
+    if finished:
+        archival.status = ARCHIVAL_DONE
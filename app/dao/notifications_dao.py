@@ -1,3 +1,5 @@
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from itertools import groupby
 from operator import attrgetter
@@ -13,19 +15,26 @@ from notifications_utils.recipients import (
     validate_and_format_email_address,
 )
 from notifications_utils.timezones import convert_bst_to_utc, convert_utc_to_bst
-from sqlalchemy import and_, asc, desc, func, or_
+from sqlalchemy import and_, asc, desc, event, func, or_
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import joinedload
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.sql import functions
 from sqlalchemy.sql.expression import case
 from werkzeug.datastructures import MultiDict
 
 from app import create_uuid, db, statsd_client
+from app.aws.s3 import get_s3_client, remove_s3_objects
 from app.clients.sms.firetext import (
     get_message_status_and_reason_from_firetext_code,
 )
 from app.dao.dao_utils import autocommit
-from app.letters.utils import LetterPDFNotFound, find_letter_pdf_in_s3
+from app.letters.utils import (
+    LetterPDFNotFound,
+    find_letter_pdf_key_and_size,
+    get_bucket_name_and_prefix_for_notification,
+)
 from app.models import (
     EMAIL_TYPE,
     KEY_TYPE_NORMAL,
@@ -43,14 +52,16 @@ from app.models import (
     SMS_TYPE,
     FactNotificationStatus,
     Notification,
+    NotificationActivity,
     NotificationHistory,
     ProviderDetails,
 )
-from app.utils import (
-    escape_special_characters,
-    get_london_midnight_in_utc,
-    midnight_n_days_ago,
+from app.notifications.notification_status_buffer import (
+    FINAL_STATUS_RANK,
+    NOTIFICATION_STATUS_RANKS,
+    notification_status_buffer,
 )
+from app.utils import escape_special_characters, midnight_n_days_ago
 
 
 def dao_get_last_date_template_was_used(template_id, service_id):
@@ -86,11 +97,46 @@ def dao_create_notification(notification):
     db.session.add(notification)
 
 
-def _decide_permanent_temporary_failure(status, notification, detailed_status_code=None):
+@autocommit
+def dao_create_notifications(notifications):
+    """
+    Insert a batch of notifications with one multi-row INSERT and return the ids that were inserted.
+
+    Notifications whose id already exists are skipped rather than raising an IntegrityError, so a batch that SQS
+    delivers twice is only saved once. The notifications must have their ids populated already (see
+    `build_notification`), and are not added to the session.
+    """
+    if not notifications:
+        return set()
+
+    table = Notification.__table__
+    stmt = insert(table).values(
+        [_get_insert_values(table, notification) for notification in notifications]
+    ).on_conflict_do_nothing(
+        index_elements=[table.c.id]
+    ).returning(
+        table.c.id
+    )
+    return {row.id for row in db.session.execute(stmt)}
+
+
+def _get_insert_values(table, model):
+    # every row in a multi-row insert needs the same columns, so fill in the scalar defaults (eg billable_units = 0)
+    # that the ORM would normally apply for us when an attribute is None
+    values = {}
+    for column in table.columns:
+        value = getattr(model, column.key)
+        if value is None and column.default is not None and column.default.is_scalar:
+            value = column.default.arg
+        values[column.key] = value
+    return values
+
+
+def _decide_permanent_temporary_failure(status, notification, detailed_status_code=None, sent_by=None):
     # Firetext will send us a pending status, followed by a success or failure status.
     # When we get a failure status we need to look at the detailed_status_code to determine if the failure type
     # is a permanent-failure or temporary-failure.
-    if notification.sent_by == 'firetext':
+    if (notification.sent_by or sent_by) == 'firetext':
         if status == NOTIFICATION_PERMANENT_FAILURE and detailed_status_code:
             try:
                 status, reason = get_message_status_and_reason_from_firetext_code(detailed_status_code)
@@ -110,17 +156,21 @@ def country_records_delivery(phone_prefix):
     return dlr and dlr.lower() == 'yes'
 
 
-def _update_notification_status(notification, status, detailed_status_code=None):
+def _update_notification_status(notification, status, detailed_status_code=None, sent_by=None, buffered=False):
     status = _decide_permanent_temporary_failure(
-        status=status, notification=notification, detailed_status_code=detailed_status_code
+        status=status, notification=notification, detailed_status_code=detailed_status_code, sent_by=sent_by
     )
-    notification.status = status
-    dao_update_notification(notification)
+    values = {'status': status, 'updated_at': datetime.utcnow()}
+    if sent_by and not notification.sent_by:
+        values['sent_by'] = sent_by
+    dao_set_notification_values(notification, buffered=buffered, **values)
     return notification
 
 
 @autocommit
-def update_notification_status_by_id(notification_id, status, sent_by=None, detailed_status_code=None):
+def update_notification_status_by_id(
+    notification_id, status, sent_by=None, detailed_status_code=None, buffered=False
+):
     notification = Notification.query.with_for_update().filter(Notification.id == notification_id).first()
 
     if not notification:
@@ -146,12 +196,12 @@ def update_notification_status_by_id(notification_id, status, sent_by=None, deta
         and not country_records_delivery(notification.phone_prefix)
     ):
         return None
-    if not notification.sent_by and sent_by:
-        notification.sent_by = sent_by
     return _update_notification_status(
         notification=notification,
         status=status,
-        detailed_status_code=detailed_status_code
+        detailed_status_code=detailed_status_code,
+        sent_by=sent_by,
+        buffered=buffered,
     )
 
 
@@ -183,6 +233,128 @@ def dao_update_notification(notification):
     db.session.add(notification)
 
 
+@autocommit
+def dao_set_notification_values(notification, buffered=False, **values):
+    """
+    Set values on a notification and save them. Only the email and text message receipt tasks pass `buffered`: if the
+    notification status buffer is on they're then saved by its next flush instead, and the notification isn't marked
+    as changed in the session, so committing doesn't write them.
+    """
+    _set_notification_values(notification, buffered, **values)
+
+
+def _set_notification_values(notification, buffered, **values):
+    if buffered and notification_status_buffer.active:
+        notification_status_buffer.add(notification.id, **values)
+        for key, value in values.items():
+            set_committed_value(notification, key, value)
+    else:
+        for key, value in values.items():
+            setattr(notification, key, value)
+        db.session.add(notification)
+
+
+@event.listens_for(Notification, 'load')
+@event.listens_for(Notification, 'refresh')
+def _apply_buffered_notification_values(notification, context, attrs=None):
+    # a notification is reloaded once the session is committed, so this keeps the values that are waiting in the
+    # notification status buffer
+    notification_status_buffer.apply_pending(notification)
+
+
+@autocommit
+def dao_update_notifications_from_status_buffer(changes):
+    """
+    Write the changes collected by the notification status buffer with one UPDATE. `changes` maps each notification's
+    id to a dict of its new status, sent_at, sent_by, billable_units and updated_at, any of which may be missing.
+
+    Another process may have changed a notification since these changes were made, so a status is only written if it
+    doesn't take the notification back to an earlier status (see NOTIFICATION_STATUS_RANKS), and updated_at only ever
+    moves forward.
+    """
+    rows = []
+    params = {}
+    for i, (notification_id, values) in enumerate(changes.items()):
+        rows.append(
+            f'(CAST(:id_{i} AS uuid), CAST(:status_{i} AS varchar), CAST(:sent_at_{i} AS timestamp), '
+            f'CAST(:sent_by_{i} AS varchar), CAST(:billable_units_{i} AS integer), '
+            f'CAST(:updated_at_{i} AS timestamp))'
+        )
+        params.update({
+            f'id_{i}': str(notification_id),
+            f'status_{i}': values.get('status'),
+            f'sent_at_{i}': values.get('sent_at'),
+            f'sent_by_{i}': values.get('sent_by'),
+            f'billable_units_{i}': values.get('billable_units'),
+            f'updated_at_{i}': values.get('updated_at'),
+        })
+
+    def rank(status):
+        cases = ' '.join(f"WHEN '{status_}' THEN {rank_}" for status_, rank_ in NOTIFICATION_STATUS_RANKS.items())
+        return f'(CASE {status} {cases} ELSE {FINAL_STATUS_RANK} END)'
+
+    db.session.execute(
+        f"""
+        UPDATE notifications
+        SET
+            notification_status = CASE
+                WHEN changes.status IS NOT NULL
+                    AND {rank('notifications.notification_status')} < {FINAL_STATUS_RANK}
+                    AND {rank('changes.status')} >= {rank('notifications.notification_status')}
+                THEN changes.status
+                ELSE notifications.notification_status
+            END,
+            sent_at = coalesce(changes.sent_at, notifications.sent_at),
+            sent_by = coalesce(changes.sent_by, notifications.sent_by),
+            billable_units = coalesce(changes.billable_units, notifications.billable_units),
+            updated_at = greatest(changes.updated_at, notifications.updated_at)
+        FROM (VALUES {', '.join(rows)}) AS changes(id, status, sent_at, sent_by, billable_units, updated_at)
+        WHERE notifications.id = changes.id
+        """,
+        params
+    )
+
+
+@autocommit
+def dao_update_notifications_sent_to_provider(sent_notifications):
+    """
+    Record the result of sending a batch of notifications to their providers, with one UPDATE. Each of
+    `sent_notifications` is a dict with the notification's id and billable_units, and, if it was sent, its sent_at,
+    sent_by and status (which are None for a notification that failed to send). As in update_notification_to_sending,
+    a notification keeps a final status that a delivery receipt has already given it.
+    """
+    if not sent_notifications:
+        return
+    db.session.execute("""
+        UPDATE notifications SET
+            billable_units = sent.billable_units,
+            sent_at = coalesce(sent.sent_at, notifications.sent_at),
+            sent_by = coalesce(sent.sent_by, notifications.sent_by),
+            notification_status = CASE
+                WHEN sent.status IS NULL OR notifications.notification_status = ANY(CAST(:completed AS text[]))
+                THEN notifications.notification_status
+                ELSE sent.status
+            END,
+            updated_at = :updated_at
+        FROM unnest(
+            CAST(:ids AS uuid[]),
+            CAST(:billable_units AS integer[]),
+            CAST(:sent_at AS timestamp[]),
+            CAST(:sent_by AS text[]),
+            CAST(:statuses AS text[])
+        ) AS sent(id, billable_units, sent_at, sent_by, status)
+        WHERE notifications.id = sent.id
+    """, {
+        'completed': list(NOTIFICATION_STATUS_TYPES_COMPLETED),
+        'updated_at': datetime.utcnow(),
+        'ids': [str(n['id']) for n in sent_notifications],
+        'billable_units': [n['billable_units'] for n in sent_notifications],
+        'sent_at': [n.get('sent_at') for n in sent_notifications],
+        'sent_by': [n.get('sent_by') for n in sent_notifications],
+        'statuses': [n.get('status') for n in sent_notifications],
+    })
+
+
 def get_notifications_for_job(service_id, job_id, filter_dict=None, page=1, page_size=None):
     if page_size is None:
         page_size = current_app.config['PAGE_SIZE']
@@ -217,6 +389,10 @@ def get_notification_by_id(notification_id, service_id=None, _raise=False):
     return query.one() if _raise else query.first()
 
 
+def dao_get_notifications_by_ids(notification_ids):
+    return Notification.query.filter(Notification.id.in_(notification_ids)).all()
+
+
 def get_notifications_for_service(
         service_id,
         filter_dict=None,
@@ -297,7 +473,7 @@ def _filter_query(query, filter_dict=None):
 
 @autocommit
 def insert_notification_history_delete_notifications(
-    notification_type, service_id, timestamp_to_delete_backwards_from, qry_limit=50000
+    notification_type, service_id, timestamp_to_delete_backwards_from, qry_limit=50000, lock_timeout_ms=None
 ):
     """
     Delete up to 50,000 notifications that are past retention for a notification type and service.
@@ -361,6 +537,10 @@ def insert_notification_history_delete_notifications(
         "qry_limit": qry_limit
     }
 
+    if lock_timeout_ms:
+        # give up (with a LockNotAvailable error) rather than queue behind, and hold up, other writes to these rows
+        db.session.execute(f"SET LOCAL lock_timeout = {int(lock_timeout_ms)}")
+
     select_to_use = select_into_temp_table_for_letters if notification_type == 'letter' else select_into_temp_table
     db.session.execute(select_to_use, input_params)
 
@@ -381,7 +561,7 @@ def move_notifications_to_notification_history(
 ):
     deleted = 0
     if notification_type == LETTER_TYPE:
-        _delete_letters_from_s3(
+        delete_letters_from_s3(
             notification_type, service_id, timestamp_to_delete_backwards_from, qry_limit
         )
     delete_count_per_call = 1
@@ -394,21 +574,29 @@ def move_notifications_to_notification_history(
         )
         deleted += delete_count_per_call
 
-    # Deleting test Notifications, test notifications are not persisted to NotificationHistory
-    Notification.query.filter(
+    delete_test_key_notifications(notification_type, service_id, timestamp_to_delete_backwards_from)
+
+    return deleted
+
+
+@autocommit
+def delete_test_key_notifications(notification_type, service_id, timestamp_to_delete_backwards_from):
+    # test notifications are not persisted to NotificationHistory
+    return Notification.query.filter(
         Notification.notification_type == notification_type,
         Notification.service_id == service_id,
         Notification.created_at < timestamp_to_delete_backwards_from,
         Notification.key_type == KEY_TYPE_TEST
     ).delete(synchronize_session=False)
-    db.session.commit()
-
-    return deleted
 
 
-def _delete_letters_from_s3(
+def delete_letters_from_s3(
         notification_type, service_id, date_to_delete_from, query_limit
 ):
+    """
+    Look up the letters' PDFs concurrently, then delete them with as few DeleteObjects requests as possible rather
+    than one request per letter.
+    """
     letters_to_delete_from_s3 = db.session.query(
         Notification
     ).filter(
@@ -420,16 +608,31 @@ def _delete_letters_from_s3(
         # them from it
         Notification.status.in_(NOTIFICATION_STATUS_TYPES_COMPLETED)
     ).limit(query_limit).all()
-    for letter in letters_to_delete_from_s3:
+
+    s3_client = get_s3_client()
+    with ThreadPoolExecutor(max_workers=current_app.config['LETTER_PDF_LOOKUP_THREADS']) as executor:
+        lookups = []
+        for letter in letters_to_delete_from_s3:
+            bucket_name, prefix = get_bucket_name_and_prefix_for_notification(letter)
+            lookups.append(
+                (letter.id, bucket_name, executor.submit(find_letter_pdf_key_and_size, s3_client, bucket_name, prefix))
+            )
+
+    letter_ids_by_bucket_and_key = defaultdict(dict)
+    for letter_id, bucket_name, lookup in lookups:
         try:
-            letter_pdf = find_letter_pdf_in_s3(letter)
-            letter_pdf.delete()
+            letter_ids_by_bucket_and_key[bucket_name][lookup.result()['Key']] = letter_id
         except ClientError:
             current_app.logger.exception(
-                "Error deleting S3 object for letter: {}".format(letter.id))
+                "Error finding S3 object for letter: {}".format(letter_id))
         except LetterPDFNotFound:
             current_app.logger.warning(
-                "No S3 object to delete for letter: {}".format(letter.id))
+                "No S3 object to delete for letter: {}".format(letter_id))
+
+    for bucket_name, letter_ids_by_key in letter_ids_by_bucket_and_key.items():
+        for key, error in remove_s3_objects(bucket_name, letter_ids_by_key).items():
+            current_app.logger.error(
+                "Error deleting S3 object for letter: {}: {}".format(letter_ids_by_key[key], error))
 
 
 @autocommit
@@ -439,6 +642,13 @@ def dao_delete_notifications_by_id(notification_id):
     ).delete(synchronize_session='fetch')
 
 
+@autocommit
+def dao_delete_notifications_by_ids(notification_ids):
+    db.session.query(Notification).filter(
+        Notification.id.in_(notification_ids)
+    ).delete(synchronize_session=False)
+
+
 def dao_timeout_notifications(cutoff_time, limit=100000):
     """
     Set email and SMS notifications (only) to "temporary-failure" status
@@ -541,6 +751,26 @@ def dao_update_notifications_by_reference(references, update_dict):
     return updated_count, updated_history_count
 
 
+def dao_update_notification_statuses(notification_statuses):
+    """
+    Takes a list of (notification, status) from SES receipts, where each notification is a Notification or
+    NotificationHistory, and updates them with one UPDATE for each status (or, for notifications, with the
+    notification status buffer if it's on). The notifications keep their new status until the session is committed,
+    which is left to the caller.
+    """
+    references_by_status = defaultdict(list)
+    updated_at = datetime.utcnow()
+    for notification, status in notification_statuses:
+        if notification_status_buffer.active and isinstance(notification, Notification):
+            _set_notification_values(notification, buffered=True, status=status, updated_at=updated_at)
+        else:
+            references_by_status[status].append(notification.reference)
+            set_committed_value(notification, 'status', status)
+
+    for status, references in references_by_status.items():
+        dao_update_notifications_by_reference(references, {'status': status})
+
+
 def dao_get_notifications_by_recipient_or_reference(
     service_id,
     search_term,
@@ -622,6 +852,26 @@ def dao_get_notification_or_history_by_reference(reference):
         ).one()
 
 
+def dao_get_notifications_or_history_by_references(references):
+    """
+    Returns a dict of reference to Notification for the references, looking in notification history for any that
+    aren't in the notifications table. References that can't be found in either are left out.
+    """
+    notifications = {
+        notification.reference: notification
+        for notification in Notification.query.filter(Notification.reference.in_(references)).all()
+    }
+    missing_references = set(references) - notifications.keys()
+    if missing_references:
+        notifications.update({
+            notification.reference: notification
+            for notification in NotificationHistory.query.filter(
+                NotificationHistory.reference.in_(missing_references)
+            ).all()
+        })
+    return notifications
+
+
 def dao_get_notifications_processing_time_stats(start_date, end_date):
     """
     For a given time range, returns the number of notifications sent and the number of
@@ -670,6 +920,22 @@ def dao_get_last_notification_added_for_job_id(job_id):
     return last_notification_added
 
 
+def dao_get_job_row_numbers(job_id, start_row, end_row):
+    """
+    Returns the row numbers between start_row (inclusive) and end_row (exclusive) that have already been saved for a job
+    """
+    return {
+        row.job_row_number
+        for row in db.session.query(
+            Notification.job_row_number
+        ).filter(
+            Notification.job_id == job_id,
+            Notification.job_row_number >= start_row,
+            Notification.job_row_number < end_row,
+        )
+    }
+
+
 def notifications_not_yet_sent(should_be_sending_after_seconds, notification_type):
     older_than_date = datetime.utcnow() - timedelta(seconds=should_be_sending_after_seconds)
 
@@ -788,30 +1054,69 @@ def _duplicate_update_warning(notification, status):
     )
 
 
-def get_service_ids_with_notifications_before(notification_type, timestamp):
-    return {
-        row.service_id
-        for row in db.session.query(
-            Notification.service_id
+def get_estimated_notification_counts_by_service_before(notification_type, bst_date):
+    """
+    The services that still have notifications of a type from before `bst_date` (in London time), and roughly how
+    many: the number sent on those days according to ft_notification_status, so 0 for days it doesn't cover yet.
+    Reads notification_activity rather than scanning notifications.
+    """
+    return dict(
+        db.session.query(
+            NotificationActivity.service_id,
+            func.coalesce(func.sum(FactNotificationStatus.notification_count), 0)
+        ).outerjoin(
+            FactNotificationStatus,
+            and_(
+                FactNotificationStatus.bst_date == NotificationActivity.bst_date,
+                FactNotificationStatus.service_id == NotificationActivity.service_id,
+                FactNotificationStatus.notification_type == NotificationActivity.notification_type,
+            )
         ).filter(
-            Notification.notification_type == notification_type,
-            Notification.created_at < timestamp
-        ).distinct()
-    }
+            NotificationActivity.notification_type == notification_type,
+            NotificationActivity.bst_date < bst_date
+        ).group_by(
+            NotificationActivity.service_id
+        ).all()
+    )
 
 
 def get_service_ids_with_notifications_on_date(notification_type, date):
-    start_date = get_london_midnight_in_utc(date)
-    end_date = get_london_midnight_in_utc(date + timedelta(days=1))
-
     return {
         row.service_id
         for row in db.session.query(
-            Notification.service_id
+            NotificationActivity.service_id
         ).filter(
-            Notification.notification_type == notification_type,
-            # using >= + < is much more efficient than date(created_at)
-            Notification.created_at >= start_date,
-            Notification.created_at < end_date,
-        ).distinct()
+            NotificationActivity.notification_type == notification_type,
+            NotificationActivity.bst_date == date,
+        )
     }
+
+
+@autocommit
+def dao_delete_notification_activity_before(service_id, notification_type, bst_date):
+    """
+    Forget the days before `bst_date` that a service no longer has any notifications of a type for, once they've been
+    moved to notification_history. Days that still have some (letters that haven't been sent yet, for example) are
+    kept, so the service is archived again the next night.
+    """
+    return db.session.execute("""
+        DELETE FROM notification_activity
+        WHERE service_id = :service_id
+          AND notification_type = :notification_type
+          AND bst_date < :bst_date
+          AND NOT EXISTS (
+            SELECT 1 FROM notifications
+            WHERE notifications.service_id = :service_id
+              AND notifications.notification_type = CAST(:notification_type AS notification_type)
+              AND notifications.created_at >= timezone(
+                'UTC', timezone('Europe/London', notification_activity.bst_date::timestamp)
+              )
+              AND notifications.created_at < timezone(
+                'UTC', timezone('Europe/London', (notification_activity.bst_date + 1)::timestamp)
+              )
+          )
+    """, {
+        'service_id': service_id,
+        'notification_type': notification_type,
+        'bst_date': bst_date,
+    }).rowcount
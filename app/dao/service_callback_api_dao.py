@@ -41,6 +41,16 @@ def get_service_delivery_status_callback_api_for_service(service_id):
     ).first()
 
 
+def get_service_delivery_status_callback_apis_for_services(service_ids):
+    return {
+        service_callback_api.service_id: service_callback_api
+        for service_callback_api in ServiceCallbackApi.query.filter(
+            ServiceCallbackApi.service_id.in_(service_ids),
+            ServiceCallbackApi.callback_type == DELIVERY_STATUS_CALLBACK_TYPE,
+        ).all()
+    }
+
+
 def get_service_complaint_callback_api_for_service(service_id):
     return ServiceCallbackApi.query.filter_by(
         service_id=service_id,
@@ -4,6 +4,7 @@ from app import db
 from app.dao.dao_utils import autocommit
 from app.errors import InvalidRequest
 from app.exceptions import ArchiveValidationError
+from app.memory_cache import invalidate_service_cache
 from app.models import ServiceEmailReplyTo
 
 
@@ -38,6 +39,7 @@ def add_reply_to_email_address_for_service(service_id, email_address, is_default
 
     new_reply_to = ServiceEmailReplyTo(service_id=service_id, email_address=email_address, is_default=is_default)
     db.session.add(new_reply_to)
+    invalidate_service_cache(service_id)
     return new_reply_to
 
 
@@ -54,6 +56,7 @@ def update_reply_to_email_address(service_id, reply_to_id, email_address, is_def
     reply_to_update.email_address = email_address
     reply_to_update.is_default = is_default
     db.session.add(reply_to_update)
+    invalidate_service_cache(service_id)
     return reply_to_update
 
 
@@ -70,6 +73,7 @@ def archive_reply_to_email_address(service_id, reply_to_id):
     reply_to_archive.archived = True
 
     db.session.add(reply_to_archive)
+    invalidate_service_cache(service_id)
     return reply_to_archive
 
 
@@ -2,6 +2,7 @@ from sqlalchemy import desc
 
 from app import db
 from app.dao.dao_utils import autocommit
+from app.memory_cache import invalidate_service_cache
 from app.models import ServiceLetterContact, Template
 
 
@@ -42,6 +43,7 @@ def add_letter_contact_for_service(service_id, contact_block, is_default):
         is_default=is_default
     )
     db.session.add(new_letter_contact)
+    invalidate_service_cache(service_id)
     return new_letter_contact
 
 
@@ -56,6 +58,7 @@ def update_letter_contact(service_id, letter_contact_id, contact_block, is_defau
     letter_contact_update.contact_block = contact_block
     letter_contact_update.is_default = is_default
     db.session.add(letter_contact_update)
+    invalidate_service_cache(service_id)
     return letter_contact_update
 
 
@@ -75,6 +78,7 @@ def archive_letter_contact(service_id, letter_contact_id):
     letter_contact_to_archive.archived = True
 
     db.session.add(letter_contact_to_archive)
+    invalidate_service_cache(service_id)
     return letter_contact_to_archive
 
 
@@ -1,5 +1,6 @@
 from app import db
 from app.dao.dao_utils import autocommit
+from app.memory_cache import invalidate_service_cache
 from app.models import ServicePermission
 
 
@@ -12,11 +13,13 @@ def dao_fetch_service_permissions(service_id):
 def dao_add_service_permission(service_id, permission):
     service_permission = ServicePermission(service_id=service_id, permission=permission)
     db.session.add(service_permission)
+    invalidate_service_cache(service_id)
 
 
 def dao_remove_service_permission(service_id, permission):
     deleted = ServicePermission.query.filter(
         ServicePermission.service_id == service_id,
         ServicePermission.permission == permission).delete()
+    invalidate_service_cache(service_id)
     db.session.commit()
     return deleted
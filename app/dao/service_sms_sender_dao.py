@@ -3,6 +3,7 @@ from sqlalchemy import desc
 from app import db
 from app.dao.dao_utils import autocommit
 from app.exceptions import ArchiveValidationError
+from app.memory_cache import invalidate_service_cache
 from app.models import ServiceSmsSender
 
 
@@ -48,6 +49,7 @@ def dao_add_sms_sender_for_service(service_id, sms_sender, is_default, inbound_n
     )
 
     db.session.add(new_sms_sender)
+    invalidate_service_cache(service_id)
     return new_sms_sender
 
 
@@ -65,6 +67,7 @@ def dao_update_service_sms_sender(service_id, service_sms_sender_id, is_default,
     if not sms_sender_to_update.inbound_number_id and sms_sender:
         sms_sender_to_update.sms_sender = sms_sender
     db.session.add(sms_sender_to_update)
+    invalidate_service_cache(service_id)
     return sms_sender_to_update
 
 
@@ -73,6 +76,7 @@ def update_existing_sms_sender_with_inbound_number(service_sms_sender, sms_sende
     service_sms_sender.sms_sender = sms_sender
     service_sms_sender.inbound_number_id = inbound_number_id
     db.session.add(service_sms_sender)
+    invalidate_service_cache(service_sms_sender.service_id)
     return service_sms_sender
 
 
@@ -91,6 +95,7 @@ def archive_sms_sender(service_id, sms_sender_id):
     sms_sender_to_archive.archived = True
 
     db.session.add(sms_sender_to_archive)
+    invalidate_service_cache(service_id)
     return sms_sender_to_archive
 
 
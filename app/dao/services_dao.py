@@ -1,8 +1,9 @@
 import uuid
-from datetime import date, datetime, timedelta
+from datetime import datetime
 
 from flask import current_app
-from sqlalchemy import Float, cast
+from notifications_utils.timezones import convert_utc_to_bst
+from sqlalchemy import Float, Integer, cast
 from sqlalchemy.orm import joinedload
 from sqlalchemy.sql.expression import and_, asc, case, func
 
@@ -15,6 +16,7 @@ from app.dao.organisation_dao import dao_get_organisation_by_email_address
 from app.dao.service_sms_sender_dao import insert_service_sms_sender
 from app.dao.service_user_dao import dao_get_service_user
 from app.dao.template_folder_dao import dao_get_valid_template_folders_by_id
+from app.memory_cache import invalidate_service_cache
 from app.models import (
     CROWN_ORGANISATION_TYPES,
     EMAIL_TYPE,
@@ -33,7 +35,10 @@ from app.models import (
     InboundNumber,
     InvitedUser,
     Job,
+    LiveNotificationStatus,
     Notification,
+    NotificationActivity,
+    NotificationArchival,
     NotificationHistory,
     Organisation,
     Permission,
@@ -53,7 +58,6 @@ from app.utils import (
     email_address_is_nhs,
     escape_special_characters,
     get_archived_db_column_value,
-    get_london_midnight_in_utc,
     midnight_n_days_ago,
 )
 
@@ -269,11 +273,14 @@ def dao_archive_service(service_id):
     for template in service.templates:
         if not template.archived:
             template.archived = True
+            invalidate_service_cache(service.id, template_id=template.id)
 
     for api_key in service.api_keys:
         if not api_key.expiry_date:
             api_key.expiry_date = datetime.utcnow()
 
+    invalidate_service_cache(service.id)
+
 
 def dao_fetch_service_by_id_and_user(service_id, user_id):
     return Service.query.filter(
@@ -344,6 +351,7 @@ def dao_create_service(
 @version_class(Service)
 def dao_update_service(service):
     db.session.add(service)
+    invalidate_service_cache(service.id)
 
 
 def dao_add_user_to_service(service, user, permissions=None, folder_permissions=None):
@@ -399,6 +407,8 @@ def delete_service_and_all_associated_db_objects(service):
     _delete_commit(Permission.query.filter_by(service=service))
     _delete_commit(NotificationHistory.query.filter_by(service=service))
     _delete_commit(Notification.query.filter_by(service=service))
+    _delete_commit(NotificationArchival.query.filter_by(service_id=service.id))
+    _delete_commit(NotificationActivity.query.filter_by(service_id=service.id))
     _delete_commit(Job.query.filter_by(service=service))
     _delete_commit(Template.query.filter_by(service=service))
     _delete_commit(TemplateHistory.query.filter_by(service_id=service.id))
@@ -431,10 +441,20 @@ def dao_fetch_stats_for_service(service_id, limit_days):
 
 
 def dao_fetch_todays_stats_for_service(service_id):
-    today = date.today()
-    start_date = get_london_midnight_in_utc(today)
-    return _stats_for_service_query(service_id).filter(
-        Notification.created_at >= start_date
+    today = convert_utc_to_bst(datetime.utcnow()).date()
+    return db.session.query(
+        LiveNotificationStatus.notification_type,
+        LiveNotificationStatus.notification_status.label('status'),
+        cast(func.sum(LiveNotificationStatus.notification_count), Integer).label('count')
+    ).filter(
+        LiveNotificationStatus.bst_date == today,
+        LiveNotificationStatus.service_id == service_id,
+        LiveNotificationStatus.key_type != KEY_TYPE_TEST
+    ).group_by(
+        LiveNotificationStatus.notification_type,
+        LiveNotificationStatus.notification_status,
+    ).having(
+        func.sum(LiveNotificationStatus.notification_count) != 0
     ).all()
 
 
@@ -453,26 +473,25 @@ def _stats_for_service_query(service_id):
 
 
 def dao_fetch_todays_stats_for_all_services(include_from_test_key=True, only_active=True):
-    today = date.today()
-    start_date = get_london_midnight_in_utc(today)
-    end_date = get_london_midnight_in_utc(today + timedelta(days=1))
+    today = convert_utc_to_bst(datetime.utcnow()).date()
 
     subquery = db.session.query(
-        Notification.notification_type,
-        Notification.status,
-        Notification.service_id,
-        func.count(Notification.id).label('count')
+        LiveNotificationStatus.notification_type,
+        LiveNotificationStatus.notification_status.label('status'),
+        LiveNotificationStatus.service_id,
+        cast(func.sum(LiveNotificationStatus.notification_count), Integer).label('count')
     ).filter(
-        Notification.created_at >= start_date,
-        Notification.created_at < end_date
+        LiveNotificationStatus.bst_date == today,
     ).group_by(
-        Notification.notification_type,
-        Notification.status,
-        Notification.service_id
+        LiveNotificationStatus.notification_type,
+        LiveNotificationStatus.notification_status,
+        LiveNotificationStatus.service_id
+    ).having(
+        func.sum(LiveNotificationStatus.notification_count) != 0
     )
 
     if not include_from_test_key:
-        subquery = subquery.filter(Notification.key_type != KEY_TYPE_TEST)
+        subquery = subquery.filter(LiveNotificationStatus.key_type != KEY_TYPE_TEST)
 
     subquery = subquery.subquery()
 
@@ -514,6 +533,7 @@ def dao_suspend_service(service_id):
             api_key.expiry_date = datetime.utcnow()
 
     service.active = False
+    invalidate_service_cache(service.id)
 
 
 @autocommit
@@ -521,6 +541,7 @@ def dao_suspend_service(service_id):
 def dao_resume_service(service_id):
     service = Service.query.get(service_id)
     service.active = True
+    invalidate_service_cache(service.id)
 
 
 def dao_fetch_active_users_for_service(service_id):
@@ -0,0 +1,223 @@
+import re
+import sys
+from threading import RLock
+
+import cachetools
+from gds_metrics.metrics import Counter
+from notifications_utils.template import (
+    HTMLEmailTemplate,
+    PlainTextEmailTemplate,
+)
+
+EMAIL_RENDER_CACHE_REQUESTS = Counter(
+    'email_render_cache_requests',
+    'Total number of emails rendered for sending, by whether the cached rendering of their template could be used',
+    ['result']
+)
+
+# personalisation that can be put straight into a cached rendering: words of (ASCII) letters and numbers, separated by
+# single spaces. Anything else (punctuation, markdown, new lines, lists) can change how the text around it is
+# formatted, so the email is rendered from scratch
+SLOT_SAFE_VALUE = re.compile(r'[A-Za-z0-9]+(?: [A-Za-z0-9]+)*')
+CONDITIONAL_PLACEHOLDER = re.compile(r'\(\([^)]*\?\?')
+PLACEHOLDER = re.compile(r'\(\([^()]*\)\)')
+# even safe personalisation can become part of a link or a domain (which is then autolinked, or has GOV.UK unlinked)
+# when the text it's put next to has any of these in it, like `((scheme))://gov.uk` or `((department)).UK`
+LINK_TEXT = re.compile(r'[.:/@]')
+# punctuation that can end the text after a placeholder without making it part of a link, like `((name)).`
+TRAILING_PUNCTUATION = '.,;:!?)]\'"’”'
+PERSONALISATION_KEY_TRANSLATION = {ord(c): None for c in ' _-'}
+
+PREHEADER_START = 'zqxpreheaderstartxqz'
+PREHEADER_END = 'zqxpreheaderendxqz'
+
+# values the cached rendering of a template is checked against before it's used, to catch templates where the text
+# around a placeholder is formatted differently depending on what's put in it (for example a placeholder in a URL)
+PROBE_VALUES = [
+    lambda i: 'a',
+    lambda i: f'{i}{"x" * 300}',
+    lambda i: f'Firstname{i} Lastname',
+    lambda i: f'{i}0123456789',
+    lambda i: 'www',
+]
+
+
+def _slot_token(i):
+    return f'zqxslot{i}xqz'
+
+
+def _has_placeholder_next_to_link_text(text):
+    """
+    Whether any placeholder in the text is joined (with no whitespace between) to text that could make it part of a
+    link or domain, like `((scheme))://` or `gov.((tld))`
+    """
+    for match in PLACEHOLDER.finditer(text):
+        before = re.search(r'\S*$', text[:match.start()]).group()
+        after = re.match(r'\S*', text[match.end():]).group().rstrip(TRAILING_PUNCTUATION)
+        if LINK_TEXT.search(before) or LINK_TEXT.search(after):
+            return True
+    return False
+
+
+class _UntruncatedPreheaderEmailTemplate(HTMLEmailTemplate):
+    # the preheader (the preview text shown in an inbox) is cut to PREHEADER_LENGTH_IN_CHARACTERS after the
+    # personalisation is put in, so for the cached rendering it's kept whole, and marked so it can be cut later
+    PREHEADER_LENGTH_IN_CHARACTERS = sys.maxsize
+
+    @property
+    def preheader(self):
+        return f'{PREHEADER_START}{super().preheader}{PREHEADER_END}'
+
+
+def _render(template_dict, values, html_options, html_template_class=HTMLEmailTemplate):
+    plain_text_email = PlainTextEmailTemplate(template_dict, values=values)
+    return (
+        plain_text_email.subject,
+        str(plain_text_email),
+        str(html_template_class(template_dict, values=values, **html_options)),
+    )
+
+
+def _split(rendered, tokens):
+    """
+    Split rendered text into a list of literal strings and the indexes of the placeholders between them
+    """
+    if not tokens:
+        return [rendered]
+    pattern = re.compile('|'.join(re.escape(token) for token in tokens))
+    index_by_token = {token: i for i, token in enumerate(tokens)}
+    parts, position = [], 0
+    for match in pattern.finditer(rendered):
+        parts += [rendered[position:match.start()], index_by_token[match.group()]]
+        position = match.end()
+    parts.append(rendered[position:])
+    return parts
+
+
+def _fill(parts, values):
+    return ''.join(part if isinstance(part, str) else values[part] for part in parts)
+
+
+def _cut_preheader(html):
+    start = html.find(PREHEADER_START)
+    end = html.find(PREHEADER_END, start)
+    if start == -1 or end == -1:
+        return html
+    preheader = html[start + len(PREHEADER_START):end]
+    return (
+        html[:start]
+        + preheader[:HTMLEmailTemplate.PREHEADER_LENGTH_IN_CHARACTERS].strip()
+        + html[end + len(PREHEADER_END):]
+    )
+
+
+class EmailRendering:
+    """
+    A template's subject, plain text body and HTML body, rendered once with a token in place of each placeholder, so
+    an email can be made by putting the personalisation into the gaps rather than parsing the markdown and building
+    the HTML again.
+    """
+    def __init__(self, template_dict, html_options):
+        self.placeholders = list(PlainTextEmailTemplate(template_dict).placeholders)
+        tokens = [_slot_token(i) for i in range(len(self.placeholders))]
+        self.parts = [
+            _split(rendered, tokens)
+            for rendered in _render(
+                template_dict,
+                dict(zip(self.placeholders, tokens)),
+                html_options,
+                html_template_class=_UntruncatedPreheaderEmailTemplate,
+            )
+        ]
+
+    def fill(self, values):
+        subject, plain_text, html = (_fill(parts, values) for parts in self.parts)
+        return subject, plain_text, _cut_preheader(html)
+
+    def matches_full_rendering(self, template_dict, html_options):
+        for probe in PROBE_VALUES:
+            values = [probe(i) for i in range(len(self.placeholders))]
+            if self.fill(values) != _render(template_dict, dict(zip(self.placeholders, values)), html_options):
+                return False
+        return True
+
+    def values_from(self, personalisation):
+        """
+        The personalisation for each placeholder in order, or None if any of it can't be put into the gaps
+        """
+        personalisation = {
+            str(key).translate(PERSONALISATION_KEY_TRANSLATION).lower(): value
+            for key, value in (personalisation or {}).items()
+        }
+        values = []
+        for placeholder in self.placeholders:
+            value = personalisation.get(placeholder.translate(PERSONALISATION_KEY_TRANSLATION).lower())
+            if isinstance(value, int) and not isinstance(value, bool):
+                value = str(value)
+            if not isinstance(value, str) or not SLOT_SAFE_VALUE.fullmatch(value):
+                return None
+            values.append(value)
+        return values
+
+
+class EmailRenderCache:
+    """
+    Cached `EmailRendering`s, keyed by template id and version and the branding options. Templates whose rendering
+    can't be filled in safely are remembered as None, so they aren't checked again.
+    """
+    def __init__(self, maxsize=256):
+        self.renderings = cachetools.LRUCache(maxsize)
+        self.lock = RLock()
+
+    def get(self, template_dict, html_options):
+        key = (template_dict['id'], template_dict['version'], tuple(sorted(html_options.items())))
+        with self.lock:
+            if key in self.renderings:
+                return self.renderings[key]
+
+        rendering = None
+        if not any(
+            CONDITIONAL_PLACEHOLDER.search(template_dict.get(field) or '')
+            or _has_placeholder_next_to_link_text(template_dict.get(field) or '')
+            for field in ('content', 'subject')
+        ):
+            try:
+                rendering = EmailRendering(template_dict, html_options)
+                if not rendering.matches_full_rendering(template_dict, html_options):
+                    rendering = None
+            except Exception:
+                rendering = None
+
+        with self.lock:
+            self.renderings[key] = rendering
+        return rendering
+
+    def clear(self):
+        with self.lock:
+            self.renderings.clear()
+
+
+email_render_cache = EmailRenderCache()
+
+
+def render_email(template_dict, personalisation, html_options):
+    """
+    Returns the subject, plain text body and HTML body of an email, the same as rendering `PlainTextEmailTemplate`
+    and `HTMLEmailTemplate` would, reusing the cached rendering of the template where the personalisation allows.
+    """
+    if template_dict.get('id') is None or template_dict.get('version') is None:
+        EMAIL_RENDER_CACHE_REQUESTS.labels('uncacheable').inc()
+        return _render(template_dict, personalisation, html_options)
+
+    rendering = email_render_cache.get(template_dict, html_options)
+    if rendering is None:
+        EMAIL_RENDER_CACHE_REQUESTS.labels('uncacheable').inc()
+        return _render(template_dict, personalisation, html_options)
+
+    values = rendering.values_from(personalisation)
+    if values is None:
+        EMAIL_RENDER_CACHE_REQUESTS.labels('personalisation').inc()
+        return _render(template_dict, personalisation, html_options)
+
+    EMAIL_RENDER_CACHE_REQUESTS.labels('hit').inc()
+    return rendering.fill(values)
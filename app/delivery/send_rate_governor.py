@@ -0,0 +1,190 @@
+import time
+
+from flask import current_app
+from gds_metrics.metrics import Counter, Gauge, Histogram
+
+from app import redis_store
+from app.clients.email.aws_ses import AwsSesClientThrottlingSendRateException
+
+SEND_RATE_GOVERNOR_RATE = Gauge(
+    'send_rate_governor_rate',
+    'How many messages a second all workers together are currently allowed to send to the provider',
+    ['provider'],
+)
+SEND_RATE_GOVERNOR_WAIT_SECONDS = Histogram(
+    'send_rate_governor_wait_seconds',
+    'How long a worker waited for its turn to send a message to the provider',
+    ['provider'],
+)
+SEND_RATE_GOVERNOR_THROTTLES = Counter(
+    'send_rate_governor_throttles',
+    'Total number of times a provider told us we were sending too fast',
+    ['provider'],
+)
+
+# the rate is cut by this much when a provider throttles us, but at most once every DECREASE_INTERVAL_SECONDS, as
+# the requests that were already in flight are likely to be throttled too
+RATE_DECREASE_FACTOR = 0.5
+DECREASE_INTERVAL_SECONDS = 1
+# how many seconds of sending at the current rate can be saved up while no messages are being sent
+BURST_SECONDS = 1
+# a provider's bucket is forgotten after this long without any messages, and starts again at the ceiling
+BUCKET_TTL_SECONDS = 3600
+
+# A token bucket shared by every worker, with its rate adjusted by additive increase and multiplicative decrease.
+# Tokens are added at the current rate, and the rate itself goes up by `increase` every second until it reaches the
+# ceiling. A caller takes a token even if there isn't a whole one yet, and is told how long to wait until it would
+# have been added, so that callers queue up in order. If the wait would be more than max_wait nothing is taken.
+#
+# Returns {wait, rate, taken} (as strings, as Lua numbers are truncated to integers when returned).
+ACQUIRE_SCRIPT = """
+local key = KEYS[1]
+local now, ceiling, minimum = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local increase, burst_seconds, max_wait, ttl = tonumber(ARGV[4]), tonumber(ARGV[5]), tonumber(ARGV[6]), ARGV[7]
+
+local bucket = redis.call('HMGET', key, 'rate', 'tokens', 'updated_at')
+local elapsed = math.max(0, now - (tonumber(bucket[3]) or now))
+local rate = math.max(minimum, math.min(ceiling, (tonumber(bucket[1]) or ceiling) + increase * elapsed))
+local capacity = math.max(1, rate * burst_seconds)
+local tokens = math.min(capacity, (tonumber(bucket[2]) or capacity) + rate * elapsed)
+
+local wait = math.max(0, (1 - tokens) / rate)
+local taken = 0
+if wait <= max_wait then
+    tokens = tokens - 1
+    taken = 1
+end
+
+redis.call('HMSET', key, 'rate', rate, 'tokens', tokens, 'updated_at', now)
+redis.call('EXPIRE', key, ttl)
+return {tostring(wait), tostring(rate), taken}
+"""
+
+# Cuts the rate after the provider has throttled us, and drops any tokens that had been saved up.
+#
+# Returns the new rate, as a string.
+THROTTLED_SCRIPT = """
+local key = KEYS[1]
+local now, ceiling, minimum = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local decrease, decrease_interval, ttl = tonumber(ARGV[4]), tonumber(ARGV[5]), ARGV[6]
+
+local bucket = redis.call('HMGET', key, 'rate', 'tokens', 'decreased_at')
+local rate = math.min(ceiling, tonumber(bucket[1]) or ceiling)
+if now - (tonumber(bucket[3]) or 0) >= decrease_interval then
+    rate = math.max(minimum, rate * decrease)
+    local tokens = math.min(0, tonumber(bucket[2]) or 0)
+    redis.call('HMSET', key, 'rate', rate, 'tokens', tokens, 'updated_at', now, 'decreased_at', now)
+    redis.call('EXPIRE', key, ttl)
+end
+return tostring(rate)
+"""
+
+
+class SendRateExceeded(Exception):
+    def __init__(self, provider, retry_after):
+        self.provider = provider
+        self.retry_after = retry_after
+
+    def __str__(self):
+        return f'Sending to {self.provider} would have to wait {self.retry_after:.1f} seconds'
+
+
+def is_throttling_exception(exception):
+    return (
+        isinstance(exception, AwsSesClientThrottlingSendRateException) or
+        getattr(exception, 'status_code', None) == 429
+    )
+
+
+class SendRateGovernor:
+    """
+    Paces every worker's sending to a provider so that, together, they stay under the rate the provider will accept.
+
+    The rate starts at the provider's ceiling (from SEND_RATE_CEILINGS). Each time the provider throttles us it is
+    halved, and it then climbs back by SEND_RATE_INCREASE_PER_SECOND each second. Providers without a ceiling, or
+    any provider while Redis is unavailable, aren't paced.
+    """
+    def __init__(self):
+        self._acquire_script = None
+        self._throttled_script = None
+
+    def wait_for_turn(self, provider):
+        """
+        Blocks until this worker may send a message to the provider. Raises SendRateExceeded if that would be more
+        than SEND_RATE_MAX_WAIT_SECONDS away, so the caller can try again later instead of holding up a worker.
+        """
+        ceiling = self._ceiling(provider)
+        if not ceiling:
+            return
+
+        config = current_app.config
+        try:
+            if self._acquire_script is None:
+                self._acquire_script = redis_store.redis_store.register_script(ACQUIRE_SCRIPT)
+            wait, rate, taken = self._acquire_script(
+                keys=[self._cache_key(provider)],
+                args=[
+                    time.time(),
+                    ceiling,
+                    config['SEND_RATE_MINIMUM'],
+                    config['SEND_RATE_INCREASE_PER_SECOND'],
+                    BURST_SECONDS,
+                    config['SEND_RATE_MAX_WAIT_SECONDS'],
+                    BUCKET_TTL_SECONDS,
+                ],
+            )
+        except Exception:
+            # as with the rest of our redis calls, don't stop sending if redis is unavailable
+            current_app.logger.exception(f'Failed to check send rate in redis for {provider}')
+            return
+
+        wait = float(wait)
+        SEND_RATE_GOVERNOR_RATE.labels(provider).set(float(rate))
+        if not int(taken):
+            raise SendRateExceeded(provider, wait)
+        SEND_RATE_GOVERNOR_WAIT_SECONDS.labels(provider).observe(wait)
+        if wait:
+            time.sleep(wait)
+
+    def throttled(self, provider):
+        """
+        Call when the provider has told us we're sending too fast.
+        """
+        SEND_RATE_GOVERNOR_THROTTLES.labels(provider).inc()
+        ceiling = self._ceiling(provider)
+        if not ceiling:
+            return
+
+        try:
+            if self._throttled_script is None:
+                self._throttled_script = redis_store.redis_store.register_script(THROTTLED_SCRIPT)
+            rate = self._throttled_script(
+                keys=[self._cache_key(provider)],
+                args=[
+                    time.time(),
+                    ceiling,
+                    current_app.config['SEND_RATE_MINIMUM'],
+                    RATE_DECREASE_FACTOR,
+                    DECREASE_INTERVAL_SECONDS,
+                    BUCKET_TTL_SECONDS,
+                ],
+            )
+        except Exception:
+            current_app.logger.exception(f'Failed to reduce send rate in redis for {provider}')
+            return
+
+        SEND_RATE_GOVERNOR_RATE.labels(provider).set(float(rate))
+        current_app.logger.warning(f'{provider} throttled sending, send rate is now {float(rate):.1f} a second')
+
+    @staticmethod
+    def _ceiling(provider):
+        if not redis_store.active:
+            return None
+        return current_app.config['SEND_RATE_CEILINGS'].get(provider)
+
+    @staticmethod
+    def _cache_key(provider):
+        return f'send-rate-governor-{provider}'
+
+
+send_rate_governor = SendRateGovernor()
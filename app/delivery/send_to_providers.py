@@ -1,39 +1,56 @@
 import random
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from threading import BoundedSemaphore
 from urllib import parse
 
 from cachetools import TTLCache, cached
 from flask import current_app
-from notifications_utils.template import (
-    HTMLEmailTemplate,
-    PlainTextEmailTemplate,
-    SMSMessageTemplate,
-)
+from notifications_utils.template import SMSMessageTemplate
 
 from app import create_uuid, db, notification_provider_clients, statsd_client
 from app.celery.research_mode_tasks import (
     send_email_response,
     send_sms_response,
 )
-from app.dao.email_branding_dao import dao_get_email_branding_by_id
-from app.dao.notifications_dao import dao_update_notification
+from app.dao.notifications_dao import (
+    dao_get_notifications_by_ids,
+    dao_update_notification,
+    dao_update_notifications_sent_to_provider,
+)
 from app.dao.provider_details_dao import (
     dao_reduce_sms_provider_priority,
     get_provider_details_by_notification_type,
 )
+from app.delivery.email_render_cache import render_email
+from app.delivery.send_rate_governor import (
+    SendRateExceeded,
+    is_throttling_exception,
+    send_rate_governor,
+)
+from app.delivery.sms_provider_health import (
+    get_provider_health,
+    weigh_providers,
+)
 from app.exceptions import NotificationTechnicalFailureException
 from app.models import (
     BRANDING_BOTH,
     BRANDING_ORG_BANNER,
     EMAIL_TYPE,
     KEY_TYPE_TEST,
+    NOTIFICATION_CREATED,
     NOTIFICATION_SENDING,
     NOTIFICATION_SENT,
     NOTIFICATION_STATUS_TYPES_COMPLETED,
     NOTIFICATION_TECHNICAL_FAILURE,
     SMS_TYPE,
 )
-from app.serialised_models import SerialisedService, SerialisedTemplate
+from app.serialised_models import (
+    SerialisedEmailBranding,
+    SerialisedService,
+    SerialisedTemplate,
+)
 
 
 def send_sms_to_provider(notification):
@@ -45,17 +62,7 @@ def send_sms_to_provider(notification):
 
     if notification.status == 'created':
         provider = provider_to_use(SMS_TYPE, notification.international)
-
-        template_model = SerialisedTemplate.from_id_and_service_id(
-            template_id=notification.template_id, service_id=service.id, version=notification.template_version
-        )
-
-        template = SMSMessageTemplate(
-            template_model.__dict__,
-            values=notification.personalisation,
-            prefix=service.name,
-            show_prefix=service.prefix_sms,
-        )
+        template = _get_sms_template(notification, service)
         created_at = notification.created_at
         key_type = notification.key_type
         if service.research_mode or notification.key_type == KEY_TYPE_TEST:
@@ -70,16 +77,14 @@ def send_sms_to_provider(notification):
                 # providers as a slow down of our providers can cause us to run out of DB connections
                 # Therefore we pull all the data from our DB models into `send_sms_kwargs`now before
                 # closing the session (as otherwise it would be reopened immediately)
-                send_sms_kwargs = {
-                    'to': notification.normalised_to,
-                    'content': str(template),
-                    'reference': str(notification.id),
-                    'sender': notification.reply_to_text,
-                    'international': notification.international,
-                }
+                send_sms_kwargs = _get_send_sms_kwargs(notification, template)
                 db.session.close()  # no commit needed as no changes to objects have been made above
-                provider.send_sms(**send_sms_kwargs)
+                _send_sms(provider, send_sms_kwargs)
+            except SendRateExceeded:
+                raise
             except Exception as e:
+                if is_throttling_exception(e):
+                    send_rate_governor.throttled(provider.get_name())
                 notification.billable_units = template.fragment_count
                 dao_update_notification(notification)
                 dao_reduce_sms_provider_priority(provider.get_name(), time_threshold=timedelta(minutes=1))
@@ -88,17 +93,144 @@ def send_sms_to_provider(notification):
                 notification.billable_units = template.fragment_count
                 update_notification_to_sending(notification, provider)
 
-        delta_seconds = (datetime.utcnow() - created_at).total_seconds()
-        statsd_client.timing("sms.total-time", delta_seconds)
+        _time_sms_delivery(created_at, key_type, service)
 
-        if key_type == KEY_TYPE_TEST:
-            statsd_client.timing("sms.test-key.total-time", delta_seconds)
+
+PendingSms = namedtuple('PendingSms', [
+    'notification_id', 'provider', 'billable_units', 'send_sms_kwargs', 'created_at', 'key_type', 'service',
+])
+
+
+def send_smss_to_provider(notification_ids):
+    """
+    Batch version of send_sms_to_provider. The notifications are loaded with one query, sent to their providers at
+    the same time (up to SMS_DELIVERY_MAX_IN_FLIGHT at once, and SMS_DELIVERY_MAX_IN_FLIGHT_PER_PROVIDER to any one
+    provider) with no database connection held, and then updated with one query.
+
+    Notifications that have already been sent are skipped, and notifications from inactive services are marked as
+    technical failures. Returns a dict of the id of each notification that couldn't be sent to the exception it
+    failed with, for the caller to retry.
+    """
+    pending, failures = [], {}
+    for notification in dao_get_notifications_by_ids(notification_ids):
+        if notification.status != NOTIFICATION_CREATED:
+            continue
+        service = SerialisedService.from_id(notification.service_id)
+        if not service.active or service.research_mode or notification.key_type == KEY_TYPE_TEST:
+            # these don't go to a provider, so there's nothing to gain from batching them. Sending one on its own
+            # mustn't stop the rest of the batch being sent
+            try:
+                send_sms_to_provider(notification)
+            except NotificationTechnicalFailureException as e:
+                # the notification has been marked as a technical failure, so there's nothing to retry
+                current_app.logger.warning(str(e))
+            except Exception as e:
+                failures[notification.id] = e
+            continue
+
+        template = _get_sms_template(notification, service)
+        pending.append(PendingSms(
+            notification.id,
+            provider_to_use(SMS_TYPE, notification.international),
+            template.fragment_count,
+            _get_send_sms_kwargs(notification, template),
+            notification.created_at,
+            notification.key_type,
+            service,
+        ))
+    db.session.close()  # as in send_sms_to_provider, don't hold a connection open while waiting for the providers
+
+    if not pending:
+        return failures
+
+    app = current_app._get_current_object()
+    in_flight_per_provider = {
+        sms.provider.get_name(): BoundedSemaphore(app.config['SMS_DELIVERY_MAX_IN_FLIGHT_PER_PROVIDER'])
+        for sms in pending
+    }
+
+    def send(sms):
+        with app.app_context(), in_flight_per_provider[sms.provider.get_name()]:
+            _send_sms(sms.provider, sms.send_sms_kwargs)
+            return datetime.utcnow()
+
+    with ThreadPoolExecutor(max_workers=min(len(pending), app.config['SMS_DELIVERY_MAX_IN_FLIGHT'])) as executor:
+        futures = [executor.submit(send, sms) for sms in pending]
+
+    sent_notifications, failing_providers = [], set()
+    for sms, future in zip(pending, futures):
+        provider_name = sms.provider.get_name()
+        exception = future.exception()
+        if exception is None:
+            sent_notifications.append({
+                'id': sms.notification_id,
+                'billable_units': sms.billable_units,
+                'sent_at': future.result(),
+                'sent_by': provider_name,
+                'status': NOTIFICATION_SENT if sms.send_sms_kwargs['international'] else NOTIFICATION_SENDING,
+            })
+            continue
+
+        failures[sms.notification_id] = exception
+        if isinstance(exception, SendRateExceeded):
+            continue
+        if is_throttling_exception(exception):
+            send_rate_governor.throttled(provider_name)
+        sent_notifications.append({'id': sms.notification_id, 'billable_units': sms.billable_units})
+        failing_providers.add(provider_name)
+
+    dao_update_notifications_sent_to_provider(sent_notifications)
+    for provider_name in failing_providers:
+        dao_reduce_sms_provider_priority(provider_name, time_threshold=timedelta(minutes=1))
+
+    for sms in pending:
+        if sms.notification_id not in failures:
+            _time_sms_delivery(sms.created_at, sms.key_type, sms.service)
+
+    return failures
+
+
+def _get_sms_template(notification, service):
+    template_model = SerialisedTemplate.from_id_and_service_id(
+        template_id=notification.template_id, service_id=service.id, version=notification.template_version
+    )
+
+    return SMSMessageTemplate(
+        template_model.__dict__,
+        values=notification.personalisation,
+        prefix=service.name,
+        show_prefix=service.prefix_sms,
+    )
+
+
+def _get_send_sms_kwargs(notification, template):
+    return {
+        'to': notification.normalised_to,
+        'content': str(template),
+        'reference': str(notification.id),
+        'sender': notification.reply_to_text,
+        'international': notification.international,
+    }
+
+
+def _send_sms(provider, send_sms_kwargs):
+    send_rate_governor.wait_for_turn(provider.get_name())
+    with get_provider_health(provider.get_name()).recording_outcome():
+        provider.send_sms(**send_sms_kwargs)
+
+
+def _time_sms_delivery(created_at, key_type, service):
+    delta_seconds = (datetime.utcnow() - created_at).total_seconds()
+    statsd_client.timing("sms.total-time", delta_seconds)
+
+    if key_type == KEY_TYPE_TEST:
+        statsd_client.timing("sms.test-key.total-time", delta_seconds)
+    else:
+        statsd_client.timing("sms.live-key.total-time", delta_seconds)
+        if service.high_volume:
+            statsd_client.timing("sms.live-key.high-volume.total-time", delta_seconds)
         else:
-            statsd_client.timing("sms.live-key.total-time", delta_seconds)
-            if service.high_volume:
-                statsd_client.timing("sms.live-key.high-volume.total-time", delta_seconds)
-            else:
-                statsd_client.timing("sms.live-key.not-high-volume.total-time", delta_seconds)
+            statsd_client.timing("sms.live-key.not-high-volume.total-time", delta_seconds)
 
 
 def send_email_to_provider(notification):
@@ -114,16 +246,6 @@ def send_email_to_provider(notification):
             template_id=notification.template_id, service_id=service.id, version=notification.template_version
         ).__dict__
 
-        html_email = HTMLEmailTemplate(
-            template_dict,
-            values=notification.personalisation,
-            **get_html_email_options(service)
-        )
-
-        plain_text_email = PlainTextEmailTemplate(
-            template_dict,
-            values=notification.personalisation
-        )
         created_at = notification.created_at
         key_type = notification.key_type
         if service.research_mode or notification.key_type == KEY_TYPE_TEST:
@@ -134,14 +256,23 @@ def send_email_to_provider(notification):
             from_address = '"{}" <{}@{}>'.format(service.name, service.email_from,
                                                  current_app.config['NOTIFY_EMAIL_DOMAIN'])
 
-            reference = provider.send_email(
-                from_address,
-                notification.normalised_to,
-                plain_text_email.subject,
-                body=str(plain_text_email),
-                html_body=str(html_email),
-                reply_to_address=notification.reply_to_text
+            subject, plain_text_body, html_body = render_email(
+                template_dict, notification.personalisation, get_html_email_options(service)
             )
+            send_rate_governor.wait_for_turn(provider.get_name())
+            try:
+                reference = provider.send_email(
+                    from_address,
+                    notification.normalised_to,
+                    subject,
+                    body=plain_text_body,
+                    html_body=html_body,
+                    reply_to_address=notification.reply_to_text
+                )
+            except Exception as e:
+                if is_throttling_exception(e):
+                    send_rate_governor.throttled(provider.get_name())
+                raise
             notification.reference = reference
             update_notification_to_sending(notification, provider)
         delta_seconds = (datetime.utcnow() - created_at).total_seconds()
@@ -157,6 +288,8 @@ def send_email_to_provider(notification):
 
 
 def update_notification_to_sending(notification, provider):
+    # always written straight away, never buffered: a notification's status moving on from created is what stops it
+    # being sent twice
     notification.sent_at = datetime.utcnow()
     notification.sent_by = provider.get_name()
     if notification.status not in NOTIFICATION_STATUS_TYPES_COMPLETED:
@@ -168,7 +301,7 @@ provider_cache = TTLCache(maxsize=8, ttl=10)
 
 
 @cached(cache=provider_cache)
-def provider_to_use(notification_type, international=False):
+def get_active_provider_priorities(notification_type, international=False):
     active_providers = [
         p for p in get_provider_details_by_notification_type(notification_type, international) if p.active
     ]
@@ -180,13 +313,19 @@ def provider_to_use(notification_type, international=False):
         raise Exception("No active {} providers".format(notification_type))
 
     if len(active_providers) == 1:
-        weights = [100]
-    else:
-        weights = [p.priority for p in active_providers]
+        return [(active_providers[0].identifier, 100)]
+
+    return [(p.identifier, p.priority) for p in active_providers]
+
 
-    chosen_provider = random.choices(active_providers, weights=weights)[0]
+def provider_to_use(notification_type, international=False):
+    # the provider details are cached, but the provider is picked for each message, so that traffic is split
+    # between them by weight and moves away from one that is failing as soon as this process sees it
+    identifiers, weights = zip(*weigh_providers(get_active_provider_priorities(notification_type, international)))
+
+    chosen_provider = random.choices(identifiers, weights=weights)[0]
 
-    return notification_provider_clients.get_client_by_name_and_type(chosen_provider.identifier, notification_type)
+    return notification_provider_clients.get_client_by_name_and_type(chosen_provider, notification_type)
 
 
 def get_logo_url(base_url, logo_file):
@@ -217,14 +356,14 @@ def get_html_email_options(service):
             'brand_banner': False,
         }
     if isinstance(service, SerialisedService):
-        branding = dao_get_email_branding_by_id(service.email_branding)
+        branding = SerialisedEmailBranding.from_id(service.email_branding)
+        logo_url = branding.logo_url
     else:
         branding = service.email_branding
-
-    logo_url = get_logo_url(
-        current_app.config['ADMIN_BASE_URL'],
-        branding.logo
-    ) if branding.logo else None
+        logo_url = get_logo_url(
+            current_app.config['ADMIN_BASE_URL'],
+            branding.logo
+        ) if branding.logo else None
 
     return {
         'govuk_banner': branding.brand_type == BRANDING_BOTH,
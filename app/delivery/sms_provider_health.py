@@ -0,0 +1,129 @@
+import time
+from collections import deque
+from contextlib import contextmanager
+from threading import Lock
+
+from flask import current_app
+
+from app import statsd_client
+
+# the share of its usual traffic a provider gets once its circuit has been open for SMS_PROVIDER_CIRCUIT_OPEN_SECONDS,
+# while the next message sent to it checks whether it has recovered
+HALF_OPEN_WEIGHT = 0.1
+
+
+class ProviderHealth:
+    """
+    The outcomes of this process's recent requests to an SMS provider, and a circuit breaker that stops sending to it
+    when too many of them have failed or been slow.
+
+    While the circuit is closed the provider's weight is scaled by the share of recent requests that succeeded. When
+    the share that failed reaches SMS_PROVIDER_CIRCUIT_ERROR_PERCENTAGE the circuit opens and the provider gets no
+    traffic for SMS_PROVIDER_CIRCUIT_OPEN_SECONDS. After that it gets a small share again, and the first result
+    either closes the circuit or opens it for another period.
+    """
+    def __init__(self, identifier):
+        self.identifier = identifier
+        self.outcomes = deque()
+        self.failures = 0
+        self.opened_at = None
+        self.lock = Lock()
+
+    def record(self, succeeded, seconds):
+        config = current_app.config
+        succeeded = succeeded and seconds * 1000 < config['SMS_PROVIDER_SLOW_RESPONSE_MS']
+        now = time.monotonic()
+
+        with self.lock:
+            if self.opened_at is not None:
+                if now - self.opened_at < config['SMS_PROVIDER_CIRCUIT_OPEN_SECONDS']:
+                    # a request that was sent before the circuit opened
+                    return
+                if succeeded:
+                    self._close()
+                else:
+                    self._open(now, 'failed again')
+                return
+
+            self.outcomes.append((now, succeeded))
+            self.failures += not succeeded
+            self._forget_outcomes_before(now - config['SMS_PROVIDER_HEALTH_WINDOW_SECONDS'])
+
+            if (
+                len(self.outcomes) >= config['SMS_PROVIDER_CIRCUIT_MIN_REQUESTS'] and
+                self.failures * 100 >= len(self.outcomes) * config['SMS_PROVIDER_CIRCUIT_ERROR_PERCENTAGE']
+            ):
+                self._open(now, f'{self.failures} of the last {len(self.outcomes)} requests failed or were slow')
+
+    @contextmanager
+    def recording_outcome(self):
+        start = time.monotonic()
+        try:
+            yield
+        except Exception:
+            self.record(False, time.monotonic() - start)
+            raise
+        self.record(True, time.monotonic() - start)
+
+    def weight(self, priority):
+        config = current_app.config
+        now = time.monotonic()
+
+        with self.lock:
+            if self.opened_at is not None:
+                if now - self.opened_at < config['SMS_PROVIDER_CIRCUIT_OPEN_SECONDS']:
+                    return 0
+                return priority * HALF_OPEN_WEIGHT
+
+            self._forget_outcomes_before(now - config['SMS_PROVIDER_HEALTH_WINDOW_SECONDS'])
+            if len(self.outcomes) < config['SMS_PROVIDER_CIRCUIT_MIN_REQUESTS']:
+                return priority
+            return priority * (len(self.outcomes) - self.failures) / len(self.outcomes)
+
+    def _forget_outcomes_before(self, cutoff):
+        while self.outcomes and self.outcomes[0][0] < cutoff:
+            _, succeeded = self.outcomes.popleft()
+            self.failures -= not succeeded
+
+    def _open(self, now, reason):
+        self.opened_at = now
+        self.outcomes.clear()
+        self.failures = 0
+        current_app.logger.warning(f'Stopped sending SMS to {self.identifier} because {reason}')
+        statsd_client.incr(f'sms.provider-health.{self.identifier}.circuit-opened')
+
+    def _close(self):
+        self.opened_at = None
+        current_app.logger.info(f'Started sending SMS to {self.identifier} again')
+        statsd_client.incr(f'sms.provider-health.{self.identifier}.circuit-closed')
+
+
+_provider_health = {}
+_provider_health_lock = Lock()
+
+
+def get_provider_health(identifier):
+    with _provider_health_lock:
+        if identifier not in _provider_health:
+            _provider_health[identifier] = ProviderHealth(identifier)
+        return _provider_health[identifier]
+
+
+def reset_provider_health():
+    with _provider_health_lock:
+        _provider_health.clear()
+
+
+def weigh_providers(provider_priorities):
+    """
+    Takes a list of (identifier, priority) and returns the identifiers with their priorities scaled by how healthy
+    each provider has been. If every provider is failing the priorities are returned unchanged, as sending to a
+    failing provider is better than not sending at all.
+    """
+    weighted = [
+        (identifier, get_provider_health(identifier).weight(priority))
+        for identifier, priority in provider_priorities
+    ]
+    if not any(weight for _, weight in weighted):
+        return list(provider_priorities)
+    return weighted
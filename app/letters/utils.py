@@ -4,13 +4,13 @@ import math
 from datetime import datetime, timedelta
 from enum import Enum
 
-import boto3
 from flask import current_app
 from notifications_utils.letter_timings import LETTER_PROCESSING_DEADLINE
 from notifications_utils.pdf import pdf_page_count
 from notifications_utils.s3 import s3upload
 from notifications_utils.timezones import convert_utc_to_bst
 
+from app.aws.s3 import get_s3_client, get_s3_resource
 from app.models import (
     KEY_TYPE_TEST,
     NOTIFICATION_VALIDATION_FAILED,
@@ -44,7 +44,7 @@ class LetterPDFNotFound(Exception):
 def find_letter_pdf_in_s3(notification):
     bucket_name, prefix = get_bucket_name_and_prefix_for_notification(notification)
 
-    s3 = boto3.resource('s3')
+    s3 = get_s3_resource()
     bucket = s3.Bucket(bucket_name)
     try:
         item = next(x for x in bucket.objects.filter(Prefix=prefix))
@@ -53,6 +53,33 @@ def find_letter_pdf_in_s3(notification):
     return item
 
 
+def get_letter_pdfs_in_folder(bucket_name, folder):
+    """
+    List every letter PDF in a folder of the bucket (paging through list_objects_v2, 1000 keys per request) and
+    return a dict of the letters' references to their S3 key and size. If there is more than one PDF for a reference
+    the first in key order is used, to match find_letter_pdf_in_s3.
+    """
+    letter_pdfs = {}
+    paginator = get_s3_client().get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=folder):
+        for obj in page.get('Contents', []):
+            filename = obj['Key'][len(folder):]
+            if filename.startswith('NOTIFY.'):
+                letter_pdfs.setdefault(get_reference_from_filename(filename), {'Key': obj['Key'], 'Size': obj['Size']})
+    return letter_pdfs
+
+
+def find_letter_pdf_key_and_size(s3_client, bucket_name, prefix):
+    """
+    Look up a single letter PDF by prefix. Takes the S3 client (which, unlike a resource, is thread safe) so that it
+    can be called from a thread pool outside of the app context.
+    """
+    contents = s3_client.list_objects_v2(Bucket=bucket_name, Prefix=prefix, MaxKeys=1).get('Contents')
+    if not contents:
+        raise LetterPDFNotFound(f'File not found in bucket {bucket_name} with prefix {prefix}')
+    return {'Key': contents[0]['Key'], 'Size': contents[0]['Size']}
+
+
 def generate_letter_pdf_filename(reference, created_at, ignore_folder=False, postage=SECOND_CLASS):
     upload_file_name = LETTERS_PDF_FILE_LOCATION_STRUCTURE.format(
         folder='' if ignore_folder else get_folder_name(created_at),
@@ -176,7 +203,7 @@ def move_sanitised_letter_to_test_or_live_pdf_bucket(filename, is_test_letter, c
 
 
 def get_file_names_from_error_bucket():
-    s3 = boto3.resource('s3')
+    s3 = get_s3_resource()
     scan_bucket = current_app.config['LETTERS_SCAN_BUCKET_NAME']
     bucket = s3.Bucket(scan_bucket)
 
@@ -189,7 +216,7 @@ def get_letter_pdf_and_metadata(notification):
 
 
 def _move_s3_object(source_bucket, source_filename, target_bucket, target_filename, metadata=None):
-    s3 = boto3.resource('s3')
+    s3 = get_s3_resource()
     copy_source = {'Bucket': source_bucket, 'Key': source_filename}
 
     target_bucket = s3.Bucket(target_bucket)
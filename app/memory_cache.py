@@ -0,0 +1,232 @@
+import json
+import os
+import time
+from collections import defaultdict
+from functools import partial, wraps
+from inspect import signature
+from threading import Lock, RLock
+
+import cachetools
+from flask import current_app
+from gds_metrics.metrics import Counter
+from sqlalchemy import event
+
+from app import db, redis_store
+
+CACHE_INVALIDATION_CHANNEL = 'serialised-model-cache-invalidation'
+
+# used instead of SERIALISED_MODEL_CACHE_TTL when we aren't subscribed to invalidation messages (for example because
+# Redis is disabled or the connection dropped), as another process could have changed the data without us hearing
+UNSUBSCRIBED_CACHE_TTL = 2
+
+MEMORY_CACHE_HITS = Counter(
+    'serialised_model_memory_cache_hits',
+    'Total number of serialised model lookups served from the in-process cache',
+    ['cache']
+)
+MEMORY_CACHE_MISSES = Counter(
+    'serialised_model_memory_cache_misses',
+    'Total number of serialised model lookups that had to go to Redis or the database',
+    ['cache']
+)
+MEMORY_CACHE_EVICTIONS = Counter(
+    'serialised_model_memory_cache_evictions',
+    'Total number of entries removed from the in-process serialised model cache',
+    ['cache', 'reason']
+)
+
+
+class _BoundedCache(cachetools.LRUCache):
+    def __init__(self, name, maxsize):
+        super().__init__(maxsize)
+        self.name = name
+
+    def popitem(self):
+        # only called by cachetools when the cache is full
+        MEMORY_CACHE_EVICTIONS.labels(self.name, 'full').inc()
+        return super().popitem()
+
+
+class VersionedMemoryCache:
+    """
+    An in-process cache of values that belong to a service (or to another object with its own id, such as an email
+    branding). Entries are keyed by the id and its current cache version, which is bumped when the service, its
+    templates or its API keys change. A lookup that started before an invalidation therefore can't put stale data
+    back in the cache once it finishes.
+    """
+    service_versions = defaultdict(int)
+    instances = []
+
+    def __init__(self, name, maxsize=1024):
+        self.name = name
+        self.entries = _BoundedCache(name, maxsize)
+        self.lock = RLock()
+        VersionedMemoryCache.instances.append(self)
+
+    def get(self, key, ttl):
+        with self.lock:
+            stored_at, value = self.entries.get(key, (None, None))
+            if stored_at is None:
+                return None
+            if time.monotonic() - stored_at > ttl:
+                del self.entries[key]
+                MEMORY_CACHE_EVICTIONS.labels(self.name, 'expired').inc()
+                return None
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic(), value)
+
+    def invalidate_service(self, service_id):
+        with self.lock:
+            stale_keys = [key for key in self.entries.keys() if key[0] == service_id]
+            for key in stale_keys:
+                del self.entries[key]
+        if stale_keys:
+            MEMORY_CACHE_EVICTIONS.labels(self.name, 'invalidated').inc(len(stale_keys))
+
+    def clear(self):
+        with self.lock:
+            cleared = len(self.entries)
+            self.entries.clear()
+        if cleared:
+            MEMORY_CACHE_EVICTIONS.labels(self.name, 'invalidated').inc(cleared)
+
+    @classmethod
+    def invalidate_service_in_all_caches(cls, service_id):
+        service_id = str(service_id)
+        cls.service_versions[service_id] += 1
+        for cache in cls.instances:
+            cache.invalidate_service(service_id)
+
+    @classmethod
+    def clear_all_caches(cls):
+        for cache in cls.instances:
+            cache.clear()
+
+
+class InvalidationListener:
+    """
+    Subscribes (once per process, as celery and gunicorn fork after the app is created) to the Redis channel that
+    invalidation messages are published on. If the subscription thread dies we may have missed messages, so all the
+    caches are cleared when it is restarted.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.pid = None
+        self.thread = None
+
+    @property
+    def subscribed(self):
+        return self.pid == os.getpid() and self.thread is not None and self.thread.is_alive()
+
+    def ensure_subscribed(self):
+        if self.subscribed or not redis_store.active:
+            return self.subscribed
+
+        with self.lock:
+            if self.subscribed:
+                return True
+            try:
+                pubsub = redis_store.redis_store.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(**{CACHE_INVALIDATION_CHANNEL: handle_invalidation_message})
+                self.thread = pubsub.run_in_thread(sleep_time=0.1, daemon=True)
+                self.pid = os.getpid()
+            except Exception:
+                current_app.logger.exception('Could not subscribe to serialised model cache invalidations')
+                return False
+
+        VersionedMemoryCache.clear_all_caches()
+        return True
+
+    def ttl(self):
+        if self.ensure_subscribed():
+            return current_app.config['SERIALISED_MODEL_CACHE_TTL']
+        return UNSUBSCRIBED_CACHE_TTL
+
+
+listener = InvalidationListener()
+
+
+def handle_invalidation_message(message):
+    VersionedMemoryCache.invalidate_service_in_all_caches(json.loads(message['data'])['service_id'])
+
+
+def memory_cache(func=None, *, key='service_id'):
+    """
+    Cache the return value of a classmethod in the in-process cache. The classmethod takes a `service_id` argument,
+    or the argument named by `key` for values that belong to something else. The first (cls) argument is ignored
+    when building the cache key.
+    """
+    if func is None:
+        return partial(memory_cache, key=key)
+
+    cache = VersionedMemoryCache(func.__qualname__)
+    key_position = list(signature(func).parameters).index(key)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        owner_id = str(kwargs[key] if key in kwargs else args[key_position])
+        cache_key = (
+            owner_id,
+            VersionedMemoryCache.service_versions[owner_id],
+            cachetools.keys.hashkey(*args[1:], **kwargs),
+        )
+
+        value = cache.get(cache_key, listener.ttl())
+        if value is not None:
+            MEMORY_CACHE_HITS.labels(cache.name).inc()
+            return value
+
+        MEMORY_CACHE_MISSES.labels(cache.name).inc()
+        value = func(*args, **kwargs)
+        cache.set(cache_key, value)
+        return value
+
+    return wrapper
+
+
+def _invalidate_cache_after_commit(owner_id, redis_keys):
+    db.session.info.setdefault('invalidated_service_caches', set()).add((str(owner_id), tuple(redis_keys)))
+
+
+def invalidate_service_cache(service_id, template_id=None):
+    """
+    Call from a DAO function that changes a service, one of its templates or API keys, or anything else that's part
+    of its serialised models (such as its permissions, SMS senders, email reply-to addresses and letter contacts).
+    Once the transaction commits, the cached copies are removed from Redis and every process is told to drop its
+    in-process copies.
+    """
+    redis_keys = [f'service-{service_id}']
+    if template_id:
+        redis_keys.append(f'service-{service_id}-template-{template_id}-version-None')
+    _invalidate_cache_after_commit(service_id, redis_keys)
+
+
+def invalidate_email_branding_cache(email_branding_id):
+    """
+    Like `invalidate_service_cache`, for a DAO function that changes an email branding
+    """
+    _invalidate_cache_after_commit(email_branding_id, [f'email_branding-{email_branding_id}'])
+
+
+@event.listens_for(db.session, 'after_commit')
+def publish_cache_invalidations(session):
+    for owner_id, redis_keys in session.info.pop('invalidated_service_caches', ()):
+        VersionedMemoryCache.invalidate_service_in_all_caches(owner_id)
+
+        if not redis_store.active:
+            continue
+        try:
+            for redis_key in redis_keys:
+                redis_store.delete(redis_key)
+            # other processes only need the id, whatever it belongs to, to drop their in-process copies
+            redis_store.redis_store.publish(CACHE_INVALIDATION_CHANNEL, json.dumps({'service_id': owner_id}))
+        except Exception:
+            current_app.logger.exception(f'Failed to publish cache invalidation for {owner_id}')
+
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_cache_invalidations(session):
+    session.info.pop('invalidated_service_caches', None)
@@ -1265,6 +1265,10 @@ class Job(db.Model):
     )
     archived = db.Column(db.Boolean, nullable=False, default=False)
     contact_list_id = db.Column(UUID(as_uuid=True), db.ForeignKey('service_contact_list.id'), nullable=True)
+    # Checkpoints for large jobs that are processed in chunks (see process_job_in_chunks). chunk_count is only set
+    # once the whole file has been read, and completed_chunks is null for jobs that aren't processed in chunks.
+    chunk_count = db.Column(db.Integer, nullable=True)
+    completed_chunks = db.Column(JSONB(none_as_null=True), nullable=True)
 
 
 VERIFY_CODE_TYPES = [EMAIL_TYPE, SMS_TYPE]
@@ -2108,6 +2112,46 @@ class FactNotificationStatus(db.Model):
     updated_at = db.Column(db.DateTime, nullable=True, onupdate=datetime.datetime.utcnow)
 
 
+class LiveNotificationStatus(db.Model):
+    """
+    Running counts of notifications by status for recent days, so that "today" can be shown without scanning the
+    notifications table. Kept up to date by triggers on the notifications table (see migration
+    0368_live_notification_status), so every insert, status change and delete is counted, however it's made.
+
+    Each count is split across shards so that concurrent transactions don't queue on the same row (see migration
+    0372_shard_live_status): always sum `notification_count` over the shards, as a single shard can even be negative.
+    """
+    __tablename__ = "live_notification_status"
+
+    bst_date = db.Column(db.Date, primary_key=True, nullable=False)
+    service_id = db.Column(UUID(as_uuid=True), primary_key=True, nullable=False)
+    notification_type = db.Column(db.Text, primary_key=True, nullable=False)
+    key_type = db.Column(db.Text, primary_key=True, nullable=False)
+    template_id = db.Column(UUID(as_uuid=True), primary_key=True, nullable=False)
+    job_id = db.Column(UUID(as_uuid=True), primary_key=True, nullable=False)
+    notification_status = db.Column(db.Text, primary_key=True, nullable=False)
+    shard = db.Column(db.SmallInteger, primary_key=True, nullable=False, default=0)
+    notification_count = db.Column(db.Integer(), nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+
+class FactNotificationStatusTotal(db.Model):
+    """
+    The number of notifications sent each day (from ft_notification_status, excluding test keys) and the running
+    totals up to and including that day, so the all-time totals are a single row rather than a sum over every day.
+    """
+    __tablename__ = "ft_notification_status_totals"
+
+    bst_date = db.Column(db.Date, primary_key=True, nullable=False)
+    emails = db.Column(db.BigInteger, nullable=False)
+    sms = db.Column(db.BigInteger, nullable=False)
+    letters = db.Column(db.BigInteger, nullable=False)
+    total_emails = db.Column(db.BigInteger, nullable=False)
+    total_sms = db.Column(db.BigInteger, nullable=False)
+    total_letters = db.Column(db.BigInteger, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+
 class FactProcessingTime(db.Model):
     __tablename__ = "ft_processing_time"
 
@@ -2176,6 +2220,47 @@ class ServiceDataRetention(db.Model):
         }
 
 
+class NotificationActivity(db.Model):
+    """
+    The days (in London time) each service has sent notifications of a type that are still in the notifications
+    table, so the nightly tasks can find the services they have work for without scanning notifications. Rows are
+    added by a trigger on notifications (see migration 0371_notification_activity) and removed once a day's
+    notifications have been moved to notification_history.
+    """
+    __tablename__ = 'notification_activity'
+
+    service_id = db.Column(UUID(as_uuid=True), db.ForeignKey('services.id'), primary_key=True, nullable=False)
+    notification_type = db.Column(db.Text, primary_key=True, nullable=False)
+    bst_date = db.Column(db.Date, primary_key=True, nullable=False)
+
+    __table_args__ = (
+        Index('ix_notification_activity_notification_type_bst_date', 'notification_type', 'bst_date'),
+    )
+
+
+ARCHIVAL_PENDING = 'pending'
+ARCHIVAL_IN_PROGRESS = 'in-progress'
+ARCHIVAL_DONE = 'done'
+
+
+class NotificationArchival(db.Model):
+    """
+    A service's notifications of one type that are waiting to be moved to notification_history by the
+    archive-notifications task. Kept in the database so an interrupted night carries on where it stopped.
+    """
+    __tablename__ = 'notification_archival'
+
+    service_id = db.Column(UUID(as_uuid=True), db.ForeignKey('services.id'), primary_key=True, nullable=False)
+    notification_type = db.Column(db.Text, primary_key=True, nullable=False)
+    delete_before = db.Column(db.DateTime, nullable=False)
+    estimated_rows = db.Column(db.BigInteger, nullable=False, default=0)
+    archived_rows = db.Column(db.BigInteger, nullable=False, default=0)
+    status = db.Column(db.Text, nullable=False, default=ARCHIVAL_PENDING)
+    updated_at = db.Column(
+        db.DateTime, nullable=False, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow
+    )
+
+
 class ReturnedLetter(db.Model):
     __tablename__ = 'returned_letters'
 
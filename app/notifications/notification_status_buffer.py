@@ -0,0 +1,154 @@
+import os
+from threading import Event, Lock, Thread
+
+from celery.signals import worker_process_shutdown
+from flask import current_app
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app.models import (
+    NOTIFICATION_CANCELLED,
+    NOTIFICATION_CREATED,
+    NOTIFICATION_DELIVERED,
+    NOTIFICATION_FAILED,
+    NOTIFICATION_PENDING,
+    NOTIFICATION_PENDING_VIRUS_CHECK,
+    NOTIFICATION_PERMANENT_FAILURE,
+    NOTIFICATION_RETURNED_LETTER,
+    NOTIFICATION_SENDING,
+    NOTIFICATION_SENT,
+    NOTIFICATION_TECHNICAL_FAILURE,
+    NOTIFICATION_TEMPORARY_FAILURE,
+    NOTIFICATION_VALIDATION_FAILED,
+    NOTIFICATION_VIRUS_SCAN_FAILED,
+)
+
+FINAL_STATUS_RANK = 3
+# how far through its life each status puts a notification. A notification's status only ever moves to one with the
+# same or a higher rank, and never away from a final status. Every status is listed, so a new one has to be given a
+# rank rather than being treated as final
+NOTIFICATION_STATUS_RANKS = {
+    NOTIFICATION_PENDING_VIRUS_CHECK: 0,
+    NOTIFICATION_CREATED: 0,
+    NOTIFICATION_SENDING: 1,
+    NOTIFICATION_SENT: 1,
+    NOTIFICATION_PENDING: 2,
+    NOTIFICATION_DELIVERED: FINAL_STATUS_RANK,
+    NOTIFICATION_FAILED: FINAL_STATUS_RANK,
+    NOTIFICATION_TECHNICAL_FAILURE: FINAL_STATUS_RANK,
+    NOTIFICATION_TEMPORARY_FAILURE: FINAL_STATUS_RANK,
+    NOTIFICATION_PERMANENT_FAILURE: FINAL_STATUS_RANK,
+    NOTIFICATION_CANCELLED: FINAL_STATUS_RANK,
+    NOTIFICATION_VALIDATION_FAILED: FINAL_STATUS_RANK,
+    NOTIFICATION_VIRUS_SCAN_FAILED: FINAL_STATUS_RANK,
+    NOTIFICATION_RETURNED_LETTER: FINAL_STATUS_RANK,
+}
+
+
+def status_rank(status):
+    return NOTIFICATION_STATUS_RANKS[status]
+
+
+def can_change_status(current_status, new_status):
+    return status_rank(current_status) < FINAL_STATUS_RANK and status_rank(new_status) >= status_rank(current_status)
+
+
+def _merge(older, newer):
+    merged = {**older, **newer}
+    if 'status' in older and 'status' in newer and not can_change_status(older['status'], newer['status']):
+        merged['status'] = older['status']
+    return merged
+
+
+class NotificationStatusBuffer:
+    """
+    Collects the changes to notifications' status (and sent_by and updated_at) from delivery receipts, and writes them
+    with one UPDATE from a background thread every NOTIFICATION_STATUS_BUFFER_SECONDS, or sooner once
+    NOTIFICATION_STATUS_BUFFER_MAX_SIZE notifications are waiting, rather than committing each one as it happens.
+    Marking a notification as sending is never buffered, as it's what stops the notification being sent twice, and
+    neither is anything else that isn't a receipt for an email or text message (see dao_set_notification_values).
+
+    Changes to the same notification are combined, and a status never goes backwards, either here or when it's
+    written (see dao_update_notifications_from_status_buffer). Changes that haven't been written yet are lost if the
+    process is killed, so it's off unless NOTIFICATION_STATUS_BUFFER_SECONDS is set.
+    """
+    def __init__(self):
+        self.app = None
+        self.pending = {}
+        self.lock = Lock()
+        self.full = Event()
+        self.flusher_pid = None
+
+    @property
+    def active(self):
+        return current_app.config['NOTIFICATION_STATUS_BUFFER_SECONDS'] > 0
+
+    def add(self, notification_id, **values):
+        values = {key: value for key, value in values.items() if value is not None}
+        with self.lock:
+            self._ensure_flusher()
+            self.pending[notification_id] = _merge(self.pending.get(notification_id, {}), values)
+            waiting = len(self.pending)
+
+        if waiting >= current_app.config['NOTIFICATION_STATUS_BUFFER_MAX_SIZE']:
+            self.full.set()
+
+    def apply_pending(self, notification):
+        """
+        Puts the changes to the notification that haven't been written yet onto it, without marking it as changed in
+        the session.
+        """
+        if not self.pending:
+            return
+        with self.lock:
+            values = self.pending.get(notification.id, {})
+
+        for key, value in values.items():
+            # read from __dict__ as this is called part way through loading the notification
+            current_status = notification.__dict__.get('status')
+            if key == 'status' and current_status is not None and not can_change_status(current_status, value):
+                continue
+            set_committed_value(notification, key, value)
+
+    def flush(self):
+        from app.dao.notifications_dao import (
+            dao_update_notifications_from_status_buffer,
+        )
+
+        with self.lock:
+            changes, self.pending = self.pending, {}
+        if not changes:
+            return 0
+
+        try:
+            dao_update_notifications_from_status_buffer(changes)
+        except Exception:
+            current_app.logger.exception(f'Failed to write {len(changes)} buffered notification status changes')
+            with self.lock:
+                for notification_id, values in changes.items():
+                    self.pending[notification_id] = _merge(values, self.pending.get(notification_id, {}))
+            return 0
+        return len(changes)
+
+    def _ensure_flusher(self):
+        # celery forks its worker processes, and threads don't survive a fork, so each process starts its own
+        if self.flusher_pid != os.getpid():
+            self.flusher_pid = os.getpid()
+            self.app = current_app._get_current_object()
+            Thread(target=self._flush_periodically, daemon=True).start()
+
+    def _flush_periodically(self):
+        with self.app.app_context():
+            while True:
+                self.full.wait(self.app.config['NOTIFICATION_STATUS_BUFFER_SECONDS'])
+                self.full.clear()
+                self.flush()
+
+
+notification_status_buffer = NotificationStatusBuffer()
+
+
+@worker_process_shutdown.connect
+def flush_notification_status_buffer(**kwargs):
+    if notification_status_buffer.app is not None:
+        with notification_status_buffer.app.app_context():
+            notification_status_buffer.flush()
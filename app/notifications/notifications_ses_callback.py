@@ -14,6 +14,7 @@ from app.dao.notifications_dao import (
 from app.dao.service_callback_api_dao import (
     get_service_complaint_callback_api_for_service,
     get_service_delivery_status_callback_api_for_service,
+    get_service_delivery_status_callback_apis_for_services,
 )
 from app.models import Complaint
 
@@ -77,6 +78,23 @@ def check_and_queue_callback_task(notification):
                                                     queue=QueueNames.CALLBACKS)
 
 
+def create_delivery_status_callbacks(notifications):
+    """
+    Returns (notification id, callback data) for each of the notifications whose service has a delivery status
+    callback, looking up the services' callbacks with one query.
+    """
+    service_callback_apis = get_service_delivery_status_callback_apis_for_services(
+        {notification.service_id for notification in notifications}
+    )
+    return [
+        (str(notification.id), create_delivery_status_callback_data(
+            notification, service_callback_apis[notification.service_id]
+        ))
+        for notification in notifications
+        if notification.service_id in service_callback_apis
+    ]
+
+
 def _check_and_queue_complaint_callback_task(complaint, notification, recipient):
     # queue callback task only if the service_callback_api exists
     service_callback_api = get_service_complaint_callback_api_for_service(service_id=notification.service_id)
@@ -2,7 +2,6 @@ import uuid
 from datetime import datetime
 
 from flask import current_app
-from gds_metrics import Histogram
 from notifications_utils.clients import redis
 from notifications_utils.recipients import (
     format_email_address,
@@ -21,7 +20,9 @@ from app.celery.letters_pdf_tasks import get_pdf_for_templated_letter
 from app.config import QueueNames
 from app.dao.notifications_dao import (
     dao_create_notification,
+    dao_create_notifications,
     dao_delete_notifications_by_id,
+    dao_delete_notifications_by_ids,
 )
 from app.models import (
     EMAIL_TYPE,
@@ -32,13 +33,9 @@ from app.models import (
     SMS_TYPE,
     Notification,
 )
+from app.utils import chunked
 from app.v2.errors import BadRequestError
 
-REDIS_GET_AND_INCR_DAILY_LIMIT_DURATION_SECONDS = Histogram(
-    'redis_get_and_incr_daily_limit_duration_seconds',
-    'Time taken to get and possibly incremement the daily limit cache key',
-)
-
 
 def create_content_for_notification(template, personalisation):
     if template.template_type == EMAIL_TYPE:
@@ -80,7 +77,7 @@ def check_placeholders(template_object):
         raise BadRequestError(fields=[{'template': message}], message=message)
 
 
-def persist_notification(
+def build_notification(
     *,
     template_id,
     template_version,
@@ -96,7 +93,6 @@ def persist_notification(
     reference=None,
     client_reference=None,
     notification_id=None,
-    simulated=False,
     created_by_id=None,
     status=NOTIFICATION_CREATED,
     reply_to_text=None,
@@ -105,6 +101,10 @@ def persist_notification(
     document_download_count=None,
     updated_at=None
 ):
+    """
+    Build (but do not save) a Notification, populating the recipient-derived fields (normalised_to, international
+    etc) for its notification type.
+    """
     notification_created_at = created_at or datetime.utcnow()
     if not notification_id:
         notification_id = uuid.uuid4()
@@ -145,25 +145,102 @@ def persist_notification(
         notification.international = postage in INTERNATIONAL_POSTAGE_TYPES
         notification.normalised_to = ''.join(notification.to.split()).lower()
 
+    return notification
+
+
+def persist_notification(
+    *,
+    template_id,
+    template_version,
+    recipient,
+    service,
+    personalisation,
+    notification_type,
+    api_key_id,
+    key_type,
+    created_at=None,
+    job_id=None,
+    job_row_number=None,
+    reference=None,
+    client_reference=None,
+    notification_id=None,
+    simulated=False,
+    created_by_id=None,
+    status=NOTIFICATION_CREATED,
+    reply_to_text=None,
+    billable_units=None,
+    postage=None,
+    document_download_count=None,
+    updated_at=None,
+    count_towards_daily_limit=False
+):
+    """
+    Most callers reserve the service's daily count when they check its limits (see check_and_reserve_limits). Sends
+    that skip that check, like the emails and text messages from Notify to its users, pass
+    `count_towards_daily_limit` so they are still counted, without being rejected if the service is over its limit.
+    """
+    notification = build_notification(
+        template_id=template_id,
+        template_version=template_version,
+        recipient=recipient,
+        service=service,
+        personalisation=personalisation,
+        notification_type=notification_type,
+        api_key_id=api_key_id,
+        key_type=key_type,
+        created_at=created_at,
+        job_id=job_id,
+        job_row_number=job_row_number,
+        reference=reference,
+        client_reference=client_reference,
+        notification_id=notification_id,
+        created_by_id=created_by_id,
+        status=status,
+        reply_to_text=reply_to_text,
+        billable_units=billable_units,
+        postage=postage,
+        document_download_count=document_download_count,
+        updated_at=updated_at
+    )
+
     # if simulated create a Notification model to return but do not persist the Notification to the dB
     if not simulated:
         dao_create_notification(notification)
-        if key_type != KEY_TYPE_TEST and current_app.config['REDIS_ENABLED']:
+        if count_towards_daily_limit and key_type != KEY_TYPE_TEST and current_app.config['REDIS_ENABLED']:
             cache_key = redis.daily_limit_cache_key(service.id)
             if redis_store.get(cache_key) is None:
                 # if cache does not exist set the cache to 1 with an expiry of 24 hours,
-                # The cache should be set by the time we create the notification
-                # but in case it is this will make sure the expiry is set to 24 hours,
-                # where if we let the incr method create the cache it will be set a ttl.
+                # where if we let the incr method create the cache it will not be set a ttl.
                 redis_store.set(cache_key, 1, ex=86400)
             else:
                 redis_store.incr(cache_key)
         current_app.logger.info(
-            "{} {} created at {}".format(notification_type, notification_id, notification_created_at)
+            "{} {} created at {}".format(notification_type, notification.id, notification.created_at)
         )
     return notification
 
 
+def persist_notifications(notifications, service):
+    """
+    Save a batch of notifications built by `build_notification` with a single multi-row insert. Notifications that
+    already exist are skipped; returns the notifications that were saved.
+    """
+    if not notifications:
+        return []
+
+    inserted_ids = {str(notification_id) for notification_id in dao_create_notifications(notifications)}
+    saved_notifications = [
+        notification for notification in notifications if str(notification.id) in inserted_ids
+    ]
+
+    current_app.logger.info(
+        "{} {} notifications created for service {}".format(
+            len(saved_notifications), notifications[0].notification_type, service.id
+        )
+    )
+    return saved_notifications
+
+
 def send_notification_to_queue_detached(
     key_type, notification_type, notification_id, research_mode, queue=None
 ):
@@ -195,6 +272,55 @@ def send_notification_to_queue_detached(
                                                          queue))
 
 
+def send_notifications_to_queue_detached(
+    key_type, notification_type, notification_ids, research_mode, queue=None
+):
+    """
+    Queue delivery tasks for a batch of notifications that have already been saved. If publishing fails, the
+    notifications that have not been queued yet are deleted.
+    """
+    if research_mode or key_type == KEY_TYPE_TEST:
+        queue = QueueNames.RESEARCH_MODE
+
+    if notification_type == SMS_TYPE:
+        queue = queue or QueueNames.SEND_SMS
+        batch_size = current_app.config['SMS_DELIVERY_BATCH_SIZE']
+    elif notification_type == EMAIL_TYPE:
+        queue = queue or QueueNames.SEND_EMAIL
+        batch_size = 1
+
+    queued = 0
+    try:
+        for batch in chunked(notification_ids, batch_size):
+            if notification_type == SMS_TYPE:
+                queue_sms_deliveries(batch, queue)
+            else:
+                provider_tasks.deliver_email.apply_async([str(batch[0])], queue=queue)
+            queued += len(batch)
+    except Exception:
+        dao_delete_notifications_by_ids(notification_ids[queued:])
+        raise
+
+    current_app.logger.debug(
+        "{} {} notifications sent to the {} queue for delivery".format(
+            len(notification_ids), notification_type, queue
+        )
+    )
+
+
+def queue_sms_deliveries(notification_ids, queue):
+    """
+    Queue delivery of saved SMS notifications, in deliver_sms_batch tasks of SMS_DELIVERY_BATCH_SIZE notifications,
+    or a deliver_sms task each if that is 1.
+    """
+    batch_size = current_app.config['SMS_DELIVERY_BATCH_SIZE']
+    for batch in chunked([str(notification_id) for notification_id in notification_ids], batch_size):
+        if batch_size > 1:
+            provider_tasks.deliver_sms_batch.apply_async([batch], queue=queue)
+        else:
+            provider_tasks.deliver_sms.apply_async(batch, queue=queue)
+
+
 def send_notification_to_queue(notification, research_mode, queue=None):
     send_notification_to_queue_detached(
         notification.key_type, notification.notification_type, notification.id, research_mode, queue
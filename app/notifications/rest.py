@@ -20,6 +20,7 @@ from app.notifications.process_notifications import (
 from app.notifications.validators import (
     check_if_service_can_send_to_number,
     check_rate_limiting,
+    release_daily_limit,
     service_has_permission,
     validate_template,
 )
@@ -129,6 +130,7 @@ def send_notification(notification_type):
                                    research_mode=authenticated_service.research_mode,
                                    queue=queue_name)
     else:
+        release_daily_limit(authenticated_service, 1)
         current_app.logger.debug("POST simulated notification for id: {}".format(notification_model.id))
     notification_form.update({"template_version": template.version})
 
@@ -1,4 +1,6 @@
-from flask import current_app
+import time
+
+from flask import current_app, g, has_request_context
 from gds_metrics.metrics import Histogram
 from notifications_utils import SMS_CHAR_COUNT_LIMIT
 from notifications_utils.clients.redis import (
@@ -40,46 +42,163 @@ from app.v2.errors import (
     ValidationError,
 )
 
-REDIS_EXCEEDED_RATE_LIMIT_DURATION_SECONDS = Histogram(
-    'redis_exceeded_rate_limit_duration_seconds',
-    'Time taken to check rate limit',
+REDIS_LIMITS_DURATION_SECONDS = Histogram(
+    'redis_limits_duration_seconds',
+    'Time taken to check the rate limit and check and increment the daily limit',
 )
 
+DAILY_LIMIT_CACHE_TTL_SECONDS = 86400
+
+# Checks the throughput window and then checks and increments the daily count in a single round trip. Running it as
+# a script makes the daily check and increment atomic, so concurrent requests can't all pass the check before any of
+# them are counted.
+#
+# Each notification takes a place in the throughput window, so a bulk request for notification_count notifications
+# is only let through if there's room for all of them. A request that's turned away still takes one place, as it
+# always has.
+#
+# Returns {1, 0} if the rate limit is exceeded, {2, count} if the daily limit would be exceeded (in which case nothing
+# is counted) and {0, count} once notification_count has been added to the daily count, where count is the number of
+# notifications sent beforehand.
+LIMITS_SCRIPT = """
+local rate_limit_key, daily_limit_key = KEYS[1], KEYS[2]
+local now, rate_limit, interval = ARGV[1], tonumber(ARGV[2]), tonumber(ARGV[3])
+local daily_limit, notification_count, daily_limit_ttl = tonumber(ARGV[4]), tonumber(ARGV[5]), tonumber(ARGV[6])
+local check_throughput, check_daily_limit = ARGV[7] == '1', ARGV[8] == '1'
+
+if check_throughput then
+    redis.call('ZREMRANGEBYSCORE', rate_limit_key, '-inf', tonumber(now) - interval)
+    local requests = redis.call('ZCARD', rate_limit_key)
+    if requests + notification_count > rate_limit then
+        redis.call('ZADD', rate_limit_key, now, now)
+        redis.call('EXPIRE', rate_limit_key, interval)
+        return {1, 0}
+    end
+    if notification_count == 1 then
+        redis.call('ZADD', rate_limit_key, now, now)
+    else
+        for i = 1, notification_count do
+            redis.call('ZADD', rate_limit_key, now, now .. ':' .. i)
+        end
+    end
+    redis.call('EXPIRE', rate_limit_key, interval)
+end
+
+if not check_daily_limit then
+    return {0, 0}
+end
+
+local sent = tonumber(redis.call('GET', daily_limit_key) or '0')
+if sent + notification_count > daily_limit then
+    return {2, sent}
+end
+redis.call('INCRBY', daily_limit_key, notification_count)
+if redis.call('TTL', daily_limit_key) < 0 then
+    redis.call('EXPIRE', daily_limit_key, daily_limit_ttl)
+end
+return {0, sent}
+"""
+RATE_LIMIT_EXCEEDED = 1
+DAILY_LIMIT_EXCEEDED = 2
+
+_limits_script = None
+
+
+def _run_limits_script(keys, args):
+    global _limits_script
+    if _limits_script is None:
+        _limits_script = redis_store.redis_store.register_script(LIMITS_SCRIPT)
+    return _limits_script(keys=keys, args=args)
+
+
+def check_and_reserve_limits(service, key_type, notification_count=1, check_throughput=True):
+    """
+    Check the service's throughput (per API key type) and daily message limits, and count notification_count
+    notifications towards today's limit, in one call to Redis. Callers then save the notifications without touching
+    the daily count again. Test keys aren't counted towards the daily limit.
+
+    In a request, anything reserved is given back if the response is an error (see release_daily_limit_reservations).
+    Returns the number of notifications the service had sent today before this call.
+    """
+    if not current_app.config['REDIS_ENABLED']:
+        return 0
 
-def check_service_over_api_rate_limit(service, api_key):
-    if current_app.config['API_RATE_LIMIT_ENABLED'] and current_app.config['REDIS_ENABLED']:
-        cache_key = rate_limit_cache_key(service.id, api_key.key_type)
-        rate_limit = service.rate_limit
-        interval = 60
-        with REDIS_EXCEEDED_RATE_LIMIT_DURATION_SECONDS.time():
-            if redis_store.exceeded_rate_limit(cache_key, rate_limit, interval):
-                current_app.logger.info("service {} has been rate limited for throughput".format(service.id))
-                raise RateLimitError(rate_limit, interval, api_key.key_type)
-
-
-def check_service_over_daily_message_limit(key_type, service):
-    if key_type == KEY_TYPE_TEST or not current_app.config['REDIS_ENABLED']:
+    check_throughput = check_throughput and current_app.config['API_RATE_LIMIT_ENABLED']
+    check_daily_limit = key_type != KEY_TYPE_TEST
+    if not check_throughput and not check_daily_limit:
         return 0
 
+    interval = 60
     cache_key = daily_limit_cache_key(service.id)
-    service_stats = redis_store.get(cache_key)
-    if service_stats is None:
-        # first message of the day, set the cache to 0 and the expiry to 24 hours
-        service_stats = 0
-        redis_store.set(cache_key, service_stats, ex=86400)
-        return service_stats
-    if int(service_stats) >= service.message_limit:
+    try:
+        with REDIS_LIMITS_DURATION_SECONDS.time():
+            result, sent = _run_limits_script(
+                keys=[rate_limit_cache_key(service.id, key_type), cache_key],
+                args=[
+                    time.time(),
+                    service.rate_limit,
+                    interval,
+                    service.message_limit,
+                    notification_count,
+                    DAILY_LIMIT_CACHE_TTL_SECONDS,
+                    int(check_throughput),
+                    int(check_daily_limit),
+                ],
+            )
+    except Exception:
+        # as with the rest of our redis calls, don't fail the request if redis is unavailable
+        current_app.logger.exception('Failed to check limits in redis for service {}'.format(service.id))
+        return 0
+
+    if result == RATE_LIMIT_EXCEEDED:
+        current_app.logger.info("service {} has been rate limited for throughput".format(service.id))
+        raise RateLimitError(service.rate_limit, interval, key_type)
+    if result == DAILY_LIMIT_EXCEEDED:
         current_app.logger.info(
             "service {} has been rate limited for daily use sent {} limit {}".format(
-                service.id, int(service_stats), service.message_limit)
+                service.id, sent, service.message_limit)
         )
         raise TooManyRequestsError(service.message_limit)
-    return int(service_stats)
+
+    if check_daily_limit and has_request_context():
+        reservations = g.setdefault('daily_limit_reservations', {})
+        reservations[cache_key] = reservations.get(cache_key, 0) + notification_count
+    return int(sent)
 
 
-def check_rate_limiting(service, api_key):
-    check_service_over_api_rate_limit(service, api_key)
-    check_service_over_daily_message_limit(api_key.key_type, service)
+def release_daily_limit(service, notification_count):
+    """
+    Give back part of a reservation made by check_and_reserve_limits in this request, for notifications that weren't
+    saved (for example because they were to a simulated recipient).
+    """
+    cache_key = daily_limit_cache_key(service.id)
+    reservations = g.get('daily_limit_reservations', {})
+    if notification_count and reservations.get(cache_key):
+        notification_count = min(notification_count, reservations[cache_key])
+        reservations[cache_key] -= notification_count
+        try:
+            redis_store.redis_store.decrby(cache_key, notification_count)
+        except Exception:
+            current_app.logger.exception('Failed to release daily limit reservation for {}'.format(cache_key))
+
+
+def release_daily_limit_reservations(response):
+    """
+    Registered as an after_request hook. If the request failed after the daily limit was checked, the notifications
+    it counted weren't sent, so take them off the daily count again.
+    """
+    if response.status_code >= 400:
+        for cache_key, notification_count in g.pop('daily_limit_reservations', {}).items():
+            if notification_count:
+                try:
+                    redis_store.redis_store.decrby(cache_key, notification_count)
+                except Exception:
+                    current_app.logger.exception('Failed to release daily limit reservation for {}'.format(cache_key))
+    return response
+
+
+def check_rate_limiting(service, api_key, notification_count=1):
+    check_and_reserve_limits(service, api_key.key_type, notification_count=notification_count)
 
 
 def check_template_is_for_notification_type(notification_type, template_type):
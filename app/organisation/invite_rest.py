@@ -63,6 +63,7 @@ def invite_user_to_org(organisation_id):
         notification_type=EMAIL_TYPE,
         api_key_id=None,
         key_type=KEY_TYPE_NORMAL,
+        count_towards_daily_limit=True,
         reply_to_text=invited_org_user.invited_by.email_address
     )
 
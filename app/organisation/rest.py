@@ -203,6 +203,7 @@ def send_notifications_on_mou_signed(organisation_id):
             notification_type=template.template_type,
             api_key_id=None,
             key_type=KEY_TYPE_NORMAL,
+            count_towards_daily_limit=True,
             reply_to_text=notify_service.get_default_reply_to_email_address()
         )
         send_notification_to_queue(saved_notification, research_mode=False, queue=QueueNames.NOTIFY)
@@ -1,8 +1,10 @@
 from datetime import datetime
 
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, current_app, json, request
 
+from app import redis_store
 from app.dao.fact_notification_status_dao import (
+    get_total_notifications_for_all_time,
     get_total_notifications_for_date_range,
 )
 from app.dao.fact_processing_time_dao import (
@@ -33,12 +35,29 @@ def get_performance_dashboard():
 
     start_date = datetime.strptime(request.args.get('start_date', today), '%Y-%m-%d').date()
     end_date = datetime.strptime(request.args.get('end_date', today), '%Y-%m-%d').date()
-    total_for_all_time = get_total_notifications_for_date_range(start_date=None, end_date=None)
+    total_for_all_time = get_total_notifications_for_all_time()
+
+    # the latest day in the totals is part of the key, so the cached response is replaced once last night's figures
+    # are in
+    latest_day = total_for_all_time[0].bst_date if total_for_all_time else None
+    cache_key = f'performance-dashboard-{start_date}-{end_date}-{latest_day}'
+
+    payload = redis_store.get(cache_key)
+    if payload is None:
+        payload = json.dumps(get_performance_dashboard_stats(start_date, end_date, total_for_all_time))
+        redis_store.set(cache_key, payload, ex=current_app.config['PERFORMANCE_DASHBOARD_CACHE_TTL'])
+
+    response = current_app.response_class(payload, mimetype='application/json')
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+def get_performance_dashboard_stats(start_date, end_date, total_for_all_time):
     total_notifications, emails, sms, letters = transform_results_into_totals(total_for_all_time)
     totals_for_date_range = get_total_notifications_for_date_range(start_date=start_date, end_date=end_date)
     processing_time_results = get_processing_time_percentage_for_date_range(start_date=start_date, end_date=end_date)
     services = get_live_services_with_organisation()
-    stats = {
+    return {
         "total_notifications": total_notifications,
         "email_notifications": emails,
         "sms_notifications": sms,
@@ -47,11 +66,8 @@ def get_performance_dashboard():
         "processing_time": transform_processing_time_results_to_json(processing_time_results),
         "live_service_count": len(services),
         "services_using_notify": transform_services_to_json(services)
-
     }
 
-    return jsonify(stats)
-
 
 def transform_results_into_totals(total_notifications_results):
     total_notifications = 0
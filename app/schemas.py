@@ -476,6 +476,8 @@ class JobSchema(BaseSchema):
     class Meta(BaseSchema.Meta):
         model = models.Job
         exclude = (
+            'chunk_count',
+            'completed_chunks',
             'notifications',
             'notifications_delivered',
             'notifications_failed',
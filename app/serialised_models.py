@@ -1,8 +1,3 @@
-from collections import defaultdict
-from functools import partial
-from threading import RLock
-
-import cachetools
 from flask import current_app
 from notifications_utils.clients.redis import RequestCache
 from notifications_utils.serialised_model import (
@@ -13,29 +8,13 @@ from werkzeug.utils import cached_property
 
 from app import db, redis_store
 from app.dao.api_key_dao import get_model_api_keys
+from app.dao.email_branding_dao import dao_get_email_branding_by_id
 from app.dao.services_dao import dao_fetch_service_by_id
+from app.memory_cache import memory_cache
 
-caches = defaultdict(partial(cachetools.TTLCache, maxsize=1024, ttl=2))
-locks = defaultdict(RLock)
 redis_cache = RequestCache(redis_store)
 
 
-def memory_cache(func):
-    @cachetools.cached(
-        cache=caches[func.__qualname__],
-        lock=locks[func.__qualname__],
-        key=ignore_first_argument_cache_key,
-    )
-    def wrapper(*args, **kwargs):
-        return func(*args, **kwargs)
-
-    return wrapper
-
-
-def ignore_first_argument_cache_key(cls, *args, **kwargs):
-    return cachetools.keys.hashkey(*args, **kwargs)
-
-
 class SerialisedTemplate(SerialisedModel):
     ALLOWED_PROPERTIES = {
         'archived',
@@ -112,6 +91,38 @@ class SerialisedService(SerialisedModel):
         return self.id in current_app.config['HIGH_VOLUME_SERVICE']
 
 
+class SerialisedEmailBranding(SerialisedModel):
+    ALLOWED_PROPERTIES = {
+        'id',
+        'brand_type',
+        'colour',
+        'logo',
+        'logo_url',
+        'name',
+        'text',
+    }
+
+    @classmethod
+    @memory_cache(key='email_branding_id')
+    def from_id(cls, email_branding_id):
+        return cls(cls.get_dict(email_branding_id)['data'])
+
+    @staticmethod
+    @redis_cache.set('email_branding-{email_branding_id}')
+    def get_dict(email_branding_id):
+        from app.delivery.send_to_providers import get_logo_url
+
+        email_branding = dao_get_email_branding_by_id(email_branding_id)
+        email_branding_dict = email_branding.serialize()
+        email_branding_dict['logo_url'] = get_logo_url(
+            current_app.config['ADMIN_BASE_URL'],
+            email_branding.logo
+        ) if email_branding.logo else None
+        db.session.commit()
+
+        return {'data': email_branding_dict}
+
+
 class SerialisedAPIKey(SerialisedModel):
     ALLOWED_PROPERTIES = {
         'id',
@@ -785,6 +785,7 @@ def verify_reply_to_email_address(service_id):
         notification_type=template.template_type,
         api_key_id=None,
         key_type=KEY_TYPE_NORMAL,
+        count_towards_daily_limit=True,
         reply_to_text=notify_service.get_default_reply_to_email_address()
     )
 
@@ -35,8 +35,8 @@ from app.notifications.process_notifications import (
     send_notification_to_queue,
 )
 from app.notifications.validators import (
+    check_and_reserve_limits,
     check_service_has_permission,
-    check_service_over_daily_message_limit,
     validate_address,
     validate_and_format_recipient,
     validate_template,
@@ -71,7 +71,7 @@ def send_one_off_notification(service_id, post_data):
 
     validate_template(template.id, personalisation, service, template.template_type)
 
-    check_service_over_daily_message_limit(KEY_TYPE_NORMAL, service)
+    check_and_reserve_limits(service, KEY_TYPE_NORMAL, check_throughput=False)
 
     validate_and_format_recipient(
         send_to=post_data['to'],
@@ -156,7 +156,7 @@ def send_pdf_letter_notification(service_id, post_data):
     check_service_has_permission(LETTER_TYPE, [
         p.permission for p in service.permissions
     ])
-    check_service_over_daily_message_limit(KEY_TYPE_NORMAL, service)
+    check_and_reserve_limits(service, KEY_TYPE_NORMAL, check_throughput=False)
     validate_created_by(service, post_data['created_by'])
     validate_and_format_recipient(
         send_to=post_data['recipient_address'],
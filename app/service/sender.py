@@ -32,6 +32,7 @@ def send_notification_to_service_users(service_id, template_id, personalisation=
             notification_type=template.template_type,
             api_key_id=None,
             key_type=KEY_TYPE_NORMAL,
+            count_towards_daily_limit=True,
             reply_to_text=notify_service.get_default_reply_to_email_address()
         )
         send_notification_to_queue(notification, False, queue=QueueNames.NOTIFY)
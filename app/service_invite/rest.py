@@ -53,6 +53,7 @@ def create_invited_user(service_id):
         notification_type=EMAIL_TYPE,
         api_key_id=None,
         key_type=KEY_TYPE_NORMAL,
+        count_towards_daily_limit=True,
         reply_to_text=invited_user.from_user.email_address
     )
 
@@ -135,6 +135,7 @@ def update_user_attribute(user_id):
             notification_type=template.template_type,
             api_key_id=None,
             key_type=KEY_TYPE_NORMAL,
+            count_towards_daily_limit=True,
             reply_to_text=reply_to
         )
 
@@ -334,6 +335,7 @@ def create_2fa_code(template_id, user_to_send_to, secret_code, recipient, person
         notification_type=template.template_type,
         api_key_id=None,
         key_type=KEY_TYPE_NORMAL,
+        count_towards_daily_limit=True,
         reply_to_text=reply_to
     )
     # Assume that we never want to observe the Notify service's research mode
@@ -365,6 +367,7 @@ def send_user_confirm_new_email(user_id):
         notification_type=template.template_type,
         api_key_id=None,
         key_type=KEY_TYPE_NORMAL,
+        count_towards_daily_limit=True,
         reply_to_text=service.get_default_reply_to_email_address()
     )
 
@@ -397,6 +400,7 @@ def send_new_user_email_verification(user_id):
         notification_type=template.template_type,
         api_key_id=None,
         key_type=KEY_TYPE_NORMAL,
+        count_towards_daily_limit=True,
         reply_to_text=service.get_default_reply_to_email_address()
     )
 
@@ -424,6 +428,7 @@ def send_already_registered_email(user_id):
         notification_type=template.template_type,
         api_key_id=None,
         key_type=KEY_TYPE_NORMAL,
+        count_towards_daily_limit=True,
         reply_to_text=service.get_default_reply_to_email_address()
     )
 
@@ -525,6 +530,7 @@ def send_user_reset_password():
         notification_type=template.template_type,
         api_key_id=None,
         key_type=KEY_TYPE_NORMAL,
+        count_towards_daily_limit=True,
         reply_to_text=service.get_default_reply_to_email_address()
     )
 
@@ -9,7 +9,7 @@ from notifications_utils.template import (
     SMSMessageTemplate,
 )
 from notifications_utils.timezones import convert_bst_to_utc, convert_utc_to_bst
-from sqlalchemy import func
+from sqlalchemy import func, not_
 
 DATETIME_FORMAT_NO_TIMEZONE = "%Y-%m-%d %H:%M:%S.%f"
 DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
@@ -154,6 +154,33 @@ def get_notification_table_to_use(service, notification_type, process_day, has_d
     return Notification if days_ago <= timedelta(days=days_of_retention) else NotificationHistory
 
 
+def notification_table_filter(table, notification_type, process_day, has_delete_task_run):
+    """
+    get_notification_table_to_use for every service at once, for set-based queries. Returns a filter for the rows of
+    `table` (Notification or NotificationHistory) that belong to services whose notifications from process_day are
+    in that table, looking up each service's data retention in the database.
+    """
+    from app import db
+    from app.models import Notification, ServiceDataRetention
+
+    days_ago = (convert_utc_to_bst(datetime.utcnow()).date() - process_day).days
+    days_of_retention = func.coalesce(
+        db.session.query(
+            ServiceDataRetention.days_of_retention
+        ).filter(
+            ServiceDataRetention.service_id == table.service_id,
+            ServiceDataRetention.notification_type == notification_type,
+        ).scalar_subquery(),
+        7
+    )
+
+    if not has_delete_task_run:
+        days_of_retention += 1
+
+    in_notification_table = days_of_retention >= days_ago
+    return in_notification_table if table == Notification else not_(in_notification_table)
+
+
 def get_archived_db_column_value(column):
     date = datetime.utcnow().strftime("%Y-%m-%d")
     return f'_archived_{date}_{column}'
@@ -175,3 +202,18 @@ def get_reference_from_personalisation(personalisation):
     if personalisation:
         return personalisation.get("reference")
     return None
+
+
+def chunked(iterable, chunk_size):
+    """
+    Yield lists of up to chunk_size items from iterable. Unlike slicing, this works for generators, so large
+    result sets or files don't need to be loaded into memory all at once.
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
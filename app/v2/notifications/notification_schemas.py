@@ -273,3 +273,47 @@ post_letter_response = {
     },
     "required": ["id", "content", "uri", "template"]
 }
+
+
+MAX_NOTIFICATIONS_PER_BULK_REQUEST = 3000
+
+
+def _bulk_request(notification_request, title):
+    return {
+        "$schema": "http://json-schema.org/draft-04/schema#",
+        "description": "POST bulk {} notifications schema".format(title),
+        "type": "object",
+        "title": "POST v2/notifications/{}/bulk".format(title),
+        "properties": {
+            "notifications": {
+                "type": "array",
+                "items": {k: v for k, v in notification_request.items() if k != "$schema"},
+                "minItems": 1,
+                "maxItems": MAX_NOTIFICATIONS_PER_BULK_REQUEST,
+            }
+        },
+        "required": ["notifications"],
+        "additionalProperties": False
+    }
+
+
+def _bulk_response(notification_response, title):
+    return {
+        "$schema": "http://json-schema.org/draft-04/schema#",
+        "description": "POST bulk {} notifications response schema".format(title),
+        "type": "object",
+        "title": "response v2/notifications/{}/bulk".format(title),
+        "properties": {
+            "notifications": {
+                "type": "array",
+                "items": {k: v for k, v in notification_response.items() if k != "$schema"},
+            }
+        },
+        "required": ["notifications"]
+    }
+
+
+post_sms_bulk_request = _bulk_request(post_sms_request, "sms")
+post_sms_bulk_response = _bulk_response(post_sms_response, "sms")
+post_email_bulk_request = _bulk_request(post_email_request, "email")
+post_email_bulk_response = _bulk_response(post_email_response, "email")
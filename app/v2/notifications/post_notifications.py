@@ -1,6 +1,7 @@
 import base64
 import functools
 import uuid
+from collections import defaultdict
 from datetime import datetime
 
 import botocore
@@ -20,7 +21,12 @@ from app.celery.letters_pdf_tasks import (
     sanitise_letter,
 )
 from app.celery.research_mode_tasks import create_fake_letter_response_file
-from app.celery.tasks import save_api_email, save_api_sms
+from app.celery.tasks import (
+    save_api_email,
+    save_api_emails,
+    save_api_sms,
+    save_api_smss,
+)
 from app.clients.document_download import DocumentDownloadError
 from app.config import QueueNames, TaskNames
 from app.dao.dao_utils import transaction
@@ -44,8 +50,11 @@ from app.notifications.process_letter_notifications import (
     create_letter_notification,
 )
 from app.notifications.process_notifications import (
+    build_notification,
     persist_notification,
+    persist_notifications,
     send_notification_to_queue_detached,
+    send_notifications_to_queue_detached,
     simulated_recipient,
 )
 from app.notifications.validators import (
@@ -55,12 +64,13 @@ from app.notifications.validators import (
     check_service_email_reply_to_id,
     check_service_has_permission,
     check_service_sms_sender_id,
+    release_daily_limit,
     validate_address,
     validate_and_format_recipient,
     validate_template,
 )
 from app.schema_validation import validate
-from app.utils import DATETIME_FORMAT
+from app.utils import DATETIME_FORMAT, chunked
 from app.v2.errors import BadRequestError
 from app.v2.notifications import v2_notification_blueprint
 from app.v2.notifications.create_response import (
@@ -69,11 +79,14 @@ from app.v2.notifications.create_response import (
     create_post_sms_response_from_notification,
 )
 from app.v2.notifications.notification_schemas import (
+    post_email_bulk_request,
     post_email_request,
     post_letter_request,
     post_precompiled_letter_request,
+    post_sms_bulk_request,
     post_sms_request,
 )
+from app.v2.notifications.save_to_queue_batcher import SaveToQueueBatcher
 from app.v2.utils import get_valid_json
 
 POST_NOTIFICATION_JSON_PARSE_DURATION_SECONDS = Histogram(
@@ -167,6 +180,184 @@ def post_notification(notification_type):
     return jsonify(notification), 201
 
 
+@v2_notification_blueprint.route('/<notification_type>/bulk', methods=['POST'])
+def post_bulk_notifications(notification_type):
+    """
+    Send up to MAX_NOTIFICATIONS_PER_BULK_REQUEST emails or text messages in one request. Every notification is
+    validated before any are saved, so one invalid notification fails the whole request. Valid notifications are
+    saved with a single insert and their delivery tasks are queued together.
+    """
+    with POST_NOTIFICATION_JSON_PARSE_DURATION_SECONDS.time():
+        request_json = get_valid_json()
+
+        if notification_type == EMAIL_TYPE:
+            form = validate(request_json, post_email_bulk_request)
+        elif notification_type == SMS_TYPE:
+            form = validate(request_json, post_sms_bulk_request)
+        else:
+            abort(404)
+
+    check_service_has_permission(notification_type, authenticated_service.permissions)
+
+    check_rate_limiting(authenticated_service, api_user, notification_count=len(form['notifications']))
+
+    notifications = process_bulk_sms_or_email_notifications(
+        forms=form['notifications'],
+        notification_type=notification_type,
+        service=authenticated_service,
+    )
+
+    return jsonify(notifications=notifications), 201
+
+
+def process_bulk_sms_or_email_notifications(*, forms, notification_type, service):
+    responses = []
+    notifications_by_queue = defaultdict(list)
+    notifications_to_save_to_queue = []
+    use_save_queue = service.high_volume and api_user.key_type == KEY_TYPE_NORMAL
+    simulated_count = 0
+
+    # validate every notification before uploading any of their documents, so that an invalid notification later
+    # in the request doesn't leave documents uploaded for notifications that are never sent
+    validated_forms = []
+    for form in forms:
+        template, template_with_content = validate_template(
+            form['template_id'],
+            form.get('personalisation', {}),
+            service,
+            notification_type,
+            check_char_count=False
+        )
+        reply_to_text = get_reply_to_text(notification_type, form, template)
+
+        form_send_to = form['email_address'] if notification_type == EMAIL_TYPE else form['phone_number']
+
+        send_to = validate_and_format_recipient(send_to=form_send_to,
+                                                key_type=api_user.key_type,
+                                                service=service,
+                                                notification_type=notification_type)
+
+        simulated = simulated_recipient(send_to, notification_type)
+
+        # check the length with the test links that simulated notifications get in place of their documents
+        personalisation, document_download_count = process_document_uploads(
+            form.get('personalisation'),
+            service,
+            simulated=True
+        )
+        if document_download_count:
+            template_with_content.values = personalisation
+
+        check_is_message_too_long(template_with_content)
+
+        validated_forms.append((form, template, template_with_content, reply_to_text, form_send_to, simulated))
+
+    for form, template, template_with_content, reply_to_text, form_send_to, simulated in validated_forms:
+        notification_id = uuid.uuid4()
+
+        personalisation, document_download_count = process_document_uploads(
+            form.get('personalisation'),
+            service,
+            simulated=simulated
+        )
+        if document_download_count:
+            template_with_content.values = personalisation
+            check_is_message_too_long(template_with_content)
+
+        responses.append(create_response_for_post_notification(
+            notification_id=notification_id,
+            client_reference=form.get('reference', None),
+            template_id=template.id,
+            template_version=template.version,
+            service_id=service.id,
+            notification_type=notification_type,
+            reply_to=reply_to_text,
+            template_with_content=template_with_content
+        ))
+
+        # Simulated notifications get a response but are not saved, sent or counted towards the daily limit
+        if simulated:
+            simulated_count += 1
+            continue
+
+        if use_save_queue:
+            # As with single notifications, high volume services have their notifications saved to the db by the
+            # save-api-email/sms workers. Batches of them go on the queue together, to be saved with one insert.
+            notifications_to_save_to_queue.append(get_save_to_queue_data(
+                notification_id=str(notification_id),
+                form=form,
+                notification_type=notification_type,
+                api_key=api_user,
+                template=template,
+                service_id=service.id,
+                personalisation=personalisation,
+                document_download_count=document_download_count,
+                reply_to_text=reply_to_text
+            ))
+            continue
+
+        queue_name = QueueNames.PRIORITY if template.process_type == PRIORITY else None
+        notifications_by_queue[queue_name].append(build_notification(
+            notification_id=notification_id,
+            template_id=template.id,
+            template_version=template.version,
+            recipient=form_send_to,
+            service=service,
+            personalisation=personalisation,
+            notification_type=notification_type,
+            api_key_id=api_user.id,
+            key_type=api_user.key_type,
+            client_reference=form.get('reference', None),
+            reply_to_text=reply_to_text,
+            document_download_count=document_download_count
+        ))
+
+    for notifications_data in chunked(notifications_to_save_to_queue, current_app.config['SAVE_API_BATCH_SIZE']):
+        try:
+            save_emails_or_smss_to_queue(notification_type=notification_type, notifications_data=notifications_data)
+        except (botocore.exceptions.ClientError, botocore.parsers.ResponseParserError):
+            # probably over SQS's 256kb message limit - save this batch in the normal flow instead
+            current_app.logger.info(
+                f'{len(notifications_data)} notifications failed to save to high volume queue. '
+                'Using normal flow instead'
+            )
+            notifications_by_queue[None].extend(
+                build_notification(
+                    notification_id=data['id'],
+                    template_id=data['template_id'],
+                    template_version=data['template_version'],
+                    recipient=data['to'],
+                    service=service,
+                    personalisation=data['personalisation'],
+                    notification_type=notification_type,
+                    api_key_id=api_user.id,
+                    key_type=api_user.key_type,
+                    client_reference=data['client_reference'],
+                    reply_to_text=data['reply_to_text'],
+                    document_download_count=data['document_download_count']
+                )
+                for data in notifications_data
+            )
+
+    release_daily_limit(service, simulated_count)
+
+    persist_notifications(
+        [notification for notifications in notifications_by_queue.values() for notification in notifications],
+        service=service,
+    )
+
+    for queue_name, notifications in notifications_by_queue.items():
+        send_notifications_to_queue_detached(
+            key_type=api_user.key_type,
+            notification_type=notification_type,
+            notification_ids=[notification.id for notification in notifications],
+            research_mode=service.research_mode,  # research_mode is deprecated
+            queue=queue_name
+        )
+
+    return responses
+
+
 def process_sms_or_email_notification(
     *,
     form,
@@ -266,6 +457,7 @@ def process_sms_or_email_notification(
             queue=queue_name
         )
     else:
+        release_daily_limit(service, 1)
         current_app.logger.debug("POST simulated notification for id: {}".format(notification_id))
 
     return resp
@@ -283,7 +475,58 @@ def save_email_or_sms_to_queue(
     document_download_count,
     reply_to_text=None
 ):
-    data = {
+    data = get_save_to_queue_data(
+        notification_id=notification_id,
+        form=form,
+        notification_type=notification_type,
+        api_key=api_key,
+        template=template,
+        service_id=service_id,
+        personalisation=personalisation,
+        document_download_count=document_download_count,
+        reply_to_text=reply_to_text,
+    )
+    if current_app.config['SAVE_API_BATCH_WAIT_MS'] > 0:
+        save_to_queue_batcher.save(notification_type, data)
+        return Notification(**data)
+
+    encrypted = encryption.encrypt(
+        data
+    )
+
+    if notification_type == EMAIL_TYPE:
+        save_api_email.apply_async([encrypted], queue=QueueNames.SAVE_API_EMAIL)
+    elif notification_type == SMS_TYPE:
+        save_api_sms.apply_async([encrypted], queue=QueueNames.SAVE_API_SMS)
+
+    return Notification(**data)
+
+
+def save_emails_or_smss_to_queue(*, notification_type, notifications_data):
+    encrypted = [encryption.encrypt(data) for data in notifications_data]
+
+    if notification_type == EMAIL_TYPE:
+        save_api_emails.apply_async([encrypted], queue=QueueNames.SAVE_API_EMAIL)
+    elif notification_type == SMS_TYPE:
+        save_api_smss.apply_async([encrypted], queue=QueueNames.SAVE_API_SMS)
+
+
+save_to_queue_batcher = SaveToQueueBatcher(save_emails_or_smss_to_queue)
+
+
+def get_save_to_queue_data(
+    *,
+    notification_id,
+    form,
+    notification_type,
+    api_key,
+    template,
+    service_id,
+    personalisation,
+    document_download_count,
+    reply_to_text=None
+):
+    return {
         "id": notification_id,
         "template_id": str(template.id),
         "template_version": template.version,
@@ -299,16 +542,6 @@ def save_email_or_sms_to_queue(
         "status": NOTIFICATION_CREATED,
         "created_at": datetime.utcnow().strftime(DATETIME_FORMAT),
     }
-    encrypted = encryption.encrypt(
-        data
-    )
-
-    if notification_type == EMAIL_TYPE:
-        save_api_email.apply_async([encrypted], queue=QueueNames.SAVE_API_EMAIL)
-    elif notification_type == SMS_TYPE:
-        save_api_sms.apply_async([encrypted], queue=QueueNames.SAVE_API_SMS)
-
-    return Notification(**data)
 
 
 def process_document_uploads(personalisation_data, service, simulated=False):
@@ -0,0 +1,59 @@
+from threading import Event, Lock
+
+from flask import current_app
+
+
+class _Batch:
+    def __init__(self):
+        self.notifications_data = []
+        self.full = Event()
+        self.published = Event()
+        self.exception = None
+
+
+class SaveToQueueBatcher:
+    """
+    Groups the notifications that concurrent API requests from high volume services put on the save queues, so that
+    they go on the queue as one save-api-emails/smss task instead of a save-api-email/sms task each.
+
+    The first request to add a notification to a batch waits up to SAVE_API_BATCH_WAIT_MS (or until the batch has
+    SAVE_API_BATCH_SIZE notifications) and then publishes the batch. Every request in the batch waits until it has
+    been published, and gets the exception if publishing failed, so no request returns before its notification is on
+    the queue.
+
+    Batches are only shared between the threads of one process, so this needs threaded workers. It's only used when
+    SAVE_API_BATCH_WAIT_MS is set.
+    """
+    def __init__(self, publish):
+        self.publish = publish
+        self.lock = Lock()
+        self.open_batches = {}
+
+    def save(self, notification_type, notification_data):
+        config = current_app.config
+        with self.lock:
+            batch = self.open_batches.get(notification_type)
+            publisher = batch is None
+            if publisher:
+                batch = self.open_batches[notification_type] = _Batch()
+            batch.notifications_data.append(notification_data)
+            if len(batch.notifications_data) >= config['SAVE_API_BATCH_SIZE']:
+                del self.open_batches[notification_type]
+                batch.full.set()
+
+        if publisher:
+            batch.full.wait(config['SAVE_API_BATCH_WAIT_MS'] / 1000)
+            with self.lock:
+                if self.open_batches.get(notification_type) is batch:
+                    del self.open_batches[notification_type]
+            try:
+                self.publish(notification_type=notification_type, notifications_data=batch.notifications_data)
+            except Exception as e:
+                batch.exception = e
+            finally:
+                batch.published.set()
+        else:
+            batch.published.wait()
+
+        if batch.exception:
+            raise batch.exception
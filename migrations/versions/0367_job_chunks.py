@@ -0,0 +1,23 @@
+"""
+
+Revision ID: 0367_job_chunks
+Revises: 0366_letter_rates_2022
+Create Date: 2022-03-01 10:12:43.118264
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = '0367_job_chunks'
+down_revision = '0366_letter_rates_2022'
+
+
+def upgrade():
+    op.add_column('jobs', sa.Column('chunk_count', sa.Integer(), nullable=True))
+    op.add_column('jobs', sa.Column('completed_chunks', postgresql.JSONB(astext_type=sa.Text()), nullable=True))
+
+
+def downgrade():
+    op.drop_column('jobs', 'completed_chunks')
+    op.drop_column('jobs', 'chunk_count')
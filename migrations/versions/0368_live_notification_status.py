@@ -0,0 +1,114 @@
+"""
+
+Revision ID: 0368_live_notification_status
+Revises: 0367_job_chunks
+Create Date: 2022-03-07 11:02:31.481262
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = '0368_live_notification_status'
+down_revision = '0367_job_chunks'
+
+# The triggers are statement level, so a statement that inserts or updates many notifications makes one upsert per
+# combination of columns rather than one per notification. Rows are upserted in a consistent order so that
+# concurrent statements don't deadlock.
+#
+# Only recent deletes are counted: older notifications are only deleted when they're moved to
+# notification_history, and nothing reads the live counts for days that long ago.
+COUNT_CHANGES = """
+    INSERT INTO live_notification_status AS live (
+        bst_date, service_id, notification_type, key_type, template_id, job_id, notification_status,
+        notification_count, updated_at
+    )
+    SELECT
+        timezone('Europe/London', timezone('UTC', created_at))::date,
+        service_id,
+        notification_type::text,
+        key_type,
+        template_id,
+        coalesce(job_id, '00000000-0000-0000-0000-000000000000'),
+        coalesce(notification_status, 'created'),
+        sum(change),
+        timezone('UTC', now())
+    FROM ({changes}) AS changes
+    GROUP BY 1, 2, 3, 4, 5, 6, 7
+    HAVING sum(change) != 0
+    ORDER BY 1, 2, 3, 4, 5, 6, 7
+    ON CONFLICT ON CONSTRAINT live_notification_status_pkey DO UPDATE SET
+        notification_count = live.notification_count + excluded.notification_count,
+        updated_at = excluded.updated_at
+"""
+COUNT_CHANGES_FUNCTION = """
+CREATE OR REPLACE FUNCTION {name}() RETURNS trigger AS $$
+BEGIN
+    {count_changes};
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+COLUMNS = 'created_at, service_id, notification_type, key_type, template_id, job_id, notification_status'
+TRIGGERS = {
+    'INSERT': (
+        'REFERENCING NEW TABLE AS new_rows',
+        f'SELECT {COLUMNS}, 1 AS change FROM new_rows',
+    ),
+    'UPDATE': (
+        'REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows',
+        f"""
+        SELECT {', '.join('old_rows.' + column for column in COLUMNS.split(', '))}, -1 AS change
+        FROM old_rows JOIN new_rows USING (id)
+        WHERE old_rows.notification_status IS DISTINCT FROM new_rows.notification_status
+        UNION ALL
+        SELECT {', '.join('new_rows.' + column for column in COLUMNS.split(', '))}, 1 AS change
+        FROM old_rows JOIN new_rows USING (id)
+        WHERE old_rows.notification_status IS DISTINCT FROM new_rows.notification_status
+        """,
+    ),
+    'DELETE': (
+        'REFERENCING OLD TABLE AS old_rows',
+        f"SELECT {COLUMNS}, -1 AS change FROM old_rows WHERE created_at >= timezone('UTC', now()) - interval '2 days'",
+    ),
+}
+
+
+def upgrade():
+    op.create_table(
+        'live_notification_status',
+        sa.Column('bst_date', sa.Date(), nullable=False),
+        sa.Column('service_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('notification_type', sa.Text(), nullable=False),
+        sa.Column('key_type', sa.Text(), nullable=False),
+        sa.Column('template_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('job_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('notification_status', sa.Text(), nullable=False),
+        sa.Column('notification_count', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint(
+            'bst_date', 'service_id', 'notification_type', 'key_type', 'template_id', 'job_id', 'notification_status'
+        )
+    )
+
+    for event, (referencing, changes) in TRIGGERS.items():
+        name = f'count_notification_status_on_{event.lower()}'
+        op.execute(COUNT_CHANGES_FUNCTION.format(name=name, count_changes=COUNT_CHANGES.format(changes=changes)))
+        op.execute(f"""
+            CREATE TRIGGER {name} AFTER {event} ON notifications {referencing}
+            FOR EACH STATEMENT EXECUTE PROCEDURE {name}()
+        """)
+
+    # start off with the counts for the last couple of days
+    op.execute(COUNT_CHANGES.format(changes=f"""
+        SELECT {COLUMNS}, 1 AS change FROM notifications
+        WHERE created_at >= timezone('UTC', now()) - interval '2 days'
+    """))
+
+
+def downgrade():
+    for event in TRIGGERS:
+        name = f'count_notification_status_on_{event.lower()}'
+        op.execute(f'DROP TRIGGER {name} ON notifications')
+        op.execute(f'DROP FUNCTION {name}()')
+    op.drop_table('live_notification_status')
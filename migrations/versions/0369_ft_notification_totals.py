@@ -0,0 +1,56 @@
+"""
+
+Revision ID: 0369_ft_notification_totals
+Revises: 0368_live_notification_status
+Create Date: 2022-03-10 09:41:12.602838
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0369_ft_notification_totals'
+down_revision = '0368_live_notification_status'
+
+
+def upgrade():
+    op.create_table(
+        'ft_notification_status_totals',
+        sa.Column('bst_date', sa.Date(), nullable=False),
+        sa.Column('emails', sa.BigInteger(), nullable=False),
+        sa.Column('sms', sa.BigInteger(), nullable=False),
+        sa.Column('letters', sa.BigInteger(), nullable=False),
+        sa.Column('total_emails', sa.BigInteger(), nullable=False),
+        sa.Column('total_sms', sa.BigInteger(), nullable=False),
+        sa.Column('total_letters', sa.BigInteger(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('bst_date')
+    )
+
+    op.execute("""
+        INSERT INTO ft_notification_status_totals (
+            bst_date, emails, sms, letters, total_emails, total_sms, total_letters, created_at
+        )
+        SELECT
+            bst_date,
+            emails,
+            sms,
+            letters,
+            sum(emails) OVER (ORDER BY bst_date),
+            sum(sms) OVER (ORDER BY bst_date),
+            sum(letters) OVER (ORDER BY bst_date),
+            timezone('UTC', now())
+        FROM (
+            SELECT
+                bst_date,
+                sum(CASE WHEN notification_type = 'email' THEN notification_count ELSE 0 END) AS emails,
+                sum(CASE WHEN notification_type = 'sms' THEN notification_count ELSE 0 END) AS sms,
+                sum(CASE WHEN notification_type = 'letter' THEN notification_count ELSE 0 END) AS letters
+            FROM ft_notification_status
+            WHERE key_type != 'test'
+            GROUP BY bst_date
+        ) AS daily
+    """)
+
+
+def downgrade():
+    op.drop_table('ft_notification_status_totals')
@@ -0,0 +1,34 @@
+"""
+
+Revision ID: 0370_notification_archival
+Revises: 0369_ft_notification_totals
+Create Date: 2022-03-16 14:27:48.091622
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = '0370_notification_archival'
+down_revision = '0369_ft_notification_totals'
+
+
+def upgrade():
+    op.create_table(
+        'notification_archival',
+        sa.Column('service_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('notification_type', sa.Text(), nullable=False),
+        sa.Column('delete_before', sa.DateTime(), nullable=False),
+        sa.Column('estimated_rows', sa.BigInteger(), nullable=False),
+        sa.Column('archived_rows', sa.BigInteger(), nullable=False),
+        sa.Column('status', sa.Text(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['service_id'], ['services.id'], ),
+        sa.PrimaryKeyConstraint('service_id', 'notification_type')
+    )
+    op.create_index('ix_notification_archival_status', 'notification_archival', ['status'])
+
+
+def downgrade():
+    op.drop_index('ix_notification_archival_status', table_name='notification_archival')
+    op.drop_table('notification_archival')
@@ -0,0 +1,66 @@
+"""
+
+Revision ID: 0371_notification_activity
+Revises: 0370_notification_archival
+Create Date: 2022-03-18 09:41:12.603714
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = '0371_notification_activity'
+down_revision = '0370_notification_archival'
+
+# Like the live_notification_status triggers (see 0368_live_notification_status) this is statement level, so a
+# statement that inserts many notifications makes one insert per service and day. Existing rows are left alone, so
+# after the first notification of the day nothing is locked or written.
+RECORD_ACTIVITY = """
+    INSERT INTO notification_activity (service_id, notification_type, bst_date)
+    SELECT DISTINCT
+        service_id,
+        notification_type::text,
+        timezone('Europe/London', timezone('UTC', created_at))::date
+    FROM {source}
+    ORDER BY 1, 2, 3
+    ON CONFLICT DO NOTHING
+"""
+
+
+def upgrade():
+    op.create_table(
+        'notification_activity',
+        sa.Column('service_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('notification_type', sa.Text(), nullable=False),
+        sa.Column('bst_date', sa.Date(), nullable=False),
+        sa.ForeignKeyConstraint(['service_id'], ['services.id'], ),
+        sa.PrimaryKeyConstraint('service_id', 'notification_type', 'bst_date')
+    )
+    op.create_index(
+        'ix_notification_activity_notification_type_bst_date',
+        'notification_activity',
+        ['notification_type', 'bst_date']
+    )
+
+    op.execute(f"""
+        CREATE OR REPLACE FUNCTION record_notification_activity() RETURNS trigger AS $$
+        BEGIN
+            {RECORD_ACTIVITY.format(source='new_rows')};
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER record_notification_activity AFTER INSERT ON notifications REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE PROCEDURE record_notification_activity()
+    """)
+
+    # the one time the whole table has to be scanned
+    op.execute(RECORD_ACTIVITY.format(source='notifications'))
+
+
+def downgrade():
+    op.execute('DROP TRIGGER record_notification_activity ON notifications')
+    op.execute('DROP FUNCTION record_notification_activity()')
+    op.drop_index('ix_notification_activity_notification_type_bst_date', table_name='notification_activity')
+    op.drop_table('notification_activity')
@@ -0,0 +1,109 @@
+"""
+
+Revision ID: 0372_shard_live_status
+Revises: 0371_notification_activity
+Create Date: 2022-03-21 14:26:48.190321
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0372_shard_live_status'
+down_revision = '0371_notification_activity'
+
+# With one live_notification_status row per day, service, template and status, every transaction that saves or
+# updates a busy service's notifications waits for the row lock on the same counter row until the transaction
+# before it commits. Each count is now spread over a number of shards: a connection always writes to the shard picked
+# by its backend's pid, so concurrent transactions mostly update different rows, and reads sum the shards.
+SHARDS = 16
+KEY_COLUMNS = [
+    'bst_date', 'service_id', 'notification_type', 'key_type', 'template_id', 'job_id', 'notification_status'
+]
+COUNT_CHANGES = """
+    INSERT INTO live_notification_status AS live (
+        bst_date, service_id, notification_type, key_type, template_id, job_id, notification_status, {shard_column}
+        notification_count, updated_at
+    )
+    SELECT
+        timezone('Europe/London', timezone('UTC', created_at))::date,
+        service_id,
+        notification_type::text,
+        key_type,
+        template_id,
+        coalesce(job_id, '00000000-0000-0000-0000-000000000000'),
+        coalesce(notification_status, 'created'),
+        {shard_value}
+        sum(change),
+        timezone('UTC', now())
+    FROM ({changes}) AS changes
+    GROUP BY 1, 2, 3, 4, 5, 6, 7
+    HAVING sum(change) != 0
+    ORDER BY 1, 2, 3, 4, 5, 6, 7
+    ON CONFLICT ON CONSTRAINT live_notification_status_pkey DO UPDATE SET
+        notification_count = live.notification_count + excluded.notification_count,
+        updated_at = excluded.updated_at
+"""
+COUNT_CHANGES_FUNCTION = """
+CREATE OR REPLACE FUNCTION {name}() RETURNS trigger AS $$
+BEGIN
+    {count_changes};
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+COLUMNS = 'created_at, service_id, notification_type, key_type, template_id, job_id, notification_status'
+TRIGGER_CHANGES = {
+    'insert': f'SELECT {COLUMNS}, 1 AS change FROM new_rows',
+    'update': f"""
+        SELECT {', '.join('old_rows.' + column for column in COLUMNS.split(', '))}, -1 AS change
+        FROM old_rows JOIN new_rows USING (id)
+        WHERE old_rows.notification_status IS DISTINCT FROM new_rows.notification_status
+        UNION ALL
+        SELECT {', '.join('new_rows.' + column for column in COLUMNS.split(', '))}, 1 AS change
+        FROM old_rows JOIN new_rows USING (id)
+        WHERE old_rows.notification_status IS DISTINCT FROM new_rows.notification_status
+    """,
+    'delete': (
+        f"SELECT {COLUMNS}, -1 AS change FROM old_rows WHERE created_at >= timezone('UTC', now()) - interval '2 days'"
+    ),
+}
+
+
+def _replace_trigger_functions(shard_column, shard_value):
+    for event, changes in TRIGGER_CHANGES.items():
+        count_changes = COUNT_CHANGES.format(shard_column=shard_column, shard_value=shard_value, changes=changes)
+        op.execute(COUNT_CHANGES_FUNCTION.format(
+            name=f'count_notification_status_on_{event}', count_changes=count_changes
+        ))
+
+
+def upgrade():
+    op.add_column(
+        'live_notification_status',
+        sa.Column('shard', sa.SmallInteger(), nullable=False, server_default='0'),
+    )
+    op.drop_constraint('live_notification_status_pkey', 'live_notification_status', type_='primary')
+    op.create_primary_key('live_notification_status_pkey', 'live_notification_status', KEY_COLUMNS + ['shard'])
+
+    _replace_trigger_functions(shard_column='shard,', shard_value=f'pg_backend_pid() % {SHARDS},')
+
+
+def downgrade():
+    _replace_trigger_functions(shard_column='', shard_value='')
+
+    # fold every count back into shard 0 before the shards are dropped
+    op.execute(f"""
+        INSERT INTO live_notification_status AS live ({', '.join(KEY_COLUMNS)}, shard, notification_count, updated_at)
+        SELECT {', '.join(KEY_COLUMNS)}, 0, sum(notification_count), max(updated_at)
+        FROM live_notification_status
+        WHERE shard != 0
+        GROUP BY {', '.join(KEY_COLUMNS)}
+        ON CONFLICT ON CONSTRAINT live_notification_status_pkey DO UPDATE SET
+            notification_count = live.notification_count + excluded.notification_count,
+            updated_at = greatest(live.updated_at, excluded.updated_at)
+    """)
+    op.execute('DELETE FROM live_notification_status WHERE shard != 0')
+
+    op.drop_constraint('live_notification_status_pkey', 'live_notification_status', type_='primary')
+    op.create_primary_key('live_notification_status_pkey', 'live_notification_status', KEY_COLUMNS)
+    op.drop_column('live_notification_status', 'shard')
@@ -0,0 +1,79 @@
+"""
+Compare how many emails a second the delivery workers can render with and without the email render cache.
+
+    python scripts/benchmark_email_rendering.py [number of emails]
+
+This times the rendering part of deliver_email (the subject, plain text body and HTML body that are sent to the
+provider) for a typical template with branding, a different recipient's personalisation for each email.
+"""
+import sys
+import time
+import uuid
+from os.path import abspath, dirname
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from app.delivery.email_render_cache import (  # noqa: E402
+    _render,
+    email_render_cache,
+    render_email,
+)
+
+TEMPLATE = {
+    'id': str(uuid.uuid4()),
+    'version': 1,
+    'template_type': 'email',
+    'subject': 'Your application reference ((reference))',
+    'content': '\n'.join([
+        'Dear ((first name)) ((last name)),',
+        '',
+        '# Your application has been received',
+        '',
+        'We have received your application. Your reference number is ((reference)).',
+        '',
+        'What happens next:',
+        '',
+        '* we will check your documents',
+        '* we will contact you within 10 working days',
+        '* you will get a decision by post',
+        '',
+        '^ Do not reply to this email.',
+        '',
+        '---',
+        '',
+        'You can [check the progress of your application](https://www.gov.uk/check-application) online.',
+        '',
+        'The Application Team',
+    ] * 3),
+}
+
+HTML_OPTIONS = {
+    'govuk_banner': False,
+    'brand_banner': True,
+    'brand_colour': '#005ea5',
+    'brand_logo': 'https://static-logos.notify.tools/logo.png',
+    'brand_text': 'Department of Applications',
+    'brand_name': 'Department of Applications',
+}
+
+
+def personalisation(i):
+    return {'first name': f'Firstname{i}', 'last name': 'Lastname', 'reference': f'ABC{i:08d}'}
+
+
+def main(count):
+    email_render_cache.clear()
+    assert render_email(TEMPLATE, personalisation(0), HTML_OPTIONS) == _render(
+        TEMPLATE, personalisation(0), HTML_OPTIONS
+    ), 'cached rendering is different to the full rendering'
+
+    for name, render in [('without cache', _render), ('with cache', render_email)]:
+        start = time.perf_counter()
+        for i in range(count):
+            render(TEMPLATE, personalisation(i), HTML_OPTIONS)
+        seconds = time.perf_counter() - start
+        print(f'{name:>14}: {count / seconds:10.1f} emails/second ({seconds * 1000 / count:.3f} ms each)')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
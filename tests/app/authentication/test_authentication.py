@@ -1,10 +1,15 @@
 import time
 import uuid
+from unittest.mock import Mock
 
 import jwt
 import pytest
 from flask import current_app, g, request
-from notifications_python_client.authentication import create_jwt_token
+from freezegun import freeze_time
+from notifications_python_client.authentication import (
+    create_jwt_token,
+    decode_jwt_token,
+)
 
 from app import db
 from app.authentication.auth import (
@@ -249,6 +254,80 @@ def test_decode_jwt_token_returns_error_with_no_secrets(client):
     assert exc.value.short_message == "Invalid token: API key not found"
 
 
+def _api_keys(number_of_keys):
+    return [Mock(id=uuid.uuid4(), secret=str(uuid.uuid4()), expiry_date=None) for _ in range(number_of_keys)]
+
+
+def _token_for(api_key, service_id, seconds_ago=0):
+    return create_custom_jwt_token(
+        payload={'iss': service_id, 'iat': int(time.time()) - seconds_ago},
+        secret=api_key.secret,
+    )
+
+
+@pytest.mark.parametrize('number_of_keys', [1, 10, 50])
+def test_decode_jwt_token_number_of_signature_checks(notify_api, mocker, number_of_keys):
+    mock_decode = mocker.patch('app.authentication.auth.decode_jwt_token', wraps=decode_jwt_token)
+    service_id = str(uuid.uuid4())
+    api_keys = _api_keys(number_of_keys)
+    first_token = _token_for(api_keys[-1], service_id, seconds_ago=2)
+
+    # a new service's first token is checked against each secret in turn
+    assert _decode_jwt_token(first_token, api_keys, service_id) == api_keys[-1]
+    assert mock_decode.call_count == number_of_keys
+
+    # reusing the same token doesn't need checking again
+    assert _decode_jwt_token(first_token, api_keys, service_id) == api_keys[-1]
+    assert mock_decode.call_count == number_of_keys
+
+    # a new token is checked against the key that the service used last time first
+    assert _decode_jwt_token(_token_for(api_keys[-1], service_id), api_keys, service_id) == api_keys[-1]
+    assert mock_decode.call_count == number_of_keys + 1
+
+
+def test_decode_jwt_token_checks_cached_token_again_once_iat_is_too_old(notify_api, mocker):
+    mock_decode = mocker.patch('app.authentication.auth.decode_jwt_token', wraps=decode_jwt_token)
+    api_keys = _api_keys(1)
+
+    with freeze_time('2022-03-01 12:00:00') as frozen_time:
+        token = _token_for(api_keys[0], 'some-service')
+        _decode_jwt_token(token, api_keys, 'some-service')
+
+        frozen_time.tick(30)
+        _decode_jwt_token(token, api_keys, 'some-service')
+        assert mock_decode.call_count == 1
+
+        frozen_time.tick(1)
+        with pytest.raises(AuthError) as exc:
+            _decode_jwt_token(token, api_keys, 'some-service')
+
+    assert mock_decode.call_count == 2
+    assert exc.value.short_message == "Error: Your system clock must be accurate to within 30 seconds"
+
+
+def test_decode_jwt_token_rejects_cached_token_once_api_key_is_revoked(notify_api):
+    api_keys = _api_keys(1)
+    token = _token_for(api_keys[0], 'some-service')
+    _decode_jwt_token(token, api_keys, 'some-service')
+
+    api_keys[0].expiry_date = '2022-03-01T12:00:00.000000Z'
+
+    with pytest.raises(AuthError) as exc:
+        _decode_jwt_token(token, api_keys, 'some-service')
+    assert exc.value.short_message == 'Invalid token: API key revoked'
+    assert exc.value.api_key_id == api_keys[0].id
+
+
+def test_decode_jwt_token_checks_cached_token_again_if_api_key_has_been_removed(notify_api):
+    api_keys = _api_keys(2)
+    token = _token_for(api_keys[0], 'some-service')
+    _decode_jwt_token(token, api_keys, 'some-service')
+
+    with pytest.raises(AuthError) as exc:
+        _decode_jwt_token(token, api_keys[1:], 'some-service')
+    assert exc.value.short_message == 'Invalid token: API key not found'
+
+
 @pytest.mark.parametrize('service_id', ['not-a-valid-id', 1234])
 def test_requires_auth_should_not_allow_service_id_with_the_wrong_data_type(
     client,
@@ -1,11 +1,25 @@
 from datetime import datetime, timedelta
+from io import BytesIO
+from threading import Thread
+from unittest.mock import Mock
 
 import pytest
 import pytz
+from botocore.exceptions import ClientError
 from freezegun import freeze_time
 
-from app.aws.s3 import get_list_of_files_by_suffix, get_s3_file
+from app.aws import s3
+from app.aws.s3 import (
+    get_job_and_metadata_from_s3,
+    get_list_of_files_by_suffix,
+    get_s3_client,
+    get_s3_file,
+    get_s3_resource,
+    remove_jobs_from_s3,
+    remove_s3_objects,
+)
 from tests.app.conftest import datetime_in_past
+from tests.conftest import set_config
 
 
 def single_s3_object_stub(key='foo', last_modified=None):
@@ -17,8 +31,9 @@ def single_s3_object_stub(key='foo', last_modified=None):
 
 
 def test_get_s3_file_makes_correct_call(notify_api, mocker):
-    get_s3_mock = mocker.patch('app.aws.s3.get_s3_object')
-    get_s3_file('foo-bucket', 'bar-file.txt')
+    get_s3_mock = mocker.patch('app.aws.s3.get_s3_object_body_and_metadata', return_value=(b'foo', {}))
+
+    assert get_s3_file('foo-bucket', 'bar-file.txt') == 'foo'
 
     get_s3_mock.assert_called_with(
         'foo-bucket',
@@ -26,6 +41,72 @@ def test_get_s3_file_makes_correct_call(notify_api, mocker):
     )
 
 
+def test_get_job_and_metadata_from_s3_only_downloads_file_once(notify_api, mocker):
+    mock_client = mocker.patch('app.aws.s3.get_s3_client').return_value
+    mock_client.get_object.return_value = {'Body': BytesIO(b'phone number'), 'Metadata': {'sender_id': 'abc'}}
+
+    assert get_job_and_metadata_from_s3('service-id', 'job-id') == ('phone number', {'sender_id': 'abc'})
+
+    mock_client.get_object.assert_called_once_with(
+        Bucket=notify_api.config['CSV_UPLOAD_BUCKET_NAME'], Key='service-service-id-notify/job-id.csv'
+    )
+
+
+def test_get_s3_client_is_shared_between_threads(notify_api, mocker):
+    mock_client = mocker.patch('app.aws.s3.client')
+
+    clients = []
+    threads = [Thread(target=lambda: _in_app_context(notify_api, lambda: clients.append(get_s3_client())))
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert clients == [mock_client.return_value] * 5
+    mock_client.assert_called_once()
+    assert mock_client.call_args[0] == ('s3',)
+    assert mock_client.call_args[1]['region_name'] == 'eu-west-1'
+    assert mock_client.call_args[1]['config'].max_pool_connections == notify_api.config['S3_MAX_POOL_CONNECTIONS']
+
+
+def test_get_s3_client_creates_new_client_after_fork(notify_api, mocker):
+    mock_client = mocker.patch('app.aws.s3.client', side_effect=[Mock(), Mock()])
+    mock_getpid = mocker.patch('app.aws.s3.os.getpid', return_value=1)
+
+    first_client = get_s3_client()
+    assert get_s3_client() is first_client
+
+    mock_getpid.return_value = 2
+    assert get_s3_client() is not first_client
+    assert mock_client.call_count == 2
+
+
+def test_get_s3_resource_is_reused_within_a_thread(notify_api, mocker):
+    mock_resource = mocker.patch('app.aws.s3.resource', side_effect=lambda *args, **kwargs: Mock())
+
+    resource = get_s3_resource()
+    assert get_s3_resource() is resource
+
+    other_thread_resources = []
+    thread = Thread(
+        target=lambda: _in_app_context(notify_api, lambda: other_thread_resources.append(get_s3_resource()))
+    )
+    thread.start()
+    thread.join()
+
+    assert other_thread_resources[0] is not resource
+    assert mock_resource.call_count == 2
+
+    s3.reset_s3_clients()
+    assert get_s3_resource() is not resource
+
+
+def _in_app_context(app, func):
+    with app.app_context():
+        func()
+
+
 @freeze_time("2018-01-11 00:00:00")
 @pytest.mark.parametrize('suffix_str, days_before, returned_no', [
     ('.ACK.txt', None, 1),
@@ -35,7 +116,7 @@ def test_get_s3_file_makes_correct_call(notify_api, mocker):
     ('', 1, 1),
 ])
 def test_get_list_of_files_by_suffix(notify_api, mocker, suffix_str, days_before, returned_no):
-    paginator_mock = mocker.patch('app.aws.s3.client')
+    paginator_mock = mocker.patch('app.aws.s3.get_s3_client')
     multiple_pages_s3_object = [
         {
             "Contents": [
@@ -61,7 +142,7 @@ def test_get_list_of_files_by_suffix(notify_api, mocker, suffix_str, days_before
 
 
 def test_get_list_of_files_by_suffix_empty_contents_return_with_no_error(notify_api, mocker):
-    paginator_mock = mocker.patch('app.aws.s3.client')
+    paginator_mock = mocker.patch('app.aws.s3.get_s3_client')
     multiple_pages_s3_object = [
         {
             "other_content": [
@@ -73,3 +154,56 @@ def test_get_list_of_files_by_suffix_empty_contents_return_with_no_error(notify_
     key = get_list_of_files_by_suffix('foo-bucket', subfolder='bar', suffix='.pdf')
 
     assert sum(1 for x in key) == 0
+
+
+def test_remove_s3_objects_deletes_keys_in_batches_of_1000(notify_api, mocker):
+    mock_client = mocker.patch('app.aws.s3.get_s3_client').return_value
+    mock_client.delete_objects.return_value = {'Deleted': []}
+    keys = [f'key-{i}' for i in range(2500)]
+
+    assert remove_s3_objects('bucket', keys + ['key-0']) == {}
+
+    assert sorted(
+        [item['Key'] for item in call.kwargs['Delete']['Objects']]
+        for call in mock_client.delete_objects.call_args_list
+    ) == sorted([keys[:1000], keys[1000:2000], keys[2000:]])
+    assert {call.kwargs['Bucket'] for call in mock_client.delete_objects.call_args_list} == {'bucket'}
+
+
+def test_remove_s3_objects_does_nothing_if_no_keys(notify_api, mocker):
+    mock_client = mocker.patch('app.aws.s3.get_s3_client').return_value
+
+    assert remove_s3_objects('bucket', []) == {}
+
+    mock_client.delete_objects.assert_not_called()
+
+
+def test_remove_s3_objects_returns_keys_that_could_not_be_deleted(notify_api, mocker):
+    mock_client = mocker.patch('app.aws.s3.get_s3_client').return_value
+    mock_client.delete_objects.side_effect = [
+        {'Errors': [{'Key': 'key-1', 'Code': 'AccessDenied', 'Message': 'Access Denied'}]},
+        ClientError({'Error': {'Code': 'SlowDown', 'Message': 'Reduce your request rate'}}, 'DeleteObjects'),
+    ]
+    mocker.patch('app.aws.s3.MAX_KEYS_PER_DELETE', 2)
+
+    with set_config(notify_api, 'S3_DELETE_THREADS', 1):
+        failures = remove_s3_objects('bucket', ['key-0', 'key-1', 'key-2'])
+
+    assert failures == {
+        'key-1': 'AccessDenied: Access Denied',
+        'key-2': 'SlowDown: Reduce your request rate',
+    }
+
+
+def test_remove_jobs_from_s3_returns_jobs_that_could_not_be_deleted(notify_api, mocker):
+    mock_remove = mocker.patch('app.aws.s3.remove_s3_objects', return_value={
+        'service-service-id-notify/job-2.csv': 'AccessDenied: Access Denied'
+    })
+    jobs = [Mock(service_id='service-id', id='job-1'), Mock(service_id='service-id', id='job-2')]
+
+    assert remove_jobs_from_s3(jobs) == {'job-2': 'AccessDenied: Access Denied'}
+
+    mock_remove.assert_called_once_with(notify_api.config['CSV_UPLOAD_BUCKET_NAME'], {
+        'service-service-id-notify/job-1.csv': 'job-1',
+        'service-service-id-notify/job-2.csv': 'job-2',
+    })
@@ -84,7 +84,7 @@ def test_update_letter_notifications_statuses_raises_dvla_exception(notify_api,
 
 
 def test_update_letter_notifications_statuses_calls_with_correct_bucket_location(notify_api, mocker):
-    s3_mock = mocker.patch('app.celery.tasks.s3.get_s3_object')
+    s3_mock = mocker.patch('app.celery.tasks.s3.get_s3_object_body_and_metadata', return_value=(b'', {}))
 
     with set_config(notify_api, 'NOTIFY_EMAIL_DOMAIN', 'foo.bar'):
         update_letter_notifications_statuses(filename='NOTIFY-20170823160812-RSP.TXT')
@@ -32,7 +32,7 @@ from app.celery.letters_pdf_tasks import (
 from app.config import QueueNames, TaskNames
 from app.errors import VirusScanError
 from app.exceptions import NotificationTechnicalFailureException
-from app.letters.utils import ScanErrorType
+from app.letters.utils import ScanErrorType, get_letter_pdfs_in_folder
 from app.models import (
     INTERNATIONAL_LETTERS,
     KEY_TYPE_NORMAL,
@@ -285,6 +285,70 @@ def test_get_key_and_size_of_letters_to_be_sent_to_print(
     ]
 
 
+@mock_s3
+@freeze_time('2020-02-17 18:00:00')
+def test_get_key_and_size_of_letters_to_be_sent_to_print_lists_each_folder_once(
+    notify_api, mocker, sample_letter_template
+):
+    pdf_bucket = current_app.config['LETTERS_PDF_BUCKET_NAME']
+    s3 = boto3.client('s3', region_name='eu-west-1')
+    s3.create_bucket(Bucket=pdf_bucket, CreateBucketConfiguration={'LocationConstraint': 'eu-west-1'})
+    for i in range(5):
+        s3.put_object(Bucket=pdf_bucket, Key=f'2020-02-17/NOTIFY.REF{i}.D.2.C.20200217150000.PDF', Body=b'1')
+        create_notification(
+            template=sample_letter_template,
+            status='created',
+            reference=f'ref{i}',
+            created_at=datetime.now() - timedelta(hours=3)
+        )
+    mock_list_folder = mocker.patch(
+        'app.celery.letters_pdf_tasks.get_letter_pdfs_in_folder', wraps=get_letter_pdfs_in_folder
+    )
+    mock_find_letter = mocker.patch('app.celery.letters_pdf_tasks.find_letter_pdf_key_and_size')
+
+    with set_config_values(notify_api, {'LETTER_PDF_LOOKUP_THREADS': 2}):
+        results = list(
+            get_key_and_size_of_letters_to_be_sent_to_print(datetime.now() - timedelta(minutes=30), postage='second')
+        )
+
+    assert len(results) == 5
+    mock_list_folder.assert_called_once_with(pdf_bucket, '2020-02-17/')
+    mock_find_letter.assert_not_called()
+
+
+@mock_s3
+@freeze_time('2020-02-17 18:00:00')
+def test_get_key_and_size_of_letters_to_be_sent_to_print_looks_up_letters_missing_from_listing(
+    notify_api, mocker, sample_letter_template
+):
+    pdf_bucket = current_app.config['LETTERS_PDF_BUCKET_NAME']
+    s3 = boto3.client('s3', region_name='eu-west-1')
+    s3.create_bucket(Bucket=pdf_bucket, CreateBucketConfiguration={'LocationConstraint': 'eu-west-1'})
+    s3.put_object(Bucket=pdf_bucket, Key='2020-02-17/NOTIFY.REF0.D.2.C.20200217160000.PDF', Body=b'1')
+    s3.put_object(Bucket=pdf_bucket, Key='2020-02-17/NOTIFY.REF1.D.2.C.20200217150000.PDF', Body=b'22')
+    for reference, hours_ago in [('ref1', 3), ('ref0', 2)]:
+        create_notification(
+            template=sample_letter_template,
+            status='created',
+            reference=reference,
+            created_at=datetime.now() - timedelta(hours=hours_ago)
+        )
+    # as if REF0 was uploaded after the folder was listed
+    mocker.patch(
+        'app.celery.letters_pdf_tasks.get_letter_pdfs_in_folder',
+        return_value={'REF1': {'Key': '2020-02-17/NOTIFY.REF1.D.2.C.20200217150000.PDF', 'Size': 2}}
+    )
+
+    results = list(
+        get_key_and_size_of_letters_to_be_sent_to_print(datetime.now() - timedelta(minutes=30), postage='second')
+    )
+
+    assert [(result['Key'], result['Size']) for result in results] == [
+        ('2020-02-17/NOTIFY.REF1.D.2.C.20200217150000.PDF', 2),
+        ('2020-02-17/NOTIFY.REF0.D.2.C.20200217160000.PDF', 1),
+    ]
+
+
 @mock_s3
 @freeze_time('2020-02-17 18:00:00')
 def test_get_key_and_size_of_letters_to_be_sent_to_print_handles_file_not_found(
@@ -1,5 +1,5 @@
 from datetime import date, datetime, timedelta
-from unittest.mock import ANY, call
+from unittest.mock import ANY, Mock, call
 
 import pytest
 import pytz
@@ -8,10 +8,15 @@ from freezegun import freeze_time
 from notifications_utils.clients.zendesk.zendesk_client import (
     NotifySupportTicket,
 )
+from notifications_utils.timezones import convert_utc_to_bst
+from psycopg2.errorcodes import LOCK_NOT_AVAILABLE
+from sqlalchemy.exc import OperationalError
 
 from app.celery import nightly_tasks
 from app.celery.nightly_tasks import (
+    AdaptiveBatchSize,
     _delete_notifications_older_than_retention_by_type,
+    archive_notifications,
     delete_email_notifications_older_than_retention,
     delete_inbound_sms,
     delete_letter_notifications_older_than_retention,
@@ -23,9 +28,20 @@ from app.celery.nightly_tasks import (
     remove_sms_email_csv_files,
     s3,
     save_daily_notification_processing_time,
+    start_archival_workers,
     timeout_notifications,
 )
-from app.models import EMAIL_TYPE, LETTER_TYPE, SMS_TYPE, FactProcessingTime
+from app.dao.notification_archival_dao import dao_queue_notification_archivals
+from app.models import (
+    EMAIL_TYPE,
+    LETTER_TYPE,
+    SMS_TYPE,
+    FactProcessingTime,
+    Notification,
+    NotificationActivity,
+    NotificationArchival,
+    NotificationHistory,
+)
 from tests.app.db import (
     create_job,
     create_notification,
@@ -33,6 +49,7 @@ from tests.app.db import (
     create_service_data_retention,
     create_template,
 )
+from tests.conftest import set_config
 
 
 def mock_s3_get_list_match(bucket_name, subfolder='', suffix='', last_modified=None):
@@ -57,7 +74,7 @@ def test_will_remove_csv_files_for_jobs_older_than_seven_days(
     """
     Jobs older than seven days are deleted, but only two day's worth (two-day window)
     """
-    mocker.patch('app.celery.nightly_tasks.s3.remove_job_from_s3')
+    mocker.patch('app.celery.nightly_tasks.s3.remove_jobs_from_s3', return_value={})
 
     seven_days_ago = datetime.utcnow() - timedelta(days=7)
     just_under_seven_days = seven_days_ago + timedelta(seconds=1)
@@ -74,10 +91,7 @@ def test_will_remove_csv_files_for_jobs_older_than_seven_days(
 
     remove_sms_email_csv_files()
 
-    assert s3.remove_job_from_s3.call_args_list == [
-        call(job1_to_delete.service_id, job1_to_delete.id),
-        call(job2_to_delete.service_id, job2_to_delete.id),
-    ]
+    s3.remove_jobs_from_s3.assert_called_once_with([job1_to_delete, job2_to_delete])
     assert job1_to_delete.archived is True
     assert dont_delete_me_1.archived is False
 
@@ -89,7 +103,7 @@ def test_will_remove_csv_files_for_jobs_older_than_retention_period(
     """
     Jobs older than retention period are deleted, but only two day's worth (two-day window)
     """
-    mocker.patch('app.celery.nightly_tasks.s3.remove_job_from_s3')
+    mocker.patch('app.celery.nightly_tasks.s3.remove_jobs_from_s3', return_value={})
     service_1 = create_service(service_name='service 1')
     service_2 = create_service(service_name='service 2')
     create_service_data_retention(service=service_1, notification_type=SMS_TYPE, days_of_retention=3)
@@ -114,17 +128,14 @@ def test_will_remove_csv_files_for_jobs_older_than_retention_period(
 
     remove_sms_email_csv_files()
 
-    s3.remove_job_from_s3.assert_has_calls([
-        call(job1_to_delete.service_id, job1_to_delete.id),
-        call(job2_to_delete.service_id, job2_to_delete.id),
-        call(job3_to_delete.service_id, job3_to_delete.id),
-        call(job4_to_delete.service_id, job4_to_delete.id)
-    ], any_order=True)
+    assert set(s3.remove_jobs_from_s3.call_args.args[0]) == {
+        job1_to_delete, job2_to_delete, job3_to_delete, job4_to_delete
+    }
 
 
 @freeze_time('2017-01-01 10:00:00')
 def test_remove_csv_files_filters_by_type(mocker, sample_service):
-    mocker.patch('app.celery.nightly_tasks.s3.remove_job_from_s3')
+    mocker.patch('app.celery.nightly_tasks.s3.remove_jobs_from_s3', return_value={})
     """
     Jobs older than seven days are deleted, but only two day's worth (two-day window)
     """
@@ -138,9 +149,21 @@ def test_remove_csv_files_filters_by_type(mocker, sample_service):
 
     remove_letter_csv_files()
 
-    assert s3.remove_job_from_s3.call_args_list == [
-        call(job_to_delete.service_id, job_to_delete.id),
-    ]
+    s3.remove_jobs_from_s3.assert_called_once_with([job_to_delete])
+
+
+def test_remove_csv_files_does_not_archive_jobs_that_could_not_be_removed(mocker, sample_template):
+    eight_days_ago = datetime.utcnow() - timedelta(days=8)
+    removed_job = create_job(sample_template, created_at=eight_days_ago)
+    failed_job = create_job(sample_template, created_at=eight_days_ago)
+    mocker.patch(
+        'app.celery.nightly_tasks.s3.remove_jobs_from_s3', return_value={failed_job.id: 'AccessDenied: Access Denied'}
+    )
+
+    remove_sms_email_csv_files()
+
+    assert removed_job.archived is True
+    assert failed_job.archived is False
 
 
 def test_delete_sms_notifications_older_than_retention_calls_child_task(notify_api, mocker):
@@ -441,8 +464,15 @@ def test_save_daily_notification_processing_time_when_in_bst(mocker, sample_temp
     assert persisted_to_db[0].messages_within_10_secs == 2
 
 
+def _queued_archivals():
+    return {
+        (archival.service_id, archival.notification_type): (archival.delete_before, archival.estimated_rows)
+        for archival in NotificationArchival.query.all()
+    }
+
+
 @freeze_time('2021-06-05 03:00')
-def test_delete_notifications_task_calls_task_for_services_with_data_retention_of_same_type(notify_db_session, mocker):
+def test_delete_notifications_task_queues_services_with_data_retention_of_same_type(notify_db_session, mocker):
     sms_service = create_service(service_name='a')
     email_service = create_service(service_name='b')
     letter_service = create_service(service_name='c')
@@ -451,20 +481,19 @@ def test_delete_notifications_task_calls_task_for_services_with_data_retention_o
     create_service_data_retention(email_service, notification_type='email')
     create_service_data_retention(letter_service, notification_type='letter')
 
-    mock_subtask = mocker.patch('app.celery.nightly_tasks.delete_notifications_for_service_and_type')
+    mock_start_workers = mocker.patch('app.celery.nightly_tasks.start_archival_workers')
 
     _delete_notifications_older_than_retention_by_type('sms')
 
-    mock_subtask.apply_async.assert_called_once_with(queue='reporting-tasks', kwargs={
-        'service_id': sms_service.id,
-        'notification_type': 'sms',
+    assert _queued_archivals() == {
         # three days of retention, its morn of 5th, so we want to keep all messages from 4th, 3rd and 2nd.
-        'datetime_to_delete_before': datetime(2021, 6, 1, 23, 0),
-    })
+        (sms_service.id, 'sms'): (datetime(2021, 6, 1, 23, 0), 0),
+    }
+    mock_start_workers.assert_called_once_with()
 
 
 @freeze_time('2021-04-05 03:00')
-def test_delete_notifications_task_calls_task_for_services_with_data_retention_by_looking_at_retention(
+def test_delete_notifications_task_queues_services_with_data_retention_by_looking_at_retention(
     notify_db_session,
     mocker
 ):
@@ -473,27 +502,18 @@ def test_delete_notifications_task_calls_task_for_services_with_data_retention_b
     create_service_data_retention(service_14_days, days_of_retention=14)
     create_service_data_retention(service_3_days, days_of_retention=3)
 
-    mock_subtask = mocker.patch('app.celery.nightly_tasks.delete_notifications_for_service_and_type')
+    mocker.patch('app.celery.nightly_tasks.start_archival_workers')
 
     _delete_notifications_older_than_retention_by_type('sms')
 
-    assert mock_subtask.apply_async.call_count == 2
-    mock_subtask.apply_async.assert_has_calls(any_order=True, calls=[
-        call(queue=ANY, kwargs={
-            'service_id': service_14_days.id,
-            'notification_type': 'sms',
-            'datetime_to_delete_before': datetime(2021, 3, 22, 0, 0)
-        }),
-        call(queue=ANY, kwargs={
-            'service_id': service_3_days.id,
-            'notification_type': 'sms',
-            'datetime_to_delete_before': datetime(2021, 4, 1, 23, 0)
-        }),
-    ])
+    assert _queued_archivals() == {
+        (service_14_days.id, 'sms'): (datetime(2021, 3, 22, 0, 0), 0),
+        (service_3_days.id, 'sms'): (datetime(2021, 4, 1, 23, 0), 0),
+    }
 
 
 @freeze_time('2021-04-03 03:00')
-def test_delete_notifications_task_calls_task_for_services_that_have_sent_notifications_recently(
+def test_delete_notifications_task_queues_services_that_have_sent_notifications_recently(
     notify_db_session,
     mocker
 ):
@@ -509,27 +529,174 @@ def test_delete_notifications_task_calls_task_for_services_that_have_sent_notifi
 
     # will be deleted as service has no custom retention, but past our default 7 days
     create_notification(service_will_delete_1.templates[0], created_at=datetime.now() - timedelta(days=8))
+    create_notification(service_will_delete_1.templates[0], created_at=datetime.now() - timedelta(days=9))
     create_notification(service_will_delete_2.templates[0], created_at=datetime.now() - timedelta(days=8))
 
-    # will be kept as it's recent, and we won't run delete_notifications_for_service_and_type
+    # will be kept as it's recent, so the service isn't queued
     create_notification(nothing_to_delete_sms_template, created_at=datetime.now() - timedelta(days=2))
-    # this is an old notification, but for email not sms, so we won't run delete_notifications_for_service_and_type
+    # this is an old notification, but for email not sms, so the service isn't queued
     create_notification(nothing_to_delete_email_template, created_at=datetime.now() - timedelta(days=8))
 
-    mock_subtask = mocker.patch('app.celery.nightly_tasks.delete_notifications_for_service_and_type')
+    mocker.patch('app.celery.nightly_tasks.start_archival_workers')
 
     _delete_notifications_older_than_retention_by_type('sms')
 
-    assert mock_subtask.apply_async.call_count == 2
-    mock_subtask.apply_async.assert_has_calls(any_order=True, calls=[
-        call(queue=ANY, kwargs={
-            'service_id': service_will_delete_1.id,
-            'notification_type': 'sms',
-            'datetime_to_delete_before': datetime(2021, 3, 27, 0, 0)
-        }),
-        call(queue=ANY, kwargs={
-            'service_id': service_will_delete_2.id,
-            'notification_type': 'sms',
-            'datetime_to_delete_before': datetime(2021, 3, 27, 0, 0)
-        }),
-    ])
+    # nothing's in ft_notification_status for those days, so there's no estimate of how many there are
+    assert _queued_archivals() == {
+        (service_will_delete_1.id, 'sms'): (datetime(2021, 3, 27, 0, 0), 0),
+        (service_will_delete_2.id, 'sms'): (datetime(2021, 3, 27, 0, 0), 0),
+    }
+
+
+def test_start_archival_workers_starts_the_maximum_number_of_workers(notify_api, mocker):
+    mock_archive = mocker.patch('app.celery.nightly_tasks.archive_notifications.apply_async')
+
+    with set_config(notify_api, 'ARCHIVAL_MAX_WORKERS', 3):
+        start_archival_workers()
+
+    assert mock_archive.call_args_list == [call(queue='reporting-tasks')] * 3
+
+
+@pytest.mark.parametrize('rows, seconds, expected_size', [
+    # a quick full batch grows, but by no more than half again
+    (2000, 1, 3000),
+    # an on-target full batch stays the same
+    (2000, 10, 2000),
+    # a slowish full batch shrinks towards the size that would hit the target
+    (2000, 16, 1625),
+    # a batch that took more than twice the target is halved, but not below the minimum
+    (2000, 25, 1000),
+    # the last, part, batch for a service doesn't change the size
+    (500, 1, 2000),
+])
+def test_adaptive_batch_size_record(rows, seconds, expected_size):
+    batch_size = AdaptiveBatchSize(1000, 50000, 10)
+    batch_size.size = 2000
+
+    batch_size.record(rows, seconds)
+
+    assert batch_size.size == expected_size
+
+
+def test_adaptive_batch_size_stays_within_limits():
+    batch_size = AdaptiveBatchSize(1000, 5000, 10)
+
+    for _ in range(10):
+        batch_size.record(batch_size.size, 0.1)
+    assert batch_size.size == 5000
+
+    for _ in range(10):
+        batch_size.record_lock_wait()
+    assert batch_size.size == 1000
+
+
+def _queue_archival(service, notification_type, delete_before, estimated_rows=0):
+    dao_queue_notification_archivals([{
+        'service_id': service.id,
+        'notification_type': notification_type,
+        'delete_before': delete_before,
+        'estimated_rows': estimated_rows,
+    }])
+
+
+def test_archive_notifications_moves_queued_services_notifications_to_history(sample_template, notify_api):
+    old = datetime.utcnow() - timedelta(days=8)
+    for _ in range(5):
+        create_notification(sample_template, created_at=old)
+    create_notification(sample_template, created_at=old, key_type='test')
+    recent = create_notification(sample_template)
+    _queue_archival(sample_template.service, 'sms', datetime.utcnow() - timedelta(days=7), 6)
+
+    with set_config(notify_api, 'ARCHIVAL_MIN_BATCH_SIZE', 2):
+        archive_notifications()
+
+    assert Notification.query.all() == [recent]
+    assert NotificationHistory.query.count() == 5
+    archival = NotificationArchival.query.one()
+    assert archival.status == 'done'
+    assert archival.archived_rows == 5
+    assert [activity.bst_date for activity in NotificationActivity.query.all()] == [
+        convert_utc_to_bst(recent.created_at).date()
+    ]
+
+
+def test_archive_notifications_does_nothing_if_maximum_workers_already_running(sample_template, notify_api, mocker):
+    mocker.patch('app.celery.nightly_tasks.redis_store.active', True)
+    mock_redis = mocker.patch('app.celery.nightly_tasks.redis_store.redis_store')
+    mock_redis.set.return_value = None
+    create_notification(sample_template, created_at=datetime.utcnow() - timedelta(days=8))
+    _queue_archival(sample_template.service, 'sms', datetime.utcnow() - timedelta(days=7))
+
+    with set_config(notify_api, 'ARCHIVAL_MAX_WORKERS', 2):
+        archive_notifications()
+
+    assert mock_redis.set.call_args_list == [
+        call('archive-notifications-worker-0', 1, ex=ANY, nx=True),
+        call('archive-notifications-worker-1', 1, ex=ANY, nx=True),
+    ]
+    assert Notification.query.count() == 1
+    assert NotificationArchival.query.one().status == 'pending'
+
+
+def test_archive_notifications_releases_its_worker_slot(sample_template, mocker):
+    mocker.patch('app.celery.nightly_tasks.redis_store.active', True)
+    mock_redis = mocker.patch('app.celery.nightly_tasks.redis_store.redis_store')
+    mock_redis.set.side_effect = [None, True]
+    create_notification(sample_template, created_at=datetime.utcnow() - timedelta(days=8))
+    _queue_archival(sample_template.service, 'sms', datetime.utcnow() - timedelta(days=7))
+
+    archive_notifications()
+
+    assert Notification.query.count() == 0
+    mock_redis.expire.assert_called_with('archive-notifications-worker-1', ANY)
+    mock_redis.delete.assert_called_once_with('archive-notifications-worker-1')
+
+
+def test_archive_notifications_shrinks_batch_and_retries_after_lock_timeout(sample_template, mocker):
+    lock_timeout = OperationalError('DELETE', {}, Mock(pgcode=LOCK_NOT_AVAILABLE))
+    mock_archive = mocker.patch(
+        'app.celery.nightly_tasks.insert_notification_history_delete_notifications',
+        side_effect=[lock_timeout, 0],
+    )
+    mocker.patch('app.celery.nightly_tasks.AdaptiveBatchSize.record_lock_wait')
+    mock_sleep = mocker.patch('app.celery.nightly_tasks.time.sleep')
+    mock_refresh = mocker.patch('app.celery.nightly_tasks._refresh_archival_worker_slot')
+    _queue_archival(sample_template.service, 'sms', datetime.utcnow() - timedelta(days=7))
+
+    archive_notifications()
+
+    assert mock_archive.call_count == 2
+    nightly_tasks.AdaptiveBatchSize.record_lock_wait.assert_called_once_with()
+    assert 0 <= mock_sleep.call_args[0][0] <= 4
+    assert mock_refresh.called
+    assert NotificationArchival.query.one().status == 'done'
+
+
+def test_archive_notifications_gives_up_on_service_after_repeated_lock_timeouts(
+    sample_template, notify_api, mocker
+):
+    lock_timeout = OperationalError('DELETE', {}, Mock(pgcode=LOCK_NOT_AVAILABLE))
+    mock_archive = mocker.patch(
+        'app.celery.nightly_tasks.insert_notification_history_delete_notifications',
+        side_effect=lock_timeout,
+    )
+    mock_sleep = mocker.patch('app.celery.nightly_tasks.time.sleep')
+    _queue_archival(sample_template.service, 'sms', datetime.utcnow() - timedelta(days=7))
+
+    with set_config(notify_api, 'ARCHIVAL_MAX_LOCK_TIMEOUTS', 3):
+        archive_notifications()
+
+    assert mock_archive.call_count == 3
+    assert mock_sleep.call_count == 2
+    # left for another worker to take over once it's stale
+    assert NotificationArchival.query.one().status == 'in-progress'
+
+
+def test_archive_notifications_deletes_letters_from_s3_first(sample_letter_template, mocker):
+    mock_delete_from_s3 = mocker.patch('app.celery.nightly_tasks.delete_letters_from_s3')
+    delete_before = datetime.utcnow() - timedelta(days=7)
+    _queue_archival(sample_letter_template.service, 'letter', delete_before)
+
+    archive_notifications()
+
+    mock_delete_from_s3.assert_called_once_with('letter', sample_letter_template.service.id, delete_before, ANY)
@@ -1,26 +1,35 @@
 import json
 from datetime import datetime
+from queue import Empty
+from unittest.mock import Mock, call
 
+import pytest
 from freezegun import freeze_time
 
 from app import encryption, statsd_client
-from app.celery.process_ses_receipts_tasks import process_ses_results
+from app.celery.process_ses_receipts_tasks import (
+    process_ses_results,
+    process_ses_results_batch,
+    process_ses_results_from_queue,
+)
 from app.celery.research_mode_tasks import (
     ses_hard_bounce_callback,
     ses_notification_callback,
     ses_soft_bounce_callback,
 )
 from app.dao.notifications_dao import get_notification_by_id
-from app.models import Complaint, Notification
+from app.models import Complaint, Notification, NotificationHistory
 from app.notifications.notifications_ses_callback import (
     remove_emails_from_bounce,
     remove_emails_from_complaint,
 )
 from tests.app.db import (
     create_notification,
+    create_notification_history,
     create_service_callback_api,
     ses_complaint_callback,
 )
+from tests.conftest import set_config
 
 
 def test_process_ses_results(sample_email_template):
@@ -88,6 +97,17 @@ def test_ses_callback_should_update_notification_status(
         send_mock.assert_called_once_with(updated_notification)
 
 
+def test_ses_callback_buffers_status_if_status_buffer_is_on(notify_api, sample_email_template, mocker):
+    mocker.patch('app.celery.process_ses_receipts_tasks.check_and_queue_callback_task')
+    mock_add = mocker.patch('app.dao.notifications_dao.notification_status_buffer.add')
+    notification = create_notification(template=sample_email_template, status='sending', reference='ref')
+
+    with set_config(notify_api, 'NOTIFICATION_STATUS_BUFFER_SECONDS', 1):
+        assert process_ses_results(ses_notification_callback(reference='ref'))
+
+    mock_add.assert_called_once_with(notification.id, status='delivered', updated_at=mocker.ANY)
+
+
 def test_ses_callback_should_not_update_notification_status_if_already_delivered(sample_email_template, mocker):
     mock_dup = mocker.patch('app.celery.process_ses_receipts_tasks.notifications_dao._duplicate_update_warning')
     mock_upd = mocker.patch(
@@ -227,3 +247,143 @@ def test_ses_callback_should_send_on_complaint_to_user_callback_api(sample_email
         'service_callback_api_url': 'https://original_url.com',
         'to': 'recipient1@example.com'
     }
+
+
+def test_process_ses_results_batch(sample_email_template, mocker):
+    mocker.patch('app.statsd_client.incr')
+    send_mock = mocker.patch('app.celery.process_ses_receipts_tasks.send_delivery_status_to_service.apply_async')
+    create_service_callback_api(service=sample_email_template.service, url="https://original_url.com")
+    delivered = create_notification(template=sample_email_template, reference='ref1', status='sending')
+    bounced = create_notification(template=sample_email_template, reference='ref2', status='sending')
+    history = create_notification_history(template=sample_email_template, reference='ref3', status='sending')
+
+    assert process_ses_results_batch([
+        ses_notification_callback(reference='ref1'),
+        ses_hard_bounce_callback(reference='ref2'),
+        ses_notification_callback(reference='ref3'),
+    ])
+
+    assert get_notification_by_id(delivered.id).status == 'delivered'
+    assert get_notification_by_id(bounced.id).status == 'permanent-failure'
+    assert NotificationHistory.query.get(history.id).status == 'delivered'
+    statsd_client.incr.assert_any_call('callback.ses.delivered')
+    statsd_client.incr.assert_any_call('callback.ses.permanent-failure')
+
+    assert send_mock.call_count == 2
+    callbacks = {
+        call[0][0][0]: encryption.decrypt(call[0][0][1]) for call in send_mock.call_args_list
+    }
+    assert callbacks[str(delivered.id)]['notification_status'] == 'delivered'
+    assert callbacks[str(bounced.id)]['notification_status'] == 'permanent-failure'
+    assert all(call[1] == {'queue': 'service-callbacks'} for call in send_mock.call_args_list)
+
+
+def test_process_ses_results_batch_doesnt_update_notifications_with_a_final_status(sample_email_template, mocker):
+    mock_dup = mocker.patch('app.celery.process_ses_receipts_tasks.notifications_dao._duplicate_update_warning')
+    send_mock = mocker.patch('app.celery.process_ses_receipts_tasks.send_delivery_status_to_service.apply_async')
+    notification = create_notification(template=sample_email_template, reference='ref', status='temporary-failure')
+
+    assert process_ses_results_batch([ses_notification_callback(reference='ref')])
+
+    assert get_notification_by_id(notification.id).status == 'temporary-failure'
+    mock_dup.assert_called_once_with(notification=notification, status='delivered')
+    send_mock.assert_not_called()
+
+
+def test_process_ses_results_batch_retries_results_for_notifications_that_arent_saved_yet(
+    sample_email_template, mocker
+):
+    retry_mock = mocker.patch('app.celery.process_ses_receipts_tasks.process_ses_results.apply_async')
+    mock_logger = mocker.patch('app.celery.process_ses_receipts_tasks.current_app.logger.warning')
+    recent = ses_notification_callback(reference='recent')
+    message = json.loads(recent['Message'])
+    message['mail']['timestamp'] = datetime.utcnow().isoformat()
+    recent['Message'] = json.dumps(message)
+
+    assert process_ses_results_batch([recent, ses_notification_callback(reference='old')])
+
+    retry_mock.assert_called_once_with([recent], queue='retry-tasks', countdown=300)
+    mock_logger.assert_called_once_with('notification not found for reference: old (update to delivered)')
+
+
+def test_process_ses_results_batch_handles_complaints(sample_email_template, mocker):
+    create_notification(template=sample_email_template, reference='ref1', status='sending')
+
+    assert process_ses_results_batch([ses_complaint_callback()])
+
+    assert len(Complaint.query.all()) == 1
+
+
+def test_process_ses_results_batch_processes_results_one_by_one_if_batch_fails(sample_email_template, mocker):
+    mocker.patch(
+        'app.celery.process_ses_receipts_tasks.notifications_dao.dao_update_notification_statuses',
+        side_effect=Exception('EXPECTED'),
+    )
+    retry_mock = mocker.patch('app.celery.process_ses_receipts_tasks.process_ses_results.apply_async')
+    create_notification(template=sample_email_template, reference='ref1', status='sending')
+    create_notification(template=sample_email_template, reference='ref2', status='sending')
+    responses = [ses_notification_callback(reference='ref1'), ses_notification_callback(reference='ref2')]
+
+    assert process_ses_results_batch(responses) is None
+
+    assert retry_mock.call_args_list == [
+        mocker.call([responses[0]], queue='retry-tasks'),
+        mocker.call([responses[1]], queue='retry-tasks'),
+    ]
+
+
+def _queued_message(body, headers=None):
+    return Mock(decode=Mock(return_value=body), headers=headers or {})
+
+
+@pytest.fixture
+def mock_ses_callbacks_queue(mocker):
+    queue = Mock(Empty=Empty)
+    connection = mocker.patch('app.celery.process_ses_receipts_tasks.notify_celery.connection_for_read')
+    connection.return_value.__enter__.return_value.SimpleQueue.return_value = queue
+    return queue
+
+
+def test_process_ses_results_from_queue_processes_results_in_batches(notify_api, mock_ses_callbacks_queue, mocker):
+    mock_batch = mocker.patch('app.celery.process_ses_receipts_tasks.process_ses_results_batch')
+    messages = [
+        # the SES callback lambda sends version 1 task messages
+        _queued_message({'task': 'process-ses-result', 'args': ['result 1'], 'kwargs': {}}),
+        _queued_message([['result 2'], {}, {}], headers={'task': 'process-ses-result'}),
+        _queued_message({'task': 'process-ses-result', 'args': ['result 3'], 'kwargs': {}}),
+    ]
+    mock_ses_callbacks_queue.get.side_effect = messages + [Empty()]
+
+    with set_config(notify_api, 'SES_RESULTS_BATCH_SIZE', 2):
+        process_ses_results_from_queue()
+
+    assert mock_batch.call_args_list == [
+        call(['result 1', 'result 2']),
+        call(['result 3']),
+    ]
+    assert all(message.ack.called for message in messages)
+    mock_ses_callbacks_queue.close.assert_called_once_with()
+
+
+def test_process_ses_results_from_queue_leaves_other_messages_on_the_queue(
+    notify_api, mock_ses_callbacks_queue, mocker
+):
+    mock_batch = mocker.patch('app.celery.process_ses_receipts_tasks.process_ses_results_batch')
+    message = _queued_message({'task': 'something-else', 'args': ['result'], 'kwargs': {}})
+    mock_ses_callbacks_queue.get.side_effect = [message, Empty()]
+
+    with set_config(notify_api, 'SES_RESULTS_BATCH_SIZE', 10):
+        process_ses_results_from_queue()
+
+    assert not mock_batch.called
+    message.requeue.assert_called_once_with()
+    assert not message.ack.called
+
+
+def test_process_ses_results_from_queue_does_nothing_unless_batch_size_is_set(
+    notify_api, mock_ses_callbacks_queue, mocker
+):
+    with set_config(notify_api, 'SES_RESULTS_BATCH_SIZE', 0):
+        process_ses_results_from_queue()
+
+    assert not mock_ses_callbacks_queue.get.called
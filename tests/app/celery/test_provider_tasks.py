@@ -1,17 +1,26 @@
+from unittest.mock import call
+
 import pytest
 from botocore.exceptions import ClientError
 from celery.exceptions import MaxRetriesExceededError
 
 import app
 from app.celery import provider_tasks
-from app.celery.provider_tasks import deliver_email, deliver_sms
+from app.celery.provider_tasks import (
+    THROTTLED_RETRY_DELAY_SECONDS,
+    deliver_email,
+    deliver_sms,
+    deliver_sms_batch,
+)
 from app.clients.email import EmailClientNonRetryableException
 from app.clients.email.aws_ses import (
     AwsSesClientException,
     AwsSesClientThrottlingSendRateException,
 )
 from app.clients.sms import SmsClientResponseException
+from app.delivery.send_rate_governor import SendRateExceeded
 from app.exceptions import NotificationTechnicalFailureException
+from tests.conftest import set_config
 
 
 def test_should_have_decorated_tasks_functions():
@@ -203,3 +212,85 @@ def test_if_ses_send_rate_throttle_then_should_retry_and_log_warning(sample_noti
     assert sample_notification.status == 'created'
     assert not mock_logger_exception.called
     assert mock_logger_warning.called
+
+
+@pytest.mark.parametrize('task_name, provider', [('deliver_email', 'ses'), ('deliver_sms', 'mmg')])
+def test_should_defer_delivery_when_its_turn_to_send_is_too_far_away(sample_notification, mocker, task_name, provider):
+    mocker.patch(
+        f'app.delivery.send_to_providers.send_{task_name[len("deliver_"):]}_to_provider',
+        side_effect=SendRateExceeded(provider, 10),
+    )
+    mocker.patch('app.celery.provider_tasks.random.uniform', return_value=1.2)
+    task = getattr(provider_tasks, task_name)
+    mock_retry = mocker.patch(f'app.celery.provider_tasks.{task_name}.retry')
+    mock_apply_async = mocker.patch(f'app.celery.provider_tasks.{task_name}.apply_async')
+
+    task(sample_notification.id, deferrals=3)
+
+    # waiting for its turn isn't a retry, so doesn't count towards max_retries
+    assert not mock_retry.called
+    mock_apply_async.assert_called_once_with(
+        [str(sample_notification.id)], {'deferrals': 4}, queue='retry-tasks', countdown=12, retries=0
+    )
+
+
+@pytest.mark.parametrize('task_name, provider', [('deliver_email', 'ses'), ('deliver_sms', 'mmg')])
+def test_should_retry_delivery_when_deferred_too_many_times(
+    notify_api, sample_notification, mocker, task_name, provider
+):
+    mocker.patch(
+        f'app.delivery.send_to_providers.send_{task_name[len("deliver_"):]}_to_provider',
+        side_effect=SendRateExceeded(provider, 10),
+    )
+    mocker.patch('app.celery.provider_tasks.random.uniform', return_value=1.2)
+    task = getattr(provider_tasks, task_name)
+    mock_retry = mocker.patch(f'app.celery.provider_tasks.{task_name}.retry')
+    mock_apply_async = mocker.patch(f'app.celery.provider_tasks.{task_name}.apply_async')
+
+    with set_config(notify_api, 'SEND_RATE_MAX_DEFERRALS', 3):
+        task(sample_notification.id, deferrals=3)
+
+    assert not mock_apply_async.called
+    mock_retry.assert_called_once_with(queue='retry-tasks', countdown=12)
+
+
+def test_should_retry_deliver_email_soon_if_ses_throttles(sample_notification, mocker):
+    mocker.patch(
+        'app.delivery.send_to_providers.send_email_to_provider',
+        side_effect=AwsSesClientThrottlingSendRateException('slow down'),
+    )
+    mocker.patch('app.celery.provider_tasks.deliver_email.retry')
+
+    deliver_email(sample_notification.id)
+
+    provider_tasks.deliver_email.retry.assert_called_once_with(
+        queue="retry-tasks", countdown=THROTTLED_RETRY_DELAY_SECONDS
+    )
+
+
+def test_deliver_sms_batch_retries_failed_notifications_one_at_a_time(mocker):
+    mocker.patch('app.delivery.send_to_providers.send_smss_to_provider', return_value={
+        'failed': SmsClientResponseException('error'),
+        'too-soon': SendRateExceeded('mmg', 2.5),
+    })
+    mocker.patch('app.celery.provider_tasks.random.uniform', return_value=1.2)
+    mock_deliver_sms = mocker.patch('app.celery.provider_tasks.deliver_sms.apply_async')
+
+    deliver_sms_batch(['sent', 'failed', 'too-soon'])
+
+    assert mock_deliver_sms.call_args_list == [
+        call(['failed'], queue='retry-tasks', countdown=0),
+        call(['too-soon'], queue='retry-tasks', countdown=3),
+    ]
+
+
+def test_deliver_sms_batch_retries_every_notification_if_batch_fails(mocker):
+    mocker.patch('app.delivery.send_to_providers.send_smss_to_provider', side_effect=Exception('db error'))
+    mock_deliver_sms = mocker.patch('app.celery.provider_tasks.deliver_sms.apply_async')
+
+    deliver_sms_batch(['a', 'b'])
+
+    assert mock_deliver_sms.call_args_list == [
+        call(['a'], queue='retry-tasks', countdown=0),
+        call(['b'], queue='retry-tasks', countdown=0),
+    ]
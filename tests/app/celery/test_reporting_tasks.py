@@ -9,6 +9,7 @@ from app.celery.reporting_tasks import (
     create_nightly_billing,
     create_nightly_billing_for_day,
     create_nightly_notification_status,
+    create_nightly_notification_status_for_day,
     create_nightly_notification_status_for_service_and_day,
 )
 from app.config import QueueNames
@@ -19,7 +20,6 @@ from app.models import (
     KEY_TYPE_TEAM,
     KEY_TYPE_TEST,
     LETTER_TYPE,
-    NOTIFICATION_TYPES,
     SMS_TYPE,
     FactBilling,
     FactNotificationStatus,
@@ -62,57 +62,60 @@ def test_create_nightly_billing_triggers_tasks_for_days(notify_api, mocker, day_
 
 
 @freeze_time('2019-08-01T00:30')
-def test_create_nightly_notification_status_triggers_tasks(
-    notify_api,
-    sample_service,
-    sample_template,
-    mocker,
+def test_create_nightly_notification_status_triggers_a_task_for_each_day_and_notification_type(
+    notify_db_session, mocker
 ):
     mock_celery = mocker.patch(
-        'app.celery.reporting_tasks.create_nightly_notification_status_for_service_and_day'
+        'app.celery.reporting_tasks.create_nightly_notification_status_for_day'
     ).apply_async
 
-    create_notification(template=sample_template, created_at='2019-07-31')
     create_nightly_notification_status()
 
-    mock_celery.assert_called_with(
-        kwargs={
-            'service_id': sample_service.id,
-            'process_day': '2019-07-31',
-            'notification_type': SMS_TYPE
-        },
-        queue=QueueNames.REPORTING
-    )
+    days_by_type = {}
+    for call in mock_celery.call_args_list:
+        assert call[1]['queue'] == QueueNames.REPORTING
+        kwargs = call[1]['kwargs']
+        days_by_type.setdefault(kwargs['notification_type'], []).append(kwargs['process_day'])
+
+    assert days_by_type == {
+        SMS_TYPE: ['2019-07-31', '2019-07-30', '2019-07-29', '2019-07-28'],
+        EMAIL_TYPE: ['2019-07-31', '2019-07-30', '2019-07-29', '2019-07-28'],
+        LETTER_TYPE: [
+            '2019-07-31', '2019-07-30', '2019-07-29', '2019-07-28', '2019-07-27',
+            '2019-07-26', '2019-07-25', '2019-07-24', '2019-07-23', '2019-07-22',
+        ],
+    }
 
 
 @freeze_time('2019-08-01T00:30')
-@pytest.mark.parametrize('notification_date, expected_types_aggregated', [
-    ('2019-08-01', set()),
-    ('2019-07-31', {EMAIL_TYPE, SMS_TYPE, LETTER_TYPE}),
-    ('2019-07-28', {EMAIL_TYPE, SMS_TYPE, LETTER_TYPE}),
-    ('2019-07-27', {LETTER_TYPE}),
-    ('2019-07-22', {LETTER_TYPE}),
-    ('2019-07-21', set()),
+def test_create_nightly_notification_status_deletes_old_live_counts(notify_db_session, mocker):
+    mocker.patch('app.celery.reporting_tasks.create_nightly_notification_status_for_day')
+    mock_delete = mocker.patch(
+        'app.celery.reporting_tasks.delete_live_notification_status_before', return_value=0
+    )
+
+    create_nightly_notification_status()
+
+    mock_delete.assert_called_once_with(date(2019, 7, 31))
+
+
+@freeze_time('2019-08-01T10:00')
+@pytest.mark.parametrize('process_day, expected_checks', [
+    ('2019-07-31', 1),
+    ('2019-07-30', 0),
 ])
-def test_create_nightly_notification_status_triggers_relevant_tasks(
-    notify_api,
-    sample_service,
-    mocker,
-    notification_date,
-    expected_types_aggregated,
+def test_create_nightly_notification_status_for_day_checks_yesterdays_live_counts(
+    notify_db_session, mocker, process_day, expected_checks
 ):
-    mock_celery = mocker.patch(
-        'app.celery.reporting_tasks.create_nightly_notification_status_for_service_and_day'
-    ).apply_async
-
-    for notification_type in NOTIFICATION_TYPES:
-        template = create_template(sample_service, template_type=notification_type)
-        create_notification(template=template, created_at=notification_date)
+    mock_differences = mocker.patch(
+        'app.celery.reporting_tasks.fetch_live_notification_status_differences', return_value=['a difference']
+    )
+    mock_warning = mocker.patch('app.celery.reporting_tasks.current_app.logger.warning')
 
-    create_nightly_notification_status()
+    create_nightly_notification_status_for_day(process_day, SMS_TYPE)
 
-    types = {call.kwargs['kwargs']['notification_type'] for call in mock_celery.mock_calls}
-    assert types == expected_types_aggregated
+    assert mock_differences.call_count == expected_checks
+    assert mock_warning.call_count == expected_checks
 
 
 @pytest.mark.parametrize('second_rate, records_num, billable_units, multiplier',
@@ -596,6 +599,78 @@ def test_create_nightly_notification_status_for_service_and_day(notify_db_sessio
     assert new_fact_data[2].key_type == KEY_TYPE_NORMAL
 
 
+def test_create_nightly_notification_status_for_day(notify_db_session):
+    first_service = create_service(service_name='First Service')
+    first_template = create_template(service=first_service, template_type='email')
+    second_service = create_service(service_name='second Service')
+    second_template = create_template(service=second_service, template_type='email')
+    third_service = create_service(service_name='third Service')
+    third_template = create_template(service=third_service, template_type='letter')
+
+    create_service_data_retention(second_service, 'email', days_of_retention=3)
+
+    process_day = date.today() - timedelta(days=5)
+    with freeze_time(datetime.combine(process_day, time.min)):
+        create_notification(template=first_template, status='delivered')
+        create_notification(template=first_template, status='delivered', key_type=KEY_TYPE_TEAM)
+        # not read, as the first service's notifications from 5 days ago are still in the notifications table
+        create_notification_history(template=first_template, status='delivered')
+
+        # 2nd service email has 3 day data retention - data has been moved to history and doesn't exist in notifications
+        create_notification_history(template=second_template, status='temporary-failure')
+
+        # test notifications and other notification types are ignored
+        create_notification(template=first_template, status='sending', key_type=KEY_TYPE_TEST)
+        create_notification(template=third_template, status='sending')
+
+    # these created notifications from a different day get ignored
+    with freeze_time(datetime.combine(date.today() - timedelta(days=4), time.min)):
+        create_notification(template=first_template)
+        create_notification_history(template=second_template)
+
+    create_nightly_notification_status_for_day(str(process_day), EMAIL_TYPE)
+
+    new_fact_data = FactNotificationStatus.query.order_by(
+        FactNotificationStatus.service_id, FactNotificationStatus.key_type
+    ).all()
+
+    assert sorted(
+        (row.service_id, row.template_id, row.key_type, row.notification_status, row.notification_count)
+        for row in new_fact_data
+    ) == sorted([
+        (first_service.id, first_template.id, KEY_TYPE_NORMAL, 'delivered', 1),
+        (first_service.id, first_template.id, KEY_TYPE_TEAM, 'delivered', 1),
+        (second_service.id, second_template.id, KEY_TYPE_NORMAL, 'temporary-failure', 1),
+    ])
+    assert {row.bst_date for row in new_fact_data} == {process_day}
+    assert {row.notification_type for row in new_fact_data} == {EMAIL_TYPE}
+    assert {row.job_id for row in new_fact_data} == {UUID('00000000-0000-0000-0000-000000000000')}
+
+
+def test_create_nightly_notification_status_for_day_replaces_all_services_rows(notify_db_session):
+    first_template = create_template(service=create_service(service_name='First Service'))
+    second_template = create_template(service=create_service(service_name='Second Service'))
+    letter_template = create_template(service=first_template.service, template_type='letter')
+    process_day = date.today()
+
+    second_service_notification = create_notification(template=second_template, status='sending')
+    create_notification(template=letter_template, status='sending')
+    create_nightly_notification_status_for_day(str(process_day), SMS_TYPE)
+    create_nightly_notification_status_for_day(str(process_day), LETTER_TYPE)
+    assert FactNotificationStatus.query.count() == 2
+
+    # the second service's only notification has gone, so its row should go too
+    Notification.query.filter_by(id=second_service_notification.id).delete()
+    create_notification(template=first_template, status='delivered')
+    create_nightly_notification_status_for_day(str(process_day), SMS_TYPE)
+
+    rows = FactNotificationStatus.query.order_by(FactNotificationStatus.notification_type).all()
+    assert [(row.service_id, row.notification_type, row.notification_status) for row in rows] == [
+        (first_template.service_id, LETTER_TYPE, 'sending'),
+        (first_template.service_id, SMS_TYPE, 'delivered'),
+    ]
+
+
 def test_create_nightly_notification_status_for_service_and_day_overwrites_old_data(notify_db_session):
     first_service = create_service(service_name='First Service')
     first_template = create_template(service=first_service)
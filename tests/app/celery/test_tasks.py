@@ -1,3 +1,4 @@
+import io
 import json
 import uuid
 from datetime import datetime, timedelta
@@ -7,7 +8,7 @@ import pytest
 import requests_mock
 from celery.exceptions import Retry
 from freezegun import freeze_time
-from notifications_utils.recipients import Row
+from notifications_utils.recipients import RecipientCSV, Row
 from notifications_utils.template import (
     LetterPrintTemplate,
     PlainTextEmailTemplate,
@@ -19,18 +20,26 @@ from sqlalchemy.exc import SQLAlchemyError
 from app import encryption
 from app.celery import provider_tasks, tasks
 from app.celery.tasks import (
+    JobChunk,
+    get_job_chunks,
     get_recipient_csv_and_template_and_sender_id,
     process_incomplete_job,
     process_incomplete_jobs,
     process_job,
+    process_job_chunk,
     process_returned_letters_list,
     process_row,
+    process_rows,
     s3,
     save_api_email,
+    save_api_emails,
     save_api_sms,
+    save_api_smss,
     save_email,
+    save_emails,
     save_letter,
     save_sms,
+    save_smss,
     send_inbound_sms_to_service,
 )
 from app.config import QueueNames
@@ -67,7 +76,7 @@ from tests.app.db import (
     create_template,
     create_user,
 )
-from tests.conftest import set_config_values
+from tests.conftest import set_config, set_config_values
 
 
 class AnyStringWith(str):
@@ -108,7 +117,7 @@ def email_job_with_placeholders(notify_db, notify_db_session, sample_email_templ
 def test_should_process_sms_job(sample_job, mocker):
     mocker.patch('app.celery.tasks.s3.get_job_and_metadata_from_s3',
                  return_value=(load_example_csv('sms'), {'sender_id': None}))
-    mocker.patch('app.celery.tasks.save_sms.apply_async')
+    mocker.patch('app.celery.tasks.save_smss.apply_async')
     mocker.patch('app.encryption.encrypt', return_value="something_encrypted")
     mocker.patch('app.celery.tasks.create_uuid', return_value="uuid")
 
@@ -122,10 +131,9 @@ def test_should_process_sms_job(sample_job, mocker):
     assert encryption.encrypt.call_args[0][0]['template_version'] == sample_job.template.version
     assert encryption.encrypt.call_args[0][0]['personalisation'] == {'phonenumber': '+441234123123'}
     assert encryption.encrypt.call_args[0][0]['row_number'] == 0
-    tasks.save_sms.apply_async.assert_called_once_with(
+    tasks.save_smss.apply_async.assert_called_once_with(
         (str(sample_job.service_id),
-         "uuid",
-         "something_encrypted"),
+         ["something_encrypted"]),
         {},
         queue="database-tasks"
     )
@@ -136,16 +144,15 @@ def test_should_process_sms_job(sample_job, mocker):
 def test_should_process_sms_job_with_sender_id(sample_job, mocker, fake_uuid):
     mocker.patch('app.celery.tasks.s3.get_job_and_metadata_from_s3',
                  return_value=(load_example_csv('sms'), {'sender_id': fake_uuid}))
-    mocker.patch('app.celery.tasks.save_sms.apply_async')
+    mocker.patch('app.celery.tasks.save_smss.apply_async')
     mocker.patch('app.encryption.encrypt', return_value="something_encrypted")
     mocker.patch('app.celery.tasks.create_uuid', return_value="uuid")
 
     process_job(sample_job.id, sender_id=fake_uuid)
 
-    tasks.save_sms.apply_async.assert_called_once_with(
+    tasks.save_smss.apply_async.assert_called_once_with(
         (str(sample_job.service_id),
-         "uuid",
-         "something_encrypted"),
+         ["something_encrypted"]),
         {'sender_id': fake_uuid},
         queue="database-tasks"
     )
@@ -172,7 +179,7 @@ def test_should_not_process_if_send_limit_is_exceeded(
     mocker.patch('app.celery.tasks.s3.get_job_and_metadata_from_s3',
                  return_value=(load_example_csv('multiple_sms'), {'sender_id': None}))
     mocker.patch('app.celery.tasks.process_row')
-    mocker.patch('app.celery.tasks.check_service_over_daily_message_limit',
+    mocker.patch('app.celery.tasks.check_and_reserve_limits',
                  side_effect=TooManyRequestsError("exceeded limit"))
     process_job(job.id)
 
@@ -191,7 +198,7 @@ def test_should_not_process_if_send_limit_is_exceeded_by_job_notification_count(
     mock_s3 = mocker.patch('app.celery.tasks.s3.get_job_and_metadata_from_s3',
                            return_value=(load_example_csv('multiple_sms'), {'sender_id': None}))
     mock_process_row = mocker.patch('app.celery.tasks.process_row')
-    mocker.patch('app.celery.tasks.check_service_over_daily_message_limit',
+    mocker.patch('app.celery.tasks.check_and_reserve_limits',
                  return_value=0)
     process_job(job.id)
 
@@ -210,10 +217,10 @@ def test_should_process_job_if_send_limits_are_not_exceeded(
 
     mocker.patch('app.celery.tasks.s3.get_job_and_metadata_from_s3',
                  return_value=(load_example_csv('multiple_email'), {"sender_id": None}))
-    mocker.patch('app.celery.tasks.save_email.apply_async')
+    mocker.patch('app.celery.tasks.save_emails.apply_async')
     mocker.patch('app.encryption.encrypt', return_value="something_encrypted")
     mocker.patch('app.celery.tasks.create_uuid', return_value="uuid")
-    mocker.patch('app.celery.tasks.check_service_over_daily_message_limit', return_value=0)
+    mocker.patch('app.celery.tasks.check_and_reserve_limits', return_value=0)
     process_job(job.id)
 
     s3.get_job_and_metadata_from_s3.assert_called_once_with(
@@ -222,11 +229,10 @@ def test_should_process_job_if_send_limits_are_not_exceeded(
     )
     job = jobs_dao.dao_get_job_by_id(job.id)
     assert job.job_status == 'finished'
-    tasks.save_email.apply_async.assert_called_with(
+    tasks.save_emails.apply_async.assert_called_once_with(
         (
             str(job.service_id),
-            "uuid",
-            "something_encrypted",
+            ["something_encrypted"] * 10,
         ),
         {},
         queue="database-tasks"
@@ -236,7 +242,7 @@ def test_should_process_job_if_send_limits_are_not_exceeded(
 def test_should_not_create_save_task_for_empty_file(sample_job, mocker):
     mocker.patch('app.celery.tasks.s3.get_job_and_metadata_from_s3',
                  return_value=(load_example_csv('empty'), {"sender_id": None}))
-    mocker.patch('app.celery.tasks.save_sms.apply_async')
+    mocker.patch('app.celery.tasks.save_smss.apply_async')
 
     process_job(sample_job.id)
 
@@ -246,7 +252,7 @@ def test_should_not_create_save_task_for_empty_file(sample_job, mocker):
     )
     job = jobs_dao.dao_get_job_by_id(sample_job.id)
     assert job.job_status == 'finished'
-    assert tasks.save_sms.apply_async.called is False
+    assert tasks.save_smss.apply_async.called is False
 
 
 def test_should_process_email_job(email_job_with_placeholders, mocker):
@@ -254,7 +260,7 @@ def test_should_process_email_job(email_job_with_placeholders, mocker):
     test@test.com,foo
     """
     mocker.patch('app.celery.tasks.s3.get_job_and_metadata_from_s3', return_value=(email_csv, {"sender_id": None}))
-    mocker.patch('app.celery.tasks.save_email.apply_async')
+    mocker.patch('app.celery.tasks.save_emails.apply_async')
     mocker.patch('app.encryption.encrypt', return_value="something_encrypted")
     mocker.patch('app.celery.tasks.create_uuid', return_value="uuid")
 
@@ -268,11 +274,10 @@ def test_should_process_email_job(email_job_with_placeholders, mocker):
     assert encryption.encrypt.call_args[0][0]['template'] == str(email_job_with_placeholders.template.id)
     assert encryption.encrypt.call_args[0][0]['template_version'] == email_job_with_placeholders.template.version
     assert encryption.encrypt.call_args[0][0]['personalisation'] == {'emailaddress': 'test@test.com', 'name': 'foo'}
-    tasks.save_email.apply_async.assert_called_once_with(
+    tasks.save_emails.apply_async.assert_called_once_with(
         (
             str(email_job_with_placeholders.service_id),
-            "uuid",
-            "something_encrypted",
+            ["something_encrypted"],
         ),
         {},
         queue="database-tasks"
@@ -286,16 +291,15 @@ def test_should_process_email_job_with_sender_id(email_job_with_placeholders, mo
     test@test.com,foo
     """
     mocker.patch('app.celery.tasks.s3.get_job_and_metadata_from_s3', return_value=(email_csv, {"sender_id": fake_uuid}))
-    mocker.patch('app.celery.tasks.save_email.apply_async')
+    mocker.patch('app.celery.tasks.save_emails.apply_async')
     mocker.patch('app.encryption.encrypt', return_value="something_encrypted")
     mocker.patch('app.celery.tasks.create_uuid', return_value="uuid")
 
     process_job(email_job_with_placeholders.id, sender_id=fake_uuid)
 
-    tasks.save_email.apply_async.assert_called_once_with(
+    tasks.save_emails.apply_async.assert_called_once_with(
         (str(email_job_with_placeholders.service_id),
-         "uuid",
-         "something_encrypted"),
+         ["something_encrypted"]),
         {'sender_id': fake_uuid},
         queue="database-tasks"
     )
@@ -340,7 +344,7 @@ def test_should_process_all_sms_job(sample_job_with_placeholdered_template,
                                     mocker):
     mocker.patch('app.celery.tasks.s3.get_job_and_metadata_from_s3',
                  return_value=(load_example_csv('multiple_sms'), {"sender_id": None}))
-    mocker.patch('app.celery.tasks.save_sms.apply_async')
+    mocker.patch('app.celery.tasks.save_smss.apply_async')
     mocker.patch('app.encryption.encrypt', return_value="something_encrypted")
     mocker.patch('app.celery.tasks.create_uuid', return_value="uuid")
 
@@ -355,7 +359,12 @@ def test_should_process_all_sms_job(sample_job_with_placeholdered_template,
     assert encryption.encrypt.call_args[0][0][
                'template_version'] == sample_job_with_placeholdered_template.template.version  # noqa
     assert encryption.encrypt.call_args[0][0]['personalisation'] == {'phonenumber': '+441234123120', 'name': 'chris'}
-    assert tasks.save_sms.apply_async.call_count == 10
+    assert encryption.encrypt.call_count == 10
+    tasks.save_smss.apply_async.assert_called_once_with(
+        (str(sample_job_with_placeholdered_template.service_id), ["something_encrypted"] * 10),
+        {},
+        queue="database-tasks"
+    )
     job = jobs_dao.dao_get_job_by_id(sample_job_with_placeholdered_template.id)
     assert job.job_status == 'finished'
 
@@ -1742,6 +1751,141 @@ def test_process_incomplete_job_letter(mocker, sample_letter_template):
 
 
 @freeze_time('2017-01-01')
+def test_get_job_chunks_splits_file_on_row_boundaries():
+    csv_file = b'phone number,name\r\n07700900001,"multi\nline"\r\n07700900002,b\r\n\r\n07700900003,c\r\n'
+
+    chunks = list(get_job_chunks(io.BytesIO(csv_file), 2))
+
+    assert chunks == [
+        JobChunk(0, 'phone number,name\r\n', 0, 19, 62),
+        JobChunk(1, 'phone number,name\r\n', 3, 62, 77),
+    ]
+    assert csv_file[62:77] == b'07700900003,c\r\n'
+
+
+def test_get_job_chunks_splits_lines_the_same_way_as_recipient_csv():
+    csv_file = b'phone number,name\r07700900001,a\r07700900002,b\r07700900003,c\x0b07700900004,d\r'
+
+    chunks = list(get_job_chunks(io.BytesIO(csv_file), 2))
+
+    assert chunks == [
+        JobChunk(0, 'phone number,name\r', 0, 18, 46),
+        JobChunk(1, 'phone number,name\r', 2, 46, 74),
+    ]
+    assert csv_file[46:74] == b'07700900003,c\x0b07700900004,d\r'
+
+
+@pytest.mark.parametrize('block_size', [1, 2, 3, 64 * 1024])
+def test_iter_lines_splits_lines_across_blocks(block_size):
+    csv_file = 'phone number\r\n07700900001\r07700900002\n0770090000é\u2028'
+    stream = io.BytesIO(csv_file.encode('utf-8'))
+
+    assert list(tasks._iter_lines(stream, block_size)) == csv_file.splitlines(keepends=True)
+
+
+def test_get_job_chunks_returns_nothing_for_empty_file():
+    assert list(get_job_chunks(io.BytesIO(b''), 2)) == []
+
+
+def test_process_job_splits_large_job_into_chunks(notify_api, sample_template, mocker):
+    job = create_job(template=sample_template, notification_count=10)
+    mocker.patch('app.celery.tasks.s3.get_job_stream_and_metadata_from_s3',
+                 return_value=(io.BytesIO(load_example_csv('multiple_sms').encode('utf-8')), {'sender_id': None}))
+    mock_process_chunk = mocker.patch('app.celery.tasks.process_job_chunk.apply_async')
+    mock_save_sms = mocker.patch('app.celery.tasks.save_sms.apply_async')
+
+    with set_config(notify_api, 'JOB_CHUNK_SIZE', 4):
+        process_job(job.id)
+
+    assert mock_process_chunk.call_args_list == [
+        call((str(job.id), 0, 'PhoneNumber,Name\n', 0, 17, 97), {'sender_id': None, 'resumed': False},
+             queue='job-tasks'),
+        call((str(job.id), 1, 'PhoneNumber,Name\n', 4, 97, 177), {'sender_id': None, 'resumed': False},
+             queue='job-tasks'),
+        call((str(job.id), 2, 'PhoneNumber,Name\n', 8, 177, 217), {'sender_id': None, 'resumed': False},
+             queue='job-tasks'),
+    ]
+    assert not mock_save_sms.called
+    assert job.job_status == JOB_STATUS_IN_PROGRESS
+    assert job.chunk_count == 3
+    assert job.completed_chunks == []
+
+
+def test_process_job_chunk_saves_rows_with_job_row_numbers(sample_template, mocker):
+    job = create_job(template=sample_template, notification_count=10, job_status=JOB_STATUS_IN_PROGRESS)
+    job.chunk_count = 3
+    job.completed_chunks = [0]
+    jobs_dao.dao_update_job(job)
+    mock_get_range = mocker.patch('app.celery.tasks.s3.get_job_byte_range_from_s3',
+                                  return_value='+441234123125,chris\n+441234123126,chris\n')
+    mock_save_smss = mocker.patch('app.celery.tasks.save_smss.apply_async')
+    mock_encrypt = mocker.patch('app.encryption.encrypt', return_value='something_encrypted')
+
+    process_job_chunk(str(job.id), 1, 'PhoneNumber,Name\n', 4, 97, 137)
+
+    mock_get_range.assert_called_once_with(str(job.service_id), str(job.id), 97, 137)
+    mock_save_smss.assert_called_once_with(
+        (str(job.service_id), ['something_encrypted', 'something_encrypted']),
+        {},
+        queue='database-tasks'
+    )
+    assert [args[0][0]['row_number'] for args in mock_encrypt.call_args_list] == [4, 5]
+    assert job.completed_chunks == [0, 1]
+    assert job.job_status == JOB_STATUS_IN_PROGRESS
+
+
+def test_process_job_chunk_finishes_job_when_last_chunk_completes(sample_template, mocker):
+    job = create_job(template=sample_template, notification_count=10, job_status=JOB_STATUS_IN_PROGRESS)
+    job.chunk_count = 2
+    job.completed_chunks = [1]
+    jobs_dao.dao_update_job(job)
+    mocker.patch('app.celery.tasks.s3.get_job_byte_range_from_s3', return_value='+441234123121,chris\n')
+    mocker.patch('app.celery.tasks.save_smss.apply_async')
+
+    process_job_chunk(str(job.id), 0, 'PhoneNumber,Name\n', 0, 17, 37)
+
+    assert job.job_status == JOB_STATUS_FINISHED
+    assert sorted(job.completed_chunks) == [0, 1]
+
+
+def test_process_job_chunk_skips_rows_already_saved_when_resumed(sample_template, mocker):
+    job = create_job(template=sample_template, notification_count=10, job_status=JOB_STATUS_IN_PROGRESS)
+    job.chunk_count = 3
+    job.completed_chunks = []
+    jobs_dao.dao_update_job(job)
+    create_notification(sample_template, job, 4)
+    mocker.patch('app.celery.tasks.s3.get_job_byte_range_from_s3',
+                 return_value='+441234123125,chris\n+441234123126,chris\n')
+    mock_save_smss = mocker.patch('app.celery.tasks.save_smss.apply_async')
+    mock_encrypt = mocker.patch('app.encryption.encrypt', return_value='something_encrypted')
+
+    process_job_chunk(str(job.id), 1, 'PhoneNumber,Name\n', 4, 97, 137, resumed=True)
+
+    assert mock_save_smss.call_args[0][0] == (str(job.service_id), ['something_encrypted'])
+    assert mock_encrypt.call_args[0][0]['row_number'] == 5
+
+
+def test_process_incomplete_job_resumes_chunks_that_are_not_complete(notify_api, sample_template, mocker):
+    job = create_job(template=sample_template, notification_count=10,
+                     created_at=datetime.utcnow() - timedelta(hours=2),
+                     processing_started=datetime.utcnow() - timedelta(minutes=31),
+                     job_status=JOB_STATUS_ERROR)
+    job.chunk_count = 3
+    job.completed_chunks = [0, 2]
+    jobs_dao.dao_update_job(job)
+    mocker.patch('app.celery.tasks.s3.get_job_stream_and_metadata_from_s3',
+                 return_value=(io.BytesIO(load_example_csv('multiple_sms').encode('utf-8')), {'sender_id': None}))
+    mock_process_chunk = mocker.patch('app.celery.tasks.process_job_chunk.apply_async')
+
+    with set_config(notify_api, 'JOB_CHUNK_SIZE', 4):
+        process_incomplete_job(str(job.id))
+
+    mock_process_chunk.assert_called_once_with(
+        (str(job.id), 1, 'PhoneNumber,Name\n', 4, 97, 177), {'sender_id': None, 'resumed': True}, queue='job-tasks'
+    )
+    assert job.job_status == JOB_STATUS_ERROR
+
+
 def test_process_incomplete_jobs_sets_status_to_in_progress_and_resets_processing_started_time(mocker, sample_template):
     mock_process_incomplete_job = mocker.patch('app.celery.tasks.process_incomplete_job')
 
@@ -1906,6 +2050,190 @@ def test_save_api_email_dont_retry_if_notification_already_exists(sample_service
     mock_provider_task.assert_called_once_with([data['id']], queue=expected_queue)
 
 
+def test_process_rows_publishes_sms_rows_in_batches(notify_api, sample_job, mocker):
+    mock_save_smss = mocker.patch('app.celery.tasks.save_smss.apply_async')
+    mock_encrypt = mocker.patch(
+        'app.encryption.encrypt', side_effect=lambda data: f"encrypted row {data['row_number']}"
+    )
+    mocker.patch('app.celery.tasks.create_uuid', side_effect=['uuid0', 'uuid1', 'uuid2'])
+    template = sample_job.template._as_utils_template()
+    rows = list(RecipientCSV('phone number\n07700 900000\n07700 900001\n07700 900002', template=template).get_rows())
+
+    with set_config(notify_api, 'JOB_ROW_BATCH_SIZE', 2):
+        notification_ids = process_rows(rows, template, sample_job, sample_job.service, row_offset=10)
+
+    assert notification_ids == ['uuid0', 'uuid1', 'uuid2']
+    assert mock_save_smss.call_args_list == [
+        call((str(sample_job.service_id), ['encrypted row 10', 'encrypted row 11']), {}, queue='database-tasks'),
+        call((str(sample_job.service_id), ['encrypted row 12']), {}, queue='database-tasks'),
+    ]
+    assert mock_encrypt.call_args_list[0][0][0] == {
+        'id': 'uuid0',
+        'template': str(sample_job.template_id),
+        'template_version': sample_job.template_version,
+        'job': str(sample_job.id),
+        'to': '07700 900000',
+        'row_number': 10,
+        'personalisation': {'phonenumber': '07700 900000'},
+    }
+
+
+def test_process_rows_sends_letter_rows_one_at_a_time(sample_letter_job, mocker):
+    mock_process_row = mocker.patch('app.celery.tasks.process_row', side_effect=['uuid0', 'uuid1'])
+    template = Mock(template_type=LETTER_TYPE)
+    rows = [Mock(index=0), Mock(index=1)]
+
+    notification_ids = process_rows(rows, template, sample_letter_job, sample_letter_job.service, row_offset=5)
+
+    assert notification_ids == ['uuid0', 'uuid1']
+
+    assert mock_process_row.call_args_list == [
+        call(rows[0], template, sample_letter_job, sample_letter_job.service, sender_id=None, row_number=5),
+        call(rows[1], template, sample_letter_job, sample_letter_job.service, sender_id=None, row_number=6),
+    ]
+
+
+@freeze_time('2020-03-25 14:30')
+@pytest.mark.parametrize('task_function, template_type, recipient, expected_queue', [
+    (save_smss, SMS_TYPE, '+447700900855', QueueNames.SEND_SMS),
+    (save_emails, EMAIL_TYPE, 'jane.citizen@example.com', QueueNames.SEND_EMAIL),
+])
+def test_save_smss_and_emails_save_batch_and_only_deliver_new_notifications(
+    sample_service, mocker, task_function, template_type, recipient, expected_queue
+):
+    template = create_template(sample_service, template_type=template_type)
+    job = create_job(template)
+    mock_provider_task = mocker.patch(f'app.celery.provider_tasks.deliver_{template_type}.apply_async')
+    notifications_data = [
+        dict(_notification_json(template, recipient, job_id=job.id, row_number=i), id=str(uuid.uuid4()))
+        for i in range(3)
+    ]
+    encrypted = [encryption.encrypt(data) for data in notifications_data]
+
+    task_function(str(sample_service.id), encrypted[:2])
+    # SQS delivers an overlapping batch - only the new row should be saved and sent
+    task_function(str(sample_service.id), encrypted[1:])
+
+    notifications = Notification.query.order_by(Notification.job_row_number).all()
+    assert [str(n.id) for n in notifications] == [data['id'] for data in notifications_data]
+    assert [n.job_row_number for n in notifications] == [0, 1, 2]
+    assert all(n.job_id == job.id for n in notifications)
+    assert all(n.created_at == datetime(2020, 3, 25, 14, 30) for n in notifications)
+    assert mock_provider_task.call_args_list == [
+        call([data['id']], queue=expected_queue) for data in notifications_data
+    ]
+
+
+def test_save_smss_does_not_save_rows_for_restricted_service_to_invalid_numbers(notify_db_session, mocker):
+    user = create_user(mobile_number="07700 900205")
+    service = create_service(user=user, restricted=True)
+    template = create_template(service)
+    mock_deliver_sms = mocker.patch('app.celery.provider_tasks.deliver_sms.apply_async')
+    allowed = dict(_notification_json(template, '07700 900205'), id=str(uuid.uuid4()))
+    not_allowed = dict(_notification_json(template, '07700 900849', row_number=1), id=str(uuid.uuid4()))
+
+    save_smss(str(service.id), [encryption.encrypt(allowed), encryption.encrypt(not_allowed)])
+
+    assert [str(n.id) for n in Notification.query.all()] == [allowed['id']]
+    mock_deliver_sms.assert_called_once_with([allowed['id']], queue=QueueNames.SEND_SMS)
+
+
+def test_save_smss_uses_sms_sender_reply_to_text(notify_db_session, mocker):
+    service = create_service_with_defined_sms_sender(sms_sender_value='07123123123')
+    template = create_template(service=service)
+    new_sender = service_sms_sender_dao.dao_add_sms_sender_for_service(service.id, 'new-sender', False)
+    mocker.patch('app.celery.provider_tasks.deliver_sms.apply_async')
+    data = dict(_notification_json(template, '07700 900205'), id=str(uuid.uuid4()))
+
+    save_smss(str(service.id), [encryption.encrypt(data)], sender_id=new_sender.id)
+
+    assert Notification.query.one().reply_to_text == 'new-sender'
+
+
+def test_save_smss_retries_on_sqlalchemy_error(sample_template, mocker):
+    mocker.patch('app.celery.tasks.persist_notifications', side_effect=SQLAlchemyError)
+    mock_retry = mocker.patch('app.celery.tasks.save_smss.retry', side_effect=Retry)
+    mock_deliver_sms = mocker.patch('app.celery.provider_tasks.deliver_sms.apply_async')
+    data = dict(_notification_json(sample_template, '+447700900855'), id=str(uuid.uuid4()))
+
+    with pytest.raises(Retry):
+        save_smss(str(sample_template.service_id), [encryption.encrypt(data)])
+
+    mock_retry.assert_called_once_with(queue=QueueNames.RETRY)
+    assert not mock_deliver_sms.called
+
+
+@freeze_time('2020-03-25 14:30')
+@pytest.mark.parametrize('notification_type, task_function, recipient, expected_queue', [
+    ('sms', save_api_smss, '+447700900855', QueueNames.SEND_SMS),
+    ('email', save_api_emails, 'jane.citizen@example.com', QueueNames.SEND_EMAIL),
+])
+def test_save_api_emails_or_smss_saves_batch_and_only_delivers_new_notifications(
+    sample_service, mocker, notification_type, task_function, recipient, expected_queue
+):
+    template = create_template(sample_service, template_type=notification_type)
+    mock_provider_task = mocker.patch(f'app.celery.provider_tasks.deliver_{notification_type}.apply_async')
+    api_key = create_api_key(service=template.service)
+    notifications_data = [
+        {
+            "id": str(uuid.uuid4()),
+            "template_id": str(template.id),
+            "template_version": template.version,
+            "to": recipient,
+            "service_id": str(template.service_id),
+            "personalisation": None,
+            "notification_type": notification_type,
+            "api_key_id": str(api_key.id),
+            "key_type": api_key.key_type,
+            "client_reference": f'ref {i}',
+            "reply_to_text": None,
+            "document_download_count": None,
+            "status": NOTIFICATION_CREATED,
+            "created_at": datetime.utcnow().strftime(DATETIME_FORMAT),
+        }
+        for i in range(3)
+    ]
+    encrypted = [encryption.encrypt(data) for data in notifications_data]
+
+    task_function(encrypted_notifications=encrypted[:2])
+    # SQS delivers an overlapping batch - only the new notification should be saved and sent
+    task_function(encrypted_notifications=encrypted[1:])
+
+    notifications = Notification.query.order_by(Notification.client_reference).all()
+    assert [str(n.id) for n in notifications] == [data['id'] for data in notifications_data]
+    assert all(n.created_at == datetime(2020, 3, 25, 14, 30) for n in notifications)
+    assert all(n.billable_units == 0 for n in notifications)
+    assert mock_provider_task.call_args_list == [
+        call([data['id']], queue=expected_queue) for data in notifications_data
+    ]
+
+
+def test_save_api_emails_or_smss_retries_on_sqlalchemy_error(sample_template, mocker):
+    mocker.patch('app.celery.tasks.persist_notifications', side_effect=SQLAlchemyError)
+    mock_retry = mocker.patch('app.celery.tasks.save_api_smss.retry', side_effect=Retry)
+    data = {
+        "id": str(uuid.uuid4()),
+        "template_id": str(sample_template.id),
+        "template_version": sample_template.version,
+        "to": '+447700900855',
+        "service_id": str(sample_template.service_id),
+        "personalisation": None,
+        "notification_type": SMS_TYPE,
+        "api_key_id": None,
+        "key_type": KEY_TYPE_NORMAL,
+        "client_reference": None,
+        "reply_to_text": None,
+        "document_download_count": None,
+        "status": NOTIFICATION_CREATED,
+        "created_at": datetime.utcnow().strftime(DATETIME_FORMAT),
+    }
+
+    with pytest.raises(Retry):
+        save_api_smss(encrypted_notifications=[encryption.encrypt(data)])
+
+    mock_retry.assert_called_once_with(queue=QueueNames.RETRY)
+
+
 @pytest.mark.parametrize('task_function, delivery_mock, recipient, template_args', (
     (
         save_email,
@@ -70,6 +70,7 @@ def test_send_sms_calls_firetext_correctly(mocker, mock_firetext_client):
     assert request_mock.call_count == 1
     assert request_mock.request_history[0].url == 'https://example.com/firetext'
     assert request_mock.request_history[0].method == 'POST'
+    assert request_mock.request_history[0].timeout == (5, 60)
 
     request_args = parse_qs(request_mock.request_history[0].text)
     assert request_args['apiKey'][0] == 'foo'
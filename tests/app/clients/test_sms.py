@@ -0,0 +1,37 @@
+from unittest.mock import Mock
+
+import pytest
+from requests import Request
+from requests.adapters import HTTPAdapter
+
+from app.clients.sms import ConnectionCountingHTTPAdapter
+
+
+@pytest.mark.parametrize('new_connections, expected_metric', [
+    (0, 'clients.firetext.reused-connection'),
+    (1, 'clients.firetext.new-connection'),
+])
+def test_connection_counting_adapter_counts_new_and_reused_connections(mocker, new_connections, expected_metric):
+    statsd_client = Mock()
+    pool = Mock(num_connections=3)
+
+    def send(request, **kwargs):
+        pool.num_connections += new_connections
+        return 'response'
+
+    mocker.patch.object(HTTPAdapter, 'get_connection', return_value=pool)
+    mocker.patch.object(HTTPAdapter, 'send', side_effect=send)
+    adapter = ConnectionCountingHTTPAdapter(statsd_client, 'clients.firetext', pool_maxsize=10)
+
+    assert adapter.send(Request('POST', 'https://example.com/firetext').prepare(), timeout=(5, 60)) == 'response'
+
+    statsd_client.incr.assert_called_once_with(expected_metric)
+
+
+def test_sms_client_sessions_keep_connections_open_without_retrying(mock_firetext_client):
+    adapter = mock_firetext_client.session.get_adapter('https://example.com/firetext')
+
+    assert isinstance(adapter, ConnectionCountingHTTPAdapter)
+    assert adapter._pool_maxsize == 10
+    assert adapter.max_retries.total == 0
+    assert mock_firetext_client.timeout == (5, 60)
@@ -619,7 +619,10 @@ def mock_firetext_client(mocker):
         'FIRETEXT_URL': 'https://example.com/firetext',
         'FIRETEXT_API_KEY': 'foo',
         'FIRETEXT_INTERNATIONAL_API_KEY': 'international',
-        'FROM_NUMBER': 'bar'
+        'FROM_NUMBER': 'bar',
+        'SMS_CLIENT_CONNECT_TIMEOUT_SECONDS': 5,
+        'SMS_CLIENT_READ_TIMEOUT_SECONDS': 60,
+        'SMS_CLIENT_POOL_SIZE': 10,
     })
     client.init_app(current_app, statsd_client)
     return client
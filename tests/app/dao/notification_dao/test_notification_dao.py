@@ -7,6 +7,7 @@ from freezegun import freeze_time
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from sqlalchemy.orm.exc import NoResultFound
 
+from app import db
 from app.dao.notifications_dao import (
     dao_create_notification,
     dao_delete_notifications_by_id,
@@ -17,9 +18,14 @@ from app.dao.notifications_dao import (
     dao_get_notification_count_for_job_id,
     dao_get_notification_or_history_by_reference,
     dao_get_notifications_by_recipient_or_reference,
+    dao_get_notifications_or_history_by_references,
+    dao_set_notification_values,
     dao_timeout_notifications,
     dao_update_notification,
+    dao_update_notification_statuses,
     dao_update_notifications_by_reference,
+    dao_update_notifications_from_status_buffer,
+    dao_update_notifications_sent_to_provider,
     get_notification_by_id,
     get_notification_with_personalisation,
     get_notifications_for_job,
@@ -47,6 +53,9 @@ from app.models import (
     Notification,
     NotificationHistory,
 )
+from app.notifications.notification_status_buffer import (
+    notification_status_buffer,
+)
 from tests.app.db import (
     create_job,
     create_notification,
@@ -54,6 +63,7 @@ from tests.app.db import (
     create_service,
     create_template,
 )
+from tests.conftest import set_config
 
 
 def test_should_by_able_to_update_status_by_reference(sample_email_template, ses_provider):
@@ -1742,3 +1752,128 @@ def test_get_service_ids_with_notifications_on_date_respects_gmt_bst(
     create_notification(template=sample_template, created_at=created_at_utc)
     service_ids = get_service_ids_with_notifications_on_date(SMS_TYPE, date_to_check)
     assert len(service_ids) == expected_count
+
+
+@freeze_time('2022-03-20 12:00')
+def test_dao_update_notifications_sent_to_provider(sample_template):
+    sent = create_notification(template=sample_template, status='created')
+    failed = create_notification(template=sample_template, status='created')
+    delivered_already = create_notification(template=sample_template, status='delivered')
+    untouched = create_notification(template=sample_template, status='created')
+
+    dao_update_notifications_sent_to_provider([
+        {
+            'id': sent.id,
+            'billable_units': 2,
+            'sent_at': datetime(2022, 3, 20, 11),
+            'sent_by': 'mmg',
+            'status': 'sending',
+        },
+        {'id': failed.id, 'billable_units': 3},
+        {
+            'id': delivered_already.id,
+            'billable_units': 1,
+            'sent_at': datetime(2022, 3, 20, 11),
+            'sent_by': 'firetext',
+            'status': 'sending',
+        },
+    ])
+
+    assert (sent.billable_units, sent.sent_at, sent.sent_by, sent.status, sent.updated_at) == (
+        2, datetime(2022, 3, 20, 11), 'mmg', 'sending', datetime(2022, 3, 20, 12)
+    )
+    assert (failed.billable_units, failed.sent_at, failed.sent_by, failed.status) == (3, None, None, 'created')
+    assert (delivered_already.sent_by, delivered_already.status) == ('firetext', 'delivered')
+    assert untouched.updated_at is None
+
+
+def test_dao_update_notifications_from_status_buffer(sample_template):
+    sending = create_notification(template=sample_template, status='created')
+    delivered_already = create_notification(template=sample_template, status='delivered')
+    pending_already = create_notification(
+        template=sample_template, status='pending', updated_at=datetime(2022, 3, 20, 12, 30)
+    )
+    untouched = create_notification(template=sample_template, status='created')
+
+    dao_update_notifications_from_status_buffer({
+        sending.id: {
+            'status': 'sending',
+            'sent_at': datetime(2022, 3, 20, 11),
+            'sent_by': 'mmg',
+            'billable_units': 2,
+            'updated_at': datetime(2022, 3, 20, 12),
+        },
+        delivered_already.id: {'status': 'sending', 'sent_by': 'firetext', 'updated_at': datetime(2022, 3, 20, 12)},
+        pending_already.id: {'status': 'sending', 'updated_at': datetime(2022, 3, 20, 12)},
+    })
+
+    assert (sending.status, sending.sent_at, sending.sent_by, sending.billable_units, sending.updated_at) == (
+        'sending', datetime(2022, 3, 20, 11), 'mmg', 2, datetime(2022, 3, 20, 12)
+    )
+    assert (delivered_already.status, delivered_already.sent_by) == ('delivered', 'firetext')
+    assert (pending_already.status, pending_already.updated_at) == ('pending', datetime(2022, 3, 20, 12, 30))
+    assert (untouched.status, untouched.updated_at) == ('created', None)
+
+
+def test_dao_set_notification_values_buffers_values_if_status_buffer_is_on(notify_api, sample_notification, mocker):
+    mocker.patch.object(notification_status_buffer, '_ensure_flusher')
+    mocker.patch.dict(notification_status_buffer.pending, clear=True)
+
+    with set_config(notify_api, 'NOTIFICATION_STATUS_BUFFER_SECONDS', 1):
+        dao_set_notification_values(sample_notification, buffered=True, status='sending', sent_by='mmg')
+
+    assert notification_status_buffer.pending == {sample_notification.id: {'status': 'sending', 'sent_by': 'mmg'}}
+    # the buffered values are kept when the notification is reloaded, but aren't in the database yet
+    assert (sample_notification.status, sample_notification.sent_by) == ('sending', 'mmg')
+    assert db.session.execute(
+        'SELECT notification_status FROM notifications WHERE id = :id', {'id': sample_notification.id}
+    ).scalar() == 'created'
+
+    notification_status_buffer.flush()
+
+    assert db.session.execute(
+        'SELECT notification_status FROM notifications WHERE id = :id', {'id': sample_notification.id}
+    ).scalar() == 'sending'
+
+
+def test_update_notification_status_by_id_is_not_buffered_unless_asked(notify_api, sample_letter_template, mocker):
+    mock_add = mocker.patch.object(notification_status_buffer, 'add')
+    notification = create_notification(template=sample_letter_template, status='pending-virus-check')
+
+    with set_config(notify_api, 'NOTIFICATION_STATUS_BUFFER_SECONDS', 1):
+        update_notification_status_by_id(notification.id, 'technical-failure')
+
+    assert not mock_add.called
+    assert db.session.execute(
+        'SELECT notification_status FROM notifications WHERE id = :id', {'id': notification.id}
+    ).scalar() == 'technical-failure'
+
+
+def test_dao_get_notifications_or_history_by_references(sample_template):
+    notification = create_notification(template=sample_template, reference='ref1')
+    history = create_notification_history(template=sample_template, reference='ref2')
+
+    assert dao_get_notifications_or_history_by_references(['ref1', 'ref2', 'ref3']) == {
+        'ref1': notification,
+        'ref2': history,
+    }
+
+
+def test_dao_update_notification_statuses(sample_template):
+    delivered = create_notification(template=sample_template, reference='ref1', status='sending')
+    failed = create_notification(template=sample_template, reference='ref2', status='sending')
+    history = create_notification_history(template=sample_template, reference='ref3', status='sending')
+    untouched = create_notification(template=sample_template, reference='ref4', status='sending')
+
+    dao_update_notification_statuses([
+        (delivered, 'delivered'),
+        (failed, 'permanent-failure'),
+        (history, 'delivered'),
+    ])
+
+    assert (delivered.status, failed.status, history.status) == ('delivered', 'permanent-failure', 'delivered')
+    db.session.commit()
+    assert Notification.query.get(delivered.id).status == 'delivered'
+    assert Notification.query.get(failed.id).status == 'permanent-failure'
+    assert NotificationHistory.query.get(history.id).status == 'delivered'
+    assert Notification.query.get(untouched.id).status == 'sending'
@@ -1,5 +1,5 @@
 import uuid
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 
 import boto3
 import pytest
@@ -8,6 +8,8 @@ from freezegun import freeze_time
 from moto import mock_s3
 
 from app.dao.notifications_dao import (
+    dao_delete_notification_activity_before,
+    get_estimated_notification_counts_by_service_before,
     insert_notification_history_delete_notifications,
     move_notifications_to_notification_history,
 )
@@ -16,9 +18,11 @@ from app.models import (
     KEY_TYPE_TEAM,
     KEY_TYPE_TEST,
     Notification,
+    NotificationActivity,
     NotificationHistory,
 )
 from tests.app.db import (
+    create_ft_notification_status,
     create_notification,
     create_notification_history,
     create_service,
@@ -94,7 +98,7 @@ def test_move_notifications_does_nothing_if_notification_history_row_already_exi
 def test_move_notifications_deletes_letters_not_sent_and_in_final_state_from_table_but_not_s3(
     sample_service, mocker, notification_status
 ):
-    mock_s3_object = mocker.patch("app.dao.notifications_dao.find_letter_pdf_in_s3").return_value
+    mock_s3_object = mocker.patch("app.dao.notifications_dao.find_letter_pdf_key_and_size")
     letter_template = create_template(service=sample_service, template_type='letter')
     create_notification(
         template=letter_template,
@@ -156,7 +160,7 @@ def test_move_notifications_deletes_letters_sent_and_in_final_state_from_table_a
 def test_move_notifications_does_not_delete_letters_not_yet_in_final_state(
     sample_service, mocker, notification_status
 ):
-    mock_s3_object = mocker.patch("app.dao.notifications_dao.find_letter_pdf_in_s3").return_value
+    mock_s3_object = mocker.patch("app.dao.notifications_dao.find_letter_pdf_key_and_size")
     letter_template = create_template(service=sample_service, template_type='letter')
     create_notification(
         template=letter_template,
@@ -380,3 +384,66 @@ def test_insert_notification_history_delete_notifications_insert_for_key_type(sa
     assert len(notifications) == 1
     assert with_test_key.id == notifications[0].id
     assert len(history_rows) == 2
+
+
+def test_notification_activity_is_recorded_once_per_service_and_day(sample_template, sample_email_template):
+    create_notification(sample_template, created_at=datetime(2022, 3, 26, 23, 30))
+    create_notification(sample_template, created_at=datetime(2022, 3, 27, 22, 30))
+    create_notification(sample_template, created_at=datetime(2022, 3, 27, 23, 30))
+    create_notification(sample_email_template, created_at=datetime(2022, 3, 27, 12, 0))
+
+    assert sorted(
+        (activity.notification_type, activity.bst_date) for activity in NotificationActivity.query.all()
+    ) == [
+        ('email', date(2022, 3, 27)),
+        ('sms', date(2022, 3, 26)),
+        ('sms', date(2022, 3, 27)),
+        # 23:30 UTC is 00:30 BST on the 28th
+        ('sms', date(2022, 3, 28)),
+    ]
+
+
+def test_get_estimated_notification_counts_by_service_before(sample_service):
+    sms_template = create_template(sample_service)
+    email_template = create_template(sample_service, template_type='email')
+    other_service = create_service(service_name='other service')
+    other_template = create_template(other_service)
+
+    create_notification(sms_template, created_at=datetime(2022, 3, 1, 12, 0))
+    create_notification(sms_template, created_at=datetime(2022, 3, 2, 12, 0))
+    create_notification(sms_template, created_at=datetime(2022, 3, 9, 12, 0))
+    create_notification(email_template, created_at=datetime(2022, 3, 1, 12, 0))
+    create_notification(other_template, created_at=datetime(2022, 3, 2, 12, 0))
+    create_ft_notification_status(date(2022, 3, 1), service=sample_service, template=sms_template, count=100)
+    create_ft_notification_status(date(2022, 3, 2), service=sample_service, template=sms_template, count=20)
+    create_ft_notification_status(date(2022, 3, 9), service=sample_service, template=sms_template, count=3)
+
+    assert get_estimated_notification_counts_by_service_before('sms', date(2022, 3, 9)) == {
+        sample_service.id: 120,
+        # not in ft_notification_status yet
+        other_service.id: 0,
+    }
+
+
+def test_dao_delete_notification_activity_before_keeps_days_with_notifications_left(
+    sample_template, sample_email_template
+):
+    create_notification(sample_template, created_at=datetime(2022, 3, 1, 12, 0))
+    kept = create_notification(sample_template, created_at=datetime(2022, 3, 2, 12, 0))
+    create_notification(sample_template, created_at=datetime(2022, 3, 9, 12, 0))
+    create_notification(sample_email_template, created_at=datetime(2022, 3, 1, 12, 0))
+    Notification.query.filter(
+        Notification.notification_type == 'sms',
+        Notification.created_at < datetime(2022, 3, 9),
+        Notification.id != kept.id,
+    ).delete()
+
+    assert dao_delete_notification_activity_before(sample_template.service_id, 'sms', date(2022, 3, 9)) == 1
+
+    assert sorted(
+        (activity.notification_type, activity.bst_date) for activity in NotificationActivity.query.all()
+    ) == [
+        ('email', date(2022, 3, 1)),
+        ('sms', date(2022, 3, 2)),
+        ('sms', date(2022, 3, 9)),
+    ]
@@ -5,6 +5,7 @@ from app.dao.email_branding_dao import (
     dao_update_email_branding,
 )
 from app.models import EmailBranding
+from app.serialised_models import SerialisedEmailBranding
 from tests.app.db import create_email_branding
 
 
@@ -56,3 +57,14 @@ def test_email_branding_has_no_domain(notify_db, notify_db_session):
     create_email_branding()
     email_branding = EmailBranding.query.all()
     assert not hasattr(email_branding, 'domain')
+
+
+def test_update_email_branding_invalidates_cached_email_branding(notify_db_session):
+    email_branding = create_email_branding(logo='logo.png')
+    assert SerialisedEmailBranding.from_id(email_branding.id).name == email_branding.name
+
+    dao_update_email_branding(email_branding, name='new name', logo=None)
+
+    cached = SerialisedEmailBranding.from_id(email_branding.id)
+    assert cached.name == 'new name'
+    assert cached.logo_url is None
@@ -1,11 +1,16 @@
+from collections import defaultdict
 from datetime import date, datetime, timedelta
 from unittest import mock
 from uuid import UUID
 
 import pytest
 from freezegun import freeze_time
+from notifications_utils.timezones import convert_utc_to_bst
 
+from app import db
 from app.dao.fact_notification_status_dao import (
+    delete_live_notification_status_before,
+    fetch_live_notification_status_differences,
     fetch_monthly_notification_statuses_per_service,
     fetch_monthly_template_usage_for_service,
     fetch_notification_status_for_service_by_month,
@@ -14,8 +19,11 @@ from app.dao.fact_notification_status_dao import (
     fetch_notification_status_totals_for_all_services,
     fetch_notification_statuses_for_job,
     fetch_stats_for_all_services_by_date_range,
+    get_total_notifications_for_all_time,
     get_total_notifications_for_date_range,
     update_fact_notification_status,
+    update_fact_notification_status_for_day,
+    update_fact_notification_status_totals,
 )
 from app.models import (
     EMAIL_TYPE,
@@ -33,6 +41,9 @@ from app.models import (
     NOTIFICATION_TEMPORARY_FAILURE,
     SMS_TYPE,
     FactNotificationStatus,
+    FactNotificationStatusTotal,
+    LiveNotificationStatus,
+    Notification,
 )
 from tests.app.db import (
     create_ft_notification_status,
@@ -633,3 +644,177 @@ def test_update_fact_notification_status_respects_gmt_bst(
         service_id=sample_service.id,
         bst_date=process_day
     ).count() == expected_count
+
+
+def _live_counts(service):
+    counts = defaultdict(int)
+    for row in LiveNotificationStatus.query.filter_by(service_id=service.id).all():
+        counts[(row.bst_date, row.notification_status)] += row.notification_count
+    return dict(counts)
+
+
+@freeze_time('2021-06-01T23:30:00')
+def test_live_notification_status_counts_notifications_by_bst_date(sample_template):
+    create_notification(sample_template, created_at=datetime(2021, 6, 1, 22, 59))
+    create_notification(sample_template)
+    create_notification(sample_template, status=NOTIFICATION_DELIVERED)
+
+    assert _live_counts(sample_template.service) == {
+        (date(2021, 6, 1), NOTIFICATION_CREATED): 1,
+        (date(2021, 6, 2), NOTIFICATION_CREATED): 1,
+        (date(2021, 6, 2), NOTIFICATION_DELIVERED): 1,
+    }
+
+
+@freeze_time('2021-06-01T12:00:00')
+def test_live_notification_status_moves_counts_when_status_changes(sample_template):
+    today = date(2021, 6, 1)
+    notifications = [create_notification(sample_template) for _ in range(3)]
+
+    notifications[0].status = NOTIFICATION_SENDING
+    db.session.commit()
+    Notification.query.filter(
+        Notification.id.in_([notifications[1].id, notifications[2].id])
+    ).update({'status': NOTIFICATION_DELIVERED}, synchronize_session=False)
+    db.session.commit()
+
+    assert _live_counts(sample_template.service) == {
+        (today, NOTIFICATION_CREATED): 0,
+        (today, NOTIFICATION_SENDING): 1,
+        (today, NOTIFICATION_DELIVERED): 2,
+    }
+
+
+@freeze_time('2021-06-01T12:00:00')
+def test_live_notification_status_ignores_updates_that_do_not_change_status(sample_template):
+    notification = create_notification(sample_template, status=NOTIFICATION_SENDING)
+
+    notification.billable_units = 2
+    db.session.commit()
+
+    assert _live_counts(sample_template.service) == {(date(2021, 6, 1), NOTIFICATION_SENDING): 1}
+
+
+def test_live_notification_status_removes_deleted_notifications(sample_template):
+    # not frozen, as only notifications created in the last couple of days (by the database clock) are counted
+    today = convert_utc_to_bst(datetime.utcnow()).date()
+    notification = create_notification(sample_template)
+    create_notification(sample_template)
+
+    Notification.query.filter_by(id=notification.id).delete()
+    db.session.commit()
+
+    assert _live_counts(sample_template.service) == {(today, NOTIFICATION_CREATED): 1}
+
+
+@freeze_time('2021-06-02T10:00:00')
+def test_fetch_live_notification_status_differences(sample_template):
+    create_notification(sample_template, created_at=datetime(2021, 6, 1, 12), status=NOTIFICATION_DELIVERED)
+    create_notification(sample_template, created_at=datetime(2021, 6, 1, 12), status=NOTIFICATION_FAILED)
+    update_fact_notification_status_for_day(date(2021, 6, 1), SMS_TYPE)
+
+    assert fetch_live_notification_status_differences(date(2021, 6, 1), SMS_TYPE) == []
+
+    LiveNotificationStatus.query.filter_by(notification_status=NOTIFICATION_FAILED).update({'notification_count': 3})
+    FactNotificationStatus.query.filter_by(notification_status=NOTIFICATION_DELIVERED).delete()
+    db.session.commit()
+
+    differences = sorted(
+        fetch_live_notification_status_differences(date(2021, 6, 1), SMS_TYPE),
+        key=lambda row: row.notification_status
+    )
+    assert [(row.notification_status, row.live_count, row.nightly_count) for row in differences] == [
+        (NOTIFICATION_DELIVERED, 1, 0),
+        (NOTIFICATION_FAILED, 3, 1),
+    ]
+
+
+@freeze_time('2021-06-02T10:00:00')
+def test_fetch_live_notification_status_differences_sums_shards(sample_template):
+    create_notification(sample_template, created_at=datetime(2021, 6, 1, 12), status=NOTIFICATION_DELIVERED)
+    update_fact_notification_status_for_day(date(2021, 6, 1), SMS_TYPE)
+    live_row = LiveNotificationStatus.query.one()
+
+    # another connection moved the notification to a different status, and counted it in its own shard
+    for status, change in ((NOTIFICATION_DELIVERED, -1), (NOTIFICATION_FAILED, 1)):
+        db.session.add(LiveNotificationStatus(
+            bst_date=live_row.bst_date,
+            service_id=live_row.service_id,
+            notification_type=live_row.notification_type,
+            key_type=live_row.key_type,
+            template_id=live_row.template_id,
+            job_id=live_row.job_id,
+            notification_status=status,
+            shard=live_row.shard + 1,
+            notification_count=change,
+        ))
+    db.session.commit()
+
+    differences = sorted(
+        fetch_live_notification_status_differences(date(2021, 6, 1), SMS_TYPE),
+        key=lambda row: row.notification_status
+    )
+    assert [(row.notification_status, row.live_count, row.nightly_count) for row in differences] == [
+        (NOTIFICATION_DELIVERED, 0, 1),
+        (NOTIFICATION_FAILED, 1, 0),
+    ]
+
+
+@freeze_time('2021-06-03T10:00:00')
+def test_delete_live_notification_status_before(sample_template):
+    for day in (1, 2, 3):
+        create_notification(sample_template, created_at=datetime(2021, 6, day, 12))
+
+    assert delete_live_notification_status_before(date(2021, 6, 2)) == 1
+
+    assert _live_counts(sample_template.service) == {
+        (date(2021, 6, 2), NOTIFICATION_CREATED): 1,
+        (date(2021, 6, 3), NOTIFICATION_CREATED): 1,
+    }
+
+
+def test_update_fact_notification_status_totals_carries_on_running_totals(sample_service):
+    create_ft_notification_status(date(2021, 3, 1), 'sms', sample_service, count=5)
+    create_ft_notification_status(date(2021, 3, 1), 'email', sample_service, count=3)
+    update_fact_notification_status_totals(date(2021, 3, 1))
+
+    create_ft_notification_status(date(2021, 3, 2), 'sms', sample_service, count=7)
+    create_ft_notification_status(date(2021, 3, 2), 'sms', sample_service, key_type=KEY_TYPE_TEST, count=100)
+    create_ft_notification_status(date(2021, 3, 3), 'letter', sample_service, count=2)
+    update_fact_notification_status_totals(date(2021, 3, 2))
+
+    rows = FactNotificationStatusTotal.query.order_by(FactNotificationStatusTotal.bst_date).all()
+    assert [
+        (row.bst_date, row.emails, row.sms, row.letters, row.total_emails, row.total_sms, row.total_letters)
+        for row in rows
+    ] == [
+        (date(2021, 3, 1), 3, 5, 0, 3, 5, 0),
+        (date(2021, 3, 2), 0, 7, 0, 3, 12, 0),
+        (date(2021, 3, 3), 0, 0, 2, 3, 12, 2),
+    ]
+    assert [(row.emails, row.sms, row.letters) for row in get_total_notifications_for_all_time()] == [(3, 12, 2)]
+
+
+def test_update_fact_notification_status_for_day_updates_totals(sample_template):
+    # recent enough that the notifications are still in the notifications table
+    first_day, process_day, last_day = [date.today() - timedelta(days=days) for days in (4, 3, 2)]
+    create_ft_notification_status(first_day, template=sample_template, count=5)
+    create_ft_notification_status(last_day, template=sample_template, count=2)
+    update_fact_notification_status_totals(first_day)
+
+    create_notification(
+        sample_template, created_at=datetime.combine(process_day, datetime.min.time()).replace(hour=12)
+    )
+    update_fact_notification_status_for_day(process_day, SMS_TYPE)
+
+    assert [(row.bst_date, row.sms, row.total_sms) for row in FactNotificationStatusTotal.query.order_by(
+        FactNotificationStatusTotal.bst_date
+    )] == [
+        (first_day, 5, 5),
+        (process_day, 1, 6),
+        (last_day, 2, 8),
+    ]
+
+
+def test_get_total_notifications_for_all_time_with_no_notifications(notify_db_session):
+    assert get_total_notifications_for_all_time() == []
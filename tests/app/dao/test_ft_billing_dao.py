@@ -20,6 +20,7 @@ from app.dao.fact_billing_dao import (
     fetch_volumes_by_service,
     get_rate,
     get_rates_for_billing,
+    update_fact_billing_for_day,
 )
 from app.dao.organisation_dao import dao_add_service_to_organisation
 from app.models import NOTIFICATION_STATUS_TYPES, FactBilling
@@ -285,6 +286,27 @@ def test_fetch_billing_data_for_day_uses_correct_table(notify_db_session):
     assert results[1].notifications_sent == 1
 
 
+def test_fetch_billing_data_for_day_uses_correct_table_for_each_service(notify_db_session):
+    service_with_long_retention = create_service(service_name='long retention')
+    create_service_data_retention(service_with_long_retention, notification_type='sms', days_of_retention=10)
+    service_with_default_retention = create_service(service_name='default retention')
+
+    nine_days_ago = datetime.utcnow() - timedelta(days=9)
+    for service in [service_with_long_retention, service_with_default_retention]:
+        template = create_template(service=service, template_type='sms')
+        # rows in the table we shouldn't be reading from are ignored
+        create_notification(template=template, status='delivered', created_at=nine_days_ago)
+        create_notification_history(template=template, status='delivered', created_at=nine_days_ago)
+        create_notification_history(template=template, status='delivered', created_at=nine_days_ago)
+
+    results = fetch_billing_data_for_day(process_day=nine_days_ago.date())
+
+    assert sorted((result.service_id, result.notifications_sent) for result in results) == sorted([
+        (service_with_long_retention.id, 1),
+        (service_with_default_retention.id, 2),
+    ])
+
+
 def test_fetch_billing_data_for_day_returns_list_for_given_service(notify_db_session):
     service = create_service()
     service_2 = create_service(service_name='Service 2')
@@ -392,6 +414,64 @@ def test_get_rate_for_letters_when_page_count_is_zero(notify_db_session):
     assert letter_rate == 0
 
 
+@freeze_time('2018-04-02 12:00')
+def test_update_fact_billing_for_day_writes_all_rows_with_one_read_of_the_rates(notify_db_session, mocker):
+    create_rate(start_date=datetime(2018, 1, 1), value=0.0158, notification_type='sms')
+    create_letter_rate(start_date=datetime(2018, 1, 1), sheet_count=1, rate=0.3, post_class='second')
+    service = create_service()
+    sms_template = create_template(service=service, template_type='sms')
+    email_template = create_template(service=service, template_type='email')
+    letter_template = create_template(service=service, template_type='letter')
+    create_notification(template=sms_template, status='delivered', billable_units=2)
+    create_notification(template=sms_template, status='delivered', billable_units=1, rate_multiplier=2)
+    create_notification(template=email_template, status='delivered')
+    create_notification(template=letter_template, status='delivered', billable_units=1)
+    mock_get_rates = mocker.patch(
+        'app.dao.fact_billing_dao.get_rates_for_billing', wraps=get_rates_for_billing
+    )
+
+    transit_data = fetch_billing_data_for_day(date(2018, 4, 2))
+    assert update_fact_billing_for_day(transit_data, date(2018, 4, 2)) == 4
+
+    mock_get_rates.assert_called_once_with()
+    rows = FactBilling.query.order_by(FactBilling.notification_type, FactBilling.rate_multiplier).all()
+    assert [(row.notification_type, row.rate_multiplier, row.billable_units, row.rate) for row in rows] == [
+        ('email', 0, 0, 0),
+        ('letter', 1, 1, Decimal('0.3')),
+        ('sms', 1, 2, Decimal('0.0158')),
+        ('sms', 2, 1, Decimal('0.0158')),
+    ]
+
+
+@freeze_time('2018-04-02 12:00')
+def test_update_fact_billing_for_day_adds_up_rows_for_the_same_ft_billing_row(notify_db_session):
+    create_letter_rate(start_date=datetime(2018, 1, 1), sheet_count=1, rate=0.3, post_class='second')
+    create_letter_rate(start_date=datetime(2018, 1, 1), sheet_count=2, rate=0.3, post_class='second')
+    letter_template = create_template(service=create_service(), template_type='letter')
+    create_notification(template=letter_template, status='delivered', billable_units=1)
+    create_notification(template=letter_template, status='delivered', billable_units=2)
+
+    transit_data = fetch_billing_data_for_day(date(2018, 4, 2))
+    assert len(transit_data) == 2
+    assert update_fact_billing_for_day(transit_data, date(2018, 4, 2)) == 1
+
+    row = FactBilling.query.one()
+    assert (row.billable_units, row.notifications_sent) == (3, 2)
+
+
+@freeze_time('2018-04-02 12:00')
+def test_update_fact_billing_for_day_updates_existing_rows(notify_db_session):
+    create_rate(start_date=datetime(2018, 1, 1), value=0.0158, notification_type='sms')
+    sms_template = create_template(service=create_service(), template_type='sms')
+    create_notification(template=sms_template, status='delivered')
+    update_fact_billing_for_day(fetch_billing_data_for_day(date(2018, 4, 2)), date(2018, 4, 2))
+
+    create_notification(template=sms_template, status='delivered')
+    update_fact_billing_for_day(fetch_billing_data_for_day(date(2018, 4, 2)), date(2018, 4, 2))
+
+    assert FactBilling.query.one().notifications_sent == 2
+
+
 def test_fetch_monthly_billing_for_year(notify_db_session):
     service = create_service()
     template = create_template(service=service, template_type="sms")
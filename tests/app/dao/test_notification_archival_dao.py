@@ -0,0 +1,88 @@
+from datetime import datetime, timedelta
+
+from freezegun import freeze_time
+
+from app.dao.notification_archival_dao import (
+    dao_claim_notification_archival,
+    dao_queue_notification_archivals,
+    dao_record_notification_archival_progress,
+)
+from app.models import NotificationArchival
+from tests.app.db import create_service
+
+
+def _archival(service, delete_before=datetime(2022, 3, 1), estimated_rows=0, notification_type='sms'):
+    return {
+        'service_id': service.id,
+        'notification_type': notification_type,
+        'delete_before': delete_before,
+        'estimated_rows': estimated_rows,
+    }
+
+
+def test_dao_queue_notification_archivals(notify_db_session):
+    service = create_service()
+
+    dao_queue_notification_archivals([
+        _archival(service, estimated_rows=10),
+        _archival(service, estimated_rows=20, notification_type='email'),
+    ])
+
+    archivals = NotificationArchival.query.order_by(NotificationArchival.notification_type).all()
+    assert [(a.notification_type, a.estimated_rows, a.archived_rows, a.status) for a in archivals] == [
+        ('email', 20, 0, 'pending'),
+        ('sms', 10, 0, 'pending'),
+    ]
+
+
+def test_dao_queue_notification_archivals_keeps_progress_of_unfinished_archival(notify_db_session):
+    service = create_service()
+    dao_queue_notification_archivals([_archival(service, estimated_rows=100)])
+    archival = dao_claim_notification_archival(stale_before=datetime.utcnow())
+    dao_record_notification_archival_progress(archival, 40)
+
+    dao_queue_notification_archivals([_archival(service, delete_before=datetime(2022, 3, 2), estimated_rows=70)])
+
+    archival = NotificationArchival.query.one()
+    assert archival.delete_before == datetime(2022, 3, 2)
+    assert archival.estimated_rows == 70
+    assert archival.archived_rows == 40
+    assert archival.status == 'in-progress'
+
+
+def test_dao_queue_notification_archivals_requeues_finished_archival(notify_db_session):
+    service = create_service()
+    dao_queue_notification_archivals([_archival(service)])
+    archival = dao_claim_notification_archival(stale_before=datetime.utcnow())
+    dao_record_notification_archival_progress(archival, 40, finished=True)
+    assert archival.status == 'done'
+
+    dao_queue_notification_archivals([_archival(service)])
+
+    archival = NotificationArchival.query.one()
+    assert archival.archived_rows == 0
+    assert archival.status == 'pending'
+
+
+def test_dao_claim_notification_archival_takes_largest_first(notify_db_session):
+    small = create_service(service_name='small')
+    large = create_service(service_name='large')
+    dao_queue_notification_archivals([_archival(small, estimated_rows=5), _archival(large, estimated_rows=500)])
+
+    first = dao_claim_notification_archival(stale_before=datetime.utcnow())
+    second = dao_claim_notification_archival(stale_before=datetime.utcnow())
+
+    assert (first.service_id, first.status) == (large.id, 'in-progress')
+    assert (second.service_id, second.status) == (small.id, 'in-progress')
+    assert dao_claim_notification_archival(stale_before=datetime.utcnow() - timedelta(minutes=15)) is None
+
+
+def test_dao_claim_notification_archival_takes_over_stale_archival(notify_db_session):
+    service = create_service()
+    dao_queue_notification_archivals([_archival(service)])
+    with freeze_time('2022-03-10 01:00'):
+        dao_claim_notification_archival(stale_before=datetime.utcnow())
+
+    with freeze_time('2022-03-10 01:10'):
+        assert dao_claim_notification_archival(stale_before=datetime(2022, 3, 10, 0, 55)) is None
+        assert dao_claim_notification_archival(stale_before=datetime(2022, 3, 10, 1, 5)).service_id == service.id
@@ -7,11 +7,12 @@ from app import encryption
 from app.dao.service_callback_api_dao import (
     get_service_callback_api,
     get_service_delivery_status_callback_api_for_service,
+    get_service_delivery_status_callback_apis_for_services,
     reset_service_callback_api,
     save_service_callback_api,
 )
 from app.models import ServiceCallbackApi
-from tests.app.db import create_service_callback_api
+from tests.app.db import create_service, create_service_callback_api
 
 
 def test_save_service_callback_api(sample_service):
@@ -171,3 +172,13 @@ def test_get_service_delivery_status_callback_api_for_service(sample_service):
     assert result.created_at == service_callback_api.created_at
     assert result.updated_at == service_callback_api.updated_at
     assert result.updated_by_id == service_callback_api.updated_by_id
+
+
+def test_get_service_delivery_status_callback_apis_for_services(sample_service):
+    service_callback_api = create_service_callback_api(service=sample_service)
+    create_service_callback_api(service=sample_service, callback_type='complaint')
+    service_without_callback = create_service(service_name='no callback')
+
+    assert get_service_delivery_status_callback_apis_for_services(
+        [sample_service.id, service_without_callback.id]
+    ) == {sample_service.id: service_callback_api}
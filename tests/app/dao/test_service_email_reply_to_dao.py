@@ -238,3 +238,15 @@ def test_archive_reply_to_email_address_raises_an_error_if_attempting_to_archive
 
     assert 'You cannot delete a default email reply to address' in str(e.value)
     assert not default_reply_to.archived
+
+
+def test_changing_reply_to_email_addresses_invalidates_cached_service(notify_db_session, mocker):
+    mock_invalidate = mocker.patch('app.dao.service_email_reply_to_dao.invalidate_service_cache')
+    service = create_service()
+
+    reply_to = add_reply_to_email_address_for_service(service.id, 'first@example.com', is_default=True)
+    second_reply_to = add_reply_to_email_address_for_service(service.id, 'second@example.com', is_default=False)
+    update_reply_to_email_address(service.id, reply_to.id, 'changed@example.com', is_default=True)
+    archive_reply_to_email_address(service.id, second_reply_to.id)
+
+    assert mock_invalidate.call_args_list == [mocker.call(service.id)] * 4
@@ -1,6 +1,7 @@
 import pytest
 
 from app.dao.service_permissions_dao import (
+    dao_add_service_permission,
     dao_fetch_service_permissions,
     dao_remove_service_permission,
 )
@@ -11,6 +12,7 @@ from app.models import (
     LETTER_TYPE,
     SMS_TYPE,
 )
+from app.serialised_models import SerialisedService
 from tests.app.db import create_service, create_service_permission
 
 
@@ -50,3 +52,14 @@ def test_remove_service_permission(service_without_permissions):
     assert len(permissions) == 1
     assert permissions[0].permission == INBOUND_SMS_TYPE
     assert permissions[0].service_id == service_without_permissions.id
+
+
+def test_changing_service_permissions_invalidates_cached_service(service_without_permissions):
+    service_id = service_without_permissions.id
+    assert SerialisedService.from_id(service_id).permissions == []
+
+    dao_add_service_permission(service_id, SMS_TYPE)
+    assert SerialisedService.from_id(service_id).permissions == [SMS_TYPE]
+
+    dao_remove_service_permission(service_id, SMS_TYPE)
+    assert SerialisedService.from_id(service_id).permissions == []
@@ -0,0 +1,152 @@
+import uuid
+
+import pytest
+
+from app.delivery import email_render_cache as email_render_cache_module
+from app.delivery.email_render_cache import (
+    _render,
+    email_render_cache,
+    render_email,
+)
+
+BRANDED = {
+    'govuk_banner': False,
+    'brand_banner': True,
+    'brand_colour': '#005ea5',
+    'brand_logo': 'https://static-logos.notify.tools/logo.png',
+    'brand_text': 'Brand text',
+    'brand_name': 'Brand name',
+}
+GOVUK = {'govuk_banner': True, 'brand_banner': False}
+
+
+@pytest.fixture(autouse=True)
+def clear_email_render_cache():
+    email_render_cache.clear()
+    yield
+    email_render_cache.clear()
+
+
+def _template(content, subject='Hello ((name))'):
+    return {
+        'id': str(uuid.uuid4()),
+        'version': 1,
+        'template_type': 'email',
+        'subject': subject,
+        'content': content,
+    }
+
+
+@pytest.mark.parametrize('content', [
+    'Hello ((name))',
+    'Dear ((name)),\n\n# Heading\n\n* one ((thing))\n* two\n\n^ inset ((thing))\n\n---\n\nThanks',
+    'Your code is ((thing)) and your name is ((name)). ((name)) again.',
+    # long enough that the preheader is cut off part way through a placeholder
+    'x' * 240 + ' ((name)) ' + 'more text ' * 50,
+    'No placeholders at all',
+])
+@pytest.mark.parametrize('html_options', [GOVUK, BRANDED])
+@pytest.mark.parametrize('personalisation', [
+    {'name': 'Jo', 'thing': '12345'},
+    {'Name': 'Jo Smith', 'THING': 42},
+    {'name': 'x' * 400, 'thing': 'a'},
+])
+def test_render_email_matches_full_rendering(notify_api, content, html_options, personalisation):
+    template = _template(content)
+
+    for _ in range(2):
+        assert render_email(template, personalisation, html_options) == _render(
+            template, personalisation, html_options
+        )
+
+
+@pytest.mark.parametrize('personalisation', [
+    {'name': 'O\'Brien', 'thing': 'a'},
+    {'name': '**bold**', 'thing': 'a'},
+    {'name': 'Jo', 'thing': ['one', 'two']},
+    {'name': 'Jo', 'thing': 'line one\nline two'},
+    {'name': '<em>Jo</em>', 'thing': 'a'},
+    {'name': 'Jo'},
+    None,
+])
+def test_render_email_renders_from_scratch_if_personalisation_cant_be_put_in_the_gaps(notify_api, personalisation):
+    template = _template('Hello ((name)), here is ((thing))')
+    assert email_render_cache.get(template, GOVUK) is not None
+
+    assert render_email(template, personalisation, GOVUK) == _render(template, personalisation, GOVUK)
+
+
+def test_render_email_only_renders_template_in_full_once(notify_api, mocker):
+    template = _template('Hello ((name))')
+    render_email(template, {'name': 'Jo'}, GOVUK)
+    mock_render = mocker.patch('app.delivery.email_render_cache._render', wraps=_render)
+
+    subject, plain_text, html = render_email(template, {'name': 'Sam'}, GOVUK)
+
+    mock_render.assert_not_called()
+    assert subject == 'Hello Sam'
+    assert 'Hello Sam' in plain_text
+    assert 'Hello Sam' in html
+
+
+def test_render_email_caches_separately_for_each_version_and_branding(notify_api):
+    template = _template('Hello ((name))')
+
+    render_email(template, {'name': 'Jo'}, GOVUK)
+    render_email(template, {'name': 'Jo'}, BRANDED)
+    render_email({**template, 'version': 2, 'content': 'Goodbye ((name))'}, {'name': 'Jo'}, GOVUK)
+
+    assert len(email_render_cache.renderings) == 3
+    assert 'Goodbye Jo' in render_email({**template, 'version': 2}, {'name': 'Jo'}, GOVUK)[1]
+
+
+@pytest.mark.parametrize('content', [
+    'Hello ((name))((show??You have been selected))',
+    # the space in the value would end the link
+    'Go to https://www.gov.uk/((name)) now',
+])
+def test_render_email_doesnt_cache_templates_where_personalisation_changes_the_formatting(notify_api, content):
+    template = _template(content)
+
+    assert render_email(template, {'name': 'Jo Smith', 'show': 'yes'}, GOVUK) == _render(
+        template, {'name': 'Jo Smith', 'show': 'yes'}, GOVUK
+    )
+    assert email_render_cache.get(template, GOVUK) is None
+
+
+@pytest.mark.parametrize('content, personalisation', [
+    # only a link with some values
+    ('Go to ((name))://gov.uk now', {'name': 'https'}),
+    # only GOV.UK with some values
+    ('Go to ((name)).UK now', {'name': 'GOV'}),
+    ('Go to gov.((name)) now', {'name': 'uk'}),
+    ('Go to www.((name)).gov.uk now', {'name': 'example'}),
+    ('Email ((name))@example.com', {'name': 'jo'}),
+])
+def test_render_email_doesnt_cache_templates_with_placeholders_next_to_link_text(
+    notify_api, content, personalisation
+):
+    template = _template(content, subject='Hello')
+
+    assert render_email(template, personalisation, GOVUK) == _render(template, personalisation, GOVUK)
+    assert email_render_cache.get(template, GOVUK) is None
+
+
+@pytest.mark.parametrize('content', [
+    'Your reference is ((name)).',
+    'Dear ((name)), see https://www.gov.uk',
+    'Go to GOV.UK (((name)))',
+])
+def test_render_email_caches_templates_with_punctuation_after_placeholders(notify_api, content):
+    template = _template(content, subject='Hello')
+
+    assert render_email(template, {'name': 'GOV'}, GOVUK) == _render(template, {'name': 'GOV'}, GOVUK)
+    assert email_render_cache.get(template, GOVUK) is not None
+
+
+def test_render_email_doesnt_cache_if_checking_the_rendering_fails(notify_api, mocker):
+    mocker.patch.object(email_render_cache_module.EmailRendering, 'matches_full_rendering', side_effect=ValueError)
+    template = _template('Hello ((name))')
+
+    assert render_email(template, {'name': 'Jo'}, GOVUK) == _render(template, {'name': 'Jo'}, GOVUK)
+    assert email_render_cache.get(template, GOVUK) is None
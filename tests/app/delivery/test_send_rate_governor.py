@@ -0,0 +1,126 @@
+from unittest.mock import Mock
+
+import pytest
+from requests import Response
+
+from app.clients.email.aws_ses import (
+    AwsSesClientException,
+    AwsSesClientThrottlingSendRateException,
+)
+from app.clients.sms.mmg import MMGClientResponseException
+from app.delivery.send_rate_governor import (
+    ACQUIRE_SCRIPT,
+    THROTTLED_SCRIPT,
+    SendRateExceeded,
+    SendRateGovernor,
+    is_throttling_exception,
+)
+from tests.conftest import set_config_values
+
+
+@pytest.fixture
+def scripts(mocker):
+    scripts = {ACQUIRE_SCRIPT: Mock(return_value=[b'0', b'100', 1]), THROTTLED_SCRIPT: Mock(return_value=b'50')}
+    mocker.patch('app.delivery.send_rate_governor.redis_store.active', True)
+    mocker.patch(
+        'app.delivery.send_rate_governor.redis_store.redis_store.register_script',
+        side_effect=lambda script: scripts[script],
+    )
+    return scripts
+
+
+@pytest.fixture
+def governed(notify_api):
+    with set_config_values(notify_api, {
+        'SEND_RATE_CEILINGS': {'ses': 100},
+        'SEND_RATE_MINIMUM': 1,
+        'SEND_RATE_INCREASE_PER_SECOND': 2,
+        'SEND_RATE_MAX_WAIT_SECONDS': 5,
+    }):
+        yield
+
+
+@pytest.fixture
+def mock_sleep(mocker):
+    return mocker.patch('app.delivery.send_rate_governor.time.sleep')
+
+
+def test_wait_for_turn_sleeps_until_its_turn(governed, scripts, mock_sleep, mocker):
+    mocker.patch('app.delivery.send_rate_governor.time.time', return_value=1000.5)
+    scripts[ACQUIRE_SCRIPT].return_value = [b'0.25', b'40', 1]
+
+    SendRateGovernor().wait_for_turn('ses')
+
+    scripts[ACQUIRE_SCRIPT].assert_called_once_with(
+        keys=['send-rate-governor-ses'],
+        args=[1000.5, 100, 1, 2, 1, 5, 3600],
+    )
+    mock_sleep.assert_called_once_with(0.25)
+
+
+def test_wait_for_turn_doesnt_sleep_if_there_is_a_token(governed, scripts, mock_sleep):
+    SendRateGovernor().wait_for_turn('ses')
+
+    assert mock_sleep.called is False
+
+
+def test_wait_for_turn_raises_if_the_wait_is_too_long(governed, scripts, mock_sleep):
+    scripts[ACQUIRE_SCRIPT].return_value = [b'7.5', b'1', 0]
+
+    with pytest.raises(SendRateExceeded) as e:
+        SendRateGovernor().wait_for_turn('ses')
+
+    assert e.value.retry_after == 7.5
+    assert mock_sleep.called is False
+
+
+@pytest.mark.parametrize('provider, redis_active', [
+    ('mmg', True),
+    ('ses', False),
+])
+def test_wait_for_turn_doesnt_pace_provider_without_ceiling_or_without_redis(
+    governed, scripts, mock_sleep, mocker, provider, redis_active
+):
+    mocker.patch('app.delivery.send_rate_governor.redis_store.active', redis_active)
+
+    SendRateGovernor().wait_for_turn(provider)
+
+    assert scripts[ACQUIRE_SCRIPT].called is False
+
+
+def test_wait_for_turn_carries_on_if_redis_fails(governed, scripts, mock_sleep, mocker):
+    scripts[ACQUIRE_SCRIPT].side_effect = Exception('connection refused')
+    mock_logger = mocker.patch('app.delivery.send_rate_governor.current_app.logger.exception')
+
+    SendRateGovernor().wait_for_turn('ses')
+
+    assert mock_logger.called
+    assert mock_sleep.called is False
+
+
+def test_throttled_reduces_rate(governed, scripts, mocker):
+    mocker.patch('app.delivery.send_rate_governor.time.time', return_value=1000.5)
+
+    SendRateGovernor().throttled('ses')
+
+    scripts[THROTTLED_SCRIPT].assert_called_once_with(
+        keys=['send-rate-governor-ses'],
+        args=[1000.5, 100, 1, 0.5, 1, 3600],
+    )
+
+
+def _response(status_code):
+    response = Response()
+    response.status_code = status_code
+    return response
+
+
+@pytest.mark.parametrize('exception, expected', [
+    (AwsSesClientThrottlingSendRateException('slow down'), True),
+    (AwsSesClientException('something else'), False),
+    (MMGClientResponseException(response=_response(429), exception=Exception()), True),
+    (MMGClientResponseException(response=_response(500), exception=Exception()), False),
+    (ValueError(), False),
+])
+def test_is_throttling_exception(exception, expected):
+    assert is_throttling_exception(exception) is expected
@@ -11,10 +11,16 @@ from requests import HTTPError
 
 import app
 from app import firetext_client, mmg_client, notification_provider_clients
+from app.clients.email.aws_ses import AwsSesClientThrottlingSendRateException
 from app.dao import notifications_dao
+from app.dao.email_branding_dao import dao_get_email_branding_by_id
 from app.dao.provider_details_dao import get_provider_details_by_identifier
 from app.delivery import send_to_providers
 from app.delivery.send_to_providers import get_html_email_options, get_logo_url
+from app.delivery.sms_provider_health import (
+    get_provider_health,
+    reset_provider_health,
+)
 from app.exceptions import NotificationTechnicalFailureException
 from app.models import (
     BRANDING_BOTH,
@@ -42,6 +48,7 @@ def setup_function(_function):
     # pytest will run this function before each test. It makes sure the
     # state of the cache is not shared between tests.
     send_to_providers.provider_cache.clear()
+    reset_provider_health()
 
 
 def test_provider_to_use_should_return_random_provider(mocker, notify_db_session):
@@ -49,27 +56,43 @@ def test_provider_to_use_should_return_random_provider(mocker, notify_db_session
     firetext = get_provider_details_by_identifier('firetext')
     mmg.priority = 25
     firetext.priority = 75
-    mock_choices = mocker.patch('app.delivery.send_to_providers.random.choices', return_value=[mmg])
+    mock_choices = mocker.patch('app.delivery.send_to_providers.random.choices', return_value=['mmg'])
 
     ret = send_to_providers.provider_to_use('sms', international=False)
 
-    mock_choices.assert_called_once_with([mmg, firetext], weights=[25, 75])
+    mock_choices.assert_called_once_with(('mmg', 'firetext'), weights=(25, 75))
     assert ret.get_name() == 'mmg'
 
 
-def test_provider_to_use_should_cache_repeated_calls(mocker, notify_db_session):
+def test_provider_to_use_should_cache_provider_details_but_choose_for_each_call(mocker, notify_db_session):
+    mock_get_providers = mocker.patch(
+        'app.delivery.send_to_providers.get_provider_details_by_notification_type',
+        wraps=send_to_providers.get_provider_details_by_notification_type,
+    )
     mock_choices = mocker.patch(
         'app.delivery.send_to_providers.random.choices',
         wraps=send_to_providers.random.choices,
     )
 
-    results = [
+    for _ in range(10):
         send_to_providers.provider_to_use('sms', international=False)
-        for _ in range(10)
-    ]
 
-    assert all(result == results[0] for result in results)
-    assert len(mock_choices.call_args_list) == 1
+    assert mock_get_providers.call_count == 1
+    assert mock_choices.call_count == 10
+
+
+def test_provider_to_use_sheds_load_from_failing_provider(mocker, notify_db_session):
+    mmg = get_provider_details_by_identifier('mmg')
+    firetext = get_provider_details_by_identifier('firetext')
+    mmg.priority = 50
+    firetext.priority = 50
+    mock_choices = mocker.patch('app.delivery.send_to_providers.random.choices', return_value=['firetext'])
+
+    for _ in range(current_app.config['SMS_PROVIDER_CIRCUIT_MIN_REQUESTS']):
+        get_provider_health('mmg').record(False, 1)
+    send_to_providers.provider_to_use('sms', international=False)
+
+    mock_choices.assert_called_once_with(('mmg', 'firetext'), weights=(0, 50))
 
 
 @pytest.mark.parametrize('international_provider_priority', (
@@ -84,23 +107,22 @@ def test_provider_to_use_should_only_return_mmg_for_international(
 ):
     mmg = get_provider_details_by_identifier('mmg')
     mmg.priority = international_provider_priority
-    mock_choices = mocker.patch('app.delivery.send_to_providers.random.choices', return_value=[mmg])
+    mock_choices = mocker.patch('app.delivery.send_to_providers.random.choices', return_value=['mmg'])
 
     ret = send_to_providers.provider_to_use('sms', international=True)
 
-    mock_choices.assert_called_once_with([mmg], weights=[100])
+    mock_choices.assert_called_once_with(('mmg',), weights=(100,))
     assert ret.get_name() == 'mmg'
 
 
 def test_provider_to_use_should_only_return_active_providers(mocker, restore_provider_details):
     mmg = get_provider_details_by_identifier('mmg')
-    firetext = get_provider_details_by_identifier('firetext')
     mmg.active = False
-    mock_choices = mocker.patch('app.delivery.send_to_providers.random.choices', return_value=[firetext])
+    mock_choices = mocker.patch('app.delivery.send_to_providers.random.choices', return_value=['firetext'])
 
     ret = send_to_providers.provider_to_use('sms')
 
-    mock_choices.assert_called_once_with([firetext], weights=[100])
+    mock_choices.assert_called_once_with(('firetext',), weights=(100,))
     assert ret.get_name() == 'firetext'
 
 
@@ -407,6 +429,20 @@ def test_send_email_to_provider_should_call_research_mode_task_response_task_if_
     assert persisted_notification.billable_units == 0
 
 
+def test_send_email_to_provider_waits_for_its_turn_and_reports_throttling(sample_email_template, mocker):
+    notification = create_notification(template=sample_email_template)
+    mocker.patch('app.aws_ses_client.send_email', side_effect=AwsSesClientThrottlingSendRateException('slow down'))
+    mock_wait = mocker.patch('app.delivery.send_to_providers.send_rate_governor.wait_for_turn')
+    mock_throttled = mocker.patch('app.delivery.send_to_providers.send_rate_governor.throttled')
+
+    with pytest.raises(AwsSesClientThrottlingSendRateException):
+        send_to_providers.send_email_to_provider(notification)
+
+    mock_wait.assert_called_once_with('ses')
+    mock_throttled.assert_called_once_with('ses')
+    assert notification.status == 'created'
+
+
 def test_send_email_to_provider_should_not_send_to_provider_when_status_is_not_created(
     sample_email_template,
     mocker
@@ -643,6 +679,7 @@ def test_should_set_notification_billable_units_and_reduces_provider_priority_if
 
     assert sample_notification.billable_units == 1
     mock_reduce.assert_called_once_with('mmg', time_threshold=timedelta(minutes=1))
+    assert [succeeded for _, succeeded in get_provider_health('mmg').outcomes] == [False]
 
 
 def test_should_send_sms_to_international_providers(
@@ -895,6 +932,21 @@ def test_get_html_email_options_return_email_branding_from_serialised_service(
                              }
 
 
+def test_get_html_email_options_only_fetches_email_branding_once_for_serialised_service(sample_service, mocker):
+    branding = create_email_branding()
+    sample_service.email_branding = branding
+    service = SerialisedService.from_id(sample_service.id)
+    mock_get_branding = mocker.patch(
+        'app.serialised_models.dao_get_email_branding_by_id',
+        wraps=dao_get_email_branding_by_id,
+    )
+
+    first_options = get_html_email_options(service)
+    assert get_html_email_options(service) == first_options
+
+    assert mock_get_branding.call_count == 1
+
+
 def test_get_html_email_options_add_email_branding_from_service(sample_service):
     branding = create_email_branding()
     sample_service.email_branding = branding
@@ -907,3 +959,73 @@ def test_get_html_email_options_add_email_branding_from_service(sample_service):
                              'brand_text': branding.text,
                              'brand_name': branding.name,
                              }
+
+
+def test_send_smss_to_provider_sends_batch_and_updates_notifications(sample_template, mocker):
+    sent = create_notification(template=sample_template)
+    international = create_notification(template=sample_template, international=True, to_field='+6011-17224412')
+    already_sent = create_notification(template=sample_template, status='sending')
+    mock_send_sms = mocker.patch('app.mmg_client.send_sms')
+    mocker.patch('app.firetext_client.send_sms', new=mock_send_sms)
+
+    failures = send_to_providers.send_smss_to_provider([sent.id, international.id, already_sent.id])
+
+    assert failures == {}
+    assert sorted(call[1]['reference'] for call in mock_send_sms.call_args_list) == sorted(
+        [str(sent.id), str(international.id)]
+    )
+    assert (sent.status, sent.billable_units) == ('sending', 1)
+    assert sent.sent_by in {'mmg', 'firetext'}
+    assert sent.sent_at is not None
+    assert (international.status, international.sent_by) == ('sent', 'mmg')
+
+
+def test_send_smss_to_provider_returns_failures(sample_template, mocker):
+    sent = create_notification(template=sample_template)
+    failed = create_notification(template=sample_template)
+    error = Exception('provider error')
+    mocker.patch(
+        'app.delivery.send_to_providers.provider_to_use',
+        return_value=send_to_providers.notification_provider_clients.get_sms_client('mmg'),
+    )
+
+    def send_sms(reference, **kwargs):
+        if reference == str(failed.id):
+            raise error
+
+    mocker.patch('app.mmg_client.send_sms', side_effect=send_sms)
+    mock_reduce = mocker.patch('app.delivery.send_to_providers.dao_reduce_sms_provider_priority')
+
+    failures = send_to_providers.send_smss_to_provider([sent.id, failed.id])
+
+    assert failures == {failed.id: error}
+    assert sent.status == 'sending'
+    assert (failed.status, failed.billable_units, failed.sent_by) == ('created', 1, None)
+    mock_reduce.assert_called_once_with('mmg', time_threshold=timedelta(minutes=1))
+
+
+def test_send_smss_to_provider_sends_rest_of_batch_if_service_is_inactive(sample_template, mocker):
+    inactive_service = create_service(service_name='inactive service', active=False)
+    inactive = create_notification(template=create_template(service=inactive_service))
+    sent = create_notification(template=sample_template)
+    mock_send_sms = mocker.patch('app.mmg_client.send_sms')
+    mocker.patch('app.firetext_client.send_sms', new=mock_send_sms)
+
+    failures = send_to_providers.send_smss_to_provider([inactive.id, sent.id])
+
+    assert failures == {}
+    mock_send_sms.assert_called_once()
+    assert mock_send_sms.call_args[1]['reference'] == str(sent.id)
+    assert Notification.query.get(inactive.id).status == 'technical-failure'
+    assert Notification.query.get(sent.id).status == 'sending'
+
+
+def test_send_smss_to_provider_sends_research_mode_notifications_one_at_a_time(sample_template, mocker):
+    notification = create_notification(template=sample_template, key_type=KEY_TYPE_TEST)
+    mock_send_sms_to_provider = mocker.patch('app.delivery.send_to_providers.send_sms_to_provider')
+    mock_send_sms = mocker.patch('app.mmg_client.send_sms')
+
+    assert send_to_providers.send_smss_to_provider([notification.id]) == {}
+
+    mock_send_sms_to_provider.assert_called_once_with(notification)
+    assert mock_send_sms.called is False
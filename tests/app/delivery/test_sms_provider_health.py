@@ -0,0 +1,130 @@
+import pytest
+
+from app.delivery.sms_provider_health import (
+    HALF_OPEN_WEIGHT,
+    ProviderHealth,
+    get_provider_health,
+    reset_provider_health,
+    weigh_providers,
+)
+from tests.conftest import set_config_values
+
+HEALTH_CONFIG = {
+    'SMS_PROVIDER_CIRCUIT_ERROR_PERCENTAGE': 50,
+    'SMS_PROVIDER_CIRCUIT_MIN_REQUESTS': 4,
+    'SMS_PROVIDER_HEALTH_WINDOW_SECONDS': 30,
+    'SMS_PROVIDER_SLOW_RESPONSE_MS': 5000,
+    'SMS_PROVIDER_CIRCUIT_OPEN_SECONDS': 60,
+}
+
+
+@pytest.fixture
+def health_config(notify_api):
+    reset_provider_health()
+    with set_config_values(notify_api, HEALTH_CONFIG):
+        yield
+    reset_provider_health()
+
+
+@pytest.fixture
+def mock_monotonic(mocker):
+    return mocker.patch('app.delivery.sms_provider_health.time.monotonic', return_value=1000)
+
+
+def test_weight_is_priority_until_there_are_enough_requests(health_config, mock_monotonic):
+    health = ProviderHealth('mmg')
+    for _ in range(3):
+        health.record(False, 1)
+
+    assert health.weight(60) == 60
+    assert health.opened_at is None
+
+
+def test_weight_is_scaled_by_share_of_recent_requests_that_succeeded(health_config, mock_monotonic):
+    health = ProviderHealth('mmg')
+    for succeeded in [True, True, True, False, True]:
+        health.record(succeeded, 1)
+
+    assert health.weight(50) == 40
+    assert health.opened_at is None
+
+
+def test_slow_requests_count_as_failures(health_config, mock_monotonic):
+    health = ProviderHealth('mmg')
+    health.record(True, 4.9)
+    health.record(True, 5)
+
+    assert [succeeded for _, succeeded in health.outcomes] == [True, False]
+
+
+def test_outcomes_older_than_window_are_forgotten(health_config, mock_monotonic):
+    health = ProviderHealth('mmg')
+    for _ in range(3):
+        health.record(False, 1)
+
+    mock_monotonic.return_value = 1031
+    health.record(False, 1)
+
+    assert health.opened_at is None
+    assert (len(health.outcomes), health.failures) == (1, 1)
+
+
+def test_circuit_opens_then_lets_a_trial_through_and_closes(health_config, mock_monotonic, mocker):
+    mock_incr = mocker.patch('app.delivery.sms_provider_health.statsd_client.incr')
+    health = ProviderHealth('mmg')
+    for succeeded in [True, False, True, False]:
+        health.record(succeeded, 1)
+
+    assert health.opened_at == 1000
+    assert health.weight(50) == 0
+    mock_incr.assert_called_once_with('sms.provider-health.mmg.circuit-opened')
+
+    # a request sent before the circuit opened doesn't close it
+    health.record(True, 1)
+    assert health.weight(50) == 0
+
+    mock_monotonic.return_value = 1060
+    assert health.weight(50) == 50 * HALF_OPEN_WEIGHT
+
+    health.record(True, 1)
+    assert health.opened_at is None
+    assert health.weight(50) == 50
+
+
+def test_circuit_opens_again_if_trial_fails(health_config, mock_monotonic):
+    health = ProviderHealth('mmg')
+    for _ in range(4):
+        health.record(False, 1)
+
+    mock_monotonic.return_value = 1060
+    health.record(False, 1)
+
+    assert health.opened_at == 1060
+    assert health.weight(50) == 0
+
+
+def test_recording_outcome_records_exceptions_as_failures(health_config, mock_monotonic):
+    health = ProviderHealth('mmg')
+
+    with health.recording_outcome():
+        pass
+    with pytest.raises(ValueError):
+        with health.recording_outcome():
+            raise ValueError
+
+    assert [succeeded for _, succeeded in health.outcomes] == [True, False]
+
+
+def test_weigh_providers(health_config, mock_monotonic):
+    for _ in range(4):
+        get_provider_health('mmg').record(False, 1)
+
+    assert weigh_providers([('mmg', 50), ('firetext', 50)]) == [('mmg', 0), ('firetext', 50)]
+
+
+def test_weigh_providers_uses_priorities_if_every_provider_is_failing(health_config, mock_monotonic):
+    for identifier in ['mmg', 'firetext']:
+        for _ in range(4):
+            get_provider_health(identifier).record(False, 1)
+
+    assert weigh_providers([('mmg', 30), ('firetext', 70)]) == [('mmg', 30), ('firetext', 70)]
@@ -11,11 +11,13 @@ from app.letters.utils import (
     LetterPDFNotFound,
     ScanErrorType,
     find_letter_pdf_in_s3,
+    find_letter_pdf_key_and_size,
     generate_letter_pdf_filename,
     get_billable_units_for_letter_page_count,
     get_bucket_name_and_prefix_for_notification,
     get_folder_name,
     get_letter_pdf_and_metadata,
+    get_letter_pdfs_in_folder,
     letter_print_day,
     move_failed_pdf,
     move_sanitised_letter_to_test_or_live_pdf_bucket,
@@ -77,6 +79,42 @@ def test_find_letter_pdf_in_s3_raises_if_not_found(sample_notification):
         find_letter_pdf_in_s3(sample_notification)
 
 
+@mock_s3
+def test_get_letter_pdfs_in_folder_returns_keys_and_sizes_by_reference(notify_api):
+    bucket_name = current_app.config['LETTERS_PDF_BUCKET_NAME']
+    s3 = boto3.client('s3', region_name='eu-west-1')
+    s3.create_bucket(
+        Bucket=bucket_name,
+        CreateBucketConfiguration={'LocationConstraint': 'eu-west-1'}
+    )
+    s3.put_object(Bucket=bucket_name, Key='2020-02-17/NOTIFY.REF0.D.2.C.20200217160000.PDF', Body=b'1')
+    s3.put_object(Bucket=bucket_name, Key='2020-02-17/NOTIFY.REF1.D.2.C.20200217150000.PDF', Body=b'22')
+    s3.put_object(Bucket=bucket_name, Key='2020-02-17/NOTIFY.REF1.D.2.C.20200217170000.PDF', Body=b'333')
+    s3.put_object(Bucket=bucket_name, Key='2020-02-16/NOTIFY.REF2.D.2.C.20200216150000.PDF', Body=b'4444')
+
+    assert get_letter_pdfs_in_folder(bucket_name, '2020-02-17/') == {
+        'REF0': {'Key': '2020-02-17/NOTIFY.REF0.D.2.C.20200217160000.PDF', 'Size': 1},
+        'REF1': {'Key': '2020-02-17/NOTIFY.REF1.D.2.C.20200217150000.PDF', 'Size': 2},
+    }
+
+
+@mock_s3
+def test_find_letter_pdf_key_and_size(notify_api):
+    bucket_name = current_app.config['LETTERS_PDF_BUCKET_NAME']
+    s3 = boto3.client('s3', region_name='eu-west-1')
+    s3.create_bucket(
+        Bucket=bucket_name,
+        CreateBucketConfiguration={'LocationConstraint': 'eu-west-1'}
+    )
+    s3.put_object(Bucket=bucket_name, Key='2020-02-17/NOTIFY.REF0.D.2.C.20200217160000.PDF', Body=b'1')
+
+    assert find_letter_pdf_key_and_size(s3, bucket_name, '2020-02-17/NOTIFY.REF0') == {
+        'Key': '2020-02-17/NOTIFY.REF0.D.2.C.20200217160000.PDF', 'Size': 1
+    }
+    with pytest.raises(LetterPDFNotFound):
+        find_letter_pdf_key_and_size(s3, bucket_name, '2020-02-17/NOTIFY.REF1')
+
+
 @pytest.mark.parametrize('created_at,folder', [
     (datetime(2017, 1, 1, 17, 29), '2017-01-01'),
     (datetime(2017, 1, 1, 17, 31), '2017-01-02'),
@@ -0,0 +1,100 @@
+import uuid
+
+import pytest
+
+from app.models import NOTIFICATION_STATUS_TYPES
+from app.notifications.notification_status_buffer import (
+    NOTIFICATION_STATUS_RANKS,
+    NotificationStatusBuffer,
+    can_change_status,
+)
+from tests.conftest import set_config
+
+
+@pytest.fixture
+def status_buffer(mocker):
+    status_buffer = NotificationStatusBuffer()
+    mocker.patch.object(status_buffer, '_ensure_flusher')
+    return status_buffer
+
+
+@pytest.mark.parametrize('current_status, new_status, expected', [
+    ('created', 'sending', True),
+    ('sending', 'sending', True),
+    ('sending', 'delivered', True),
+    ('pending', 'permanent-failure', True),
+    ('sending', 'created', False),
+    ('pending', 'sending', False),
+    ('delivered', 'sending', False),
+    ('delivered', 'permanent-failure', False),
+    ('pending-virus-check', 'created', True),
+    ('pending-virus-check', 'technical-failure', True),
+    ('created', 'cancelled', True),
+    ('cancelled', 'delivered', False),
+])
+def test_can_change_status(current_status, new_status, expected):
+    assert can_change_status(current_status, new_status) == expected
+
+
+def test_every_status_has_a_rank():
+    assert set(NOTIFICATION_STATUS_RANKS) == set(NOTIFICATION_STATUS_TYPES)
+
+
+def test_add_combines_changes_to_the_same_notification(notify_api, status_buffer):
+    notification_id = uuid.uuid4()
+
+    status_buffer.add(notification_id, status='sending', sent_by='mmg', billable_units=None)
+    status_buffer.add(notification_id, status='delivered', updated_at='2022-03-20 12:00')
+
+    assert status_buffer.pending == {
+        notification_id: {'status': 'delivered', 'sent_by': 'mmg', 'updated_at': '2022-03-20 12:00'}
+    }
+
+
+def test_add_doesnt_take_status_backwards(notify_api, status_buffer):
+    notification_id = uuid.uuid4()
+
+    status_buffer.add(notification_id, status='delivered')
+    status_buffer.add(notification_id, status='sending', sent_by='mmg')
+
+    assert status_buffer.pending == {notification_id: {'status': 'delivered', 'sent_by': 'mmg'}}
+
+
+def test_add_wakes_flusher_once_buffer_is_full(notify_api, status_buffer):
+    with set_config(notify_api, 'NOTIFICATION_STATUS_BUFFER_MAX_SIZE', 2):
+        status_buffer.add(uuid.uuid4(), status='sending')
+        assert not status_buffer.full.is_set()
+
+        status_buffer.add(uuid.uuid4(), status='sending')
+        assert status_buffer.full.is_set()
+
+
+def test_flush_writes_changes_and_empties_buffer(notify_api, status_buffer, mocker):
+    mock_update = mocker.patch('app.dao.notifications_dao.dao_update_notifications_from_status_buffer')
+    notification_id = uuid.uuid4()
+    status_buffer.add(notification_id, status='sending')
+
+    assert status_buffer.flush() == 1
+
+    mock_update.assert_called_once_with({notification_id: {'status': 'sending'}})
+    assert status_buffer.pending == {}
+
+
+def test_flush_keeps_changes_if_writing_them_fails(notify_api, status_buffer, mocker):
+    mocker.patch(
+        'app.dao.notifications_dao.dao_update_notifications_from_status_buffer', side_effect=Exception('EXPECTED')
+    )
+    notification_id = uuid.uuid4()
+    status_buffer.add(notification_id, status='sending', sent_by='mmg')
+
+    assert status_buffer.flush() == 0
+
+    assert status_buffer.pending == {notification_id: {'status': 'sending', 'sent_by': 'mmg'}}
+
+
+def test_flush_does_nothing_if_buffer_is_empty(notify_api, status_buffer, mocker):
+    mock_update = mocker.patch('app.dao.notifications_dao.dao_update_notifications_from_status_buffer')
+
+    assert status_buffer.flush() == 0
+
+    mock_update.assert_not_called()
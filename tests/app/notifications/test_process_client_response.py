@@ -10,6 +10,7 @@ from app.celery.process_sms_client_response_tasks import (
 )
 from app.clients import ClientException
 from app.models import NOTIFICATION_TECHNICAL_FAILURE
+from tests.conftest import set_config
 
 
 def test_process_sms_client_response_raises_error_if_reference_is_not_a_valid_uuid(client):
@@ -165,3 +166,15 @@ def test_process_sms_updates_sent_by_with_client_name_if_not_in_noti(sample_noti
     process_sms_client_response('3', str(sample_notification.id), 'MMG')
 
     assert sample_notification.sent_by == 'mmg'
+
+
+def test_process_sms_client_response_buffers_status_if_status_buffer_is_on(notify_api, sample_notification, mocker):
+    mock_add = mocker.patch('app.dao.notifications_dao.notification_status_buffer.add')
+    sample_notification.status = 'sending'
+
+    with set_config(notify_api, 'NOTIFICATION_STATUS_BUFFER_SECONDS', 1):
+        process_sms_client_response('3', str(sample_notification.id), 'MMG', '2')
+
+    mock_add.assert_called_once_with(
+        sample_notification.id, status='delivered', updated_at=mocker.ANY, sent_by='mmg'
+    )
@@ -13,14 +13,17 @@ from sqlalchemy.exc import SQLAlchemyError
 
 from app.models import LETTER_TYPE, Notification, NotificationHistory
 from app.notifications.process_notifications import (
+    build_notification,
     create_content_for_notification,
     persist_notification,
+    persist_notifications,
+    queue_sms_deliveries,
     send_notification_to_queue,
     simulated_recipient,
 )
 from app.serialised_models import SerialisedTemplate
 from app.v2.errors import BadRequestError
-from tests.app.db import create_api_key, create_service, create_template
+from tests.app.db import create_service, create_template
 from tests.conftest import set_config
 
 
@@ -152,97 +155,113 @@ def test_persist_notification_with_optionals(sample_job, sample_api_key):
     assert not persisted_notification.reply_to_text
 
 
-def test_persist_notification_cache_is_not_incremented_on_failure_to_create_notification(
-        notify_api, sample_api_key, mocker
+def test_persist_notification_does_not_touch_daily_limit_cache(
+        notify_api, sample_template, sample_api_key, mocker
 ):
-    mocked_redis = mocker.patch('app.redis_store.incr')
-    with pytest.raises(SQLAlchemyError):
-        persist_notification(template_id=None,
-                             template_version=None,
-                             recipient='+447111111111',
-                             service=sample_api_key.service,
-                             personalisation=None,
-                             notification_type='sms',
-                             api_key_id=sample_api_key.id,
-                             key_type=sample_api_key.key_type)
-    mocked_redis.assert_not_called()
-
-
-def test_persist_notification_does_not_increment_cache_if_test_key(
-        notify_api, sample_template, sample_job, mocker, sample_test_api_key
-):
-    daily_limit_cache = mocker.patch('app.notifications.process_notifications.redis_store.incr')
+    # the daily count is reserved when the service's limits are checked, not when the notification is saved
+    mock_redis = mocker.patch('app.notifications.process_notifications.redis_store')
 
-    assert Notification.query.count() == 0
-    assert NotificationHistory.query.count() == 0
     with set_config(notify_api, 'REDIS_ENABLED', True):
         persist_notification(
             template_id=sample_template.id,
             template_version=sample_template.version,
-            recipient='+447111111111',
+            recipient='+447111111122',
             service=sample_template.service,
             personalisation={},
             notification_type='sms',
-            api_key_id=sample_test_api_key.id,
-            key_type=sample_test_api_key.key_type,
-            job_id=sample_job.id,
-            job_row_number=100,
-            reference="ref",
-        )
+            api_key_id=sample_api_key.id,
+            key_type=sample_api_key.key_type,
+            reference="ref2")
 
     assert Notification.query.count() == 1
-
-    assert not daily_limit_cache.called
+    assert not mock_redis.method_calls
 
 
-@pytest.mark.parametrize('restricted_service', [True, False])
 @freeze_time("2016-01-01 11:09:00.061258")
-def test_persist_notification_increments_cache_for_trial_or_live_service(
-        notify_api, notify_db_session, mocker, restricted_service
+def test_persist_notification_counts_towards_daily_limit_if_asked_to(
+        notify_api, sample_template, sample_api_key, mocker
 ):
-    service = create_service(restricted=restricted_service)
-    template = create_template(service=service)
-    api_key = create_api_key(service=service)
     mocker.patch('app.notifications.process_notifications.redis_store.get', return_value=1)
     mock_incr = mocker.patch('app.notifications.process_notifications.redis_store.incr')
+
     with set_config(notify_api, 'REDIS_ENABLED', True):
         persist_notification(
-            template_id=template.id,
-            template_version=template.version,
+            template_id=sample_template.id,
+            template_version=sample_template.version,
             recipient='+447111111122',
-            service=template.service,
+            service=sample_template.service,
             personalisation={},
             notification_type='sms',
-            api_key_id=api_key.id,
-            key_type=api_key.key_type,
-            reference="ref2")
+            api_key_id=sample_api_key.id,
+            key_type=sample_api_key.key_type,
+            count_towards_daily_limit=True)
 
-        mock_incr.assert_called_once_with(str(service.id) + "-2016-01-01-count", )
+    mock_incr.assert_called_once_with(str(sample_template.service_id) + "-2016-01-01-count")
 
 
-@pytest.mark.parametrize('restricted_service', [True, False])
 @freeze_time("2016-01-01 11:09:00.061258")
-def test_persist_notification_sets_daily_limit_cache_if_one_does_not_exists(
-        notify_api, notify_db_session, mocker, restricted_service
+def test_persist_notification_sets_daily_limit_cache_if_one_does_not_exist(
+        notify_api, sample_template, sample_api_key, mocker
 ):
-    service = create_service(restricted=restricted_service)
-    template = create_template(service=service)
-    api_key = create_api_key(service=service)
     mocker.patch('app.notifications.process_notifications.redis_store.get', return_value=None)
     mock_set = mocker.patch('app.notifications.process_notifications.redis_store.set')
+
     with set_config(notify_api, 'REDIS_ENABLED', True):
         persist_notification(
-            template_id=template.id,
-            template_version=template.version,
+            template_id=sample_template.id,
+            template_version=sample_template.version,
             recipient='+447111111122',
-            service=template.service,
+            service=sample_template.service,
             personalisation={},
             notification_type='sms',
-            api_key_id=api_key.id,
-            key_type=api_key.key_type,
-            reference="ref2")
+            api_key_id=sample_api_key.id,
+            key_type=sample_api_key.key_type,
+            count_towards_daily_limit=True)
 
-        mock_set.assert_called_once_with(str(service.id) + "-2016-01-01-count", 1, ex=86400)
+    mock_set.assert_called_once_with(str(sample_template.service_id) + "-2016-01-01-count", 1, ex=86400)
+
+
+def test_persist_notification_does_not_count_test_key_towards_daily_limit(
+        notify_api, sample_template, sample_test_api_key, mocker
+):
+    mock_redis = mocker.patch('app.notifications.process_notifications.redis_store')
+
+    with set_config(notify_api, 'REDIS_ENABLED', True):
+        persist_notification(
+            template_id=sample_template.id,
+            template_version=sample_template.version,
+            recipient='+447111111122',
+            service=sample_template.service,
+            personalisation={},
+            notification_type='sms',
+            api_key_id=sample_test_api_key.id,
+            key_type=sample_test_api_key.key_type,
+            count_towards_daily_limit=True)
+
+    assert Notification.query.count() == 1
+    assert not mock_redis.method_calls
+
+
+def test_persist_notifications_saves_batch(notify_api, sample_template, sample_api_key):
+    notifications = [
+        build_notification(
+            template_id=sample_template.id,
+            template_version=sample_template.version,
+            recipient=recipient,
+            service=sample_template.service,
+            personalisation={},
+            notification_type='sms',
+            api_key_id=sample_api_key.id,
+            key_type=sample_api_key.key_type,
+        )
+        for recipient in ['+447700900001', '+447700900002']
+    ]
+
+    saved = persist_notifications(notifications, sample_template.service)
+
+    persisted = Notification.query.order_by(Notification.normalised_to).all()
+    assert [n.id for n in persisted] == [n.id for n in notifications] == [n.id for n in saved]
+    assert [n.normalised_to for n in persisted] == ['447700900001', '447700900002']
 
 
 @pytest.mark.parametrize((
@@ -287,6 +306,23 @@ def test_send_notification_to_queue(
     mocked.assert_called_once_with([str(notification.id)], queue=expected_queue)
 
 
+@pytest.mark.parametrize('batch_size, expected_batches', [
+    (1, []),
+    (2, [['a', 'b'], ['c']]),
+])
+def test_queue_sms_deliveries(notify_api, mocker, batch_size, expected_batches):
+    mock_deliver_sms = mocker.patch('app.celery.provider_tasks.deliver_sms.apply_async')
+    mock_deliver_sms_batch = mocker.patch('app.celery.provider_tasks.deliver_sms_batch.apply_async')
+
+    with set_config(notify_api, 'SMS_DELIVERY_BATCH_SIZE', batch_size):
+        queue_sms_deliveries(['a', 'b', 'c'], 'send-sms-tasks')
+
+    assert mock_deliver_sms_batch.call_args_list == [
+        mocker.call([batch], queue='send-sms-tasks') for batch in expected_batches
+    ]
+    assert mock_deliver_sms.call_count == (3 if batch_size == 1 else 0)
+
+
 def test_send_notification_to_queue_throws_exception_deletes_notification(sample_notification, mocker):
     mocked = mocker.patch('app.celery.provider_tasks.deliver_sms.apply_async', side_effect=Boto3Error("EXPECTED"))
     with pytest.raises(Boto3Error):
@@ -1,17 +1,17 @@
-from datetime import datetime
+from unittest.mock import call
 
 import pytest
-from flask import current_app
+from flask import Response
 from freezegun import freeze_time
 from notifications_utils import SMS_CHAR_COUNT_LIMIT
 
-import app
 from app.dao import templates_dao
 from app.models import EMAIL_TYPE, INTERNATIONAL_LETTERS, LETTER_TYPE, SMS_TYPE
 from app.notifications.process_notifications import (
     create_content_for_notification,
 )
 from app.notifications.validators import (
+    check_and_reserve_limits,
     check_if_service_can_send_files_by_email,
     check_is_message_too_long,
     check_notification_content_is_not_empty,
@@ -19,21 +19,17 @@ from app.notifications.validators import (
     check_reply_to,
     check_service_email_reply_to_id,
     check_service_letter_contact_id,
-    check_service_over_api_rate_limit,
-    check_service_over_daily_message_limit,
     check_service_sms_sender_id,
     check_template_is_active,
     check_template_is_for_notification_type,
+    release_daily_limit,
+    release_daily_limit_reservations,
     service_can_send_to_recipient,
     validate_address,
     validate_and_format_recipient,
     validate_template,
 )
-from app.serialised_models import (
-    SerialisedAPIKeyCollection,
-    SerialisedService,
-    SerialisedTemplate,
-)
+from app.serialised_models import SerialisedService, SerialisedTemplate
 from app.utils import get_template_instance
 from app.v2.errors import BadRequestError, RateLimitError, TooManyRequestsError
 from tests.app.db import (
@@ -56,66 +52,135 @@ def enable_redis(notify_api):
 
 
 @pytest.mark.parametrize('key_type', ['team', 'normal'])
-def test_check_service_message_limit_in_cache_under_message_limit_passes(
-        key_type,
-        sample_service,
-        mocker):
+def test_check_and_reserve_limits_under_message_limit_passes(key_type, sample_service, mocker):
     serialised_service = SerialisedService.from_id(sample_service.id)
-    mock_get = mocker.patch('app.notifications.validators.redis_store.get', return_value="1")
-    mock_set = mocker.patch('app.notifications.validators.redis_store.set')
-    service_stats = check_service_over_daily_message_limit(key_type, serialised_service)
-    assert service_stats == 1
-    mock_get.assert_called_once_with(f'{serialised_service.id}-{datetime.utcnow().strftime("%Y-%m-%d")}-count')
-    mock_set.assert_not_called()
+    mock_script = mocker.patch('app.notifications.validators._run_limits_script', return_value=[0, 1])
 
+    with freeze_time("2016-01-01 12:00:00.000000"):
+        assert check_and_reserve_limits(serialised_service, key_type, notification_count=2) == 1
 
-def test_check_service_over_daily_message_limit_should_not_interact_with_cache_for_test_key(sample_service, mocker):
-    mocker.patch('app.notifications.validators.redis_store')
-    mock_get = mocker.patch('app.notifications.validators.redis_store.get', side_effect=[None])
-    serialised_service = SerialisedService.from_id(sample_service.id)
-    service_stats = check_service_over_daily_message_limit('test', serialised_service)
-    assert service_stats == 0
-    mock_get.assert_not_called()
+    mock_script.assert_called_once_with(
+        keys=[f'{sample_service.id}-{key_type}', f'{sample_service.id}-2016-01-01-count'],
+        args=[1451649600.0, sample_service.rate_limit, 60, sample_service.message_limit, 2, 86400, 1, 1],
+    )
 
 
-@pytest.mark.parametrize('key_type', ['team', 'normal'])
-def test_check_service_over_daily_message_limit_should_set_cache_value_as_zero_if_cache_not_set(
-        key_type,
-        sample_template,
-        sample_service,
-        mocker
-):
+def test_check_and_reserve_limits_only_checks_throughput_for_test_key(sample_service, mocker):
     serialised_service = SerialisedService.from_id(sample_service.id)
-    with freeze_time("2016-01-01 12:00:00.000000"):
-        mocker.patch('app.notifications.validators.redis_store.set')
-        service_stats = check_service_over_daily_message_limit(key_type, serialised_service)
-        app.notifications.validators.redis_store.set.assert_called_with(
-            str(sample_service.id) + "-2016-01-01-count", 0, ex=86400
-        )
-        assert service_stats == 0
+    mock_script = mocker.patch('app.notifications.validators._run_limits_script', return_value=[0, 0])
 
+    assert check_and_reserve_limits(serialised_service, 'test') == 0
+
+    check_throughput, check_daily_limit = mock_script.call_args[1]['args'][-2:]
+    assert (check_throughput, check_daily_limit) == (1, 0)
+
+
+def test_check_and_reserve_limits_does_nothing_for_test_key_if_not_checking_throughput(sample_service, mocker):
+    mock_script = mocker.patch('app.notifications.validators._run_limits_script')
+
+    assert check_and_reserve_limits(sample_service, 'test', check_throughput=False) == 0
+
+    mock_script.assert_not_called()
+
+
+def test_check_and_reserve_limits_does_nothing_if_redis_disabled(notify_api, sample_service, mocker):
+    mock_script = mocker.patch('app.notifications.validators._run_limits_script')
 
-def test_check_service_over_daily_message_limit_does_nothing_if_redis_disabled(notify_api, sample_service, mocker):
-    serialised_service = SerialisedService.from_id(sample_service.id)
     with set_config(notify_api, 'REDIS_ENABLED', False):
-        mock_cache_key = mocker.patch('notifications_utils.clients.redis.daily_limit_cache_key')
-        service_stats = check_service_over_daily_message_limit('normal', serialised_service)
-        assert service_stats == 0
-        assert mock_cache_key.method_calls == []
+        assert check_and_reserve_limits(sample_service, 'normal') == 0
+
+    mock_script.assert_not_called()
+
+
+def test_check_and_reserve_limits_passes_if_redis_errors(sample_service, mocker):
+    mocker.patch('app.notifications.validators._run_limits_script', side_effect=Exception('connection refused'))
+
+    assert check_and_reserve_limits(sample_service, 'normal') == 0
 
 
 @pytest.mark.parametrize('key_type', ['team', 'normal'])
-def test_check_service_message_limit_over_message_limit_fails(key_type, mocker, notify_db_session):
+def test_check_and_reserve_limits_over_message_limit_fails(key_type, mocker, notify_db_session):
     service = create_service(message_limit=4)
-    mocker.patch('app.redis_store.get', return_value="5")
+    mocker.patch('app.notifications.validators._run_limits_script', return_value=[2, 3])
 
     with pytest.raises(TooManyRequestsError) as e:
-        check_service_over_daily_message_limit(key_type, service)
+        check_and_reserve_limits(service, key_type, notification_count=2)
     assert e.value.status_code == 429
     assert e.value.message == 'Exceeded send limits (4) for today'
     assert e.value.fields == []
 
 
+@pytest.mark.parametrize('key_type', ['team', 'live', 'test'])
+def test_check_and_reserve_limits_when_exceed_rate_limit_request_fails_raises_error(
+    key_type, sample_service, mocker
+):
+    api_key_type = 'normal' if key_type == 'live' else key_type
+    mocker.patch('app.notifications.validators._run_limits_script', return_value=[1, 0])
+
+    with pytest.raises(RateLimitError) as e:
+        check_and_reserve_limits(sample_service, api_key_type)
+
+    assert e.value.status_code == 429
+    assert e.value.message == 'Exceeded rate limit for key type {} of {} requests per {} seconds'.format(
+        key_type.upper(), sample_service.rate_limit, 60
+    )
+    assert e.value.fields == []
+
+
+def test_check_and_reserve_limits_does_not_check_throughput_if_limiting_is_disabled(
+    notify_api, sample_service, mocker
+):
+    mock_script = mocker.patch('app.notifications.validators._run_limits_script', return_value=[0, 0])
+
+    with set_config(notify_api, 'API_RATE_LIMIT_ENABLED', False):
+        check_and_reserve_limits(sample_service, 'normal')
+
+    check_throughput, check_daily_limit = mock_script.call_args[1]['args'][-2:]
+    assert (check_throughput, check_daily_limit) == (0, 1)
+
+
+@pytest.mark.parametrize('status_code, expect_released', [
+    (201, False),
+    (400, True),
+    (500, True),
+])
+def test_release_daily_limit_reservations_gives_back_reservations_if_request_failed(
+    notify_api, sample_service, mocker, status_code, expect_released
+):
+    mocker.patch('app.notifications.validators._run_limits_script', return_value=[0, 0])
+    mock_redis = mocker.patch('app.notifications.validators.redis_store.redis_store')
+
+    with freeze_time("2016-01-01 12:00:00.000000"), notify_api.test_request_context():
+        check_and_reserve_limits(sample_service, 'normal', notification_count=2)
+        check_and_reserve_limits(sample_service, 'normal')
+        response = Response(status=status_code)
+
+        assert release_daily_limit_reservations(response) is response
+
+    if expect_released:
+        mock_redis.decrby.assert_called_once_with(f'{sample_service.id}-2016-01-01-count', 3)
+    else:
+        mock_redis.decrby.assert_not_called()
+
+
+def test_release_daily_limit_gives_back_no_more_than_was_reserved(notify_api, sample_service, mocker):
+    mocker.patch('app.notifications.validators._run_limits_script', return_value=[0, 0])
+    mock_redis = mocker.patch('app.notifications.validators.redis_store.redis_store')
+
+    with freeze_time("2016-01-01 12:00:00.000000"), notify_api.test_request_context():
+        check_and_reserve_limits(sample_service, 'normal', notification_count=2)
+        release_daily_limit(sample_service, 1)
+        release_daily_limit(sample_service, 5)
+        release_daily_limit(sample_service, 1)
+
+        release_daily_limit_reservations(Response(status=400))
+
+    assert mock_redis.decrby.call_args_list == [
+        call(f'{sample_service.id}-2016-01-01-count', 1),
+        call(f'{sample_service.id}-2016-01-01-count', 1),
+    ]
+
+
 @pytest.mark.parametrize('template_type, notification_type',
                          [(EMAIL_TYPE, EMAIL_TYPE),
                           (SMS_TYPE, SMS_TYPE)])
@@ -391,88 +456,16 @@ def test_validate_template_calls_all_validators_exception_message_too_long(mocke
     assert not mock_check_message_is_too_long.called
 
 
-@pytest.mark.parametrize('key_type', ['team', 'live', 'test'])
-def test_check_service_over_api_rate_limit_when_exceed_rate_limit_request_fails_raises_error(
-        key_type,
-        sample_service,
-        mocker):
-    with freeze_time("2016-01-01 12:00:00.000000"):
-
-        if key_type == 'live':
-            api_key_type = 'normal'
-        else:
-            api_key_type = key_type
-
-        mocker.patch('app.redis_store.exceeded_rate_limit', return_value=True)
-
-        sample_service.restricted = True
-        api_key = create_api_key(sample_service, key_type=api_key_type)
-        serialised_service = SerialisedService.from_id(sample_service.id)
-        serialised_api_key = SerialisedAPIKeyCollection.from_service_id(serialised_service.id)[0]
-
-        with pytest.raises(RateLimitError) as e:
-            check_service_over_api_rate_limit(serialised_service, serialised_api_key)
-
-        assert app.redis_store.exceeded_rate_limit.called_with(
-            "{}-{}".format(str(sample_service.id), api_key.key_type),
-            sample_service.rate_limit,
-            60
-        )
-        assert e.value.status_code == 429
-        assert e.value.message == 'Exceeded rate limit for key type {} of {} requests per {} seconds'.format(
-            key_type.upper(), sample_service.rate_limit, 60
-        )
-        assert e.value.fields == []
-
-
-def test_check_service_over_api_rate_limit_when_rate_limit_has_not_exceeded_limit_succeeds(
-        sample_service,
-        mocker):
-    with freeze_time("2016-01-01 12:00:00.000000"):
-        mocker.patch('app.redis_store.exceeded_rate_limit', return_value=False)
-
-        sample_service.restricted = True
-        api_key = create_api_key(sample_service)
-        serialised_service = SerialisedService.from_id(sample_service.id)
-        serialised_api_key = SerialisedAPIKeyCollection.from_service_id(serialised_service.id)[0]
-
-        check_service_over_api_rate_limit(serialised_service, serialised_api_key)
-        assert app.redis_store.exceeded_rate_limit.called_with(
-            "{}-{}".format(str(sample_service.id), api_key.key_type),
-            3000,
-            60
-        )
-
-
-def test_check_service_over_api_rate_limit_should_do_nothing_if_limiting_is_disabled(
-        sample_service,
-        mocker):
-    with freeze_time("2016-01-01 12:00:00.000000"):
-        current_app.config['API_RATE_LIMIT_ENABLED'] = False
-
-        mocker.patch('app.redis_store.exceeded_rate_limit', return_value=False)
-
-        sample_service.restricted = True
-        create_api_key(sample_service)
-        serialised_service = SerialisedService.from_id(sample_service.id)
-        serialised_api_key = SerialisedAPIKeyCollection.from_service_id(serialised_service.id)[0]
-
-        check_service_over_api_rate_limit(serialised_service, serialised_api_key)
-        app.redis_store.exceeded_rate_limit.assert_not_called()
-
-
 def test_check_rate_limiting_validates_api_rate_limit_and_daily_limit(
     notify_db_session, mocker
 ):
-    mock_rate_limit = mocker.patch('app.notifications.validators.check_service_over_api_rate_limit')
-    mock_daily_limit = mocker.patch('app.notifications.validators.check_service_over_daily_message_limit')
+    mock_check_limits = mocker.patch('app.notifications.validators.check_and_reserve_limits')
     service = create_service()
     api_key = create_api_key(service=service)
 
-    check_rate_limiting(service, api_key)
+    check_rate_limiting(service, api_key, notification_count=3)
 
-    mock_rate_limit.assert_called_once_with(service, api_key)
-    mock_daily_limit.assert_called_once_with(api_key.key_type, service)
+    mock_check_limits.assert_called_once_with(service, api_key.key_type, notification_count=3)
 
 
 @pytest.mark.parametrize('key_type', ['test', 'normal'])
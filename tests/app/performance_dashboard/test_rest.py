@@ -1,5 +1,11 @@
 from datetime import date
 
+from flask import json, url_for
+
+from app.dao.fact_notification_status_dao import (
+    update_fact_notification_status_totals,
+)
+from tests import create_admin_authorization_header
 from tests.app.db import (
     create_ft_notification_status,
     create_process_time,
@@ -60,6 +66,8 @@ def test_performance_dashboard(sample_service, admin_request):
                                   template=template_letter,
                                   count=15)
 
+    update_fact_notification_status_totals(date(2021, 2, 28))
+
     create_process_time(bst_date='2021-02-28', messages_total=15, messages_within_10_secs=14)
     create_process_time(bst_date='2021-03-01', messages_total=35, messages_within_10_secs=34)
     create_process_time(bst_date='2021-03-02', messages_total=15, messages_within_10_secs=12)
@@ -80,3 +88,47 @@ def test_performance_dashboard(sample_service, admin_request):
     assert results["live_service_count"] == 1
     assert results["services_using_notify"][0]["service_name"] == sample_service.name
     assert not results["services_using_notify"][0]["organisation_name"]
+
+
+def test_performance_dashboard_returns_not_modified_if_etag_matches(sample_template, client):
+    create_ft_notification_status(bst_date=date(2021, 3, 1), template=sample_template, count=10)
+    update_fact_notification_status_totals(date(2021, 3, 1))
+    url = url_for('performance_dashboard.get_performance_dashboard', start_date='2021-03-01', end_date='2021-03-01')
+
+    response = client.get(url, headers=[create_admin_authorization_header()])
+    assert response.status_code == 200
+    assert response.json['sms_notifications'] == 10
+
+    response = client.get(
+        url, headers=[create_admin_authorization_header(), ('If-None-Match', response.headers['ETag'])]
+    )
+    assert response.status_code == 304
+    assert not response.get_data()
+
+
+def test_performance_dashboard_uses_cached_response(notify_db_session, admin_request, mocker):
+    cached_stats = {'total_notifications': 123}
+    mock_get = mocker.patch('app.performance_dashboard.rest.redis_store.get', return_value=json.dumps(cached_stats))
+    mock_set = mocker.patch('app.performance_dashboard.rest.redis_store.set')
+
+    response = admin_request.get(
+        'performance_dashboard.get_performance_dashboard', start_date='2021-03-01', end_date='2021-03-02'
+    )
+
+    assert response == cached_stats
+    mock_get.assert_called_once_with('performance-dashboard-2021-03-01-2021-03-02-None')
+    mock_set.assert_not_called()
+
+
+def test_performance_dashboard_caches_response(sample_template, admin_request, mocker):
+    create_ft_notification_status(bst_date=date(2021, 3, 1), template=sample_template, count=10)
+    update_fact_notification_status_totals(date(2021, 3, 1))
+    mocker.patch('app.performance_dashboard.rest.redis_store.get', return_value=None)
+    mock_set = mocker.patch('app.performance_dashboard.rest.redis_store.set')
+
+    response = admin_request.get(
+        'performance_dashboard.get_performance_dashboard', start_date='2021-03-01', end_date='2021-03-01'
+    )
+
+    mock_set.assert_called_once_with('performance-dashboard-2021-03-01-2021-03-01-2021-03-01', mocker.ANY, ex=3600)
+    assert json.loads(mock_set.call_args[0][1]) == response
@@ -293,7 +293,7 @@ def test_send_one_off_notification_raises_if_over_limit(notify_db_session, mocke
     service = create_service(message_limit=0)
     template = create_template(service=service)
     mocker.patch(
-        'app.service.send_notification.check_service_over_daily_message_limit',
+        'app.service.send_notification.check_and_reserve_limits',
         side_effect=TooManyRequestsError(1)
     )
 
@@ -34,7 +34,7 @@ def test_send_pdf_letter_notification_raises_error_if_service_is_over_daily_mess
     fake_uuid,
 ):
     mocker.patch(
-        'app.service.send_notification.check_service_over_daily_message_limit',
+        'app.service.send_notification.check_and_reserve_limits',
         side_effect=TooManyRequestsError(10))
     post_data = {'filename': 'valid.pdf', 'created_by': fake_uuid, 'file_id': fake_uuid, 'postage': 'first',
                  'recipient_address': 'Bugs%20Bunny%0A123%20Main%20Street%0ALooney%20Town'}
@@ -0,0 +1,175 @@
+import json
+import uuid
+from unittest.mock import Mock, call
+
+import pytest
+
+from app import db
+from app.dao.services_dao import dao_update_service
+from app.memory_cache import (
+    CACHE_INVALIDATION_CHANNEL,
+    UNSUBSCRIBED_CACHE_TTL,
+    VersionedMemoryCache,
+    handle_invalidation_message,
+    invalidate_email_branding_cache,
+    invalidate_service_cache,
+    listener,
+    memory_cache,
+)
+from app.serialised_models import SerialisedService
+from tests.conftest import set_config
+
+
+class CachedThing:
+    fetch = Mock()
+
+    @classmethod
+    @memory_cache
+    def from_id(cls, thing_id, service_id):
+        return cls.fetch(thing_id, service_id)
+
+
+class CachedBranding:
+    fetch = Mock()
+
+    @classmethod
+    @memory_cache(key='branding_id')
+    def from_id(cls, branding_id):
+        return cls.fetch(branding_id)
+
+
+@pytest.fixture
+def fetch():
+    CachedThing.fetch = Mock(side_effect=lambda thing_id, service_id: {'id': thing_id, 'service_id': service_id})
+    yield CachedThing.fetch
+
+
+@pytest.fixture
+def service_id():
+    return str(uuid.uuid4())
+
+
+def test_memory_cache_only_fetches_once(notify_api, fetch, service_id):
+    assert CachedThing.from_id('a', service_id) == {'id': 'a', 'service_id': service_id}
+    assert CachedThing.from_id('a', service_id=service_id) is CachedThing.from_id('a', service_id)
+    CachedThing.from_id('b', service_id)
+
+    assert fetch.call_args_list == [
+        call('a', service_id),
+        call('a', service_id),  # positional and keyword arguments are cached separately
+        call('b', service_id),
+    ]
+
+
+@pytest.mark.parametrize('subscribed, expected_ttl', [
+    (True, 3600),
+    (False, UNSUBSCRIBED_CACHE_TTL),
+])
+def test_memory_cache_expires_entries_after_ttl(notify_api, mocker, fetch, service_id, subscribed, expected_ttl):
+    mocker.patch.object(listener, 'ensure_subscribed', return_value=subscribed)
+    mock_monotonic = mocker.patch('app.memory_cache.time.monotonic', return_value=1000)
+
+    with set_config(notify_api, 'SERIALISED_MODEL_CACHE_TTL', 3600):
+        CachedThing.from_id('a', service_id)
+        mock_monotonic.return_value = 1000 + expected_ttl
+        CachedThing.from_id('a', service_id)
+        assert fetch.call_count == 1
+
+        mock_monotonic.return_value = 1000 + expected_ttl + 1
+        CachedThing.from_id('a', service_id)
+        assert fetch.call_count == 2
+
+
+def test_invalidate_service_cache_drops_entries_when_transaction_commits(notify_db_session, fetch, service_id):
+    other_service_id = str(uuid.uuid4())
+    CachedThing.from_id('a', service_id)
+    CachedThing.from_id('a', other_service_id)
+
+    invalidate_service_cache(service_id)
+    CachedThing.from_id('a', service_id)
+    assert fetch.call_count == 2
+
+    db.session.commit()
+    CachedThing.from_id('a', service_id)
+    CachedThing.from_id('a', other_service_id)
+    assert fetch.call_count == 3
+
+
+def test_invalidate_service_cache_is_discarded_if_transaction_rolls_back(notify_db_session, fetch, service_id):
+    CachedThing.from_id('a', service_id)
+
+    invalidate_service_cache(service_id)
+    db.session.rollback()
+    db.session.commit()
+
+    CachedThing.from_id('a', service_id)
+    assert fetch.call_count == 1
+
+
+def test_memory_cache_does_not_keep_value_fetched_before_invalidation(notify_api, fetch, service_id):
+    def fetch_and_invalidate(thing_id, service_id):
+        VersionedMemoryCache.invalidate_service_in_all_caches(service_id)
+        return 'stale'
+    fetch.side_effect = fetch_and_invalidate
+
+    assert CachedThing.from_id('a', service_id) == 'stale'
+
+    fetch.side_effect = None
+    fetch.return_value = 'fresh'
+    assert CachedThing.from_id('a', service_id) == 'fresh'
+
+
+def test_publish_cache_invalidations_clears_redis_and_notifies_other_processes(
+    notify_db_session, mocker, service_id
+):
+    mocker.patch('app.memory_cache.redis_store.active', True)
+    mock_delete = mocker.patch('app.memory_cache.redis_store.delete')
+    mock_redis = mocker.patch('app.memory_cache.redis_store.redis_store')
+    template_id = str(uuid.uuid4())
+
+    invalidate_service_cache(service_id, template_id=template_id)
+    db.session.commit()
+
+    assert mock_delete.call_args_list == [
+        call(f'service-{service_id}'),
+        call(f'service-{service_id}-template-{template_id}-version-None'),
+    ]
+    mock_redis.publish.assert_called_once_with(CACHE_INVALIDATION_CHANNEL, json.dumps({'service_id': service_id}))
+
+
+def test_handle_invalidation_message_drops_entries_for_service(notify_api, fetch, service_id):
+    CachedThing.from_id('a', service_id)
+
+    handle_invalidation_message({'data': json.dumps({'service_id': service_id}).encode()})
+
+    CachedThing.from_id('a', service_id)
+    assert fetch.call_count == 2
+
+
+def test_dao_update_service_invalidates_cached_service(sample_service):
+    assert SerialisedService.from_id(sample_service.id).name == sample_service.name
+
+    sample_service.name = 'new name'
+    dao_update_service(sample_service)
+
+    assert SerialisedService.from_id(sample_service.id).name == 'new name'
+
+
+def test_memory_cache_can_be_keyed_by_another_id(notify_db_session, mocker):
+    mocker.patch('app.memory_cache.redis_store.active', True)
+    mock_delete = mocker.patch('app.memory_cache.redis_store.delete')
+    mocker.patch('app.memory_cache.redis_store.redis_store')
+    CachedBranding.fetch = Mock(return_value='branding')
+    branding_id = str(uuid.uuid4())
+
+    CachedBranding.from_id(branding_id)
+    CachedBranding.from_id(branding_id=branding_id)
+    CachedBranding.from_id(branding_id)
+    assert CachedBranding.fetch.call_count == 2
+
+    invalidate_email_branding_cache(branding_id)
+    db.session.commit()
+
+    CachedBranding.from_id(branding_id)
+    assert CachedBranding.fetch.call_count == 3
+    mock_delete.assert_called_once_with(f'email_branding-{branding_id}')
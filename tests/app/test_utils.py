@@ -5,6 +5,7 @@ from freezegun import freeze_time
 
 from app.models import Notification, NotificationHistory
 from app.utils import (
+    chunked,
     format_sequential_number,
     get_london_midnight_in_utc,
     get_midnight_for_day_before,
@@ -103,3 +104,13 @@ def test_get_notification_table_to_use_checks_service_data_retention(sample_serv
 
 def test_format_sequential_number():
     assert format_sequential_number(123) == '0000007b'
+
+
+@pytest.mark.parametrize('items, chunk_size, expected', [
+    ([], 2, []),
+    ([1, 2, 3], 2, [[1, 2], [3]]),
+    ([1, 2, 3, 4], 2, [[1, 2], [3, 4]]),
+    ((i for i in range(3)), 5, [[0, 1, 2]]),
+])
+def test_chunked(items, chunk_size, expected):
+    assert list(chunked(items, chunk_size)) == expected
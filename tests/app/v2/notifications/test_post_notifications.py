@@ -18,7 +18,9 @@ from app.models import (
 from app.schema_validation import validate
 from app.v2.errors import RateLimitError
 from app.v2.notifications.notification_schemas import (
+    post_email_bulk_response,
     post_email_response,
+    post_sms_bulk_response,
     post_sms_response,
 )
 from tests import create_service_authorization_header
@@ -1041,7 +1043,6 @@ def test_post_notifications_saves_email_or_sms_to_queue(client, notify_db_sessio
     )
     with set_config_values(current_app, {
         'HIGH_VOLUME_SERVICE': [str(service.id)],
-
     }):
         template = create_template(service=service, content='((message))', template_type=notification_type)
         data = {
@@ -1068,6 +1069,35 @@ def test_post_notifications_saves_email_or_sms_to_queue(client, notify_db_sessio
         assert len(Notification.query.all()) == 0
 
 
+@pytest.mark.parametrize("notification_type", ("email", "sms"))
+def test_post_notifications_saves_email_or_sms_to_queue_in_batches(
+    client, notify_db_session, mocker, notification_type
+):
+    save_task = mocker.patch(f"app.celery.tasks.save_api_{notification_type}s.apply_async")
+    service = create_service(service_name='high volume service')
+    with set_config_values(current_app, {
+        'HIGH_VOLUME_SERVICE': [str(service.id)],
+        'SAVE_API_BATCH_WAIT_MS': 1,
+    }):
+        template = create_template(service=service, content='((message))', template_type=notification_type)
+        data = {
+            "template_id": template.id,
+            "personalisation": {"message": "Dear citizen, have a nice day"}
+        }
+        data.update({"email_address": "joe.citizen@example.com"}) if notification_type == EMAIL_TYPE \
+            else data.update({"phone_number": "+447700900855"})
+
+        response = client.post(
+            path=f'/v2/notifications/{notification_type}',
+            data=json.dumps(data),
+            headers=[('Content-Type', 'application/json'), create_service_authorization_header(service_id=service.id)]
+        )
+
+        assert response.status_code == 201
+        save_task.assert_called_once_with([[mock.ANY]], queue=f'save-api-{notification_type}-tasks')
+        assert Notification.query.count() == 0
+
+
 @pytest.mark.parametrize("exception", [
     botocore.exceptions.ClientError({'some': 'json'}, 'some opname'),
     botocore.parsers.ResponseParserError('exceeded max HTTP body length'),
@@ -1091,7 +1121,6 @@ def test_post_notifications_saves_email_or_sms_normally_if_saving_to_queue_fails
     )
     with set_config_values(current_app, {
         'HIGH_VOLUME_SERVICE': [str(service.id)],
-
     }):
         template = create_template(service=service, content='((message))', template_type=notification_type)
         data = {
@@ -1183,3 +1212,184 @@ def test_post_notification_does_not_use_save_queue_for_letters(client, sample_le
         json_resp = response.get_json()
         assert not mock_save.called
         mock_create_pdf_task.assert_called_once_with([str(json_resp['id'])], queue='create-letters-pdf-tasks')
+
+
+@pytest.mark.parametrize("notification_type, recipient_field, recipient, response_schema", [
+    ("sms", "phone_number", "+447700900855", post_sms_bulk_response),
+    ("email", "email_address", "joe.citizen@example.com", post_email_bulk_response),
+])
+def test_post_bulk_notifications_persists_and_queues_all_notifications(
+    client, notify_db_session, mocker, notification_type, recipient_field, recipient, response_schema
+):
+    mock_deliver = mocker.patch(f'app.celery.provider_tasks.deliver_{notification_type}.apply_async')
+    service = create_service()
+    template = create_template(service=service, template_type=notification_type, content='Hi ((name))')
+    data = {
+        "notifications": [
+            {
+                recipient_field: recipient,
+                "template_id": str(template.id),
+                "personalisation": {"name": name},
+                "reference": name,
+            }
+            for name in ["Ann", "Bob", "Cat"]
+        ]
+    }
+
+    response = client.post(
+        path=f'/v2/notifications/{notification_type}/bulk',
+        data=json.dumps(data),
+        headers=[('Content-Type', 'application/json'), create_service_authorization_header(service_id=service.id)]
+    )
+
+    assert response.status_code == 201
+    resp_json = response.get_json()
+    assert validate(resp_json, response_schema) == resp_json
+    assert [n['content']['body'] for n in resp_json['notifications']] == ['Hi Ann', 'Hi Bob', 'Hi Cat']
+
+    notifications = Notification.query.order_by(Notification.client_reference).all()
+    assert [n.client_reference for n in notifications] == ['Ann', 'Bob', 'Cat']
+    assert {str(n.id) for n in notifications} == {n['id'] for n in resp_json['notifications']}
+    assert all(n.status == NOTIFICATION_CREATED for n in notifications)
+    assert mock_deliver.call_args_list == [
+        call([n['id']], queue=f'send-{notification_type}-tasks') for n in resp_json['notifications']
+    ]
+
+
+@pytest.mark.parametrize("notification_type", ("email", "sms"))
+def test_post_bulk_notifications_saves_batches_to_queue_for_high_volume_service(
+    client, notify_db_session, mocker, notification_type
+):
+    save_task = mocker.patch(f"app.celery.tasks.save_api_{notification_type}s.apply_async")
+    mock_send_task = mocker.patch(f'app.celery.provider_tasks.deliver_{notification_type}.apply_async')
+    service = create_service(service_name='high volume service')
+    template = create_template(service=service, content='((message))', template_type=notification_type)
+    recipient_field = 'email_address' if notification_type == EMAIL_TYPE else 'phone_number'
+    recipient = 'joe.citizen@example.com' if notification_type == EMAIL_TYPE else '+447700900855'
+    data = {
+        "notifications": [
+            {recipient_field: recipient, "template_id": str(template.id), "personalisation": {"message": "Hi"}}
+            for _ in range(5)
+        ]
+    }
+
+    with set_config_values(current_app, {
+        'HIGH_VOLUME_SERVICE': [str(service.id)],
+        'SAVE_API_BATCH_SIZE': 2,
+    }):
+        response = client.post(
+            path=f'/v2/notifications/{notification_type}/bulk',
+            data=json.dumps(data),
+            headers=[('Content-Type', 'application/json'), create_service_authorization_header(service_id=service.id)]
+        )
+
+    assert response.status_code == 201
+    assert len(response.get_json()['notifications']) == 5
+    assert [len(c[0][0][0]) for c in save_task.call_args_list] == [2, 2, 1]
+    assert all(c[1] == {'queue': f'save-api-{notification_type}-tasks'} for c in save_task.call_args_list)
+    assert not mock_send_task.called
+    assert Notification.query.count() == 0
+
+
+def test_post_bulk_notifications_does_not_persist_anything_if_one_notification_is_invalid(
+    client, notify_db_session, mocker
+):
+    mock_deliver = mocker.patch('app.celery.provider_tasks.deliver_sms.apply_async')
+    service = create_service()
+    template = create_template(service=service, content='Hi ((name))')
+    data = {
+        "notifications": [
+            {
+                "phone_number": "+447700900855",
+                "template_id": str(template.id),
+                "personalisation": {"name": "Jo"},
+            },
+            {
+                "phone_number": "+447700900855",
+                "template_id": str(template.id),
+            },
+        ]
+    }
+
+    response = client.post(
+        path='/v2/notifications/sms/bulk',
+        data=json.dumps(data),
+        headers=[('Content-Type', 'application/json'), create_service_authorization_header(service_id=service.id)]
+    )
+
+    assert response.status_code == 400
+    assert response.get_json()['errors'][0]['message'] == 'Missing personalisation: name'
+    assert Notification.query.count() == 0
+    assert not mock_deliver.called
+
+
+def test_post_bulk_notifications_does_not_upload_documents_if_a_later_notification_is_invalid(
+    client, notify_db_session, mocker
+):
+    service = create_service(service_permissions=[EMAIL_TYPE])
+    service.contact_link = 'contact.me@gov.uk'
+    template = create_template(service=service, template_type='email', content='Document: ((link)) for ((name))')
+    document_download_mock = mocker.patch('app.v2.notifications.post_notifications.document_download_client')
+    document_download_mock.get_upload_url.return_value = 'https://document-download/services/1/documents'
+    data = {
+        "notifications": [
+            {
+                "email_address": service.users[0].email_address,
+                "template_id": str(template.id),
+                "personalisation": {"link": {"file": "abababab"}, "name": "Jo"},
+            },
+            {
+                "email_address": service.users[0].email_address,
+                "template_id": str(template.id),
+                "personalisation": {"link": {"file": "cdcdcdcd"}},
+            },
+        ]
+    }
+
+    response = client.post(
+        path='/v2/notifications/email/bulk',
+        data=json.dumps(data),
+        headers=[('Content-Type', 'application/json'), create_service_authorization_header(service_id=service.id)]
+    )
+
+    assert response.status_code == 400
+    assert response.get_json()['errors'][0]['message'] == 'Missing personalisation: name'
+    assert not document_download_mock.upload_document.called
+    assert Notification.query.count() == 0
+
+
+def test_post_bulk_notifications_checks_daily_limit_for_whole_batch(client, sample_template, mocker):
+    mock_check_rate_limiting = mocker.patch('app.v2.notifications.post_notifications.check_rate_limiting')
+    mocker.patch('app.celery.provider_tasks.deliver_sms.apply_async')
+    data = {
+        "notifications": [
+            {"phone_number": "+447700900855", "template_id": str(sample_template.id)}
+            for _ in range(5)
+        ]
+    }
+
+    response = client.post(
+        path='/v2/notifications/sms/bulk',
+        data=json.dumps(data),
+        headers=[
+            ('Content-Type', 'application/json'),
+            create_service_authorization_header(service_id=sample_template.service_id)
+        ]
+    )
+
+    assert response.status_code == 201
+    mock_check_rate_limiting.assert_called_once_with(mock.ANY, mock.ANY, notification_count=5)
+    assert Notification.query.count() == 5
+
+
+def test_post_bulk_notifications_returns_404_for_letters(client, sample_letter_template):
+    response = client.post(
+        path='/v2/notifications/letter/bulk',
+        data=json.dumps({"notifications": []}),
+        headers=[
+            ('Content-Type', 'application/json'),
+            create_service_authorization_header(service_id=sample_letter_template.service_id)
+        ]
+    )
+
+    assert response.status_code == 404
@@ -0,0 +1,80 @@
+from threading import Thread
+
+import pytest
+
+from app.v2.notifications.save_to_queue_batcher import SaveToQueueBatcher
+from tests.conftest import set_config_values
+
+
+def _save_concurrently(notify_api, batcher, notifications):
+    exceptions = []
+
+    def save(notification_type, notification_data):
+        with notify_api.app_context():
+            try:
+                batcher.save(notification_type, notification_data)
+            except Exception as e:
+                exceptions.append(e)
+
+    threads = [Thread(target=save, args=notification) for notification in notifications]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return exceptions
+
+
+def test_save_publishes_concurrent_notifications_together(notify_api, mocker):
+    publish = mocker.Mock()
+    batcher = SaveToQueueBatcher(publish)
+
+    with set_config_values(notify_api, {'SAVE_API_BATCH_WAIT_MS': 200, 'SAVE_API_BATCH_SIZE': 3}):
+        assert _save_concurrently(notify_api, batcher, [('sms', {'id': i}) for i in range(3)]) == []
+
+    publish.assert_called_once_with(notification_type='sms', notifications_data=mocker.ANY)
+    assert sorted(d['id'] for d in publish.call_args[1]['notifications_data']) == [0, 1, 2]
+    assert batcher.open_batches == {}
+
+
+def test_save_publishes_each_notification_type_separately(notify_api, mocker):
+    publish = mocker.Mock()
+    batcher = SaveToQueueBatcher(publish)
+
+    with set_config_values(notify_api, {'SAVE_API_BATCH_WAIT_MS': 50, 'SAVE_API_BATCH_SIZE': 10}):
+        _save_concurrently(notify_api, batcher, [('sms', {'id': 1}), ('email', {'id': 2})])
+
+    assert sorted(
+        (c[1]['notification_type'], c[1]['notifications_data']) for c in publish.call_args_list
+    ) == [('email', [{'id': 2}]), ('sms', [{'id': 1}])]
+
+
+def test_save_raises_publish_exception_for_every_notification_in_batch(notify_api, mocker):
+    batcher = SaveToQueueBatcher(mocker.Mock(side_effect=ValueError('EXPECTED')))
+
+    with set_config_values(notify_api, {'SAVE_API_BATCH_WAIT_MS': 200, 'SAVE_API_BATCH_SIZE': 2}):
+        exceptions = _save_concurrently(notify_api, batcher, [('sms', {'id': 1}), ('sms', {'id': 2})])
+
+    assert len(exceptions) == 2
+    assert all(isinstance(e, ValueError) for e in exceptions)
+
+
+def test_save_publishes_after_waiting_if_batch_isnt_full(notify_api, mocker):
+    publish = mocker.Mock()
+    batcher = SaveToQueueBatcher(publish)
+
+    with set_config_values(notify_api, {'SAVE_API_BATCH_WAIT_MS': 1, 'SAVE_API_BATCH_SIZE': 10}):
+        batcher.save('email', {'id': 1})
+
+    publish.assert_called_once_with(notification_type='email', notifications_data=[{'id': 1}])
+
+
+@pytest.mark.parametrize('notification_type', ['email', 'sms'])
+def test_save_starts_new_batch_once_previous_is_full(notify_api, mocker, notification_type):
+    publish = mocker.Mock()
+    batcher = SaveToQueueBatcher(publish)
+
+    with set_config_values(notify_api, {'SAVE_API_BATCH_WAIT_MS': 1, 'SAVE_API_BATCH_SIZE': 1}):
+        batcher.save(notification_type, {'id': 1})
+        batcher.save(notification_type, {'id': 2})
+
+    assert [c[1]['notifications_data'] for c in publish.call_args_list] == [[{'id': 1}], [{'id': 2}]]
@@ -8,7 +8,9 @@ from alembic.config import Config
 from flask import Flask
 
 from app import create_app, db
+from app.aws import s3
 from app.dao.provider_details_dao import get_provider_details_by_identifier
+from app.models import LiveNotificationStatus
 
 
 @pytest.fixture(scope='session')
@@ -123,6 +125,8 @@ def notify_db_session(notify_db, sms_providers):
                             "broadcast_channel_types",
                             "broadcast_provider_types"]:
             notify_db.engine.execute(tbl.delete())
+    # deleting notifications updates the live counts (see LiveNotificationStatus), so clear them out last
+    notify_db.engine.execute(LiveNotificationStatus.__table__.delete())
     notify_db.session.commit()
 
 
@@ -143,6 +147,15 @@ def os_environ():
         os.environ[k] = v
 
 
+@pytest.fixture(autouse=True)
+def reset_s3_clients():
+    """
+    S3 clients are shared for the life of a process, so make sure each test (and each moto mock) gets new ones
+    """
+    yield
+    s3.reset_s3_clients()
+
+
 def pytest_generate_tests(metafunc):
     # Copied from https://gist.github.com/pfctdayelise/5719730
     idparametrize = metafunc.definition.get_closest_marker('idparametrize')